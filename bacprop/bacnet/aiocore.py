@@ -0,0 +1,195 @@
+"""
+Running the bacpypes core on an asyncio event loop, instead of
+`bacpypes.core.run` on a thread of its own.
+
+The sockets of the bacpypes UDP directors are watched by the event
+loop, which hands their reads and writes to the directors. Tasks and
+deferred functions are run by a pump, called soon by the task manager's
+trigger whenever a function is deferred or a task installed, and at the
+time of the next task. Everything then runs on the event loop thread,
+so functions deferred from the event loop run without waiting for the
+core to poll its sockets.
+
+The sockets must be opened, which is when the network is made, before
+the core is started.
+"""
+
+import asyncio
+import asyncore
+import select
+from typing import Any, Callable, Dict, Optional
+
+from bacpypes import core
+from bacpypes.debugging import ModuleLogger, bacpypes_debugging
+from bacpypes.task import TaskManager
+
+from bacprop.defs import Logable
+
+_debug = 0
+_log = ModuleLogger(globals())
+
+
+def _is_writable(fd: int) -> bool:
+    return bool(select.select([], [fd], [], 0)[1])
+
+
+@bacpypes_debugging
+class AsyncioCore(Logable):
+    """
+    Drives the bacpypes sockets, tasks and deferred functions from
+    the event loop. Stands in for the trigger of the task manager
+    while started.
+    """
+
+    # Writes flushed by each pump before the rest are left to the
+    # event loop, in case a director stays writable
+    WRITES_PER_PUMP = 100
+
+    def __init__(self, loop: asyncio.AbstractEventLoop) -> None:
+        self._loop = loop
+        self._task_manager: Optional[TaskManager] = None
+        self._trigger: Any = None
+        # Dispatchers watched by the event loop, by file descriptor
+        self._dispatchers: Dict[int, asyncore.dispatcher] = {}
+        self._writing: Dict[int, asyncore.dispatcher] = {}
+
+        self._pump_handle: Optional[asyncio.Handle] = None
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._pumping = False
+        self.pumps = 0
+
+    def start(self) -> None:
+        if _debug:
+            AsyncioCore._debug("start")
+
+        task_manager = self._task_manager = core.taskManager = TaskManager()
+
+        # Functions deferred and tasks installed now call the pump
+        self._trigger = task_manager.trigger
+        task_manager.trigger = self
+
+        for fd, dispatcher in list(asyncore.socket_map.items()):
+            if dispatcher is self._trigger:
+                continue
+
+            self._dispatchers[fd] = dispatcher
+            self._loop.add_reader(fd, self._read, dispatcher)
+
+        core.running = True
+        self.set()
+
+    def stop(self) -> None:
+        if _debug:
+            AsyncioCore._debug("stop")
+
+        for fd in self._dispatchers:
+            self._loop.remove_reader(fd)
+        for fd in self._writing:
+            self._loop.remove_writer(fd)
+
+        self._dispatchers.clear()
+        self._writing.clear()
+
+        for handle in (self._pump_handle, self._timer):
+            if handle is not None:
+                handle.cancel()
+
+        self._pump_handle = self._timer = None
+
+        if self._task_manager is not None:
+            self._task_manager.trigger = self._trigger
+            self._task_manager = None
+
+        core.running = False
+
+    def set(self) -> None:
+        """
+        Called as the trigger of the task manager, to pump soon
+        """
+        if not self._pumping and self._pump_handle is None:
+            self._pump_handle = self._loop.call_soon(self._pump)
+
+    def _run(self, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> None:
+        try:
+            fn(*args, **kwargs)
+        except Exception:
+            # Same as the bacpypes core, an error doesn't stop the others
+            AsyncioCore._error("Error running %r", fn, exc_info=True)
+
+    def _pump(self) -> None:
+        self._pump_handle = None
+        task_manager = self._task_manager
+
+        if task_manager is None:
+            return
+
+        self._pumping = True
+        self.pumps += 1
+
+        try:
+            while True:
+                while core.deferredFns:
+                    deferred_fns = core.deferredFns
+                    core.deferredFns = []
+
+                    for fn, args, kwargs in deferred_fns:
+                        self._run(fn, *args, **kwargs)
+
+                task, delta = task_manager.get_next_task()
+
+                if task is None:
+                    break
+
+                self._run(task_manager.process_task, task)
+        finally:
+            self._pumping = False
+
+        if self._timer is not None:
+            self._timer.cancel()
+
+        # Woken for the next task
+        self._timer = (
+            self._loop.call_later(delta, self.set) if delta is not None else None
+        )
+
+        self._update_writers()
+
+    def _update_writers(self) -> None:
+        for fd, dispatcher in self._dispatchers.items():
+            if fd in self._writing:
+                continue
+
+            # Written now while the socket takes them, rather than
+            # after the event loop has polled it
+            for _ in range(AsyncioCore.WRITES_PER_PUMP):
+                if not (dispatcher.writable() and _is_writable(fd)):
+                    break
+
+                self._handle(dispatcher.handle_write_event, dispatcher)
+
+            if dispatcher.writable():
+                self._writing[fd] = dispatcher
+                self._loop.add_writer(fd, self._write, fd, dispatcher)
+
+    def _handle(
+        self, handler: Callable[[], None], dispatcher: asyncore.dispatcher
+    ) -> None:
+        try:
+            handler()
+        except Exception:
+            dispatcher.handle_error()
+
+    def _read(self, dispatcher: asyncore.dispatcher) -> None:
+        self._handle(dispatcher.handle_read_event, dispatcher)
+
+        # Reads are handed up the stack as deferred functions, which
+        # are run now rather than on another turn of the event loop
+        if not self._pumping:
+            self._pump()
+
+    def _write(self, fd: int, dispatcher: asyncore.dispatcher) -> None:
+        self._handle(dispatcher.handle_write_event, dispatcher)
+
+        if not dispatcher.writable():
+            del self._writing[fd]
+            self._loop.remove_writer(fd)
@@ -0,0 +1,161 @@
+"""
+Rate limited I-Am announcements of newly created sensors
+"""
+
+import heapq
+from typing import Dict, List, Optional, Tuple, TYPE_CHECKING
+
+from bacpypes.debugging import ModuleLogger, bacpypes_debugging
+from bacpypes.task import OneShotTask, TaskManager
+
+from bacprop.defs import Logable
+from bacprop.metrics import ANNOUNCE_WAIT
+
+if TYPE_CHECKING:  # pragma: no cover
+    # pylint: disable=cyclic-import
+    from bacprop.bacnet.sensor import BaseSensor
+
+_debug = 0
+_log = ModuleLogger(globals())
+
+
+@bacpypes_debugging
+class AnnounceScheduler(OneShotTask, Logable):
+    """
+    Token bucket paced queue of sensors waiting to send an I-Am.
+
+    The bucket fills at `rate` I-Ams per second, up to one second's
+    worth, and the queue is sent in batches at most every
+    `BATCH_INTERVAL` seconds, as far as the bucket allows. The sensors
+    which were updated most recently are announced first. A queued
+    sensor which is updated again is pushed with its new update time,
+    and its older entry is dropped when it comes up, or when stale
+    entries make up more than `STALE_RATIO` of the heap.
+    """
+
+    DEFAULT_RATE = 20.0
+    BATCH_INTERVAL = 0.1
+    STALE_RATIO = 0.5
+
+    def __init__(self, rate: float = DEFAULT_RATE) -> None:
+        OneShotTask.__init__(self)
+
+        self._rate = rate
+        self._capacity = max(rate, 1.0)
+        self._tokens = self._capacity
+        self._filled_at: Optional[float] = None
+
+        # (negated update time, token, sensor id)
+        self._heap: List[Tuple[float, int, int]] = []
+        # sensor id -> (sensor, token of its live heap entry, time queued)
+        self._queued: Dict[int, Tuple["BaseSensor", int, float]] = {}
+        self._token = 0
+
+        self.announced = 0
+        # Seconds from being queued to being announced
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def _push(self, sensor: "BaseSensor", queued_at: float) -> None:
+        self._token += 1
+        sensor_id = sensor.get_id()
+
+        self._queued[sensor_id] = (sensor, self._token, queued_at)
+        heapq.heappush(self._heap, (-sensor.get_update_time(), self._token, sensor_id))
+
+        # Chatty sensors would otherwise grow the heap with their updates
+        stale = len(self._heap) - len(self._queued)
+        if stale > AnnounceScheduler.STALE_RATIO * len(self._heap):
+            self._compact()
+
+    def _compact(self) -> None:
+        """
+        Rebuild the heap with only the live entries
+        """
+        queued = self._queued
+        self._heap = [
+            entry
+            for entry in self._heap
+            if entry[2] in queued and queued[entry[2]][1] == entry[1]
+        ]
+        heapq.heapify(self._heap)
+
+    def schedule(self, sensor: "BaseSensor") -> None:
+        """
+        Queue an announcement of the sensor
+        """
+        entry = self._queued.get(sensor.get_id())
+        now = TaskManager().get_time()
+
+        self._push(sensor, entry[2] if entry else now)
+
+        if not self.isScheduled:
+            self.install_task(when=now)
+
+    def touch(self, sensor: "BaseSensor") -> None:
+        """
+        Let the scheduler know that the sensor has new data,
+        which moves it up the queue if it is waiting
+        """
+        if sensor.get_id() in self._queued:
+            self.schedule(sensor)
+
+    def discard(self, sensor: "BaseSensor") -> None:
+        """
+        Stop waiting to announce the sensor. Its heap
+        entry is dropped when it comes up.
+        """
+        self._queued.pop(sensor.get_id(), None)
+
+    def _refill(self, now: float) -> None:
+        if self._filled_at is not None:
+            self._tokens = min(
+                self._capacity, self._tokens + (now - self._filled_at) * self._rate
+            )
+
+        self._filled_at = now
+
+    def _announce(self, entry: Tuple["BaseSensor", int, float], now: float) -> None:
+        sensor, _, queued_at = entry
+        del self._queued[sensor.get_id()]
+
+        sensor.announce()
+        self._tokens -= 1
+
+        wait = now - queued_at
+        ANNOUNCE_WAIT.observe(wait)
+        self.announced += 1
+        self.total_wait += wait
+        self.max_wait = max(self.max_wait, wait)
+
+    def process_task(self) -> None:
+        now = TaskManager().get_time()
+        self._refill(now)
+
+        while self._heap and self._tokens >= 1:
+            _, token, sensor_id = heapq.heappop(self._heap)
+
+            # Entries superseded by a newer one are dropped
+            entry = self._queued.get(sensor_id)
+            if entry and entry[1] == token:
+                self._announce(entry, now)
+
+        if self._queued:
+            # At least a whole token later, so each batch sends one or more
+            delay = max(
+                AnnounceScheduler.BATCH_INTERVAL, (1 - self._tokens) / self._rate
+            )
+            self.install_task(when=now + delay)
+
+        if _debug:
+            AnnounceScheduler._debug(
+                "%d announced, %d waiting", self.announced, self.queue_depth
+            )
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self._queued)
+
+    @property
+    def mean_wait(self) -> float:
+        return self.total_wait / self.announced if self.announced else 0.0
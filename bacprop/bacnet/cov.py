@@ -0,0 +1,312 @@
+"""
+Change of value subscriptions to the sensor value objects
+"""
+
+import heapq
+from typing import Any, Dict, List, Optional, Tuple
+
+from bacpypes.apdu import SimpleAckPDU
+from bacpypes.basetypes import (
+    COVSubscription,
+    DeviceAddress,
+    ObjectPropertyReference,
+    Recipient,
+    RecipientProcess,
+)
+from bacpypes.capability import Capability
+from bacpypes.constructeddata import ListOf
+from bacpypes.core import deferred
+from bacpypes.debugging import ModuleLogger, bacpypes_debugging
+from bacpypes.errors import ExecutionError
+from bacpypes.service.cov import (
+    ActiveCOVSubscriptions,
+    ChangeOfValueServices,
+    COVDetection,
+    COVIncrementCriteria,
+    Subscription,
+)
+from bacpypes.service.detect import monitor_filter
+from bacpypes.task import OneShotTask, TaskManager
+
+from bacprop.defs import Logable
+
+_debug = 0
+_log = ModuleLogger(globals())
+
+
+@bacpypes_debugging
+class SensorValueCriteria(COVIncrementCriteria, Logable):
+    """
+    Reports a value once it has moved by at least its `covIncrement`
+    since the last report. Sensors republish unchanged values all the
+    time, so an unchanged value is never reported, even with an
+    increment of 0.
+    """
+
+    previous_reported_value: Optional[float]
+
+    def __init__(self, obj: Any) -> None:
+        COVIncrementCriteria.__init__(self, obj)
+        obj.monitor_added()
+
+    def unbind(self) -> None:
+        # Once the last subscription to the object is cancelled
+        COVIncrementCriteria.unbind(self)
+        self.obj.monitor_removed()
+
+    @monitor_filter("presentValue")
+    def present_value_filter(self, old_value: float, new_value: float) -> bool:
+        if self.previous_reported_value is None:
+            self.previous_reported_value = old_value
+
+        change = abs(new_value - self.previous_reported_value)
+
+        return change > 0 and change >= self.obj.covIncrement
+
+    def send_cov_notifications(self, subscription: Any = None) -> None:
+        # Sending is deferred, and by then the object may have been removed
+        # or the subscription cancelled. Failing would lose the rest of the
+        # deferred functions run along with this one.
+        if self.obj._app is None or (
+            subscription is not None and subscription.obj_ref is None
+        ):
+            return
+
+        COVIncrementCriteria.send_cov_notifications(self, subscription)
+
+
+@bacpypes_debugging
+class SensorSubscription(Subscription, Logable):
+    """
+    COV subscription whose lifetime is tracked by a `SubscriptionExpiry`,
+    rather than by a task of its own
+    """
+
+    def __init__(
+        self,
+        obj_ref: Any,
+        client_addr: Any,
+        proc_id: int,
+        obj_id: Any,
+        confirmed: bool,
+        lifetime: int,
+        expiry: "SubscriptionExpiry",
+    ) -> None:
+        # token of the live expiry entry
+        self.token: Optional[int] = None
+        self._expiry = expiry
+
+        Subscription.__init__(
+            self, obj_ref, client_addr, proc_id, obj_id, confirmed, lifetime
+        )
+
+    def install_task(self, when: Optional[float] = None, delta: float = 0) -> None:
+        self.taskTime = when if when is not None else TaskManager().get_time() + delta
+        self.isScheduled = True
+        self._expiry.schedule(self)
+
+    def suspend_task(self) -> None:
+        self.isScheduled = False
+        self._expiry.unschedule(self)
+
+    def renew_subscription(self, lifetime: int) -> None:
+        self.lifetime = lifetime
+        Subscription.renew_subscription(self, lifetime)
+
+
+@bacpypes_debugging
+class SubscriptionExpiry(OneShotTask, Logable):
+    """
+    Min-heap of COV subscription expiry times, run as a single task.
+
+    As tasks of their own, every renewal of a subscription would suspend
+    and reinstall it, which bacpypes does with a scan of all tasks. Here
+    a renewal pushes a new entry, and entries of subscriptions which have
+    since been renewed or cancelled are dropped when they come due.
+    """
+
+    def __init__(self) -> None:
+        OneShotTask.__init__(self)
+
+        # (expiry time, token, subscription)
+        self._heap: List[Tuple[float, int, SensorSubscription]] = []
+        self._token = 0
+
+    def schedule(self, subscription: SensorSubscription) -> None:
+        self._token += 1
+        subscription.token = self._token
+        heapq.heappush(self._heap, (subscription.taskTime, self._token, subscription))
+
+        if not self.isScheduled or subscription.taskTime < self.taskTime:
+            self.install_task(when=subscription.taskTime)
+
+    def unschedule(self, subscription: SensorSubscription) -> None:
+        subscription.token = None
+
+    def process_task(self) -> None:
+        now = TaskManager().get_time()
+
+        while self._heap and self._heap[0][0] <= now:
+            _, token, subscription = heapq.heappop(self._heap)
+
+            if subscription.token != token:
+                # Renewed or cancelled since
+                continue
+
+            if _debug:
+                SubscriptionExpiry._debug("Subscription expired %r", subscription)
+
+            subscription.process_task()
+
+        if self._heap:
+            self.install_task(when=self._heap[0][0])
+
+    def __len__(self) -> int:
+        return sum(1 for _, token, cov in self._heap if cov.token == token)
+
+
+class ActiveSubscriptionsProperty(ActiveCOVSubscriptions):
+    """
+    The active COV subscriptions of a device. The bacpypes property
+    fails to look up the detection of each subscription.
+    """
+
+    def ReadProperty(self, obj: Any, arrayIndex: Optional[int] = None) -> Any:
+        current_time = TaskManager().get_time()
+        cov_subscriptions = ListOf(COVSubscription)()
+
+        for cov_detection in obj._app.cov_detections.values():
+            for cov in cov_detection.cov_subscriptions:
+                time_remaining = 0
+                if cov.lifetime:
+                    time_remaining = max(int(cov.taskTime - current_time), 1)
+
+                recipient = Recipient(
+                    address=DeviceAddress(
+                        networkNumber=cov.client_addr.addrNet or 0,
+                        macAddress=cov.client_addr.addrAddr,
+                    )
+                )
+
+                cov_subscriptions.append(
+                    COVSubscription(
+                        recipient=RecipientProcess(
+                            recipient=recipient, processIdentifier=cov.proc_id
+                        ),
+                        monitoredPropertyReference=ObjectPropertyReference(
+                            objectIdentifier=cov.obj_id,
+                            propertyIdentifier=cov_detection.monitored_property_reference,
+                        ),
+                        issueConfirmedNotifications=cov.confirmed,
+                        timeRemaining=time_remaining,
+                        covIncrement=cov_detection.covIncrement,
+                    )
+                )
+
+        return cov_subscriptions
+
+
+def cancel_object_subscriptions(
+    cov_detections: Dict[Any, COVDetection], obj: Any
+) -> None:
+    """
+    Cancel all subscriptions to an object which is being removed
+    """
+    cov_detection = cov_detections.get(obj)
+
+    if cov_detection:
+        for cov in list(cov_detection.cov_subscriptions):
+            cov.cancel_subscription()
+
+
+@bacpypes_debugging
+class SensorCOVServices(ChangeOfValueServices, Logable):
+    """
+    Confirmed and unconfirmed SubscribeCOV for the sensor value objects.
+    Applications must call `_init_cov`, as bacpypes only initialises
+    the capabilities of classes which derive from `Application` directly.
+    """
+
+    def __init__(self) -> None:
+        # Not the ChangeOfValueServices property, see ActiveSubscriptionsProperty
+        Capability.__init__(self)
+
+    def _init_cov(self, subscription_expiry: Optional[SubscriptionExpiry]) -> None:
+        if subscription_expiry is None:
+            subscription_expiry = SubscriptionExpiry()
+
+        self.subscription_expiry = subscription_expiry
+
+        # object -> its detection algorithm
+        self.cov_detections: Dict[Any, COVDetection] = {}
+
+        if self.localDevice:
+            self.localDevice.add_property(ActiveSubscriptionsProperty())
+
+    def cov_notification(self, cov: Any, request: Any) -> None:
+        # Sent straight down the stack, as the applications have no
+        # IO controller. The state machine retries confirmed ones.
+        self.request(request)
+
+    def confirmation(self, apdu: Any) -> None:
+        # Only confirmed notifications are sent, and there is nothing
+        # to do with their acks, or errors once the retries run out
+        if _debug:
+            SensorCOVServices._debug("confirmation %r", apdu)
+
+    def do_SubscribeCOVRequest(self, apdu: Any) -> None:
+        if _debug:
+            SensorCOVServices._debug("do_SubscribeCOVRequest %r", apdu)
+
+        client_addr = apdu.pduSource
+        proc_id = apdu.subscriberProcessIdentifier
+        obj_id = apdu.monitoredObjectIdentifier
+        confirmed = apdu.issueConfirmedNotifications
+
+        cancel = confirmed is None and apdu.lifetime is None
+        # A missing lifetime is an indefinite subscription
+        lifetime = apdu.lifetime or 0
+
+        obj = self.get_object_id(obj_id)
+        if not obj:
+            raise ExecutionError(errorClass="object", errorCode="unknownObject")
+
+        if obj_id[0] != "analogValue":
+            raise ExecutionError(
+                errorClass="services", errorCode="covSubscriptionFailed"
+            )
+
+        cov_detection = self.cov_detections.get(obj)
+        cov = None
+        if cov_detection:
+            cov = cov_detection.cov_subscriptions.find(client_addr, proc_id, obj_id)
+
+        if cancel:
+            if cov:
+                self.cancel_subscription(cov)
+
+            self.response(SimpleAckPDU(context=apdu))
+            return
+
+        if not cov_detection:
+            cov_detection = SensorValueCriteria(obj)
+            self.cov_detections[obj] = cov_detection
+
+        if cov:
+            cov.renew_subscription(lifetime)
+        else:
+            cov = SensorSubscription(
+                obj,
+                client_addr,
+                proc_id,
+                obj_id,
+                confirmed,
+                lifetime,
+                self.subscription_expiry,
+            )
+            self.add_subscription(cov)
+
+        self.response(SimpleAckPDU(context=apdu))
+
+        # New and renewed subscriptions are sent the current values
+        deferred(cov_detection.send_cov_notifications, cov)
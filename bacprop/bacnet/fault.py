@@ -0,0 +1,160 @@
+"""
+Deadline ordered tracking of sensors which
+have stopped sending data
+"""
+
+import heapq
+from typing import Dict, List, Optional, Tuple, TYPE_CHECKING
+
+from bacpypes.debugging import ModuleLogger, bacpypes_debugging
+
+from bacprop.defs import Logable
+
+if TYPE_CHECKING:  # pragma: no cover
+    # pylint: disable=cyclic-import
+    from bacprop.bacnet.sensor import BaseSensor
+
+_debug = 0
+_log = ModuleLogger(globals())
+
+
+@bacpypes_debugging
+class FaultScheduler(Logable):
+    """
+    Min-heap of sensor expiry deadlines.
+
+    Each sensor has at most one live entry in the heap. Updating a sensor
+    only schedules it if it is not already scheduled, and an entry which
+    comes due for a sensor that has since been updated is simply pushed
+    back to its new deadline. The cost of `pop_expired` therefore scales
+    with the number of entries coming due, not the number of sensors.
+    """
+
+    def __init__(self, default_timeout: float) -> None:
+        self._default_timeout = default_timeout
+        self._timeouts: Dict[int, float] = {}
+        self._group_timeouts: List[Tuple[range, float]] = []
+
+        # (deadline, sensor id, token)
+        self._heap: List[Tuple[float, int, int]] = []
+        # sensor id -> (sensor, token of its live heap entry)
+        self._scheduled: Dict[int, Tuple["BaseSensor", int]] = {}
+        self._token = 0
+
+    def _push(self, sensor: "BaseSensor") -> None:
+        self._token += 1
+        sensor_id = sensor.get_id()
+        deadline = sensor.get_update_time() + self.get_timeout(sensor_id)
+
+        self._scheduled[sensor_id] = (sensor, self._token)
+        heapq.heappush(self._heap, (deadline, sensor_id, self._token))
+
+    def _reschedule(self, sensor_id: int) -> None:
+        entry = self._scheduled.get(sensor_id)
+        if entry:
+            self._push(entry[0])
+
+    def get_timeout(self, sensor_id: int) -> float:
+        """
+        Get the timeout of the given sensor. Sensor specific
+        timeouts take priority over group timeouts, and the
+        first matching group wins.
+        """
+        timeout = self._timeouts.get(sensor_id)
+        if timeout is not None:
+            return timeout
+
+        for ids, group_timeout in self._group_timeouts:
+            if sensor_id in ids:
+                return group_timeout
+
+        return self._default_timeout
+
+    def set_default_timeout(self, timeout: float) -> None:
+        self._default_timeout = timeout
+
+        for sensor_id in list(self._scheduled):
+            self._reschedule(sensor_id)
+
+    def set_timeout(self, sensor_id: int, timeout: Optional[float]) -> None:
+        """
+        Set the timeout for a single sensor, or remove it when
+        `timeout` is None
+        """
+        if timeout is None:
+            self._timeouts.pop(sensor_id, None)
+        else:
+            self._timeouts[sensor_id] = timeout
+
+        self._reschedule(sensor_id)
+
+    def set_group_timeout(self, ids: range, timeout: float) -> None:
+        self._group_timeouts.append((ids, timeout))
+
+        for sensor_id in list(self._scheduled):
+            if sensor_id in ids:
+                self._reschedule(sensor_id)
+
+    def touch(self, sensor: "BaseSensor") -> None:
+        """
+        Let the scheduler know that the sensor has new data
+        """
+        if sensor.get_id() not in self._scheduled:
+            self._push(sensor)
+
+    def discard(self, sensor_id: int) -> None:
+        """
+        Stop tracking the given sensor. Its heap entry is dropped
+        lazily when it comes due.
+        """
+        self._scheduled.pop(sensor_id, None)
+
+    def pop_expired(self, now: float) -> List["BaseSensor"]:
+        """
+        Remove and return all sensors whose deadline has passed. A returned
+        sensor is scheduled again on its next `touch`.
+        """
+        expired = []
+
+        while self._heap and self._heap[0][0] <= now:
+            _, sensor_id, token = heapq.heappop(self._heap)
+
+            entry = self._scheduled.get(sensor_id)
+            if not entry or entry[1] != token:
+                # Superseded by a newer entry
+                continue
+
+            sensor = entry[0]
+            deadline = sensor.get_update_time() + self.get_timeout(sensor_id)
+
+            if deadline > now:
+                heapq.heappush(self._heap, (deadline, sensor_id, token))
+                continue
+
+            if _debug:
+                FaultScheduler._debug("Sensor %d expired at %r", sensor_id, deadline)
+
+            del self._scheduled[sensor_id]
+            expired.append(sensor)
+
+        return expired
+
+    def __len__(self) -> int:
+        return len(self._scheduled)
+
+
+@bacpypes_debugging
+class RetireScheduler(FaultScheduler):
+    """
+    Deadlines at which faulty sensors are retired, `retire_after`
+    seconds after they became faulty. Sensors are added with `touch`
+    when they become faulty, and a sensor updated since is pushed
+    back like in the `FaultScheduler`.
+    """
+
+    def __init__(self, fault_scheduler: FaultScheduler, retire_after: float) -> None:
+        FaultScheduler.__init__(self, retire_after)
+        self._fault_scheduler = fault_scheduler
+
+    def get_timeout(self, sensor_id: int) -> float:
+        return self._fault_scheduler.get_timeout(sensor_id) + self._default_timeout
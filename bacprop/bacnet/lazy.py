@@ -0,0 +1,235 @@
+"""
+Sensors which only build their bacpypes application stack once
+something on the BACnet network needs it, and drop it again when
+it has not been accessed for a while
+"""
+
+from collections import OrderedDict
+from typing import Any, Callable, Mapping, Optional, Union
+
+from bacpypes.apdu import APDU, IAmRequest
+from bacpypes.debugging import ModuleLogger, bacpypes_debugging
+from bacpypes.npdu import NPDU
+from bacpypes.pdu import PDU, Address, LocalBroadcast
+from bacpypes.task import OneShotTask, TaskManager
+
+from bacprop.bacnet.announce import AnnounceScheduler
+from bacprop.bacnet.fault import FaultScheduler
+from bacprop.bacnet.sensor import (
+    MAX_APDU_LENGTH,
+    SEGMENTATION,
+    VENDOR_ID,
+    BaseSensor,
+    Sensor,
+    SharedSensor,
+)
+from bacprop.bacnet.store import ValueStore
+from bacprop.defs import Logable
+
+_debug = 0
+_log = ModuleLogger(globals())
+
+# The application stack a lazy sensor is materialized into
+SensorStack = Union[Sensor, SharedSensor]
+
+
+def encode_i_am(sensor_id: int, address: Address) -> PDU:
+    """
+    Encode the I-Am broadcast of a sensor, as its own stack would send it
+    """
+    request = IAmRequest(
+        iAmDeviceIdentifier=("device", sensor_id),
+        maxAPDULengthAccepted=MAX_APDU_LENGTH,
+        segmentationSupported=SEGMENTATION,
+        vendorID=VENDOR_ID,
+    )
+
+    apdu = APDU()
+    request.encode(apdu)
+    npdu = NPDU()
+    apdu.encode(npdu)
+    pdu = PDU()
+    npdu.encode(pdu)
+
+    pdu.pduSource = address
+    pdu.pduDestination = LocalBroadcast()
+    return pdu
+
+
+class _SensorValue:
+    """
+    The slot of a key of a sensor without a stack, in place
+    of its value object
+    """
+
+    __slots__ = ("_values", "_slot")
+
+    def __init__(self, store: ValueStore, slot: int) -> None:
+        # Arrays grow in place, so the column can be kept
+        self._values = store.values
+        self._slot = slot
+
+    @property
+    def presentValue(self) -> float:
+        return self._values[self._slot]
+
+    def get_slot(self) -> int:
+        return self._slot
+
+    def is_monitored(self) -> bool:
+        return False
+
+    def set_value(self, value: float) -> None:
+        self._values[self._slot] = value
+
+    def fault_changed(self, fault: bool) -> None:
+        pass
+
+
+@bacpypes_debugging
+class LazySensor(BaseSensor):
+    """
+    Sensor which starts out as just its values, and is given an
+    application stack by `attach` when it is needed. Its value
+    objects are then added to the stack, and turned back into
+    plain values by `detach`.
+
+    The sensor stays the same object either way, so the schedulers
+    and the service can hold on to it.
+    """
+
+    def __init__(
+        self,
+        sensor_id: int,
+        vlan_address: Address,
+        send_i_am: Callable[["LazySensor"], None],
+        fault_scheduler: Optional[FaultScheduler] = None,
+        cov_increments: Optional[Mapping[str, float]] = None,
+        announcer: Optional[AnnounceScheduler] = None,
+        store: Optional[ValueStore] = None,
+    ) -> None:
+        BaseSensor.__init__(
+            self,
+            sensor_id,
+            vlan_address,
+            fault_scheduler,
+            cov_increments,
+            announcer,
+            store,
+        )
+
+        # Sends an I-Am for the sensor while it has no stack
+        self._send_i_am = send_i_am
+        self._stack: Optional[SensorStack] = None
+
+    def _new_object(self, instance: int, key_name: str, slot: int) -> Any:
+        if self._stack is None:
+            return _SensorValue(self._store, slot)
+
+        return BaseSensor._new_object(self, instance, key_name, slot)
+
+    def add_object(self, obj: Any) -> None:
+        if self._stack is not None:
+            self._stack.add_object(obj)
+
+    def delete_object(self, obj: Any) -> None:
+        if self._stack is not None:
+            self._stack.delete_object(obj)
+
+    def announce(self) -> None:
+        if self._stack is None:
+            self._send_i_am(self)
+        else:
+            self._stack.announce()
+
+    def _replace_objects(self) -> None:
+        # The values stay in their slots of the store
+        slots = {key: _object.get_slot() for key, _object in self._objects.items()}
+        self._objects.clear()
+
+        self._register_objects(slots, slots)
+
+    def attach(self, stack: SensorStack) -> None:
+        """
+        Put the values of the sensor in objects on the given stack
+        """
+        if _debug:
+            LazySensor._debug("Materializing sensor %d", self._id)
+
+        self._stack = stack
+        self._replace_objects()
+
+    def detach(self) -> Optional[SensorStack]:
+        """
+        Take the values of the sensor back out of its stack,
+        and give back the stack
+        """
+        if _debug:
+            LazySensor._debug("Evicting sensor %d", self._id)
+
+        stack = self._stack
+        self._stack = None
+        self._replace_objects()
+
+        return stack
+
+    def get_stack(self) -> Optional[SensorStack]:
+        return self._stack
+
+
+@bacpypes_debugging
+class IdleEviction(OneShotTask, Logable):
+    """
+    Materialized sensors in order of their last BACnet access, run as
+    a single task which evicts those not accessed for `idle_time`.
+
+    `evict` gives back False for a sensor which can't be evicted
+    yet, which is then checked again after another `idle_time`.
+    """
+
+    def __init__(self, idle_time: float, evict: Callable[[LazySensor], bool]) -> None:
+        OneShotTask.__init__(self)
+
+        self._idle_time = idle_time
+        self._evict = evict
+        # sensor -> time of its last access, oldest first
+        self._accessed: "OrderedDict[LazySensor, float]" = OrderedDict()
+
+        self.evicted = 0
+
+    def touch(self, sensor: LazySensor, now: float) -> None:
+        self._accessed[sensor] = now
+        self._accessed.move_to_end(sensor)
+
+        if not self.isScheduled:
+            self.install_task(when=now + self._idle_time)
+
+    def discard(self, sensor: LazySensor) -> None:
+        self._accessed.pop(sensor, None)
+
+    def process_task(self) -> None:
+        now = TaskManager().get_time()
+
+        while self._accessed:
+            sensor, accessed = next(iter(self._accessed.items()))
+            if accessed + self._idle_time > now:
+                break
+
+            del self._accessed[sensor]
+
+            if self._evict(sensor):
+                self.evicted += 1
+            else:
+                self._accessed[sensor] = now
+
+        if self._accessed:
+            oldest = next(iter(self._accessed.values()))
+            self.install_task(when=oldest + self._idle_time)
+
+        if _debug:
+            IdleEviction._debug(
+                "%d evicted, %d materialized", self.evicted, len(self._accessed)
+            )
+
+    def __len__(self) -> int:
+        return len(self._accessed)
@@ -3,17 +3,46 @@ Provide some abstraction layers to the bacpypes
 API
 """
 
+import random
+from collections import deque
+from copy import deepcopy
+
+from bacpypes.apdu import IAmRequest, WhoIsRequest
 from bacpypes.bvllservice import AnnexJCodec, BIPSimple, UDPMultiplexer
 from bacpypes.comm import bind
 from bacpypes.core import deferred, run, stop
 from bacpypes.debugging import ModuleLogger, bacpypes_debugging
 from bacpypes.netservice import NetworkServiceAccessPoint, NetworkServiceElement
 from bacpypes.pdu import Address, LocalBroadcast
+from bacpypes.task import TaskManager
 from bacpypes.vlan import Network, Node
-from bacprop.bacnet.sensor import Sensor
+from bacprop.bacnet.announce import AnnounceScheduler
+from bacprop.bacnet.cov import SubscriptionExpiry
+from bacprop.bacnet.fault import FaultScheduler, RetireScheduler
+from bacprop.bacnet.lazy import IdleEviction, LazySensor, SensorStack, encode_i_am
+from bacprop.bacnet.sensor import (
+    BaseSensor,
+    Sensor,
+    SharedSensor,
+    SharedSensorApplication,
+)
+from bacprop.bacnet.store import ValueStore
+from bacprop.bacnet.whois import DeviceIndex, decode_request, who_is_range
 
-from typing import Dict, Union, NoReturn, List
+from typing import (
+    Any,
+    Callable,
+    Deque,
+    Dict,
+    Iterable,
+    Union,
+    NoReturn,
+    List,
+    Mapping,
+    Optional,
+)
 from bacprop.defs import Logable
+from bacprop.snapshot import SensorSnapshot
 
 _debug = 0
 _log = ModuleLogger(globals())
@@ -54,44 +83,513 @@ class _VLANRouter(Logable):
         deferred(self.nse.i_am_router_to_network)
 
 
-class VirtualSensorNetwork(Network):
-    def __init__(self, local_address: str):
+@bacpypes_debugging
+class SensorSegment(Network, Logable):
+    """
+    One of the virtual networks of sensors behind the router,
+    and a broadcast domain of its own.
+
+    Lazy sensors are materialized by `materialize` before
+    a Who-Is or request for them is delivered.
+    """
+
+    def __init__(self, number: int, materialize: Callable[[LazySensor], None]):
         Network.__init__(self, broadcast_address=LocalBroadcast())
+        self.number = number
+        self._materialize = materialize
+
+        # vlan address -> node receiving for that address
+        self._node_index: Dict[Address, Node] = {}
+
+        # Nodes of sensors with their own stack, by device instance,
+        # and every other node, which receives all broadcasts
+        self._device_index: DeviceIndex[Node] = DeviceIndex()
+        self._device_instances: Dict[Node, int] = {}
+        self._other_nodes: List[Node] = []
+
+        # Lazy sensors by device instance, and by address
+        self._lazy_index: DeviceIndex[LazySensor] = DeviceIndex()
+        self._lazy_addresses: Dict[Address, LazySensor] = {}
+
+        self._shared_app: Optional[SharedSensorApplication] = None
+
+    def add_node(self, node: Node, device_instance: Optional[int] = None) -> None:
+        """
+        Add a node to the network. Nodes given the instance of the
+        device they serve only receive the Who-Is requests for it.
+        """
+        Network.add_node(self, node)
+        self._node_index[node.address] = node
+
+        if device_instance is None:
+            self._other_nodes.append(node)
+        else:
+            self._device_index.add(device_instance, node)
+            self._device_instances[node] = device_instance
+
+    def remove_node(self, node: Node) -> None:
+        Network.remove_node(self, node)
+        del self._node_index[node.address]
+
+        device_instance = self._device_instances.pop(node, None)
+        if device_instance is None:
+            self._other_nodes.remove(node)
+        else:
+            self._device_index.remove(device_instance)
+
+    def _broadcast_nodes(self, pdu: Any) -> List[Node]:
+        request = decode_request(pdu)
+
+        # Sensors have no use for the I-Ams of other devices
+        if isinstance(request, IAmRequest):
+            return self._other_nodes
+
+        if isinstance(request, WhoIsRequest):
+            who_is = who_is_range(
+                request.deviceInstanceRangeLowLimit,
+                request.deviceInstanceRangeHighLimit,
+            )
+
+            # Inconsistent limits are left to every sensor to reject
+            if who_is is not None:
+                for sensor in self._lazy_index.find(who_is):
+                    self._materialize(sensor)
+
+                return self._other_nodes + self._device_index.find(who_is)
+
+        return self.nodes
+
+    def process_pdu(self, pdu: Any) -> None:
+        """
+        Same as `Network.process_pdu`, but unicast PDUs are delivered
+        through the address index rather than by checking every node.
+        A Who-Is is only broadcast to the sensors in its range, and
+        an I-Am to none of them. Lazy sensors are materialized
+        before a Who-Is or request for them is delivered.
+
+        The traffic log and dropped packets work as they do for any
+        network, but promiscuous nodes only receive their own PDUs.
+        """
+        if _debug:
+            SensorSegment._debug("[%d]process_pdu %r", self.number, pdu)
+
+        if self.traffic_log:
+            self.traffic_log(self.name, pdu)
+
+        if self.drop_percent and random.random() * 100.0 < self.drop_percent:
+            if _debug:
+                SensorSegment._debug("    - packet dropped")
+            return
+
+        if pdu.pduDestination == self.broadcast_address:
+            source_node = self._node_index.get(pdu.pduSource)
+
+            for node in self._broadcast_nodes(pdu):
+                if node is not source_node:
+                    node.response(deepcopy(pdu))
+        else:
+            sensor = self._lazy_addresses.get(pdu.pduDestination)
+            if sensor:
+                self._materialize(sensor)
+
+            node = self._node_index.get(pdu.pduDestination)
+
+            if node:
+                node.response(deepcopy(pdu))
+
+    def set_shared_app(self, shared_app: SharedSensorApplication) -> None:
+        self._shared_app = shared_app
+        self.add_node(shared_app.get_node())
+
+    def get_shared_app(self) -> Optional[SharedSensorApplication]:
+        return self._shared_app
+
+    def add_shared_sensor(self, sensor: SharedSensor) -> None:
+        assert self._shared_app
+        self._shared_app.add_sensor(sensor)
+        self._node_index[sensor.get_address()] = self._shared_app.get_node()
+
+    def remove_shared_sensor(self, sensor: SharedSensor) -> None:
+        assert self._shared_app
+        self._shared_app.remove_sensor(sensor)
+        del self._node_index[sensor.get_address()]
+
+    def add_lazy_sensor(self, sensor: LazySensor) -> None:
+        self._lazy_index.add(sensor.get_id(), sensor)
+        self._lazy_addresses[sensor.get_address()] = sensor
+
+    def remove_lazy_sensor(self, sensor: LazySensor) -> None:
+        self._lazy_index.remove(sensor.get_id())
+        del self._lazy_addresses[sensor.get_address()]
+
+    def is_taken(self, address: Address) -> bool:
+        return address in self._node_index or address in self._lazy_addresses
+
+
+@bacpypes_debugging
+class VirtualSensorNetwork(SensorSegment):
+    """
+    VLAN of sensors behind a router to the local network.
+
+    In shared stack mode all sensors are served by one
+    `SharedSensorApplication`, instead of each sensor having
+    an application stack and VLAN node of its own.
+
+    New sensors are announced with an I-Am, at no more than
+    `announce_rate` per second, or not at all if it is 0.
+
+    With `lazy_stacks`, sensors are only given their application
+    stack once a Who-Is in their range or a request for them arrives,
+    or straight away if their id is in `eager_sensors`. The stacks of
+    other sensors are dropped once they have not been accessed for
+    `idle_timeout` seconds, unless that is 0, or the sensor has COV
+    subscriptions.
+
+    Sensors which have been faulty for `retire_after` seconds, if
+    given, are removed, and their addresses are given to new sensors
+    once the addresses which have never been used run out.
+
+    Sensors are split across `networks` virtual networks, numbered
+    from 1, so that broadcasts only reach the sensors of one of them.
+    They are assigned in ranges of `network_size` ids, the last network
+    taking every id past the ranges, or by their id modulo the number
+    of networks if no size is given. The network is the first of them
+    itself, and the only one by default.
+    """
+
+    DEFAULT_SENSOR_TIMEOUT = 60 * 10  # 10 Minutes
+    DEFAULT_IDLE_TIMEOUT = 60 * 10  # 10 Minutes
+
+    def __init__(
+        self,
+        local_address: str,
+        shared_stack: bool = False,
+        cov_increments: Optional[Mapping[str, float]] = None,
+        announce_rate: float = AnnounceScheduler.DEFAULT_RATE,
+        lazy_stacks: bool = False,
+        eager_sensors: Iterable[range] = (),
+        idle_timeout: float = DEFAULT_IDLE_TIMEOUT,
+        retire_after: Optional[float] = None,
+        networks: int = 1,
+        network_size: int = 0,
+    ):
+        SensorSegment.__init__(self, 1, self._access)
+
+        self._segments: List[SensorSegment] = [self]
+        self._segments.extend(
+            SensorSegment(number, self._access) for number in range(2, networks + 1)
+        )
+        self._network_size = network_size
+
+        self._lazy_stacks = lazy_stacks
+        self._eager_sensors = list(eager_sensors)
+        self._eviction = (
+            IdleEviction(idle_timeout, self._evict) if idle_timeout > 0 else None
+        )
 
         # create the VLAN router, bind it to the local network
         self._router = _VLANRouter(Address(local_address), 0)
 
         self._address_index = 1
-        # create a node for the router, address 1 on the VLAN
-        router_node = Node(Address(self._address_index.to_bytes(4, "big")))
-        self._address_index += 1
+        # Addresses of removed sensors, reused oldest first
+        self._free_addresses: Deque[Address] = deque()
+
+        for segment in self._segments:
+            # create a node for the router, address 1 on the first VLAN
+            router_node = Node(self._next_address())
+
+            segment.add_node(router_node)
 
-        self.add_node(router_node)
+            # bind the router stack to the vlan network through this node
+            self._router.bind(router_node, segment.number)
 
-        # bind the router stack to the vlan network through this node
-        self._router.bind(router_node, 1)
         self._router.start()
 
-        self._sensors: Dict[int, Sensor] = {}
+        self._sensors: Dict[int, BaseSensor] = {}
+        # Values and fault state of every sensor
+        self._store = ValueStore()
+        self._fault_scheduler = FaultScheduler(
+            VirtualSensorNetwork.DEFAULT_SENSOR_TIMEOUT
+        )
+        self._retirement = (
+            RetireScheduler(self._fault_scheduler, retire_after)
+            if retire_after is not None
+            else None
+        )
+        self._cov_increments = dict(cov_increments or {})
+        # One expiry task for the COV subscriptions of every sensor
+        self._subscription_expiry = SubscriptionExpiry()
+        self._announcer = (
+            AnnounceScheduler(announce_rate) if announce_rate > 0 else None
+        )
+
+        if shared_stack:
+            for segment in self._segments:
+                segment.set_shared_app(
+                    SharedSensorApplication(
+                        self._next_address(), self._subscription_expiry
+                    )
+                )
+
+    def _next_address(self) -> Address:
+        if self._free_addresses:
+            return self._free_addresses.popleft()
+
+        address = Address(self._address_index.to_bytes(4, "big"))
+        self._address_index += 1
+
+        return address
+
+    def get_segments(self) -> List[SensorSegment]:
+        return self._segments
+
+    def get_segment(self, _id: int) -> SensorSegment:
+        """
+        Get the virtual network of the sensor with the given id
+        """
+        if self._network_size:
+            index = min(_id // self._network_size, len(self._segments) - 1)
+        else:
+            index = _id % len(self._segments)
 
-    def get_sensor(self, _id: int) -> Union[Sensor, None]:
+        return self._segments[index]
+
+    def get_sensor(self, _id: int) -> Union[BaseSensor, None]:
         return self._sensors.get(_id)
 
-    def get_sensors(self) -> Dict[int, Sensor]:
+    def get_sensors(self) -> Dict[int, BaseSensor]:
         return self._sensors.copy()
 
-    def create_sensor(self, _id: int) -> Sensor:
+    def _new_stack(
+        self, _id: int, address: Address, lazy: Optional[LazySensor] = None
+    ) -> SensorStack:
+        """
+        Make the application stack of a sensor, and connect it to the
+        network. The stack is the sensor itself, unless it is made
+        for a lazy sensor, which keeps its own values and timeouts,
+        and whose row of the store the stack shares.
+        """
+        fault_scheduler = None if lazy else self._fault_scheduler
+        cov_increments = None if lazy else self._cov_increments
+        announcer = None if lazy else self._announcer
+        row = lazy.get_row() if lazy else None
+        segment = self.get_segment(_id)
+        shared_app = segment.get_shared_app()
+
+        stack: SensorStack
+        if shared_app:
+            stack = SharedSensor(
+                _id,
+                address,
+                shared_app,
+                fault_scheduler,
+                cov_increments,
+                announcer,
+                self._store,
+                row,
+            )
+            segment.add_shared_sensor(stack)
+        else:
+            stack = Sensor(
+                _id,
+                address,
+                fault_scheduler,
+                cov_increments,
+                self._subscription_expiry,
+                announcer,
+                self._store,
+                row,
+            )
+            segment.add_node(stack.get_node(), _id)
+
+        return stack
+
+    def _remove_stack(self, stack: SensorStack) -> None:
+        segment = self.get_segment(stack.get_id())
+
+        if isinstance(stack, SharedSensor):
+            segment.remove_shared_sensor(stack)
+        else:
+            segment.remove_node(stack.get_node())
+
+    def _is_eager(self, _id: int) -> bool:
+        return any(_id in ids for ids in self._eager_sensors)
+
+    def _send_i_am(self, sensor: BaseSensor) -> None:
+        """
+        Broadcast an I-Am for a sensor without a stack
+        """
+        segment = self.get_segment(sensor.get_id())
+        segment.process_pdu(encode_i_am(sensor.get_id(), sensor.get_address()))
+
+    def _access(self, sensor: LazySensor) -> None:
+        """
+        Materialize a lazy sensor if it has no stack,
+        and note that it was accessed
+        """
+        if sensor.get_stack() is None:
+            sensor.attach(
+                self._new_stack(sensor.get_id(), sensor.get_address(), sensor)
+            )
+
+        if self._eviction is not None and not self._is_eager(sensor.get_id()):
+            self._eviction.touch(sensor, TaskManager().get_time())
+
+    def _evict(self, sensor: LazySensor) -> bool:
+        stack = sensor.get_stack()
+
+        # Subscriptions would be lost
+        if stack is None or stack.cov_detections:
+            return False
+
+        sensor.detach()
+        self._remove_stack(stack)
+        return True
+
+    def _add_sensor(self, _id: int, address: Address) -> BaseSensor:
         if self.get_sensor(_id):
             raise ValueError(f"Sensor {_id} already exists on network")
 
-        sensor = Sensor(_id, Address(self._address_index.to_bytes(4, "big")))
+        sensor: BaseSensor
+        if self._lazy_stacks:
+            lazy_sensor = LazySensor(
+                _id,
+                address,
+                self._send_i_am,
+                self._fault_scheduler,
+                self._cov_increments,
+                self._announcer,
+                self._store,
+            )
+            self.get_segment(_id).add_lazy_sensor(lazy_sensor)
+
+            if self._is_eager(_id):
+                self._access(lazy_sensor)
+
+            sensor = lazy_sensor
+        else:
+            sensor = self._new_stack(_id, address)
+
         self._sensors[_id] = sensor
 
-        self.add_node(sensor.get_node())
-        self._address_index += 1
+        return sensor
+
+    def create_sensor(self, _id: int) -> BaseSensor:
+        sensor = self._add_sensor(_id, self._next_address())
+
+        if self._announcer is not None:
+            self._announcer.schedule(sensor)
+
+        return sensor
+
+    def restore_sensors(self, snapshots: Iterable[SensorSnapshot]) -> List[BaseSensor]:
+        """
+        Create sensors as they were in their snapshots, at the same
+        VLAN addresses unless those are taken. They are announced
+        like new sensors, and time out from their last update.
+        """
+        snapshots = list(snapshots)
+        restored = []
+
+        # New sensors are given addresses after all of the restored ones
+        for snapshot in snapshots:
+            self._address_index = max(self._address_index, snapshot.address + 1)
+
+        for snapshot in snapshots:
+            address = Address(snapshot.address.to_bytes(4, "big"))
+
+            if self.get_segment(snapshot.sensor_id).is_taken(address):
+                VirtualSensorNetwork._warning(
+                    f"Address of sensor {snapshot.sensor_id} is taken, "
+                    "giving it a new one"
+                )
+                address = self._next_address()
+
+            sensor = self._add_sensor(snapshot.sensor_id, address)
+            sensor.restore(snapshot)
+            self._fault_scheduler.touch(sensor)
+
+            if self._announcer is not None:
+                self._announcer.schedule(sensor)
+
+            restored.append(sensor)
+
+        return restored
+
+    def get_eviction(self) -> Optional[IdleEviction]:
+        return self._eviction
+
+    def get_announcer(self) -> Optional[AnnounceScheduler]:
+        return self._announcer
+
+    def get_store(self) -> ValueStore:
+        return self._store
+
+    def get_fault_scheduler(self) -> FaultScheduler:
+        return self._fault_scheduler
+
+    def pop_outdated_sensors(self, now: float) -> List[BaseSensor]:
+        """
+        Get the sensors which have not received data within
+        their timeout since they were last updated
+        """
+        outdated = self._fault_scheduler.pop_expired(now)
+
+        if self._retirement is not None:
+            for sensor in outdated:
+                self._retirement.touch(sensor)
+
+        return outdated
+
+    def remove_sensor(self, _id: int) -> BaseSensor:
+        """
+        Remove a sensor from the network, and free its address
+        """
+        sensor = self._sensors.pop(_id)
+        address = sensor.get_address()
+
+        self._fault_scheduler.discard(_id)
+        if self._retirement is not None:
+            self._retirement.discard(_id)
+        if self._announcer is not None:
+            self._announcer.discard(sensor)
+
+        sensor.close()
+
+        if isinstance(sensor, LazySensor):
+            self.get_segment(_id).remove_lazy_sensor(sensor)
+            if self._eviction is not None:
+                self._eviction.discard(sensor)
+
+            stack = sensor.detach()
+            if stack is not None:
+                self._remove_stack(stack)
+        else:
+            assert isinstance(sensor, (Sensor, SharedSensor))
+            self._remove_stack(sensor)
+
+        self._free_addresses.append(address)
 
         return sensor
 
+    def retire_sensors(self, now: float) -> List[BaseSensor]:
+        """
+        Remove the sensors which have been faulty for
+        `retire_after` seconds
+        """
+        if self._retirement is None:
+            return []
+
+        retired = self._retirement.pop_expired(now)
+
+        for sensor in retired:
+            if _debug:
+                VirtualSensorNetwork._debug(f"Retiring sensor {sensor.get_id()}")
+
+            self.remove_sensor(sensor.get_id())
+
+        return retired
+
     def run(self) -> None:
         run(sigterm=None, sigusr1=None)
 
@@ -0,0 +1,242 @@
+"""
+ReadProperty and ReadPropertyMultiple services answering from
+pre-encoded property values.
+
+Nearly every property of the sensors' objects, such as their names,
+identifiers and units, and the properties of their devices, never
+change once the object is made. The first read of such a property
+encodes its result into tags, which are kept on the object, so later
+reads only copy the tags into the response. The present value and
+status flags of the values, and the properties computed on every read
+such as the device's local time and COV subscriptions, are still read
+and encoded each time.
+
+None of the cached properties can be written over BACnet. The cache
+of a device is cleared when objects are added to or removed from its
+object list.
+"""
+
+from typing import Any, Dict, List, Optional, Tuple
+
+from bacpypes.apdu import (
+    ReadAccessResult,
+    ReadAccessResultElement,
+    ReadPropertyACK,
+    ReadPropertyMultipleACK,
+)
+from bacpypes.debugging import ModuleLogger, bacpypes_debugging
+from bacpypes.errors import ExecutionError
+from bacpypes.object import Property
+from bacpypes.primitivedata import TagList
+from bacpypes.service.object import (
+    ReadWritePropertyMultipleServices,
+    ReadWritePropertyServices,
+    read_property_to_result_element,
+)
+
+from bacprop.defs import Logable
+
+_debug = 0
+_log = ModuleLogger(globals())
+
+WILDCARD_DEVICE = ("device", 4194303)
+
+# Read from the value store on every read
+_ENCODED_ON_READ = frozenset(("presentValue", "statusFlags"))
+
+# Computed on read, but only from the object and its application,
+# which do not change without clearing the cache
+_COMPUTED_STATIC = frozenset(("propertyList", "protocolServicesSupported"))
+
+# Property identifiers which stand for a group of properties
+_SPECIAL = ("all", "required", "optional")
+
+
+class _EncodedElement(ReadAccessResultElement):
+    """
+    Result element of reading a property, encoded once. The value
+    or error is kept as well, for ReadProperty responses.
+    """
+
+    def __init__(self, element: ReadAccessResultElement) -> None:
+        ReadAccessResultElement.__init__(
+            self,
+            propertyIdentifier=element.propertyIdentifier,
+            propertyArrayIndex=element.propertyArrayIndex,
+            readResult=element.readResult,
+        )
+
+        tags = TagList()
+        ReadAccessResultElement.encode(self, tags)
+        self._tags = tags.tagList
+
+    def encode(self, taglist: TagList) -> None:
+        taglist.extend(self._tags)
+
+
+class _ObjectCache:
+    __slots__ = ("elements", "properties")
+
+    def __init__(self) -> None:
+        # Encoded elements by property identifier and array index
+        self.elements: Dict[Tuple[str, Optional[int]], _EncodedElement] = {}
+        # Property identifiers read for each of the special identifiers
+        self.properties: Dict[str, List[str]] = {}
+
+
+def _get_cache(obj: Any) -> _ObjectCache:
+    try:
+        cache: _ObjectCache = obj._read_cache
+    except AttributeError:
+        cache = obj._read_cache = _ObjectCache()
+
+    return cache
+
+
+def clear_read_cache(obj: Any) -> None:
+    """
+    Drop the encoded properties of the object, once
+    it has changed without being written
+    """
+    try:
+        del obj._read_cache
+    except AttributeError:
+        pass
+
+
+def _is_static(obj: Any, identifier: str) -> bool:
+    prop = obj._properties.get(identifier)
+
+    if prop is None or identifier in _ENCODED_ON_READ:
+        return False
+
+    if identifier in _COMPUTED_STATIC:
+        return True
+
+    # Properties which don't just read their value compute it
+    return type(prop).ReadProperty is Property.ReadProperty
+
+
+def _is_unknown(element: ReadAccessResultElement) -> bool:
+    error = element.readResult.propertyAccessError
+    return error is not None and error.errorCode == "unknownProperty"
+
+
+def read_element(
+    obj: Any, identifier: str, array_index: Optional[int] = None
+) -> ReadAccessResultElement:
+    """
+    Read a property of the object into a result element, pre-encoded
+    and cached if the property does not change. Errors reading such a
+    property, mostly properties without a value, are cached as well.
+    """
+    cache = _get_cache(obj)
+    element = cache.elements.get((identifier, array_index))
+
+    if element is not None:
+        return element
+
+    result = read_property_to_result_element(obj, identifier, array_index)
+
+    if _is_static(obj, identifier):
+        element = cache.elements[(identifier, array_index)] = _EncodedElement(result)
+        return element
+
+    return result
+
+
+def _special_properties(obj: Any, special: str) -> List[str]:
+    cache = _get_cache(obj)
+    identifiers = cache.properties.get(special)
+
+    if identifiers is None:
+        identifiers = cache.properties[special] = [
+            identifier
+            for identifier, prop in obj._properties.items()
+            if special == "all" or prop.optional == (special == "optional")
+        ]
+
+    return identifiers
+
+
+@bacpypes_debugging
+class CachedReadPropertyServices(
+    ReadWritePropertyServices, ReadWritePropertyMultipleServices, Logable
+):
+    """
+    Same as the bacpypes read and write property services,
+    reading properties through the cache of their object
+    """
+
+    def _read_object(self, identifier: Any) -> Tuple[Any, Any]:
+        if identifier == WILDCARD_DEVICE and self.localDevice is not None:
+            identifier = self.localDevice.objectIdentifier
+
+        return identifier, self.get_object_id(identifier)
+
+    def do_ReadPropertyRequest(self, apdu: Any) -> None:
+        if _debug:
+            CachedReadPropertyServices._debug("do_ReadPropertyRequest %r", apdu)
+
+        identifier, obj = self._read_object(apdu.objectIdentifier)
+
+        if not obj:
+            raise ExecutionError(errorClass="object", errorCode="unknownObject")
+
+        element = read_element(obj, apdu.propertyIdentifier, apdu.propertyArrayIndex)
+        error = element.readResult.propertyAccessError
+
+        if error is not None:
+            raise ExecutionError(errorClass=error.errorClass, errorCode=error.errorCode)
+
+        response = ReadPropertyACK(context=apdu)
+        response.objectIdentifier = identifier
+        response.propertyIdentifier = apdu.propertyIdentifier
+        response.propertyArrayIndex = apdu.propertyArrayIndex
+        response.propertyValue = element.readResult.propertyValue
+
+        self.response(response)
+
+    def do_ReadPropertyMultipleRequest(self, apdu: Any) -> None:
+        if _debug:
+            CachedReadPropertyServices._debug("do_ReadPropertyMultipleRequest %r", apdu)
+
+        results = []
+
+        for spec in apdu.listOfReadAccessSpecs:
+            identifier, obj = self._read_object(spec.objectIdentifier)
+            elements: List[ReadAccessResultElement] = []
+
+            for reference in spec.listOfPropertyReferences:
+                property_identifier = reference.propertyIdentifier
+                array_index = reference.propertyArrayIndex
+
+                if not obj:
+                    # Every property of an unknown object is an error
+                    elements.append(
+                        read_property_to_result_element(
+                            obj, property_identifier, array_index
+                        )
+                    )
+
+                elif property_identifier in _SPECIAL:
+                    for special_identifier in _special_properties(
+                        obj, property_identifier
+                    ):
+                        element = read_element(obj, special_identifier, array_index)
+
+                        # Undefined properties are left out
+                        if not _is_unknown(element):
+                            elements.append(element)
+
+                else:
+                    elements.append(read_element(obj, property_identifier, array_index))
+
+            results.append(
+                ReadAccessResult(objectIdentifier=identifier, listOfResults=elements)
+            )
+
+        response = ReadPropertyMultipleACK(context=apdu)
+        response.listOfReadAccessResults = results
+
+        self.response(response)
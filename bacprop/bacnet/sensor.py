@@ -1,7 +1,9 @@
 import argparse
+import heapq
 import random
 import time
-from typing import Dict, Iterable, Any
+from abc import ABC, abstractmethod
+from typing import Any, Dict, Iterable, List, Mapping, Optional, Set
 
 from bacpypes.app import Application
 from bacpypes.basetypes import StatusFlags
@@ -9,41 +11,164 @@ from bacpypes.appservice import ApplicationServiceAccessPoint, StateMachineAcces
 from bacpypes.comm import bind
 from bacpypes.debugging import ModuleLogger, bacpypes_debugging
 from bacpypes.local.device import LocalDeviceObject
+from bacpypes.errors import ExecutionError
 from bacpypes.netservice import NetworkServiceAccessPoint, NetworkServiceElement
-from bacpypes.object import AnalogValueObject, register_object_type
+from bacpypes.object import AnalogValueObject, ReadableProperty, register_object_type
+from bacpypes.apdu import WhoIsRequest
 from bacpypes.pdu import Address, LocalBroadcast
+from bacpypes.primitivedata import Real
 from bacpypes.service.device import WhoIsIAmServices
-from bacpypes.service.object import (
-    ReadWritePropertyMultipleServices,
-    ReadWritePropertyServices,
-)
 from bacpypes.vlan import Node
+from bacprop.bacnet.cov import (
+    ActiveSubscriptionsProperty,
+    SensorCOVServices,
+    SubscriptionExpiry,
+    cancel_object_subscriptions,
+)
+from bacprop.bacnet.announce import AnnounceScheduler
+from bacprop.bacnet.fault import FaultScheduler
+from bacprop.bacnet.readcache import CachedReadPropertyServices, clear_read_cache
+from bacprop.bacnet.store import ValueStore
+from bacprop.bacnet.whois import MAX_INSTANCE, DeviceIndex, who_is_range
 from bacprop.defs import Logable
+from bacprop.metrics import BACNET_REQUESTS
+from bacprop.profiler import stage
+from bacprop.snapshot import SensorSnapshot
 
 # some debugging
 _debug = 0
 _log = ModuleLogger(globals())
 
 
+def _status_flags(fault: int) -> List[int]:
+    status_flags = [0, 0, 0, 0]
+    status_flags[StatusFlags.bitNames["fault"]] = fault
+
+    return status_flags
+
+
+class _StoredValues(dict):
+    """
+    Property values of a value object, which has its present value in
+    a slot of the value store, and its status flags from the fault bit
+    of its sensor's row. bacpypes reads the values from here as well
+    as through the properties.
+    """
+
+    def __init__(self, store: ValueStore, row: int, slot: int) -> None:
+        dict.__init__(self)
+        self.store = store
+        # Arrays grow in place, so the columns can be kept
+        self.present_values = store.values
+        self.faults = store.faults
+        self.row = row
+        self.slot = slot
+
+    def __missing__(self, identifier: str) -> Any:
+        if identifier == "presentValue":
+            return self.present_values[self.slot]
+
+        if identifier == "statusFlags":
+            return _status_flags(self.faults[self.row])
+
+        raise KeyError(identifier)
+
+
+class _StoredProperty(ReadableProperty):
+    """
+    Property read from the value store, which is only set directly
+    """
+
+    def WriteProperty(
+        self,
+        obj: Any,
+        value: Any,
+        arrayIndex: Optional[int] = None,
+        priority: Optional[int] = None,
+        direct: bool = False,
+    ) -> None:
+        if not direct or self.identifier != "presentValue":
+            raise ExecutionError(errorClass="property", errorCode="writeAccessDenied")
+
+        stored = obj._values
+        values = stored.present_values
+        slot = stored.slot
+
+        if "presentValue" not in obj._property_monitors:
+            values[slot] = value
+            return
+
+        old_value = values[slot]
+        values[slot] = value
+
+        # Like any other property, for COV detection
+        for monitor in obj._property_monitors["presentValue"]:
+            monitor(old_value, values[slot])
+
+
 @bacpypes_debugging
 class _SensorValueObject(AnalogValueObject, Logable):
-    def __init__(self, index: int, name: str):
+    _values: _StoredValues
+
+    properties = [
+        _StoredProperty("presentValue", Real),
+        _StoredProperty("statusFlags", StatusFlags),
+    ]
+
+    def __init__(
+        self,
+        index: int,
+        name: str,
+        store: ValueStore,
+        row: int,
+        slot: int,
+        cov_increment: float = 0.0,
+    ):
         kwargs = dict(
             objectIdentifier=("analogValue", index),
             objectName=name,
-            presentValue=0,
-            statusFlags=[0, 0, 0, 0],
+            covIncrement=cov_increment,
         )
         if _debug:
             _SensorValueObject._debug("__init__ %r", kwargs)
 
         AnalogValueObject.__init__(self, **kwargs)
 
+        values = _StoredValues(store, row, slot)
+        values.update(
+            (identifier, value)
+            for identifier, value in self._values.items()
+            if not isinstance(self._properties[identifier], _StoredProperty)
+        )
+        self._values = values
+
+    def get_slot(self) -> int:
+        return self._values.slot
+
+    def is_monitored(self) -> bool:
+        # Unbinding leaves an empty list behind
+        return bool(self._property_monitors.get("presentValue"))
+
+    def monitor_added(self) -> None:
+        store = self._values.store
+        store.monitored += 1
+        store.monitor_changes += 1
+
+    def monitor_removed(self) -> None:
+        store = self._values.store
+        store.monitored -= 1
+        store.monitor_changes += 1
+
     def set_value(self, value: float) -> None:
         self.presentValue = value
 
-    def set_fault(self, fault: bool) -> None:
-        self.statusFlags[StatusFlags.bitNames["fault"]] = int(fault)
+    def fault_changed(self, fault: bool) -> None:
+        """
+        Tell the monitors of the status flags that the
+        fault bit of the sensor has changed
+        """
+        for monitor in self._property_monitors.get("statusFlags", ()):
+            monitor(_status_flags(int(not fault)), _status_flags(int(fault)))
 
 
 register_object_type(_SensorValueObject)
@@ -53,15 +178,22 @@ register_object_type(_SensorValueObject)
 class _VLANApplication(
     Application,
     WhoIsIAmServices,
-    ReadWritePropertyServices,
-    ReadWritePropertyMultipleServices,
+    CachedReadPropertyServices,
+    SensorCOVServices,
     Logable,
 ):
-    def __init__(self, vlan_device: LocalDeviceObject, vlan_address: Address) -> None:
+    def __init__(
+        self,
+        vlan_device: LocalDeviceObject,
+        vlan_address: Address,
+        subscription_expiry: Optional[SubscriptionExpiry] = None,
+    ) -> None:
         if _debug:
             _VLANApplication._debug("__init__ %r %r", vlan_device, vlan_address)
         Application.__init__(self, localDevice=vlan_device, aseID=None)
 
+        self._init_cov(subscription_expiry)
+
         # include a application decoder
         self._asap = ApplicationServiceAccessPoint()
 
@@ -94,10 +226,14 @@ class _VLANApplication(
             _VLANApplication._debug("[%s]request %r", self._vlan_node.address, apdu)
         Application.request(self, apdu)
 
+    @stage("bacnet")
     def indication(self, apdu: Any) -> None:
         if _debug:
             _VLANApplication._debug("[%s]indication %r", self._vlan_node.address, apdu)
+
+        start = time.perf_counter()
         Application.indication(self, apdu)
+        BACNET_REQUESTS.observe(time.perf_counter() - start, type(apdu).__name__)
 
     def response(self, apdu: Any) -> None:
         if _debug:
@@ -109,89 +245,751 @@ class _VLANApplication(
             _VLANApplication._debug(
                 "[%s]confirmation %r", self._vlan_node.address, apdu
             )
-        Application.confirmation(self, apdu)
+        SensorCOVServices.confirmation(self, apdu)
 
     def get_node(self) -> Node:
         return self._vlan_node
 
 
+MAX_APDU_LENGTH = 1024
+SEGMENTATION = "segmentedBoth"
+VENDOR_ID = 15
+
+
+def _make_device(sensor_id: int) -> LocalDeviceObject:
+    return LocalDeviceObject(
+        objectName="Sensor %d" % (sensor_id,),
+        objectIdentifier=("device", sensor_id),
+        maxApduLengthAccepted=MAX_APDU_LENGTH,
+        segmentationSupported=SEGMENTATION,
+        vendorIdentifier=VENDOR_ID,
+    )
+
+
 @bacpypes_debugging
-class Sensor(_VLANApplication, Logable):
-    """
-    Bacnet representation of a sensor
-    on the network
+class BaseSensor(ABC, Logable):
     """
+    Sensor values and fault state, shared by sensors with their
+    own application stack and sensors on a shared stack. The
+    object collection methods come from the class this is mixed into.
 
-    def __init__(self, sensor_id: int, vlan_address: Address) -> None:
-        vlan_device = LocalDeviceObject(
-            objectName="Sensor %d" % (sensor_id,),
-            objectIdentifier=("device", sensor_id),
-            maxApduLengthAccepted=1024,
-            segmentationSupported="segmentedBoth",
-            vendorIdentifier=15,
-        )
-        if _debug:
-            Sensor._debug("    - vlan_device: %r", vlan_device)
+    The update time, fault bit and values are kept in the value
+    store of the network, or a store of the sensor's own.
 
-        if _debug:
-            Sensor._debug("    - vlan_address: %r", vlan_address)
-
-        # make the application
-        _VLANApplication.__init__(self, vlan_device, vlan_address)
-        if _debug:
-            Sensor._debug("    - vlan_app: %r", self)
+    A key whose object is removed keeps its instance number in case
+    it comes back, for up to `REMOVED_KEYS` removed keys, after which
+    the longest removed are forgotten, and their instance numbers
+    are given to new keys.
+    """
 
+    REMOVED_KEYS = 32
+
+    def __init__(
+        self,
+        sensor_id: int,
+        vlan_address: Address,
+        fault_scheduler: Optional[FaultScheduler] = None,
+        cov_increments: Optional[Mapping[str, float]] = None,
+        announcer: Optional[AnnounceScheduler] = None,
+        store: Optional[ValueStore] = None,
+        row: Optional[int] = None,
+    ) -> None:
         self._id = sensor_id
         self._vlan_address = vlan_address
+        self._store = store if store is not None else ValueStore()
+        # The stack of a lazy sensor is given the sensor's row
+        self._row = row if row is not None else self._store.add_row(sensor_id)
         self._object_index = 0
         self._objects: Dict[str, _SensorValueObject] = {}
-        self._last_updated: float = 0
-        self._fault = False
+        # Instance numbers stay with their key, even once its object is removed
+        self._instances: Dict[str, int] = {}
+        # Keys without an object, longest removed first
+        self._removed_keys: Dict[str, None] = {}
+        # Instance numbers of forgotten keys, as a heap
+        self._free_instances: List[int] = []
+        # Update times of keys set by merge updates
+        self._key_updated: Dict[str, float] = {}
+        self._fault_scheduler = fault_scheduler
+        self._announcer = announcer
+        # COV increment of each key name, 0 reports any change
+        self._cov_increments = cov_increments or {}
+        # Store slot of each key's object
+        self._slots: Dict[str, int] = {}
+        # Whether values can be written straight into their slots, as
+        # none of the objects are monitored, checked again when the
+        # store's monitored objects change
+        self._direct = False
+        self._direct_monitored = -1
+
+    @abstractmethod
+    def add_object(self, obj: Any) -> None:
+        pass
+
+    @abstractmethod
+    def delete_object(self, obj: Any) -> None:
+        pass
+
+    @abstractmethod
+    def announce(self) -> None:
+        """
+        Send an I-Am for the sensor
+        """
+
+    def _new_object(self, instance: int, key_name: str, slot: int) -> Any:
+        return _SensorValueObject(
+            instance,
+            key_name,
+            self._store,
+            self._row,
+            slot,
+            self._cov_increments.get(key_name, 0.0),
+        )
 
-    def _register_objects(self, keys: Iterable[str]) -> None:
+    def _register_objects(
+        self, keys: Iterable[str], slots: Optional[Mapping[str, int]] = None
+    ) -> None:
+        """
+        Add objects for the keys, over the given store slots
+        or new ones
+        """
         value_keys = list(keys)
         value_keys.sort()
 
         for key_name in value_keys:
-            new_object = _SensorValueObject(self._object_index, key_name)
+            instance = self._instances.get(key_name)
+
+            if instance is None:
+                instance = self._new_instance()
+                if instance is None:
+                    # pylint: disable=no-member
+                    BaseSensor._error(
+                        f"Sensor {self._id} has run out of object instance "
+                        f"numbers, {key_name!r} is left out"
+                    )
+                    continue
+                self._instances[key_name] = instance
+            else:
+                self._removed_keys.pop(key_name, None)
+
+            slot = (
+                slots[key_name] if slots else self._store.add_slot(self._row, key_name)
+            )
+
+            new_object = self._new_object(instance, key_name, slot)
             self.add_object(new_object)
-            self._object_index += 1
             self._objects[key_name] = new_object
+            self._slots[key_name] = slot
+
+        self._direct_monitored = -1
+
+    def _remove_objects(self, keys: Iterable[str]) -> None:
+        for key_name in keys:
+            _object = self._objects.pop(key_name)
+            self.delete_object(_object)
+            self._store.free_slot(self._slots.pop(key_name))
+            self._removed_keys[key_name] = None
+
+        self._forget_removed_keys()
+        self._direct_monitored = -1
+
+    def _new_instance(self) -> Optional[int]:
+        """
+        Get an instance number for a new key, the lowest forgotten
+        one if any, or None once they have all been used
+        """
+        if not self._free_instances and self._object_index > MAX_INSTANCE:
+            # Forget a removed key early, rather than leave this one out
+            if not self._removed_keys:
+                return None
+            self._forget_removed_key()
+
+        if self._free_instances:
+            return heapq.heappop(self._free_instances)
+
+        self._object_index += 1
+        return self._object_index - 1
+
+    def _forget_removed_key(self) -> None:
+        key_name = next(iter(self._removed_keys))
+        del self._removed_keys[key_name]
+        heapq.heappush(self._free_instances, self._instances.pop(key_name))
+
+    def _forget_removed_keys(self) -> None:
+        while len(self._removed_keys) > BaseSensor.REMOVED_KEYS:
+            self._forget_removed_key()
 
     def _clear_objects(self) -> None:
-        for attr in self._objects:
-            self.delete_object(self._objects[attr])
+        self._remove_objects(list(self._objects))
 
-        self._object_index = 0
-        self._objects = {}
+    def close(self) -> None:
+        """
+        Remove the objects of a sensor which is being removed
+        from the network, cancelling their COV subscriptions,
+        and free its row of the store
+        """
+        self._clear_objects()
+        self._store.free_row(self._row)
 
-    def set_values(self, new_values: Dict[str, Any]) -> None:
+    def _update_objects(self, keys: Iterable[str]) -> None:
+        """
+        Add objects for new keys and remove the objects of
+        keys which are no longer given
+        """
+        keys = set(keys)
+
+        self._remove_objects([key for key in self._objects if key not in keys])
+        self._register_objects([key for key in keys if key not in self._objects])
+
+    def _merge_values(self, new_values: Dict[str, Any]) -> None:
+        for key, value in new_values.items():
+            _object = self._objects.get(key)
+
+            if value is None:
+                if _object:
+                    self._remove_objects((key,))
+                self._key_updated.pop(key, None)
+                continue
+
+            if not _object:
+                self._register_objects((key,))
+                _object = self._objects.get(key)
+                if not _object:
+                    continue
+
+            _object.set_value(value)
+            self._key_updated[key] = self._store.update_times[self._row]
+
+    def set_values(self, new_values: Dict[str, Any], merge: bool = False) -> None:
         """
         Set the values of the sensor. If the attributes have changed,
         update the attributes.
+
+        When merging, only the given keys are updated, and keys
+        given a None value are removed. Otherwise the given keys
+        replace all existing ones.
+        """
+        self._store.update_times[self._row] = time.time()
+        if self._fault_scheduler is not None:
+            self._fault_scheduler.touch(self)
+        if self._announcer is not None:
+            self._announcer.touch(self)
+
+        if merge:
+            self._merge_values(new_values)
+            return
+
+        self._key_updated.clear()
+
+        if None in new_values.values():
+            new_values = {
+                key: value for key, value in new_values.items() if value is not None
+            }
+
+        # Key views compare without building sets, so the
+        # common case of unchanged keys costs no allocations
+        if new_values.keys() != self._objects.keys():
+            if _debug:
+                BaseSensor._debug("Sensor %d keys changed", self._id)
+            self._update_objects(new_values)
+
+            # Keys left out for want of instance numbers
+            if len(self._objects) < len(new_values):
+                new_values = {
+                    key: value
+                    for key, value in new_values.items()
+                    if key in self._objects
+                }
+
+        if self._direct_monitored != self._store.monitor_changes:
+            self._check_direct()
+
+        # Values go straight into their slots, unless
+        # something has to be told of the change
+        if self._direct:
+            values = self._store.values
+            slots = self._slots
+            for key, value in new_values.items():
+                values[slots[key]] = value
+        else:
+            for key, value in new_values.items():
+                self._objects[key].set_value(value)
+
+    def _check_direct(self) -> None:
+        # Nothing can be monitored until something in the store is
+        self._direct = not self._store.monitored or not any(
+            _object.is_monitored() for _object in self._objects.values()
+        )
+        self._direct_monitored = self._store.monitor_changes
+
+    def expire_keys(self, before: float) -> List[str]:
         """
-        self._last_updated = time.time()
-        if set(self._objects.keys()) != set(new_values.keys()):
-            self._clear_objects()
-            self._register_objects(new_values)
+        Remove the keys set by merge updates which have
+        not been updated since `before`
+        """
+        expired = [
+            key for key, updated in self._key_updated.items() if updated < before
+        ]
 
-        for attr in new_values:
-            self._objects[attr].set_value(new_values[attr])
+        for key in expired:
+            del self._key_updated[key]
 
-    def mark_fault(self) -> None:
-        for _object in self._objects.values():
-            _object.set_fault(True)
+        self._remove_objects(expired)
+
+        return expired
+
+    def _set_fault(self, fault: bool) -> None:
+        faults = self._store.faults
 
-        self._fault = True
+        if faults[self._row] != fault:
+            faults[self._row] = fault
+
+            for _object in self._objects.values():
+                _object.fault_changed(fault)
+
+    def mark_fault(self) -> None:
+        self._set_fault(True)
 
     def mark_ok(self) -> None:
-        for _object in self._objects.values():
-            _object.set_fault(False)
+        self._set_fault(False)
 
-        self._fault = False
+    def get_snapshot(self) -> SensorSnapshot:
+        """
+        Get the state of the sensor, including the instance
+        numbers of keys which no longer have an object
+        """
+        keys = {}
+        for key, instance in self._instances.items():
+            _object = self._objects.get(key)
+            keys[key] = (instance, None if _object is None else _object.presentValue)
+
+        return SensorSnapshot(
+            self._id,
+            int.from_bytes(self._vlan_address.addrAddr, "big"),
+            self.get_update_time(),
+            self.has_fault(),
+            bool(self._key_updated),
+            keys,
+        )
+
+    def restore(self, snapshot: SensorSnapshot) -> None:
+        """
+        Restore the state of a newly created sensor from its snapshot,
+        keeping the instance numbers its keys had
+        """
+        self._instances = {
+            key: instance for key, (instance, _) in snapshot.keys.items()
+        }
+        self._object_index = max(self._instances.values(), default=-1) + 1
+        used = set(self._instances.values())
+        self._free_instances = [
+            instance
+            for instance in range(min(self._object_index, MAX_INSTANCE + 1))
+            if instance not in used
+        ]
+        self._removed_keys = {
+            key: None for key, (_, value) in snapshot.keys.items() if value is None
+        }
+        self._forget_removed_keys()
+        self._store.update_times[self._row] = snapshot.update_time
+        self._store.faults[self._row] = snapshot.fault
+
+        values = {
+            key: value for key, (_, value) in snapshot.keys.items() if value is not None
+        }
+        self._register_objects(values)
+
+        for key, value in values.items():
+            self._objects[key].set_value(value)
+
+        if snapshot.merged:
+            self._key_updated = dict.fromkeys(values, snapshot.update_time)
+
+    def get_id(self) -> int:
+        return self._id
+
+    def get_address(self) -> Address:
+        return self._vlan_address
+
+    def get_row(self) -> int:
+        return self._row
+
+    def get_object_count(self) -> int:
+        return len(self._objects)
 
     def has_fault(self) -> bool:
-        return self._fault
+        return bool(self._store.faults[self._row])
 
     def get_update_time(self) -> float:
-        return self._last_updated
+        return self._store.update_times[self._row]
+
+
+@bacpypes_debugging
+class Sensor(_VLANApplication, BaseSensor):
+    """
+    Bacnet representation of a sensor
+    on the network
+    """
+
+    def __init__(
+        self,
+        sensor_id: int,
+        vlan_address: Address,
+        fault_scheduler: Optional[FaultScheduler] = None,
+        cov_increments: Optional[Mapping[str, float]] = None,
+        subscription_expiry: Optional[SubscriptionExpiry] = None,
+        announcer: Optional[AnnounceScheduler] = None,
+        store: Optional[ValueStore] = None,
+        row: Optional[int] = None,
+    ) -> None:
+        vlan_device = _make_device(sensor_id)
+        if _debug:
+            Sensor._debug("    - vlan_device: %r", vlan_device)
+
+        if _debug:
+            Sensor._debug("    - vlan_address: %r", vlan_address)
+
+        # make the application
+        _VLANApplication.__init__(self, vlan_device, vlan_address, subscription_expiry)
+        if _debug:
+            Sensor._debug("    - vlan_app: %r", self)
+
+        BaseSensor.__init__(
+            self,
+            sensor_id,
+            vlan_address,
+            fault_scheduler,
+            cov_increments,
+            announcer,
+            store,
+            row,
+        )
+
+    def add_object(self, obj: Any) -> None:
+        _VLANApplication.add_object(self, obj)
+        # The object list has changed
+        clear_read_cache(self.localDevice)
+
+    def delete_object(self, obj: Any) -> None:
+        cancel_object_subscriptions(self.cov_detections, obj)
+        _VLANApplication.delete_object(self, obj)
+        clear_read_cache(self.localDevice)
+
+    def announce(self) -> None:
+        self.i_am()
+
+
+class _DeviceAddress(Address):
+    """
+    The address of a remote device, qualified by which of the
+    shared sensors it is talking to.
+
+    Server transactions in the state machine access point are matched
+    on the remote address and invoke ID only, and a client may well
+    use the same invoke ID with two sensors at once.
+    """
+
+    def __init__(self, address: Address, device_address: Address) -> None:
+        self.addrType = address.addrType
+        self.addrNet = address.addrNet
+        self.addrAddr = address.addrAddr
+        self.addrLen = address.addrLen
+        self.remoteAddress = address
+        self.deviceAddress = device_address
+
+    def __hash__(self) -> int:
+        return hash((Address.__hash__(self), self.deviceAddress))
+
+    def __eq__(self, other: Any) -> bool:
+        return (
+            isinstance(other, _DeviceAddress)
+            and Address.__eq__(self, other)
+            and self.deviceAddress == other.deviceAddress
+        )
+
+    def __ne__(self, other: Any) -> bool:
+        return not self.__eq__(other)
+
+
+class _SharedStateMachineAccessPoint(StateMachineAccessPoint):
+    def confirmation(self, pdu: Any) -> None:
+        if pdu.pduUserData is not None:
+            pdu.pduSource = _DeviceAddress(pdu.pduSource, pdu.pduUserData)
+
+        StateMachineAccessPoint.confirmation(self, pdu)
+
+
+@bacpypes_debugging
+class _SharedNode(Node, Logable):
+    """
+    VLAN node which receives for every address of the shared sensors.
+
+    Incoming unicast PDUs are tagged with the address they were sent to,
+    and the tag is carried through the stack into the response context,
+    so outgoing PDUs can be sent from the right sensor address.
+    """
+
+    def __init__(self, vlan_address: Address) -> None:
+        Node.__init__(self, vlan_address, spoofing=True)
+        self.addresses: Set[Address] = set()
+
+    def indication(self, pdu: Any) -> None:
+        if pdu.pduSource is None and pdu.pduUserData in self.addresses:
+            pdu.pduSource = pdu.pduUserData
+
+        if isinstance(pdu.pduDestination, _DeviceAddress):
+            pdu.pduDestination = pdu.pduDestination.remoteAddress
+
+        Node.indication(self, pdu)
+
+    def response(self, pdu: Any) -> None:
+        if pdu.pduDestination in self.addresses:
+            pdu.pduUserData = pdu.pduDestination
+        else:
+            pdu.pduUserData = None
+
+        if _debug:
+            _SharedNode._debug("response %r for %r", pdu, pdu.pduUserData)
+
+        Node.response(self, pdu)
+
+
+@bacpypes_debugging
+class SharedSensorApplication(
+    Application,
+    WhoIsIAmServices,
+    CachedReadPropertyServices,
+    SensorCOVServices,
+    Logable,
+):
+    """
+    One application stack serving many `SharedSensor` devices,
+    dispatching requests on the sensor address they were sent to.
+    """
+
+    def __init__(
+        self,
+        vlan_address: Address,
+        subscription_expiry: Optional[SubscriptionExpiry] = None,
+    ) -> None:
+        if _debug:
+            SharedSensorApplication._debug("__init__ %r", vlan_address)
+        Application.__init__(self, aseID=None)
+
+        self.localDevice = None
+        self._init_cov(subscription_expiry)
+        self._sensors: Dict[Address, SharedSensor] = {}
+        self._device_index: DeviceIndex[SharedSensor] = DeviceIndex()
+        self._current: Optional[SharedSensor] = None
+
+        # include a application decoder
+        self._asap = ApplicationServiceAccessPoint()
+
+        # all of the sensors have the same segmentation support
+        self._smap = _SharedStateMachineAccessPoint()
+        self._smap.deviceInfoCache = self.deviceInfoCache
+        self._smap.segmentationSupported = "segmentedBoth"
+        self._smap.maxSegmentsAccepted = 16
+
+        # a network service access point will be needed
+        self._nsap = NetworkServiceAccessPoint()
+
+        # give the NSAP a generic network layer service element
+        self._nse = NetworkServiceElement()
+        bind(self._nse, self._nsap)
+
+        # bind the top layers
+        bind(self, self._asap, self._smap, self._nsap)
+
+        # one vlan node for all of the sensors
+        self._vlan_node = _SharedNode(vlan_address)
+        self._nsap.bind(self._vlan_node)
+
+    def _select(self, sensor: Optional["SharedSensor"]) -> None:
+        self._current = sensor
+
+        if sensor:
+            self.localDevice = sensor.localDevice
+            self.objectName = sensor.objectName
+            self.objectIdentifier = sensor.objectIdentifier
+            self.cov_detections = sensor.cov_detections
+        else:
+            self.localDevice = None
+            self.objectName = {}
+            self.objectIdentifier = {}
+            self.cov_detections = {}
+
+    def add_sensor(self, sensor: "SharedSensor") -> None:
+        self._sensors[sensor.get_address()] = sensor
+        self._device_index.add(sensor.get_id(), sensor)
+        self._vlan_node.addresses.add(sensor.get_address())
+
+    def remove_sensor(self, sensor: "SharedSensor") -> None:
+        del self._sensors[sensor.get_address()]
+        self._device_index.remove(sensor.get_id())
+        self._vlan_node.addresses.discard(sensor.get_address())
+
+    def _who_is_sensors(self, apdu: WhoIsRequest) -> List["SharedSensor"]:
+        who_is = who_is_range(
+            apdu.deviceInstanceRangeLowLimit, apdu.deviceInstanceRangeHighLimit
+        )
+
+        # Every sensor rejects inconsistent limits
+        if who_is is None:
+            return list(self._sensors.values())
+
+        return self._device_index.find(who_is)
+
+    def get_node(self) -> Node:
+        return self._vlan_node
+
+    def request(self, apdu: Any) -> None:
+        # requests made on behalf of a sensor are sent from its address
+        if apdu.pduUserData is None and self._current:
+            apdu.pduUserData = self._current.get_address()
+
+        Application.request(self, apdu)
+
+    def confirmation(self, apdu: Any) -> None:
+        SensorCOVServices.confirmation(self, apdu)
+
+    @stage("bacnet")
+    def indication(self, apdu: Any) -> None:
+        if _debug:
+            SharedSensorApplication._debug("[%s]indication %r", apdu.pduUserData, apdu)
+
+        sensor = self._sensors.get(apdu.pduUserData)
+        start = time.perf_counter()
+
+        try:
+            if sensor:
+                self._select(sensor)
+                Application.indication(self, apdu)
+
+            elif isinstance(apdu, WhoIsRequest):
+                # broadcast, answer for every sensor in range
+                for sensor in self._who_is_sensors(apdu):
+                    self._select(sensor)
+                    self.do_WhoIsRequest(apdu)
+        finally:
+            self._select(None)
+
+        BACNET_REQUESTS.observe(time.perf_counter() - start, type(apdu).__name__)
+
+    def announce(
+        self, sensor: "SharedSensor", address: Optional[Address] = None
+    ) -> None:
+        """
+        Send an I-Am on behalf of the given sensor
+        """
+        try:
+            self._select(sensor)
+            self.i_am(address)
+        finally:
+            self._select(None)
+
+    def cancel_sensor_subscription(self, sensor: "SharedSensor", cov: Any) -> None:
+        previous = self._current
+        try:
+            self._select(sensor)
+            self.cancel_subscription(cov)
+        finally:
+            self._select(previous)
+
+    def sensor_cov_notification(
+        self, sensor: "SharedSensor", cov: Any, request: Any
+    ) -> None:
+        # Confirmed notifications may be queued, and sent
+        # once the sensor is no longer selected
+        request.pduUserData = sensor.get_address()
+        self.cov_notification(cov, request)
+
+
+@bacpypes_debugging
+class SharedSensor(BaseSensor):
+    """
+    Bacnet representation of a sensor served by a
+    `SharedSensorApplication`. Only the device object and
+    the value objects are held for each sensor.
+    """
+
+    def __init__(
+        self,
+        sensor_id: int,
+        vlan_address: Address,
+        application: SharedSensorApplication,
+        fault_scheduler: Optional[FaultScheduler] = None,
+        cov_increments: Optional[Mapping[str, float]] = None,
+        announcer: Optional[AnnounceScheduler] = None,
+        store: Optional[ValueStore] = None,
+        row: Optional[int] = None,
+    ) -> None:
+        self.localDevice = _make_device(sensor_id)
+        if _debug:
+            SharedSensor._debug("    - vlan_device: %r", self.localDevice)
+
+        # protocolServicesSupported is read through the application
+        self.localDevice._app = application
+        self.localDevice.add_property(ActiveSubscriptionsProperty())
+        self._application = application
+
+        self.objectName = {self.localDevice.objectName: self.localDevice}
+        self.objectIdentifier = {self.localDevice.objectIdentifier: self.localDevice}
+        self.cov_detections: Dict[Any, Any] = {}
+
+        BaseSensor.__init__(
+            self,
+            sensor_id,
+            vlan_address,
+            fault_scheduler,
+            cov_increments,
+            announcer,
+            store,
+            row,
+        )
+
+    def add_object(self, obj: Any) -> None:
+        """
+        Same as `Application.add_object`
+        """
+        if obj.objectName in self.objectName:
+            raise RuntimeError("already an object with name %r" % (obj.objectName,))
+        if obj.objectIdentifier in self.objectIdentifier:
+            raise RuntimeError(
+                "already an object with identifier %r" % (obj.objectIdentifier,)
+            )
+
+        self.objectName[obj.objectName] = obj
+        self.objectIdentifier[obj.objectIdentifier] = obj
+        self.localDevice.objectList.append(obj.objectIdentifier)
+        clear_read_cache(self.localDevice)
+
+        obj._app = self
+
+    def delete_object(self, obj: Any) -> None:
+        """
+        Same as `Application.delete_object`
+        """
+        del self.objectName[obj.objectName]
+        del self.objectIdentifier[obj.objectIdentifier]
+
+        object_list = self.localDevice.objectList
+        del object_list[object_list.index(obj.objectIdentifier)]
+        clear_read_cache(self.localDevice)
+
+        cancel_object_subscriptions(self.cov_detections, obj)
+        obj._app = None
+
+    def cancel_subscription(self, cov: Any) -> None:
+        self._application.cancel_sensor_subscription(self, cov)
+
+    def cov_notification(self, cov: Any, request: Any) -> None:
+        self._application.sensor_cov_notification(self, cov, request)
+
+    def announce(self) -> None:
+        self._application.announce(self)
+
+    def get_object_id(self, objid: Any) -> Any:
+        return self.objectIdentifier.get(objid)
+
+    def get_object_name(self, objname: str) -> Any:
+        return self.objectName.get(objname)
@@ -0,0 +1,107 @@
+"""
+Columnar store of the state of every sensor on a network.
+
+Each sensor has a row, holding its update time and fault bit, and
+each of its keys a slot, holding its value. The columns are typed
+arrays, so counting the faulty sensors or exporting every value is
+a single pass over contiguous memory, without visiting the value
+objects. The sensors and their value objects only hold their row
+and slots.
+
+Rows and slots of removed sensors and keys are reused.
+"""
+
+from array import array
+from typing import Dict, List
+
+from bacpypes.debugging import ModuleLogger, bacpypes_debugging
+
+from bacprop.defs import Logable
+
+_debug = 0
+_log = ModuleLogger(globals())
+
+# Sensor id of a free row, and row of a free slot
+FREE = -1
+
+
+@bacpypes_debugging
+class ValueStore(Logable):
+    def __init__(self) -> None:
+        # Sensor rows
+        self.sensor_ids = array("q")
+        self.update_times = array("d")
+        self.faults = array("B")
+        self._free_rows: List[int] = []
+
+        # Key slots
+        self.slot_rows = array("q")
+        self.values = array("d")
+        self._slot_keys: List[str] = []
+        self._free_slots: List[int] = []
+
+        # Count of value objects given monitors, whose values
+        # can't be written straight into their slots
+        self.monitored = 0
+        # Bumped whenever an object gains or loses its monitors, as
+        # the count alone can come back to the same number
+        self.monitor_changes = 0
+
+    def add_row(self, sensor_id: int) -> int:
+        if self._free_rows:
+            row = self._free_rows.pop()
+            self.sensor_ids[row] = sensor_id
+            return row
+
+        self.sensor_ids.append(sensor_id)
+        self.update_times.append(0.0)
+        self.faults.append(0)
+
+        return len(self.sensor_ids) - 1
+
+    def free_row(self, row: int) -> None:
+        self.sensor_ids[row] = FREE
+        self.update_times[row] = 0.0
+        self.faults[row] = 0
+        self._free_rows.append(row)
+
+    def add_slot(self, row: int, key: str) -> int:
+        if self._free_slots:
+            slot = self._free_slots.pop()
+            self.slot_rows[slot] = row
+            self._slot_keys[slot] = key
+            return slot
+
+        self.slot_rows.append(row)
+        self.values.append(0.0)
+        self._slot_keys.append(key)
+
+        return len(self.slot_rows) - 1
+
+    def free_slot(self, slot: int) -> None:
+        self.slot_rows[slot] = FREE
+        self.values[slot] = 0.0
+        self._slot_keys[slot] = ""
+        self._free_slots.append(slot)
+
+    def count_sensors(self) -> int:
+        return len(self.sensor_ids) - len(self._free_rows)
+
+    def count_faults(self) -> int:
+        # Free rows have no fault
+        return self.faults.count(1)
+
+    def export_values(self) -> Dict[int, Dict[str, float]]:
+        """
+        Get the values of every key of every sensor, by sensor id
+        """
+        sensor_ids = self.sensor_ids
+        exported: Dict[int, Dict[str, float]] = {
+            sensor_id: {} for sensor_id in sensor_ids if sensor_id != FREE
+        }
+
+        for row, key, value in zip(self.slot_rows, self._slot_keys, self.values):
+            if row != FREE:
+                exported[sensor_ids[row]][key] = value
+
+        return exported
@@ -0,0 +1,112 @@
+"""
+Sorted index of the device instances on the network, so a Who-Is
+is only handed to the devices in its range
+"""
+
+from bisect import bisect_left, bisect_right, insort
+from copy import deepcopy
+from typing import Any, Dict, Generic, List, Optional, Tuple, TypeVar
+
+from bacpypes.apdu import APDU, UnconfirmedRequestPDU, unconfirmed_request_types
+from bacpypes.debugging import ModuleLogger
+from bacpypes.errors import AbortException, DecodingError, RejectException
+from bacpypes.npdu import NPDU
+from bacpypes.pdu import PDU
+
+_debug = 0
+_log = ModuleLogger(globals())
+
+MAX_INSTANCE = 4_194_303
+
+# (low limit, high limit), both inclusive
+WhoIsRange = Tuple[int, int]
+
+T = TypeVar("T")
+
+
+def who_is_range(
+    low_limit: Optional[int], high_limit: Optional[int]
+) -> Optional[WhoIsRange]:
+    """
+    Get the range of device instances a Who-Is is asking for. None is
+    returned for inconsistent limits, which the devices have to reject.
+    """
+    if low_limit is None and high_limit is None:
+        return 0, MAX_INSTANCE
+
+    if low_limit is None or high_limit is None:
+        return None
+
+    if not (0 <= low_limit <= MAX_INSTANCE and 0 <= high_limit <= MAX_INSTANCE):
+        return None
+
+    return low_limit, high_limit
+
+
+def decode_request(pdu: Any) -> Optional[APDU]:
+    """
+    Decode the unconfirmed request carried by a VLAN PDU, such as a
+    Who-Is. None is returned for anything else.
+    """
+    try:
+        npdu = NPDU()
+        npdu.decode(PDU(pdu.pduData))
+
+        if npdu.npduNetMessage is not None:
+            return None
+
+        apdu = APDU()
+        apdu.decode(deepcopy(npdu))
+
+        if apdu.apduType != UnconfirmedRequestPDU.pduType:
+            return None
+
+        request_type = unconfirmed_request_types.get(apdu.apduService)
+        if request_type is None:
+            return None
+
+        unconfirmed = UnconfirmedRequestPDU()
+        unconfirmed.decode(apdu)
+
+        request = request_type()
+        request.decode(unconfirmed)
+    except (AbortException, DecodingError, RejectException):
+        return None
+
+    return request
+
+
+class DeviceIndex(Generic[T]):
+    """
+    Devices ordered by instance number, answering which are in the range
+    of a Who-Is with two binary searches. Adding and removing a device
+    shifts the sorted list, which is a memory move rather than a scan.
+    """
+
+    def __init__(self) -> None:
+        self._instances: List[int] = []
+        self._devices: Dict[int, T] = {}
+
+    def add(self, instance: int, device: T) -> None:
+        if instance in self._devices:
+            raise ValueError(f"Device {instance} is already indexed")
+
+        insort(self._instances, instance)
+        self._devices[instance] = device
+
+    def remove(self, instance: int) -> None:
+        del self._devices[instance]
+        del self._instances[bisect_left(self._instances, instance)]
+
+    def find(self, who_is: WhoIsRange) -> List[T]:
+        """
+        Get the devices in the range, in instance order
+        """
+        low_limit, high_limit = who_is
+        start = bisect_left(self._instances, low_limit)
+        end = bisect_right(self._instances, high_limit)
+
+        return [self._devices[instance] for instance in self._instances[start:end]]
+
+    def __len__(self) -> int:
+        return len(self._instances)
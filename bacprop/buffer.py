@@ -0,0 +1,70 @@
+"""
+Hand over sensor updates from the MQTT thread
+to the bacpypes thread
+"""
+
+from threading import Lock
+from typing import Dict, Mapping, Optional, Tuple
+
+from bacpypes.debugging import ModuleLogger, bacpypes_debugging
+
+from bacprop.defs import Logable
+
+_debug = 0
+_log = ModuleLogger(globals())
+
+# (merge, values), where a None value removes the key
+Update = Tuple[bool, Dict[str, Optional[float]]]
+
+
+@bacpypes_debugging
+class UpdateBuffer(Logable):
+    """
+    Last value wins buffer of sensor values.
+
+    Merge updates for a sensor which already has values waiting to be
+    applied are merged into them key by key, and other updates replace
+    them, so a sensor publishing several times between flushes is only
+    applied once. An update combined like this is counted as coalesced,
+    and every pending sensor update handed out by `take` is counted as
+    applied.
+    """
+
+    def __init__(self) -> None:
+        self._lock = Lock()
+        self._pending: Dict[int, Update] = {}
+
+        self.coalesced = 0
+        self.applied = 0
+
+    def put(
+        self, sensor_id: int, values: Mapping[str, Optional[float]], merge: bool = False
+    ) -> None:
+        with self._lock:
+            pending = self._pending.get(sensor_id)
+
+            if pending is not None:
+                self.coalesced += 1
+
+            if pending is not None and merge:
+                # Merged into whatever kind of update is pending
+                pending[1].update(values)
+            else:
+                self._pending[sensor_id] = (merge, dict(values))
+
+    def take(self) -> Dict[int, Update]:
+        """
+        Remove and return all pending updates
+        """
+        with self._lock:
+            pending = self._pending
+            self._pending = {}
+            self.applied += len(pending)
+
+        if _debug and pending:
+            UpdateBuffer._debug(f"Taking updates for {len(pending)} sensors")
+
+        return pending
+
+    def __len__(self) -> int:
+        return len(self._pending)
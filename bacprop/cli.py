@@ -1,5 +1,14 @@
 import os
+import tempfile
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing import get_context
+from typing import Dict, List, Tuple
 
+from bacprop.bacnet.announce import AnnounceScheduler
+from bacprop.bacnet.network import VirtualSensorNetwork
+from bacprop.mqtt import BaseSensorStream, ClientSensorStream, SensorStream
+from bacprop.pipeline import DecodePipeline
+from bacprop.ratelog import RateLimitedLog
 from bacprop.service import BacPropagator
 from bacpypes.debugging import ModuleLogger
 from bacpypes.consolelogging import ArgumentParser
@@ -8,11 +17,184 @@ _debug = 0
 _log = ModuleLogger(globals())
 
 
+def parse_group_timeouts(spec: str) -> List[Tuple[range, float]]:
+    """
+    Parse group timeouts in the form "<id>:<seconds>,<first id>-<last id>:<seconds>,..."
+    """
+    group_timeouts = []
+
+    for group in filter(None, spec.split(",")):
+        ids, _, timeout = group.partition(":")
+        first_id, _, last_id = ids.partition("-")
+
+        try:
+            group_ids = range(int(first_id), int(last_id or first_id) + 1)
+            group_timeouts.append((group_ids, float(timeout)))
+        except ValueError:
+            raise ValueError(
+                f"Invalid group timeout {group!r}, expected "
+                '"<id>:<seconds>" or "<first id>-<last id>:<seconds>"'
+            ) from None
+
+    return group_timeouts
+
+
+def parse_sensor_ids(spec: str, variable: str) -> List[range]:
+    """
+    Parse sensor ids in the form "<id>,<first id>-<last id>,...",
+    given in the environment variable `variable`
+    """
+    sensor_ids = []
+
+    for ids in filter(None, spec.split(",")):
+        first_id, _, last_id = ids.partition("-")
+
+        try:
+            sensor_ids.append(range(int(first_id), int(last_id or first_id) + 1))
+        except ValueError:
+            raise ValueError(
+                f"Invalid sensor ids {ids!r} in {variable}, expected "
+                '"<id>" or "<first id>-<last id>"'
+            ) from None
+
+    return sensor_ids
+
+
+def parse_cov_increments(spec: str) -> Dict[str, float]:
+    """
+    Parse COV increments in the form "<key name>:<increment>,..."
+    """
+    cov_increments = {}
+
+    for increment in filter(None, spec.split(",")):
+        key, _, value = increment.rpartition(":")
+
+        try:
+            if not key:
+                raise ValueError()
+            cov_increments[key] = float(value)
+        except ValueError:
+            raise ValueError(
+                f"Invalid COV increment {increment!r} in COV_INCREMENTS, "
+                'expected "<key name>:<increment>"'
+            ) from None
+
+    return cov_increments
+
+
+def make_decode_executor(pool: str, workers: int) -> Executor:
+    """
+    Make the executor for the decode pipeline, either a "process"
+    or a "thread" pool
+    """
+    if pool == "process":
+        _log.info(f"Decoding sensor data in {workers} processes")
+        # Forking would copy the event loop and bacnet thread state
+        return ProcessPoolExecutor(workers, mp_context=get_context("spawn"))
+
+    if pool == "thread":
+        _log.info(f"Decoding sensor data in {workers} threads")
+        return ThreadPoolExecutor(workers)
+
+    raise ValueError(f"Unknown decode pool {pool!r}")
+
+
 def main() -> None:
-    mqtt_port = os.environ.get("MQTT_PORT", 1883)
+    mqtt_port = int(os.environ.get("MQTT_PORT", 1883))
     mqtt_addr = os.environ.get("MQTT_ADDR", "127.0.0.1")
+    mqtt_external = os.environ.get("MQTT_EXTERNAL_BROKER", "") == "1"
+    mqtt_qos = int(os.environ.get("MQTT_QOS", 2))
+    mqtt_shared_group = os.environ.get("MQTT_SHARED_GROUP") or None
+    sensor_timeout = float(
+        os.environ.get("SENSOR_TIMEOUT", BacPropagator.SENSOR_OUTDATED_TIME)
+    )
+    retire_after = os.environ.get("SENSOR_RETIRE_AFTER")
+    group_timeouts = parse_group_timeouts(os.environ.get("SENSOR_GROUP_TIMEOUTS", ""))
+    shared_stack = os.environ.get("BACNET_SHARED_STACK", "") == "1"
+    flush_interval = float(
+        os.environ.get("UPDATE_FLUSH_INTERVAL", BacPropagator.FLUSH_INTERVAL)
+    )
+    merge_sensors = parse_sensor_ids(
+        os.environ.get("MERGE_SENSORS", ""), "MERGE_SENSORS"
+    )
+    merge_topics = list(filter(None, os.environ.get("MERGE_TOPICS", "").split(",")))
+    key_timeout = os.environ.get("KEY_TIMEOUT")
+    cov_increments = parse_cov_increments(os.environ.get("COV_INCREMENTS", ""))
+    announce_rate = float(
+        os.environ.get("ANNOUNCE_RATE", AnnounceScheduler.DEFAULT_RATE)
+    )
+    lazy_stacks = os.environ.get("BACNET_LAZY_STACKS", "") == "1"
+    eager_sensors = parse_sensor_ids(
+        os.environ.get("EAGER_SENSORS", ""), "EAGER_SENSORS"
+    )
+    idle_timeout = float(
+        os.environ.get("STACK_IDLE_TIMEOUT", VirtualSensorNetwork.DEFAULT_IDLE_TIMEOUT)
+    )
+    networks = int(os.environ.get("BACNET_NETWORKS", 1))
+    network_size = int(os.environ.get("BACNET_NETWORK_SIZE", 0))
+    asyncio_core = os.environ.get("BACNET_ASYNCIO", "") == "1"
+    snapshot_path = os.environ.get("SNAPSHOT_PATH") or None
+    snapshot_interval = float(
+        os.environ.get("SNAPSHOT_INTERVAL", BacPropagator.SNAPSHOT_INTERVAL)
+    )
+    metrics_port = os.environ.get("METRICS_PORT")
+    metrics_addr = os.environ.get("METRICS_ADDR", "127.0.0.1")
+    profile_dir = os.environ.get("PROFILE_DIR") or tempfile.gettempdir()
+    profile_seconds = float(
+        os.environ.get("PROFILE_SECONDS", BacPropagator.PROFILE_SECONDS)
+    )
+    log_period = float(os.environ.get("SENSOR_LOG_PERIOD", RateLimitedLog.PERIOD))
+    log_burst = int(os.environ.get("SENSOR_LOG_BURST", RateLimitedLog.BURST))
+    log_sample = int(os.environ.get("SENSOR_LOG_SAMPLE", 0))
+    decode_workers = int(os.environ.get("DECODE_WORKERS", 0))
+    decode_pool = os.environ.get("DECODE_POOL", "process")
+    decode_max_in_flight = int(
+        os.environ.get("DECODE_MAX_IN_FLIGHT", DecodePipeline.MAX_IN_FLIGHT)
+    )
 
     ArgumentParser().parse_args()
 
+    stream: BaseSensorStream
+    if mqtt_external:
+        _log.info(f"Using external broker at {mqtt_addr}:{mqtt_port}")
+        stream = ClientSensorStream(
+            mqtt_addr, mqtt_port, qos=mqtt_qos, shared_group=mqtt_shared_group
+        )
+    else:
+        stream = SensorStream(mqtt_port)
+
+    decode_executor = (
+        make_decode_executor(decode_pool, decode_workers) if decode_workers else None
+    )
+
     _log.info("Starting bacprop")
-    BacPropagator().start()
+    BacPropagator(
+        sensor_timeout=sensor_timeout,
+        group_timeouts=group_timeouts,
+        shared_stack=shared_stack,
+        flush_interval=flush_interval,
+        merge_sensors=merge_sensors,
+        merge_topics=merge_topics,
+        key_timeout=float(key_timeout) if key_timeout else None,
+        stream=stream,
+        decode_executor=decode_executor,
+        decode_max_in_flight=decode_max_in_flight,
+        cov_increments=cov_increments,
+        announce_rate=announce_rate,
+        snapshot_path=snapshot_path,
+        snapshot_interval=snapshot_interval,
+        lazy_stacks=lazy_stacks,
+        eager_sensors=eager_sensors,
+        idle_timeout=idle_timeout,
+        retire_after=float(retire_after) if retire_after else None,
+        networks=networks,
+        network_size=network_size,
+        asyncio_core=asyncio_core,
+        metrics_port=int(metrics_port) if metrics_port else None,
+        metrics_address=metrics_addr,
+        profile_dir=profile_dir,
+        profile_seconds=profile_seconds,
+        log_period=log_period,
+        log_burst=log_burst,
+        log_sample=log_sample,
+    ).start()
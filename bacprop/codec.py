@@ -0,0 +1,205 @@
+"""
+Decoding of sensor payloads, which are either JSON objects
+or messages in the compact binary format.
+
+Binary messages start with the marker byte 0xBA, which can never
+start a UTF-8 encoded JSON document. All fields are big-endian:
+
+    marker   uint8   0xBA
+    type     uint8   1 = key dictionary, 2 = values
+    sensorId uint32
+    count    uint8
+
+A key dictionary message is followed by `count` key names, each a
+uint8 length and that many bytes of UTF-8. It registers the names
+for the sensor, replacing any it had, and the position of a name is
+its key index.
+
+A values message is followed by `count` pairs of a uint8 key index
+and a float32 value. Values can only be sent for a sensor once its
+key dictionary has been registered.
+
+Batches of JSON readings from gateways are either a JSON array of
+reading objects, or one reading object per line.
+"""
+
+import json
+import struct
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+from bacpypes.debugging import ModuleLogger, bacpypes_debugging
+
+from bacprop.defs import Logable
+from bacprop.profiler import stage
+
+_debug = 0
+_log = ModuleLogger(globals())
+
+BINARY_MARKER = 0xBA
+KEYS_TYPE = 1
+VALUES_TYPE = 2
+
+_HEADER = struct.Struct(">BBIB")
+_KEY_VALUE = struct.Struct(">Bf")
+
+Payload = Union[bytes, bytearray]
+
+
+class DecodeError(ValueError):
+    pass
+
+
+def _check_reading(reading: Any) -> Dict[str, Any]:
+    if not isinstance(reading, dict):
+        raise DecodeError(f"Sensor data must be an object, not {reading!r}")
+
+    return reading
+
+
+def encode_keys(sensor_id: int, keys: Iterable[str]) -> bytes:
+    names = [key.encode() for key in keys]
+    body = b"".join(bytes((len(name),)) + name for name in names)
+
+    return _HEADER.pack(BINARY_MARKER, KEYS_TYPE, sensor_id, len(names)) + body
+
+
+def encode_values(sensor_id: int, values: Iterable[Tuple[int, float]]) -> bytes:
+    pairs = [_KEY_VALUE.pack(index, value) for index, value in values]
+
+    return _HEADER.pack(BINARY_MARKER, VALUES_TYPE, sensor_id, len(pairs)) + b"".join(
+        pairs
+    )
+
+
+@bacpypes_debugging
+class PayloadDecoder(Logable):
+    """
+    Decodes payloads into sensor data dicts, keeping the
+    key dictionaries registered by binary senders
+    """
+
+    def __init__(self) -> None:
+        self._keys: Dict[int, List[str]] = {}
+
+    def _decode_keys(self, sensor_id: int, count: int, payload: Payload) -> None:
+        keys = []
+        offset = _HEADER.size
+
+        for _ in range(count):
+            if offset >= len(payload):
+                raise DecodeError("Key dictionary is truncated")
+
+            end = offset + 1 + payload[offset]
+            if end > len(payload):
+                raise DecodeError("Key dictionary is truncated")
+
+            try:
+                keys.append(payload[offset + 1 : end].decode())
+            except UnicodeDecodeError as e:
+                raise DecodeError(f"Key name is not UTF-8: {e}")
+
+            offset = end
+
+        if _debug:
+            PayloadDecoder._debug(f"Registered keys for sensor {sensor_id}: {keys}")
+
+        self._keys[sensor_id] = keys
+
+    def _decode_values(
+        self, sensor_id: int, count: int, payload: Payload
+    ) -> Dict[str, Any]:
+        keys = self._keys.get(sensor_id)
+        if keys is None:
+            raise DecodeError(f"No keys registered for sensor {sensor_id}")
+
+        if len(payload) != _HEADER.size + count * _KEY_VALUE.size:
+            raise DecodeError(f"Expected {count} values")
+
+        data: Dict[str, Any] = {"sensorId": sensor_id}
+
+        # Unpacked straight out of the payload buffer
+        for index, value in _KEY_VALUE.iter_unpack(memoryview(payload)[_HEADER.size :]):
+            if index >= len(keys):
+                raise DecodeError(f"Unknown key index {index}")
+
+            data[keys[index]] = value
+
+        return data
+
+    def decode(self, payload: Payload) -> Optional[Dict[str, Any]]:
+        """
+        Decode the payload into sensor data, or None if
+        the payload was a key dictionary
+        """
+        if not payload or payload[0] != BINARY_MARKER:
+            try:
+                return _check_reading(json.loads(payload))
+            except UnicodeDecodeError as e:
+                raise DecodeError(f"Payload is not UTF-8: {e}")
+
+        if len(payload) < _HEADER.size:
+            raise DecodeError("Binary header is truncated")
+
+        _, kind, sensor_id, count = _HEADER.unpack_from(payload)
+
+        if kind == KEYS_TYPE:
+            self._decode_keys(sensor_id, count, payload)
+            return None
+
+        if kind == VALUES_TYPE:
+            return self._decode_values(sensor_id, count, payload)
+
+        raise DecodeError(f"Unknown binary message type {kind}")
+
+    def decode_batch(
+        self, payload: Payload
+    ) -> Iterator[Union[Dict[str, Any], DecodeError]]:
+        """
+        Decode each reading of a batch in turn. Readings which
+        can't be decoded are given as the error, so the rest of
+        the batch can still be used.
+        """
+        if payload.lstrip()[:1] == b"[":
+            try:
+                readings = json.loads(payload)
+            except ValueError as e:
+                yield DecodeError(f"Could not decode batch: {e}")
+                return
+
+            for i, reading in enumerate(readings):
+                try:
+                    yield _check_reading(reading)
+                except DecodeError as e:
+                    yield DecodeError(f"Reading {i}: {e}")
+
+            return
+
+        for i, line in enumerate(payload.splitlines()):
+            if not line.strip():
+                continue
+
+            try:
+                yield _check_reading(json.loads(line))
+            except ValueError as e:
+                yield DecodeError(f"Line {i + 1}: {e}")
+
+    @stage("decode")
+    def decode_all(
+        self, payload: Payload, batch: bool = False
+    ) -> Iterator[Union[Dict[str, Any], DecodeError]]:
+        """
+        Decode the readings of a single or batch payload, giving
+        readings which can't be decoded as the error
+        """
+        if batch:
+            yield from self.decode_batch(payload)
+            return
+
+        try:
+            data = self.decode(payload)
+        except ValueError as e:
+            yield e if isinstance(e, DecodeError) else DecodeError(str(e))
+            return
+
+        if data is not None:
+            yield data
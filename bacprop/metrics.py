@@ -0,0 +1,392 @@
+"""
+Counters and histograms of what bacprop is doing, served over HTTP
+in the Prometheus text format.
+
+Ingestion runs on the event loop and the sensors on the bacnet
+thread, so each thread updates its own copy of a metric, found
+through a thread local, and no lock is taken. The copies are only
+summed when the metrics are scraped. Gauges are read from a
+function when they are scraped.
+"""
+
+import asyncio
+import threading
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    Mapping,
+    Optional,
+    Sequence,
+    Tuple,
+    TypeVar,
+)
+
+from bacpypes.debugging import ModuleLogger, bacpypes_debugging
+
+from bacprop.defs import Logable
+
+_debug = 0
+_log = ModuleLogger(globals())
+
+# Label values of a sample, in the order of the metric's label names
+Labels = Tuple[str, ...]
+
+M = TypeVar("M", bound="Metric")
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", r"\\").replace('"', r"\"").replace("\n", r"\n")
+
+
+def _format_labels(names: Sequence[str], values: Labels, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    return repr(float(value))
+
+
+class Metric(ABC):
+    TYPE = "untyped"
+
+    def __init__(
+        self, name: str, documentation: str, label_names: Sequence[str] = ()
+    ) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+
+    def _sample(self, labels: Labels, value: float, suffix: str = "") -> str:
+        return (
+            f"{self.name}{suffix}{_format_labels(self.label_names, labels)} "
+            f"{_format_value(value)}"
+        )
+
+    @abstractmethod
+    def collect(self) -> Iterator[str]:
+        pass
+
+    def render(self) -> Iterator[str]:
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} {self.TYPE}"
+        yield from self.collect()
+
+
+class _ThreadMetric(Metric):
+    """
+    Metric with a copy of its values for each thread which updates it
+    """
+
+    def __init__(
+        self, name: str, documentation: str, label_names: Sequence[str] = ()
+    ) -> None:
+        Metric.__init__(self, name, documentation, label_names)
+
+        self._local = threading.local()
+        # The values of every thread, only changed by their own thread
+        self._shards: List[Dict[Labels, Any]] = []
+
+    def _new_shard(self) -> Dict[Labels, Any]:
+        shard: Dict[Labels, Any] = {}
+        self._local.shard = shard
+        self._shards.append(shard)
+
+        return shard
+
+    def _copies(self) -> List[Dict[Labels, Any]]:
+        return [shard.copy() for shard in list(self._shards)]
+
+
+class Counter(_ThreadMetric):
+    TYPE = "counter"
+
+    def inc(self, *labels: str, amount: float = 1.0) -> None:
+        try:
+            shard = self._local.shard
+        except AttributeError:
+            shard = self._new_shard()
+
+        shard[labels] = shard.get(labels, 0.0) + amount
+
+    def _totals(self) -> Dict[Labels, float]:
+        totals: Dict[Labels, float] = {}
+
+        for shard in self._copies():
+            for labels, value in shard.items():
+                totals[labels] = totals.get(labels, 0.0) + value
+
+        return totals
+
+    def get(self, *labels: str) -> float:
+        return self._totals().get(labels, 0.0)
+
+    def collect(self) -> Iterator[str]:
+        for labels, value in sorted(self._totals().items()):
+            yield self._sample(labels, value)
+
+
+class Histogram(_ThreadMetric):
+    """
+    Histogram with fixed bucket upper bounds. Each labelled series
+    holds the count of every bucket and then the sum of the values.
+    """
+
+    TYPE = "histogram"
+    # 10us to 1s
+    DEFAULT_BUCKETS = (
+        0.00001,
+        0.000_025,
+        0.00005,
+        0.0001,
+        0.00025,
+        0.0005,
+        0.001,
+        0.0025,
+        0.005,
+        0.01,
+        0.025,
+        0.05,
+        0.1,
+        0.25,
+        0.5,
+        1.0,
+    )
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        label_names: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ) -> None:
+        _ThreadMetric.__init__(self, name, documentation, label_names)
+        self._buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, *labels: str) -> None:
+        try:
+            shard = self._local.shard
+        except AttributeError:
+            shard = self._new_shard()
+
+        counts = shard.get(labels)
+
+        if counts is None:
+            # A count for each bucket and for +Inf, then the sum
+            counts = shard[labels] = [0.0] * (len(self._buckets) + 2)
+
+        counts[bisect_left(self._buckets, value)] += 1
+        counts[-1] += value
+
+    def _totals(self) -> Dict[Labels, List[float]]:
+        totals: Dict[Labels, List[float]] = {}
+
+        for shard in self._copies():
+            for labels, counts in shard.items():
+                total = totals.setdefault(labels, [0.0] * len(counts))
+                for i, count in enumerate(list(counts)):
+                    total[i] += count
+
+        return totals
+
+    def get_count(self, *labels: str) -> float:
+        counts = self._totals().get(labels)
+        return sum(counts[:-1]) if counts else 0.0
+
+    def collect(self) -> Iterator[str]:
+        for labels, counts in sorted(self._totals().items()):
+            cumulative = 0.0
+
+            for i, bound in enumerate(self._buckets + (float("inf"),)):
+                cumulative += counts[i]
+                le = "+Inf" if i == len(self._buckets) else repr(bound)
+
+                bucket_labels = _format_labels(self.label_names, labels, f'le="{le}"')
+                yield f"{self.name}_bucket{bucket_labels} {_format_value(cumulative)}"
+
+            yield self._sample(labels, counts[-1], "_sum")
+            yield self._sample(labels, cumulative, "_count")
+
+
+class Gauge(Metric):
+    """
+    Gauge whose values are read from a function when it is scraped,
+    as label values -> value
+    """
+
+    TYPE = "gauge"
+
+    def __init__(
+        self, name: str, documentation: str, label_names: Sequence[str] = ()
+    ) -> None:
+        Metric.__init__(self, name, documentation, label_names)
+        self._function: Optional[Callable[[], Mapping[Labels, float]]] = None
+
+    def set_function(
+        self, function: Optional[Callable[[], Mapping[Labels, float]]]
+    ) -> None:
+        self._function = function
+
+    def collect(self) -> Iterator[str]:
+        if self._function is None:
+            return
+
+        for labels, value in sorted(self._function().items()):
+            yield self._sample(labels, value)
+
+
+class Registry:
+    def __init__(self) -> None:
+        self._metrics: Dict[str, Metric] = {}
+
+    def register(self, metric: M) -> M:
+        self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        return "".join(
+            f"{line}\n"
+            for metric in list(self._metrics.values())
+            for line in metric.render()
+        )
+
+
+REGISTRY = Registry()
+
+PUBLISHES = REGISTRY.register(
+    Counter("bacprop_publishes_received_total", "Publishes read from the broker")
+)
+READINGS = REGISTRY.register(
+    Counter("bacprop_readings_total", "Sensor readings decoded and validated")
+)
+# Reason of the reading failures which could not be decoded at all
+UNDECODABLE = "undecodable"
+READING_FAILURES = REGISTRY.register(
+    Counter(
+        "bacprop_reading_failures_total",
+        "Sensor data which could not be decoded, or had invalid parts",
+        ["reason"],
+    )
+)
+HANDLE_SECONDS = REGISTRY.register(
+    Histogram(
+        "bacprop_handle_sensor_data_seconds",
+        "Time taken to validate and buffer sensor data",
+    )
+)
+BACNET_REQUESTS = REGISTRY.register(
+    Histogram(
+        "bacprop_bacnet_request_seconds",
+        "Time taken by the sensors to handle BACnet requests",
+        ["service"],
+    )
+)
+SENSORS = REGISTRY.register(
+    Gauge("bacprop_sensors", "Sensors on the BACnet network", ["state"])
+)
+SENSOR_OBJECTS = REGISTRY.register(
+    Gauge(
+        "bacprop_sensors_by_objects",
+        "Sensors on the BACnet network by their number of objects",
+        ["objects"],
+    )
+)
+QUEUE_DEPTH = REGISTRY.register(
+    Gauge("bacprop_stream_queue_depth", "Publishes waiting to be read from the broker")
+)
+ANNOUNCE_QUEUE_DEPTH = REGISTRY.register(
+    Gauge("bacprop_announce_queue_depth", "New sensors waiting to send an I-Am")
+)
+ANNOUNCE_WAIT = REGISTRY.register(
+    Histogram(
+        "bacprop_announce_wait_seconds",
+        "Time from a sensor being queued to sending its I-Am",
+        # 100ms to 10 minutes
+        buckets=(0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0),
+    )
+)
+
+
+@bacpypes_debugging
+class MetricsServer(Logable):
+    """
+    Serves the metrics of a registry at /metrics over HTTP,
+    on the event loop
+    """
+
+    PATH = b"/metrics"
+    CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+    def __init__(
+        self, host: str = "127.0.0.1", port: int = 9180, registry: Registry = REGISTRY
+    ) -> None:
+        self._host = host
+        self.port = port
+        self._registry = registry
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    async def start(self) -> None:
+        self._server = await asyncio.start_server(self._handle, self._host, self.port)
+
+        # The port picked by the system, when given 0
+        self.port = self._server.sockets[0].getsockname()[1]
+        MetricsServer._info(
+            f"Serving metrics on http://{self._host}:{self.port}/metrics"
+        )
+
+    async def stop(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    def _respond(self, request_line: bytes) -> Tuple[str, bytes]:
+        parts = request_line.split()
+
+        if len(parts) < 2 or parts[0] != b"GET":
+            return "405 Method Not Allowed", b""
+
+        if parts[1].split(b"?")[0] != MetricsServer.PATH:
+            return "404 Not Found", b""
+
+        try:
+            return "200 OK", self._registry.render().encode()
+        except Exception as e:  # pylint: disable=broad-except
+            MetricsServer._error(f"Could not render metrics: {e!r}")
+            return "500 Internal Server Error", b""
+
+    async def _handle(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        try:
+            request_line = await reader.readline()
+
+            # The headers are of no interest
+            while (await reader.readline()).strip():
+                pass
+
+            status, body = self._respond(request_line)
+            if _debug:
+                MetricsServer._debug(f"{request_line!r}: {status}")
+
+            writer.write(
+                (
+                    f"HTTP/1.0 {status}\r\n"
+                    f"Content-Type: {MetricsServer.CONTENT_TYPE}\r\n"
+                    f"Content-Length: {len(body)}\r\n\r\n"
+                ).encode()
+                + body
+            )
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
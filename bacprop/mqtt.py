@@ -1,76 +1,387 @@
 import asyncio
 import json
-from typing import AsyncIterable, Dict, NoReturn, Union
+import random
+from abc import ABC, abstractmethod
+from typing import Any, AsyncIterable, Callable, Dict, Iterator, List, Optional, Tuple
 
 from bacpypes.debugging import ModuleLogger, bacpypes_debugging
 from hbmqtt.broker import Broker
-from hbmqtt.client import QOS_2, MQTTClient
+from hbmqtt.client import QOS_2, ClientException, MQTTClient
+
+from bacprop.codec import DecodeError, Payload, PayloadDecoder
+from bacprop.defs import Logable
+from bacprop.metrics import PUBLISHES, READING_FAILURES, UNDECODABLE
+from bacprop.ratelog import RateLimitedLog
 
 _debug = 0
 _log = ModuleLogger(globals())
 
 
+def topic_matches(topic: str, topic_filter: str) -> bool:
+    """
+    Check if the topic matches the MQTT topic filter,
+    which may contain `+` and `#` wildcards
+    """
+    levels = topic.split("/")
+    filter_levels = topic_filter.split("/")
+
+    for i, filter_level in enumerate(filter_levels):
+        if filter_level == "#":
+            return True
+
+        if i >= len(levels) or filter_level not in ("+", levels[i]):
+            return False
+
+    return len(levels) == len(filter_levels)
+
+
+# (topic, payload), or None to stop reading
+Publish = Optional[Tuple[str, Payload]]
+
+
+class _IngestBroker(Broker):
+    """
+    Broker which passes publishes on the sensor topics straight
+    to a queue, as well as on to any subscribers.
+
+    This overrides a private method of the hbmqtt broker, so
+    `can_ingest` checks that the installed hbmqtt still has it.
+    """
+
+    def __init__(
+        self,
+        config: Dict[str, Any],
+        loop: asyncio.AbstractEventLoop,
+        queue: "asyncio.Queue[Publish]",
+        topic_filters: List[str],
+    ) -> None:
+        Broker.__init__(self, config, loop)
+        self._ingest_queue = queue
+        self._topic_filters = topic_filters
+
+    async def _broadcast_message(
+        self, session: Any, topic: str, data: bytearray, force_qos: Any = None
+    ) -> None:
+        if any(
+            topic_matches(topic, topic_filter) for topic_filter in self._topic_filters
+        ):
+            # Waiting for space holds up the publishing client
+            await self._ingest_queue.put((topic, data))
+
+        await Broker._broadcast_message(self, session, topic, data, force_qos)
+
+    @staticmethod
+    def can_ingest() -> bool:
+        return hasattr(Broker, "_broadcast_message")
+
+
+def backoff_delay(
+    attempt: int, base: float, cap: float, rand: Callable[[], float] = random.random
+) -> float:
+    """
+    Exponential backoff with full jitter, so clients which lost their
+    connection together don't all reconnect at the same moment
+    """
+    return rand() * min(cap, base * 2 ** attempt)
+
+
+@bacpypes_debugging
+class BaseSensorStream(ABC, Logable):
+    """
+    Decodes sensor data from the publishes put on its queue
+    """
+
+    BATCH_TOPIC = "sensors/batch"
+    TOPIC_FILTERS = ["sensor/#", BATCH_TOPIC]
+    QUEUE_SIZE = 10000
+    # Reading a queued publish doesn't wait, so the reader gives
+    # the rest of the event loop a turn after this many
+    PUBLISHES_PER_YIELD = 100
+
+    def __init__(self, queue: "Optional[asyncio.Queue[Publish]]" = None) -> None:
+        self._queue: "asyncio.Queue[Publish]" = (
+            queue
+            if queue is not None
+            else asyncio.Queue(
+                BaseSensorStream.QUEUE_SIZE, loop=asyncio.get_event_loop()
+            )
+        )
+        self._running = False
+        self._decoder = PayloadDecoder()
+        self._data_log = RateLimitedLog()
+
+    @abstractmethod
+    async def start(self) -> None:
+        pass
+
+    @abstractmethod
+    async def stop(self) -> None:
+        pass
+
+    def _stop_reading(self) -> None:
+        self._running = False
+
+        # Wake up a waiting reader. A full queue means it isn't waiting.
+        try:
+            self._queue.put_nowait(None)
+        except asyncio.QueueFull:
+            pass
+
+    async def read_publishes(self) -> AsyncIterable[Tuple[str, Payload]]:
+        """
+        Read the undecoded publishes
+        """
+        read = 0
+
+        while self._running:
+            publish = await self._queue.get()
+            if publish is None:
+                break
+
+            PUBLISHES.inc()
+            yield publish
+
+            read += 1
+            if read % BaseSensorStream.PUBLISHES_PER_YIELD == 0:
+                await asyncio.sleep(0)
+
+    def decode(self, topic: str, payload: Payload) -> Iterator[Dict[str, Any]]:
+        for reading in self._decoder.decode_all(
+            payload, topic == BaseSensorStream.BATCH_TOPIC
+        ):
+            if isinstance(reading, DecodeError):
+                READING_FAILURES.inc(UNDECODABLE)
+                self._data_log.log(
+                    # pylint: disable=no-member
+                    BaseSensorStream._error,
+                    topic,
+                    UNDECODABLE,
+                    None,
+                    "Could not decode sensor data: %s",
+                    reading,
+                )
+            else:
+                yield reading
+
+    def set_data_log(self, data_log: RateLimitedLog) -> None:
+        """
+        Log the problems with the sensor data through the given log
+        """
+        self._data_log = data_log
+
+    def get_queue_depth(self) -> int:
+        return self._queue.qsize()
+
+    async def read(self) -> AsyncIterable[Tuple[str, Dict[str, Any]]]:
+        async for topic, payload in self.read_publishes():
+            for data in self.decode(topic, payload):
+                yield topic, data
+
+
 @bacpypes_debugging
-class SensorStream(MQTTClient):
+class SensorStream(BaseSensorStream):
+    """
+    Stream of the sensor data published to an embedded broker
+    """
+
     BROKER_CONFIG = {
         "listeners": {"default": {"type": "tcp", "bind": "0.0.0.0:1883"}},
         "topic-check": {"enabled": False},
     }
 
-    def __init__(self) -> None:
+    def __init__(self, port: int = 1883) -> None:
+        BaseSensorStream.__init__(self)
+
         # pylint: disable=no-member
-        SensorStream._info("Initialising broker on 0.0.0.0:1883")
-        self._broker = Broker(SensorStream.BROKER_CONFIG, asyncio.get_event_loop())
-        self._running = False
-        MQTTClient.__init__(self)
+        SensorStream._info(f"Initialising broker on 0.0.0.0:{port}")
+        config = dict(SensorStream.BROKER_CONFIG)
+        config["listeners"] = {"default": {"type": "tcp", "bind": f"0.0.0.0:{port}"}}
 
-    async def start(self) -> Union[None, NoReturn]:
-        if _debug:
-            # pylint: disable=no-member
-            SensorStream._debug("Starting broker")
-        await self._broker.start()
+        self._broker = _IngestBroker(
+            config, asyncio.get_event_loop(), self._queue, SensorStream.TOPIC_FILTERS
+        )
 
-        if _debug:
+        # Without the broker's hook, the publishes are read
+        # by a client of the broker instead
+        self._client_stream: Optional[ClientSensorStream] = None
+        if not _IngestBroker.can_ingest():
             # pylint: disable=no-member
-            SensorStream._debug("Connecting to broker")
-        await self.connect("mqtt://localhost")
+            SensorStream._warning(
+                "The hbmqtt broker can't pass on publishes directly, "
+                "reading them through a local client instead"
+            )
+            self._client_stream = ClientSensorStream(
+                "127.0.0.1", port, queue=self._queue
+            )
 
+    async def start(self) -> None:
         if _debug:
             # pylint: disable=no-member
-            SensorStream._debug("Subscribing to sensor stream")
-        await self.subscribe([("sensor/#", QOS_2)])
+            SensorStream._debug("Starting broker")
+        await self._broker.start()
+
+        if self._client_stream is not None:
+            await self._client_stream.start()
 
         self._running = True
-        return None
 
-    async def stop(self) -> Union[None, NoReturn]:
+    async def stop(self) -> None:
         if _debug:
             # pylint: disable=no-member
             SensorStream._debug("Stopping")
 
         if not self._running:
-            return None
+            return
 
         if _debug:
             # pylint: disable=no-member
             SensorStream._debug("Shutting down broker")
 
-        await self.disconnect()
+        if self._client_stream is not None:
+            await self._client_stream.stop()
+
         await self._broker.shutdown()
 
-        self._running = False
+        self._stop_reading()
+
+
+@bacpypes_debugging
+class ClientSensorStream(BaseSensorStream):
+    """
+    Stream of the sensor data published to an external broker.
+
+    The connection is retried with jittered exponential backoff
+    whenever it fails or is lost, subscribing again each time. With
+    a shared subscription group, the broker balances the sensor data
+    between all the clients in the group.
+    """
+
+    CLIENT_CONFIG = {"auto_reconnect": False}
+    MIN_BACKOFF = 1.0
+    MAX_BACKOFF = 60.0
 
-        return None
+    def __init__(
+        self,
+        address: str,
+        port: int = 1883,
+        qos: int = QOS_2,
+        shared_group: Optional[str] = None,
+        min_backoff: float = MIN_BACKOFF,
+        max_backoff: float = MAX_BACKOFF,
+        queue: "Optional[asyncio.Queue[Publish]]" = None,
+    ) -> None:
+        BaseSensorStream.__init__(self, queue)
 
-    async def read(self) -> AsyncIterable[Dict[str, float]]:
+        self._uri = f"mqtt://{address}:{port}"
+        self._qos = qos
+        self._min_backoff = min_backoff
+        self._max_backoff = max_backoff
+
+        self._topic_filters = list(ClientSensorStream.TOPIC_FILTERS)
+        if shared_group:
+            self._topic_filters = [
+                f"$share/{shared_group}/{topic_filter}"
+                for topic_filter in self._topic_filters
+            ]
+
+        self._client: Optional[MQTTClient] = None
+        self._connection_task: Optional[asyncio.Future] = None
+        self._attempt = 0
+
+    async def _receive(self, client: MQTTClient) -> None:
+        # pylint: disable=no-member
+        ClientSensorStream._info(f"Connecting to {self._uri}")
+        await client.connect(self._uri, cleansession=True)
+
+        if _debug:
+            # pylint: disable=no-member
+            ClientSensorStream._debug(f"Subscribing to {self._topic_filters}")
+        await client.subscribe(
+            [(topic_filter, self._qos) for topic_filter in self._topic_filters]
+        )
+
+        # Connected, so any reconnection starts backing off from scratch
+        self._attempt = 0
+
+        # hbmqtt fails to wake a waiting deliver_message when the
+        # connection is lost, so also wait for its disconnect handler,
+        # which is private to the client
+        delivering = asyncio.ensure_future(self._deliver(client))
+        disconnected = getattr(client, "_disconnect_task", None)
+
+        if disconnected is None:
+            # pylint: disable=no-member
+            ClientSensorStream._warning(
+                "The hbmqtt client has no disconnect handler, "
+                "a lost connection may not be noticed"
+            )
+            disconnected = asyncio.get_event_loop().create_future()
+
+        try:
+            done, _ = await asyncio.wait(
+                [delivering, disconnected], return_when=asyncio.FIRST_COMPLETED
+            )
+        finally:
+            delivering.cancel()
+
+        if delivering in done:
+            delivering.result()
+
+        if disconnected.done() and not disconnected.cancelled():
+            # Its own error from failing to wake deliver_message
+            disconnected.exception()
+
+        raise ClientException("Connection lost")
+
+    async def _deliver(self, client: MQTTClient) -> None:
+        while True:
+            message = await client.deliver_message()
+            await self._queue.put((message.topic, message.publish_packet.payload.data))
+
+    def _is_connected(self) -> bool:
+        return bool(
+            self._client
+            and self._client.session
+            and self._client.session.transitions.is_connected()
+        )
+
+    async def _connection_loop(self) -> None:
         while self._running:
-            msg = await self.deliver_message()
-            packet = msg.publish_packet
+            self._client = MQTTClient(config=ClientSensorStream.CLIENT_CONFIG)
 
-            # Decode the JSON data
             try:
-                data = json.loads(packet.payload.data)
-                yield data
-            except json.JSONDecodeError as e:
+                await self._receive(self._client)
+            except (ClientException, OSError) as e:
                 # pylint: disable=no-member
-                SensorStream._error(f"Could not decode sensor data: {e}")
+                ClientSensorStream._warning(f"Connection to {self._uri} failed: {e!r}")
+
+            if self._is_connected():
+                await self._client.disconnect()
+
+            delay = backoff_delay(self._attempt, self._min_backoff, self._max_backoff)
+            self._attempt += 1
+
+            # pylint: disable=no-member
+            ClientSensorStream._info(f"Reconnecting in {delay:.1f} seconds")
+            await asyncio.sleep(delay)
+
+    async def start(self) -> None:
+        self._running = True
+        self._connection_task = asyncio.ensure_future(self._connection_loop())
+
+    async def stop(self) -> None:
+        if _debug:
+            # pylint: disable=no-member
+            ClientSensorStream._debug("Stopping")
+
+        if not self._running:
+            return
+
+        self._stop_reading()
+
+        if self._connection_task:
+            self._connection_task.cancel()
+            await asyncio.gather(self._connection_task, return_exceptions=True)
+
+        if self._client and self._is_connected():
+            await self._client.disconnect()
@@ -0,0 +1,358 @@
+"""
+Validation of decoded sensor data, and an optional stage which
+decodes and validates payloads on an executor
+"""
+
+import asyncio
+from concurrent.futures import Executor
+from typing import Any, AsyncIterable, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from bacpypes.debugging import ModuleLogger, bacpypes_debugging
+
+from bacprop.codec import BINARY_MARKER, DecodeError, Payload, PayloadDecoder
+from bacprop.defs import Logable
+from bacprop.metrics import READING_FAILURES, READINGS, UNDECODABLE
+from bacprop.mqtt import BaseSensorStream, topic_matches
+from bacprop.profiler import stage
+from bacprop.ratelog import RateLimitedLog
+
+_debug = 0
+_log = ModuleLogger(globals())
+
+# (sensor id, values, merge), where a None value removes the key
+Reading = Tuple[int, Dict[str, Optional[float]], bool]
+
+
+class ValidationWarning(NamedTuple):
+    # Label of the warning in the reading failure metrics
+    reason: str
+    # Sensor id, or the topic when there is no valid sensor id
+    source: Any
+    # Key of the value the warning is about, if any
+    key: Optional[str]
+    # Message, which is only formatted with its args when logged
+    template: str
+    args: Tuple[Any, ...]
+
+    @property
+    def message(self) -> str:
+        return self.template % self.args
+
+
+# (readings, decode errors, validation warnings)
+Decoded = Tuple[List[Reading], List[str], List[ValidationWarning]]
+
+# (topic, decoded publish), or None once the stream has ended
+Pending = Optional[Tuple[str, "asyncio.Future[Decoded]"]]
+
+_NUMBER_TYPES = (float, int)
+
+
+class _Schema(NamedTuple):
+    """
+    Shape of the last valid sensor data of a sensor
+    """
+
+    # Keys of the sensor data, in order, including the sensor id
+    keys: Tuple[str, ...]
+    topic: str
+    merge: bool
+
+
+class ReadingValidator:
+    """
+    Turns decoded sensor data into readings, dropping anything which
+    isn't a number. Picklable, so it can be sent to worker processes.
+
+    The shape of each sensor's last valid data is kept, and data of
+    the same shape from the same topic only has its values checked.
+    Anything else goes through the full validation, which then keeps
+    its new shape.
+
+    With a thread pool, the workers share the shapes without a lock.
+    Each is replaced whole by a single dict operation, and depends
+    only on the data it came from and the merge settings, so whichever
+    shape a worker finds, or misses, the reading is the same. A race
+    only costs a full validation, or a shape kept for a forgotten
+    sensor until its next update.
+    """
+
+    SENSOR_ID_KEY = "sensorId"
+
+    def __init__(
+        self, merge_sensors: Iterable[range] = (), merge_topics: Iterable[str] = ()
+    ) -> None:
+        # Sensors and topics whose messages only update the keys they carry
+        self.merge_sensors = list(merge_sensors)
+        self.merge_topics = list(merge_topics)
+        # sensor id -> shape of its last valid data
+        self._schemas: Dict[int, _Schema] = {}
+
+    def __getstate__(self) -> Dict[str, Any]:
+        # The schemas are left behind, rather than copied with every payload
+        state = self.__dict__.copy()
+        state["_schemas"] = {}
+        return state
+
+    def forget(self, sensor_id: int) -> None:
+        """
+        Drop the schema of a sensor which is gone
+        """
+        self._schemas.pop(sensor_id, None)
+
+    def is_merge(self, sensor_id: int, topic: str) -> bool:
+        return any(sensor_id in ids for ids in self.merge_sensors) or any(
+            topic_matches(topic, topic_filter) for topic_filter in self.merge_topics
+        )
+
+    @stage("validate")
+    def validate(
+        self, data: Dict[str, Any], topic: str, warnings: List[ValidationWarning]
+    ) -> Optional[Reading]:
+        """
+        Validate the sensor data, adding a warning for each problem
+        found. None is returned when there is no valid sensor id.
+        """
+        if ReadingValidator.SENSOR_ID_KEY not in data:
+            warnings.append(
+                ValidationWarning(
+                    "missing_sensor_id",
+                    topic,
+                    None,
+                    "sensorId missing from sensor data: %s",
+                    (data,),
+                )
+            )
+            return None
+
+        raw_id = data[ReadingValidator.SENSOR_ID_KEY]
+
+        try:
+            sensor_id = int(raw_id)
+        except (TypeError, ValueError):
+            warnings.append(
+                ValidationWarning(
+                    "invalid_sensor_id",
+                    topic,
+                    None,
+                    "sensorId %s could not be decoded",
+                    (raw_id,),
+                )
+            )
+            return None
+
+        if sensor_id < 0:
+            warnings.append(
+                ValidationWarning(
+                    "negative_sensor_id",
+                    topic,
+                    None,
+                    "sensorId %s is an invalid id",
+                    (raw_id,),
+                )
+            )
+            return None
+
+        keys = tuple(data)
+        schema = self._schemas.get(sensor_id)
+
+        if schema is None or schema.topic != topic:
+            merge = self.is_merge(sensor_id, topic)
+        elif schema.keys == keys:
+            values = data.copy()
+            del values[ReadingValidator.SENSOR_ID_KEY]
+
+            for value in values.values():
+                if type(value) not in _NUMBER_TYPES:
+                    break
+            else:
+                return sensor_id, values, schema.merge
+
+            merge = schema.merge
+        else:
+            merge = schema.merge
+
+        return self._validate_values(sensor_id, data, keys, topic, merge, warnings)
+
+    def _validate_values(
+        self,
+        sensor_id: int,
+        data: Dict[str, Any],
+        keys: Tuple[str, ...],
+        topic: str,
+        merge: bool,
+        warnings: List[ValidationWarning],
+    ) -> Reading:
+        values: Dict[str, Optional[float]] = {}
+
+        # Only allow through data which are actually floats,
+        # or null to remove a key when merging
+        for key, value in data.items():
+            if key == ReadingValidator.SENSOR_ID_KEY:
+                continue
+
+            if value is None and merge:
+                values[key] = None
+            elif type(value) not in _NUMBER_TYPES:
+                warnings.append(
+                    ValidationWarning(
+                        "non_number_value",
+                        sensor_id,
+                        key,
+                        "Recieved non-number value (%s: '%s') from sensor id: %s",
+                        (key, value, sensor_id),
+                    )
+                )
+            else:
+                values[key] = value
+
+        # Data of this shape takes the fast path next time,
+        # unless some of it was dropped
+        if len(values) == len(keys) - 1:
+            self._schemas[sensor_id] = _Schema(keys, topic, merge)
+        else:
+            self._schemas.pop(sensor_id, None)
+
+        return sensor_id, values, merge
+
+
+def decode_and_validate(
+    validator: ReadingValidator,
+    topic: str,
+    payload: Payload,
+    decoder: Optional[PayloadDecoder] = None,
+) -> Decoded:
+    """
+    Decode and validate a payload. Runs in worker processes, so
+    problems are returned to be logged rather than logged here.
+    """
+    if decoder is None:
+        decoder = PayloadDecoder()
+
+    readings: List[Reading] = []
+    errors: List[str] = []
+    warnings: List[ValidationWarning] = []
+
+    for data in decoder.decode_all(payload, topic == BaseSensorStream.BATCH_TOPIC):
+        if isinstance(data, DecodeError):
+            errors.append(str(data))
+            continue
+
+        reading = validator.validate(data, topic, warnings)
+        if reading is not None:
+            readings.append(reading)
+
+    return readings, errors, warnings
+
+
+@bacpypes_debugging
+class DecodePipeline(Logable):
+    """
+    Decodes and validates the publishes of a stream on an executor.
+
+    At most `max_in_flight` payloads are waiting on the executor at
+    once, after which reading from the stream waits. Results are handed
+    back in the order the publishes arrived, which keeps the updates of
+    each sensor in order.
+
+    Binary payloads are decoded in line, as their key dictionaries are
+    state which has to be shared between the messages of a sender.
+
+    Problems are logged through `data_log`, by topic or sensor.
+    """
+
+    MAX_IN_FLIGHT = 64
+
+    def __init__(
+        self,
+        executor: Executor,
+        validator: ReadingValidator,
+        max_in_flight: int = MAX_IN_FLIGHT,
+        data_log: Optional[RateLimitedLog] = None,
+    ) -> None:
+        self._executor = executor
+        self._validator = validator
+        self._max_in_flight = max_in_flight
+        self._decoder = PayloadDecoder()
+        self._data_log = data_log if data_log is not None else RateLimitedLog()
+
+    def _is_binary(self, topic: str, payload: Payload) -> bool:
+        return (
+            topic != BaseSensorStream.BATCH_TOPIC
+            and len(payload) > 0
+            and payload[0] == BINARY_MARKER
+        )
+
+    async def _submit(
+        self, stream: BaseSensorStream, pending: "asyncio.Queue[Pending]"
+    ) -> None:
+        loop = asyncio.get_event_loop()
+
+        async for topic, payload in stream.read_publishes():
+            future: "asyncio.Future[Decoded]"
+
+            if self._is_binary(topic, payload):
+                future = loop.create_future()
+                future.set_result(
+                    decode_and_validate(self._validator, topic, payload, self._decoder)
+                )
+            else:
+                future = loop.run_in_executor(
+                    self._executor,
+                    decode_and_validate,
+                    self._validator,
+                    topic,
+                    bytes(payload),
+                )
+
+            # Waits while too much work is in flight
+            await pending.put((topic, future))
+
+        await pending.put(None)
+
+    async def process(self, stream: BaseSensorStream) -> AsyncIterable[Reading]:
+        """
+        Read the validated readings from the stream
+        """
+        pending: "asyncio.Queue[Pending]" = asyncio.Queue(self._max_in_flight)
+        submitter = asyncio.ensure_future(self._submit(stream, pending))
+
+        try:
+            while True:
+                decoding = await pending.get()
+                if decoding is None:
+                    break
+
+                topic, future = decoding
+                readings, errors, warnings = await future
+
+                for error in errors:
+                    READING_FAILURES.inc(UNDECODABLE)
+                    self._data_log.log(
+                        DecodePipeline._error,
+                        topic,
+                        UNDECODABLE,
+                        None,
+                        "Could not decode sensor data: %s",
+                        error,
+                    )
+
+                for warning in warnings:
+                    READING_FAILURES.inc(warning.reason)
+                    self._data_log.log(
+                        DecodePipeline._warning,
+                        warning.source,
+                        warning.reason,
+                        warning.key,
+                        warning.template,
+                        *warning.args,
+                    )
+
+                READINGS.inc(amount=len(readings))
+                for reading in readings:
+                    yield reading
+        finally:
+            submitter.cancel()
+
+    def shutdown(self) -> None:
+        self._executor.shutdown()
@@ -0,0 +1,140 @@
+"""
+Sampling profiler which can be started while bacprop is running.
+
+The stacks of the profiled threads are sampled from a thread of
+its own, and written in the collapsed stack format read by
+flamegraph.pl and speedscope: one line for each distinct stack, of
+`;` separated frames from the root, followed by its sample count.
+
+Functions which make up a stage of handling sensor data are marked
+with `stage`, and a frame named after the stage is put above them
+in the stacks. Marking a function only registers its code object,
+so nothing is added to it, and nothing runs while not profiling.
+"""
+
+import sys
+import time
+from threading import Event, Thread
+from types import CodeType, FrameType
+from typing import Any, Callable, Counter, Dict, Iterable, Optional, TypeVar
+
+from bacpypes.debugging import ModuleLogger, bacpypes_debugging
+
+from bacprop.defs import Logable
+
+_debug = 0
+_log = ModuleLogger(globals())
+
+F = TypeVar("F", bound=Callable[..., Any])
+
+# code object -> name of the stage it is part of
+STAGES: Dict[CodeType, str] = {}
+
+
+def stage(name: str) -> Callable[[F], F]:
+    """
+    Mark a function as a stage, which is shown as `[name]`
+    in the profiles
+    """
+
+    def register(function: F) -> F:
+        STAGES[function.__code__] = name
+        return function
+
+    return register
+
+
+def collapse_stack(frame: Optional[FrameType], root: str) -> str:
+    frames = []
+
+    while frame is not None:
+        code = frame.f_code
+        frames.append(f"{frame.f_globals.get('__name__', '?')}:{code.co_name}")
+
+        stage_name = STAGES.get(code)
+        if stage_name is not None:
+            frames.append(f"[{stage_name}]")
+
+        frame = frame.f_back
+
+    frames.append(root)
+    return ";".join(reversed(frames))
+
+
+@bacpypes_debugging
+class SamplingProfiler(Logable):
+    """
+    Samples the stacks of some threads every `interval` seconds for
+    a while, and then writes the collapsed stacks to a file. Only
+    one profile is taken at a time.
+    """
+
+    INTERVAL = 0.005
+
+    def __init__(self, interval: float = INTERVAL) -> None:
+        self._interval = interval
+        self._thread: Optional[Thread] = None
+        self._stop = Event()
+
+    def is_running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, seconds: float, path: str, threads: Iterable[Thread]) -> bool:
+        """
+        Start profiling the given threads, giving back
+        False if a profile is already being taken
+        """
+        if self.is_running():
+            SamplingProfiler._warning("Already profiling, not starting another")
+            return False
+
+        names = {thread.ident: thread.name for thread in threads if thread.ident}
+
+        SamplingProfiler._info(
+            f"Profiling {', '.join(names.values())} for {seconds}s into {path}"
+        )
+
+        self._stop.clear()
+        self._thread = Thread(
+            target=self._run, args=(seconds, path, names), name="profiler"
+        )
+        self._thread.daemon = True
+        self._thread.start()
+
+        return True
+
+    def stop(self) -> None:
+        """
+        Stop profiling early, writing the samples taken so far
+        """
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+
+    def _sample(self, stacks: Counter[str], names: Dict[int, str]) -> None:
+        for ident, frame in sys._current_frames().items():
+            name = names.get(ident)
+
+            if name is not None:
+                stacks[collapse_stack(frame, name)] += 1
+
+    def _run(self, seconds: float, path: str, names: Dict[int, str]) -> None:
+        stacks: Counter[str] = Counter()
+        deadline = time.monotonic() + seconds
+        samples = 0
+
+        while time.monotonic() < deadline and not self._stop.is_set():
+            self._sample(stacks, names)
+            samples += 1
+            self._stop.wait(self._interval)
+
+        try:
+            with open(path, "w") as profile_file:
+                for stack, count in stacks.most_common():
+                    profile_file.write(f"{stack} {count}\n")
+        except OSError as e:
+            SamplingProfiler._error(f"Could not write profile {path}: {e}")
+            return
+
+        SamplingProfiler._info(f"Wrote {samples} samples to {path}")
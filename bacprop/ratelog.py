@@ -0,0 +1,128 @@
+"""
+Rate limited logging of the problems with sensor data.
+
+A broken publisher can send the same bad data many times a second.
+Each problem, by its source, reason and key, only has its first
+`burst` occurrences of a period logged, and after that one in every
+`sample` if sampling. The rest are counted, and summed up in a line
+of their own once the period is over. Messages are formatted by the
+logging module when they are logged, so a suppressed problem only
+costs a lookup and a count.
+
+Only used from the event loop thread, so nothing is locked.
+"""
+
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from bacpypes.debugging import ModuleLogger, bacpypes_debugging
+
+from bacprop.defs import Logable
+
+_debug = 0
+_log = ModuleLogger(globals())
+
+# (source, reason, key)
+Problem = Tuple[Any, str, Optional[str]]
+
+LogFunction = Callable[..., None]
+
+
+class _Window:
+    __slots__ = ("start", "count", "suppressed", "log")
+
+    def __init__(self, start: float, log: LogFunction) -> None:
+        self.start = start
+        self.count = 0
+        self.suppressed = 0
+        # Where the summary of the suppressed problems is logged
+        self.log = log
+
+
+def describe_source(source: Any) -> str:
+    # Sensor ids are ints, anything else is the topic it came from
+    return f"Sensor {source}" if isinstance(source, int) else f"Topic {source}"
+
+
+@bacpypes_debugging
+class RateLimitedLog(Logable):
+    """
+    Logs problems with the given log functions, at most `burst` of
+    each problem every `period` seconds, and then one in every `sample`
+    if it is not 0. `flush` must be called regularly to log the
+    summaries and start new periods.
+    """
+
+    PERIOD = 60.0
+    BURST = 5
+
+    def __init__(
+        self,
+        period: float = PERIOD,
+        burst: int = BURST,
+        sample: int = 0,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self._period = period
+        self._burst = burst
+        self._sample = sample
+        self._clock = clock
+        self._windows: Dict[Problem, _Window] = {}
+
+    def log(
+        self,
+        log: LogFunction,
+        source: Any,
+        reason: str,
+        key: Optional[str],
+        template: str,
+        *args: Any,
+    ) -> None:
+        """
+        Log a problem, from a sensor id or topic, about one of its
+        keys or None. The message is `template % args`.
+        """
+        problem = (source, reason, key)
+        window = self._windows.get(problem)
+
+        if window is None:
+            window = self._windows[problem] = _Window(self._clock(), log)
+
+        window.count += 1
+        over = window.count - self._burst
+
+        if over <= 0 or (self._sample and over % self._sample == 0):
+            log(template, *args)
+        else:
+            window.suppressed += 1
+
+    def flush(self) -> None:
+        """
+        Log the summaries of the problems whose period is over,
+        and start them over
+        """
+        now = self._clock()
+        ended: List[Tuple[Problem, _Window]] = [
+            (problem, window)
+            for problem, window in self._windows.items()
+            if now - window.start >= self._period
+        ]
+
+        if _debug and ended:
+            RateLimitedLog._debug("Periods of %d problems ended", len(ended))
+
+        for (source, reason, key), window in ended:
+            del self._windows[(source, reason, key)]
+
+            if window.suppressed:
+                window.log(
+                    "%s: %s more %s%s in the last %gs",
+                    describe_source(source),
+                    f"{window.suppressed:,}",
+                    reason,
+                    f" for '{key}'" if key is not None else "",
+                    self._period,
+                )
+
+    def __len__(self) -> int:
+        return len(self._windows)
@@ -1,16 +1,39 @@
 import asyncio
 import logging
+import os
+import signal
+import tempfile
 import time
 import traceback
-from threading import Thread
-from typing import Dict, Any
+from concurrent.futures import Executor
+from threading import Thread, current_thread
+from typing import Any, Dict, Iterable, List, Mapping, Optional, Set, Tuple
 
+from bacpypes.core import deferred
 from bacpypes.debugging import ModuleLogger, bacpypes_debugging
 from hbmqtt.broker import Broker
 
+from bacprop.bacnet.aiocore import AsyncioCore
+from bacprop.bacnet.announce import AnnounceScheduler
 from bacprop.bacnet.network import VirtualSensorNetwork
+from bacprop.buffer import UpdateBuffer
 from bacprop.defs import Logable
-from bacprop.mqtt import SensorStream
+from bacprop.metrics import (
+    ANNOUNCE_QUEUE_DEPTH,
+    HANDLE_SECONDS,
+    QUEUE_DEPTH,
+    READING_FAILURES,
+    READINGS,
+    SENSOR_OBJECTS,
+    SENSORS,
+    Labels,
+    MetricsServer,
+)
+from bacprop.mqtt import BaseSensorStream, SensorStream
+from bacprop.pipeline import DecodePipeline, ReadingValidator, ValidationWarning
+from bacprop.profiler import SamplingProfiler, stage
+from bacprop.ratelog import RateLimitedLog
+from bacprop.snapshot import SnapshotWriter
 
 _debug = 0
 _log = ModuleLogger(globals())
@@ -18,75 +41,300 @@ _log = ModuleLogger(globals())
 
 @bacpypes_debugging
 class BacPropagator(Logable):
-    SENSOR_ID_KEY = "sensorId"
-    SENSOR_OUTDATED_TIME = 60 * 10  # 10 Minutes
+    SENSOR_ID_KEY = ReadingValidator.SENSOR_ID_KEY
+    SENSOR_OUTDATED_TIME = VirtualSensorNetwork.DEFAULT_SENSOR_TIMEOUT
+    FLUSH_INTERVAL = 0.1
+    SNAPSHOT_INTERVAL = 5.0
+    PROFILE_SECONDS = 10.0
+    PROFILE_SIGNAL = signal.SIGUSR2
 
-    def __init__(self) -> None:
+    def __init__(
+        self,
+        sensor_timeout: float = SENSOR_OUTDATED_TIME,
+        group_timeouts: Optional[Iterable[Tuple[range, float]]] = None,
+        shared_stack: bool = False,
+        flush_interval: float = FLUSH_INTERVAL,
+        merge_sensors: Iterable[range] = (),
+        merge_topics: Iterable[str] = (),
+        key_timeout: Optional[float] = None,
+        stream: Optional[BaseSensorStream] = None,
+        decode_executor: Optional[Executor] = None,
+        decode_max_in_flight: int = DecodePipeline.MAX_IN_FLIGHT,
+        cov_increments: Optional[Mapping[str, float]] = None,
+        announce_rate: float = AnnounceScheduler.DEFAULT_RATE,
+        snapshot_path: Optional[str] = None,
+        snapshot_interval: float = SNAPSHOT_INTERVAL,
+        lazy_stacks: bool = False,
+        eager_sensors: Iterable[range] = (),
+        idle_timeout: float = VirtualSensorNetwork.DEFAULT_IDLE_TIMEOUT,
+        retire_after: Optional[float] = None,
+        networks: int = 1,
+        network_size: int = 0,
+        asyncio_core: bool = False,
+        metrics_port: Optional[int] = None,
+        metrics_address: str = "127.0.0.1",
+        profile_dir: str = tempfile.gettempdir(),
+        profile_seconds: float = PROFILE_SECONDS,
+        log_period: float = RateLimitedLog.PERIOD,
+        log_burst: int = RateLimitedLog.BURST,
+        log_sample: int = 0,
+    ) -> None:
         BacPropagator._info(f"Intialising SensorStream and Bacnet")
-        self._stream = SensorStream()
-        self._sensor_net = VirtualSensorNetwork("0.0.0.0")
+        self._stream = stream if stream is not None else SensorStream()
+        self._sensor_net = VirtualSensorNetwork(
+            "0.0.0.0",
+            shared_stack=shared_stack,
+            cov_increments=cov_increments,
+            announce_rate=announce_rate,
+            lazy_stacks=lazy_stacks,
+            eager_sensors=eager_sensors,
+            idle_timeout=idle_timeout,
+            retire_after=retire_after,
+            networks=networks,
+            network_size=network_size,
+        )
+        self._updates = UpdateBuffer()
+        self._flush_interval = flush_interval
         self._running = False
 
-    def _handle_sensor_data(self, data: Dict[str, Any]) -> None:
-        if BacPropagator.SENSOR_ID_KEY not in data:
-            BacPropagator._warning(f"sensorId missing from sensor data: {data}")
-            return
+        # The bacnet core runs on a thread of its own, unless run
+        # on the event loop
+        self._asyncio_core = asyncio_core
 
-        try:
-            sensor_id = int(data[BacPropagator.SENSOR_ID_KEY])
-        except ValueError:
-            BacPropagator._warning(
-                f"sensorId {data[BacPropagator.SENSOR_ID_KEY]} could not be decoded"
+        self._validator = ReadingValidator(merge_sensors, merge_topics)
+
+        # Problems with the sensor data are logged at a limited rate
+        self._data_log = RateLimitedLog(log_period, log_burst, log_sample)
+        self._stream.set_data_log(self._data_log)
+
+        # Decoding and validating off the event loop is optional
+        self._decode_pipeline = (
+            DecodePipeline(
+                decode_executor, self._validator, decode_max_in_flight, self._data_log
             )
-            return
+            if decode_executor is not None
+            else None
+        )
+        self._key_timeout = key_timeout
+        self._merged_sensor_ids: Set[int] = set()
+
+        # Sensors are snapshotted when they have changed
+        self._snapshot = SnapshotWriter(snapshot_path) if snapshot_path else None
+        self._snapshot_interval = snapshot_interval
+        self._snapshot_dirty: Set[int] = set()
+        self._snapshot_removed: Set[int] = set()
+
+        # Metrics are always counted, but only served when given a port
+        self._metrics_server = (
+            MetricsServer(metrics_address, metrics_port)
+            if metrics_port is not None
+            else None
+        )
+        SENSORS.set_function(self._sensor_states)
+        SENSOR_OBJECTS.set_function(self._sensor_objects)
+        QUEUE_DEPTH.set_function(lambda: {(): self._stream.get_queue_depth()})
+        ANNOUNCE_QUEUE_DEPTH.set_function(self._announce_queue_depth)
+
+        # Profiles are taken of the event loop and bacnet threads on request
+        self._profiler = SamplingProfiler()
+        self._profile_dir = profile_dir
+        self._profile_seconds = profile_seconds
+        self._profile_threads: List[Thread] = []
+
+        fault_scheduler = self._sensor_net.get_fault_scheduler()
+        fault_scheduler.set_default_timeout(sensor_timeout)
+
+        for ids, timeout in group_timeouts or ():
+            fault_scheduler.set_group_timeout(ids, timeout)
 
-        if sensor_id < 0:
-            BacPropagator._warning(
-                f"sensorId {data[BacPropagator.SENSOR_ID_KEY]} is an invalid id"
+    def _handle_sensor_data(self, data: Dict[str, Any], topic: str = "") -> None:
+        start = time.perf_counter()
+        warnings: List[ValidationWarning] = []
+        reading = self._validator.validate(data, topic, warnings)
+
+        for warning in warnings:
+            READING_FAILURES.inc(warning.reason)
+            self._data_log.log(
+                BacPropagator._warning,
+                warning.source,
+                warning.reason,
+                warning.key,
+                warning.template,
+                *warning.args,
             )
-            return
 
-        del data[BacPropagator.SENSOR_ID_KEY]
+        if reading is not None:
+            sensor_id, values, merge = reading
+            READINGS.inc()
 
-        values: Dict[str, float] = {}
+            # Applied to the sensor later, by the bacnet core
+            self._updates.put(sensor_id, values, merge)
 
-        # Only allow through data which are actually floats
-        for key in data:
-            if type(data[key]) not in (float, int):
-                BacPropagator._warning(
-                    f"Recieved non-number value ({key}: '{data[key]}') from sensor id: {sensor_id}"
-                )
-            else:
-                values[key] = data[key]
+        HANDLE_SECONDS.observe(time.perf_counter() - start)
 
-        sensor = self._sensor_net.get_sensor(sensor_id)
+    def _sensor_states(self) -> Dict[Labels, float]:
+        """
+        Count the sensors by state, from the value store
+        """
+        store = self._sensor_net.get_store()
+        faulty = store.count_faults()
 
-        if not sensor:
-            sensor = self._sensor_net.create_sensor(sensor_id)
+        return {("ok",): store.count_sensors() - faulty, ("fault",): faulty}
 
-        sensor.set_values(values)
+    def _announce_queue_depth(self) -> Dict[Labels, float]:
+        announcer = self._sensor_net.get_announcer()
+        return {(): announcer.queue_depth} if announcer is not None else {}
 
-        if sensor.has_fault():
-            if _debug:
-                BacPropagator._debug(
-                    f"Sensor {sensor_id} now has new data, so marking as OK"
-                )
-            sensor.mark_ok()
+    def _sensor_objects(self) -> Dict[Labels, float]:
+        counts: Dict[Labels, float] = {}
+
+        for sensor in self._sensor_net.get_sensors().values():
+            objects = (str(sensor.get_object_count()),)
+            counts[objects] = counts.get(objects, 0) + 1
+
+        return counts
+
+    def profile(self, seconds: Optional[float] = None) -> Optional[str]:
+        """
+        Start profiling the event loop and bacnet threads, giving back the
+        path the profile will be written to, or None if already profiling
+        """
+        path = os.path.join(
+            self._profile_dir, f"bacprop-{time.strftime('%Y%m%d-%H%M%S')}.folded"
+        )
+        seconds = seconds if seconds is not None else self._profile_seconds
+
+        if not self._profiler.start(seconds, path, self._profile_threads):
+            return None
+
+        return path
+
+    @stage("apply")
+    def _apply_updates(self) -> None:
+        """
+        Apply the buffered sensor values. Must run on the bacnet core.
+        """
+        for sensor_id, (merge, values) in self._updates.take().items():
+            sensor = self._sensor_net.get_sensor(sensor_id)
+
+            if not sensor:
+                sensor = self._sensor_net.create_sensor(sensor_id)
+
+            sensor.set_values(values, merge)
+            self._snapshot_dirty.add(sensor_id)
+
+            if merge:
+                self._merged_sensor_ids.add(sensor_id)
+
+            if sensor.has_fault():
+                if _debug:
+                    BacPropagator._debug(
+                        f"Sensor {sensor_id} now has new data, so marking as OK"
+                    )
+                sensor.mark_ok()
+
+    @stage("faults")
+    def _check_faults(self, now: float) -> None:
+        """
+        Mark outdated sensors as faulty. Must run on the bacnet core.
+        """
+        # Only the sensors whose deadline has passed are returned
+        for sensor in self._sensor_net.pop_outdated_sensors(now):
+            if not sensor.has_fault():
+                if _debug:
+                    BacPropagator._debug(
+                        f"Sensor {sensor.get_id()} data is outdated, notifying fault"
+                    )
+                sensor.mark_fault()
+                self._snapshot_dirty.add(sensor.get_id())
+
+        for sensor in self._sensor_net.retire_sensors(now):
+            sensor_id = sensor.get_id()
+            BacPropagator._info(f"Sensor {sensor_id} has been faulty too long, retired")
+
+            self._merged_sensor_ids.discard(sensor_id)
+            self._snapshot_dirty.discard(sensor_id)
+            self._snapshot_removed.add(sensor_id)
+            self._validator.forget(sensor_id)
+
+        if self._key_timeout is not None:
+            self._expire_keys(now - self._key_timeout)
+
+    def _expire_keys(self, before: float) -> None:
+        for sensor_id in self._merged_sensor_ids:
+            sensor = self._sensor_net.get_sensor(sensor_id)
+
+            if sensor:
+                expired = sensor.expire_keys(before)
+
+                if expired:
+                    self._snapshot_dirty.add(sensor_id)
 
-    async def _fault_check_loop(self) -> None:
-        BacPropagator._info("Starting fault check loop")
-        while self._running:
-            for sensor_id, sensor in self._sensor_net.get_sensors().items():
-                if (
-                    not sensor.has_fault()
-                    and abs(time.time() - sensor.get_update_time())
-                    > BacPropagator.SENSOR_OUTDATED_TIME
-                ):
                     if _debug:
                         BacPropagator._debug(
-                            f"Sensor {sensor_id} data is outdated, notifying fault"
+                            f"Sensor {sensor_id} keys {expired} expired, removing"
                         )
-                    sensor.mark_fault()
+
+    def _restore_snapshot(self, snapshot: SnapshotWriter) -> None:
+        """
+        Restore the sensors from the snapshot, before the bacnet
+        thread is started
+        """
+        start = time.perf_counter()
+        snapshots = snapshot.load()
+        sensors = self._sensor_net.restore_sensors(snapshots)
+
+        # Sensors given a new address are saved again with it
+        for sensor_snapshot, sensor in zip(snapshots, sensors):
+            address = sensor_snapshot.address.to_bytes(4, "big")
+            if sensor.get_address().addrAddr != address:
+                self._snapshot_dirty.add(sensor.get_id())
+
+        # Restored merged keys expire like any others
+        self._merged_sensor_ids.update(
+            sensor.sensor_id for sensor in snapshots if sensor.merged
+        )
+
+        BacPropagator._info(
+            f"Restored {len(sensors)} sensors from snapshot "
+            f"in {time.perf_counter() - start:.2f}s"
+        )
+
+        snapshot.start()
+
+    @stage("snapshot")
+    def _save_snapshot(self, snapshot: SnapshotWriter) -> None:
+        """
+        Hand the changed and removed sensors to the snapshot writer.
+        Must run on the bacnet core.
+        """
+        sensors = [self._sensor_net.get_sensor(_id) for _id in self._snapshot_dirty]
+        removed = list(self._snapshot_removed)
+        self._snapshot_dirty.clear()
+        self._snapshot_removed.clear()
+
+        snapshot.write([sensor.get_snapshot() for sensor in sensors if sensor], removed)
+
+    async def _snapshot_loop(self, snapshot: SnapshotWriter) -> None:
+        BacPropagator._info("Starting snapshot loop")
+        while self._running:
+            await asyncio.sleep(self._snapshot_interval)
+
+            deferred(self._save_snapshot, snapshot)
+
+    async def _flush_loop(self) -> None:
+        BacPropagator._info("Starting update flush loop")
+        while self._running:
+            if self._updates:
+                deferred(self._apply_updates)
+
+            await asyncio.sleep(self._flush_interval)
+
+    async def _fault_check_loop(self) -> None:
+        BacPropagator._info("Starting fault check loop")
+        while self._running:
+            deferred(self._check_faults, time.time())
+            self._data_log.flush()
 
             await asyncio.sleep(1)
 
@@ -94,29 +342,71 @@ class BacPropagator(Logable):
         BacPropagator._info("Starting stream receive loop")
         await self._stream.start()
 
-        async for data in self._stream.read():
+        if self._decode_pipeline is not None:
+            await self._pipeline_loop(self._decode_pipeline)
+            return
+
+        async for topic, data in self._stream.read():
             if _debug:
-                BacPropagator._debug(f"Received: {data}")
+                BacPropagator._debug(f"Received on {topic}: {data}")
 
-            self._handle_sensor_data(data)
+            self._handle_sensor_data(data, topic)
+
+    async def _pipeline_loop(self, pipeline: DecodePipeline) -> None:
+        BacPropagator._info("Decoding sensor data on the decode pipeline")
+
+        async for sensor_id, values, merge in pipeline.process(self._stream):
+            if _debug:
+                BacPropagator._debug(f"Received from sensor {sensor_id}: {values}")
+
+            self._updates.put(sensor_id, values, merge)
 
     def _start_bacnet_thread(self) -> Thread:
         BacPropagator._info("Starting bacnet sensor network")
 
-        bacnet_thread = Thread(target=self._sensor_net.run)
+        bacnet_thread = Thread(target=self._sensor_net.run, name="bacnet")
         bacnet_thread.daemon = True
         bacnet_thread.start()
 
         return bacnet_thread
 
+    def _start_bacnet_core(self, loop: asyncio.AbstractEventLoop) -> AsyncioCore:
+        BacPropagator._info("Starting bacnet sensor network on the event loop")
+
+        bacnet_core = AsyncioCore(loop)
+        bacnet_core.start()
+
+        return bacnet_core
+
     def start(self) -> None:
         self._running = True
 
-        bacnet_thread = self._start_bacnet_thread()
+        if self._snapshot is not None:
+            self._restore_snapshot(self._snapshot)
+
+        loop = asyncio.get_event_loop()
+
+        bacnet_thread: Optional[Thread] = None
+        bacnet_core: Optional[AsyncioCore] = None
+
+        if self._asyncio_core:
+            bacnet_core = self._start_bacnet_core(loop)
+            self._profile_threads = [current_thread()]
+        else:
+            bacnet_thread = self._start_bacnet_thread()
+            self._profile_threads = [current_thread(), bacnet_thread]
 
+        loop.add_signal_handler(BacPropagator.PROFILE_SIGNAL, self.profile)
+
+        if self._metrics_server is not None:
+            loop.run_until_complete(self._metrics_server.start())
+
+        asyncio.ensure_future(self._flush_loop())
         asyncio.ensure_future(self._fault_check_loop())
 
-        loop = asyncio.get_event_loop()
+        if self._snapshot is not None:
+            asyncio.ensure_future(self._snapshot_loop(self._snapshot))
+
         try:
             loop.run_until_complete(self._main_loop())
         except KeyboardInterrupt:
@@ -129,6 +419,46 @@ class BacPropagator(Logable):
         BacPropagator._info("Stopping stream loop")
         loop.run_until_complete(self._stream.stop())
 
+        if self._metrics_server is not None:
+            loop.run_until_complete(self._metrics_server.stop())
+
+        loop.remove_signal_handler(BacPropagator.PROFILE_SIGNAL)
+        self._profiler.stop()
+
+        if self._decode_pipeline is not None:
+            BacPropagator._info("Stopping decode pipeline")
+            self._decode_pipeline.shutdown()
+
+        BacPropagator._info(
+            f"Applied {self._updates.applied} sensor updates, "
+            f"coalesced {self._updates.coalesced}"
+        )
+
+        announcer = self._sensor_net.get_announcer()
+        if announcer is not None:
+            BacPropagator._info(
+                f"Announced {announcer.announced} sensors, "
+                f"{announcer.mean_wait:.2f}s mean and "
+                f"{announcer.max_wait:.2f}s max time to announce, "
+                f"{announcer.queue_depth} still waiting"
+            )
+
+        eviction = self._sensor_net.get_eviction()
+        if eviction is not None:
+            BacPropagator._info(
+                f"Evicted {eviction.evicted} idle sensor stacks, "
+                f"{len(eviction)} evictable stacks still built"
+            )
+
         BacPropagator._info("Closing bacnet sensor network")
-        self._sensor_net.stop()
-        bacnet_thread.join()
+        if bacnet_core is not None:
+            bacnet_core.stop()
+
+        if bacnet_thread is not None:
+            self._sensor_net.stop()
+            bacnet_thread.join()
+
+        if self._snapshot is not None:
+            BacPropagator._info("Writing final snapshot")
+            self._save_snapshot(self._snapshot)
+            self._snapshot.close()
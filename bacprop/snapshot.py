@@ -0,0 +1,309 @@
+"""
+Append-only snapshot of the sensors on the network, so they can be
+restored as they were when bacprop restarts.
+
+The file starts with the magic bytes "BPSN" and a uint8 version,
+followed by records. All fields are little-endian:
+
+    length      uint32   length of the rest of the record
+    sensorId    uint32
+    address     uint32   VLAN address of the sensor
+    updated     float64  time of the last update
+    flags       uint8    1 if the sensor is faulty, 2 if its keys
+                         were set by merge updates, 4 if the
+                         sensor has been removed
+    count       uint16
+
+followed by `count` keys, each a uint32 instance number, a float64
+value, a uint8 of flags, 1 if the key has an object, and a uint8
+length and that many bytes of UTF-8 key name. Every key the sensor
+holds an instance number for, including recently removed keys, is
+included, so instance numbers stay stable.
+
+A record replaces any earlier record of the same sensor, and a
+removed record, with no keys, deletes it. A truncated record at the
+end of the file, from being stopped while writing, is ignored. A
+sensor whose id, address or keys don't fit in the record is logged
+and left out. Once the file holds more than `COMPACT_RATIO` records
+for each sensor, it is rewritten with only the latest ones.
+"""
+
+import os
+import struct
+from queue import Queue
+from threading import Thread
+from typing import Dict, Iterator, List, NamedTuple, Optional, Sequence, Tuple
+
+from bacpypes.debugging import ModuleLogger, bacpypes_debugging
+
+from bacprop.defs import Logable
+
+_debug = 0
+_log = ModuleLogger(globals())
+
+MAGIC = b"BPSN"
+VERSION = 2
+
+_FILE_HEADER = struct.Struct("<4sB")
+_LENGTH = struct.Struct("<I")
+_RECORD = struct.Struct("<IIdBH")
+_KEY = struct.Struct("<IdBB")
+_UINT32_MAX = 0xFFFFFFFF
+_NAME_MAX = 0xFF
+_COUNT_MAX = 0xFFFF
+
+_FAULT = 1
+_MERGED = 2
+_REMOVED = 4
+
+_HAS_OBJECT = 1
+
+
+class SensorSnapshot(NamedTuple):
+    sensor_id: int
+    address: int
+    update_time: float
+    fault: bool
+    merged: bool
+    # key name -> (instance number, value), None for a key without an object
+    keys: Dict[str, Tuple[int, Optional[float]]]
+
+
+class SnapshotError(ValueError):
+    pass
+
+
+def _check_id(name: str, value: int) -> None:
+    if not 0 <= value <= _UINT32_MAX:
+        raise SnapshotError(f"{name} {value} does not fit")
+
+
+def encode_snapshot(snapshot: SensorSnapshot) -> bytes:
+    """
+    Encode the record of a sensor. Raises a SnapshotError if the
+    sensor doesn't fit in one.
+    """
+    _check_id("Sensor id", snapshot.sensor_id)
+    _check_id("Address", snapshot.address)
+
+    if len(snapshot.keys) > _COUNT_MAX:
+        raise SnapshotError(f"{len(snapshot.keys)} keys do not fit")
+
+    parts = [
+        _RECORD.pack(
+            snapshot.sensor_id,
+            snapshot.address,
+            snapshot.update_time,
+            (_FAULT if snapshot.fault else 0) | (_MERGED if snapshot.merged else 0),
+            len(snapshot.keys),
+        )
+    ]
+
+    for key, (instance, value) in snapshot.keys.items():
+        name = key.encode()
+        if len(name) > _NAME_MAX:
+            raise SnapshotError(f"Key name of {len(name)} bytes does not fit")
+
+        _check_id("Instance", instance)
+        parts.append(
+            _KEY.pack(
+                instance,
+                0.0 if value is None else value,
+                0 if value is None else _HAS_OBJECT,
+                len(name),
+            )
+        )
+        parts.append(name)
+
+    record = b"".join(parts)
+    return _LENGTH.pack(len(record)) + record
+
+
+def encode_removal(sensor_id: int) -> bytes:
+    return _LENGTH.pack(_RECORD.size) + _RECORD.pack(sensor_id, 0, 0.0, _REMOVED, 0)
+
+
+def _decode_record(data: memoryview) -> SensorSnapshot:
+    sensor_id, address, update_time, flags, count = _RECORD.unpack_from(data)
+    offset = _RECORD.size
+    keys: Dict[str, Tuple[int, Optional[float]]] = {}
+
+    for _ in range(count):
+        instance, value, key_flags, length = _KEY.unpack_from(data, offset)
+        offset += _KEY.size
+        name = bytes(data[offset : offset + length]).decode()
+        offset += length
+
+        keys[name] = (instance, value if key_flags & _HAS_OBJECT else None)
+
+    return SensorSnapshot(
+        sensor_id,
+        address,
+        update_time,
+        bool(flags & _FAULT),
+        bool(flags & _MERGED),
+        keys,
+    )
+
+
+def _records(data: bytes) -> Iterator[Tuple[int, int, memoryview]]:
+    """
+    Iterate over the (sensor id, flags, record) of each record in
+    a snapshot file, stopping at a truncated record
+    """
+    if len(data) < _FILE_HEADER.size:
+        raise SnapshotError("Snapshot file is too short")
+
+    magic, version = _FILE_HEADER.unpack_from(data)
+    if magic != MAGIC or version != VERSION:
+        raise SnapshotError(f"Not a version {VERSION} snapshot file")
+
+    view = memoryview(data)
+    offset = _FILE_HEADER.size
+
+    while offset + _LENGTH.size + _RECORD.size <= len(data):
+        (length,) = _LENGTH.unpack_from(view, offset)
+        end = offset + _LENGTH.size + length
+
+        if end > len(data):
+            break
+
+        sensor_id, _, _, flags, _ = _RECORD.unpack_from(view, offset + _LENGTH.size)
+        yield sensor_id, flags, view[offset:end]
+
+        offset = end
+
+
+@bacpypes_debugging
+class SnapshotWriter(Logable):
+    """
+    Appends sensor snapshots to the snapshot file on a thread of
+    its own, so the bacnet thread only has to hand them over.
+    """
+
+    COMPACT_RATIO = 4
+
+    def __init__(self, path: str) -> None:
+        self._path = path
+        # sensor id -> latest encoded record, for compacting
+        self._latest: Dict[int, bytes] = {}
+        self._written = 0
+        # (snapshots, removed sensor ids), or None to stop
+        self._queue: "Queue[Optional[Tuple[List[SensorSnapshot], Sequence[int]]]]" = (
+            Queue()
+        )
+        self._thread: Optional[Thread] = None
+
+    def load(self) -> List[SensorSnapshot]:
+        """
+        Read the latest snapshot of every sensor from the file. A file
+        which can't be read is logged and started again.
+        """
+        try:
+            with open(self._path, "rb") as snapshot_file:
+                data = snapshot_file.read()
+
+            for sensor_id, flags, record in _records(data):
+                if flags & _REMOVED:
+                    self._latest.pop(sensor_id, None)
+                else:
+                    self._latest[sensor_id] = bytes(record)
+
+                self._written += 1
+
+        except FileNotFoundError:
+            return []
+        except (SnapshotError, struct.error, UnicodeDecodeError) as e:
+            SnapshotWriter._error(f"Could not load snapshot {self._path}: {e}")
+            self._latest.clear()
+            self._written = 0
+            return []
+
+        return [
+            _decode_record(memoryview(record)[_LENGTH.size :])
+            for record in self._latest.values()
+        ]
+
+    def start(self) -> None:
+        # Written cleanly, so nothing follows a truncated record
+        self._compact()
+
+        self._thread = Thread(target=self._write_loop, name="snapshot")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def write(
+        self, snapshots: List[SensorSnapshot], removed: Sequence[int] = ()
+    ) -> None:
+        """
+        Queue snapshots, and the removal of sensors, to be
+        appended to the file. Removals are written first.
+        """
+        if snapshots or removed:
+            self._queue.put((snapshots, removed))
+
+    def close(self) -> None:
+        """
+        Write everything queued, and stop the writer thread
+        """
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+
+    def _compact(self) -> None:
+        temp_path = self._path + ".tmp"
+
+        with open(temp_path, "wb") as snapshot_file:
+            snapshot_file.write(_FILE_HEADER.pack(MAGIC, VERSION))
+            snapshot_file.writelines(self._latest.values())
+            snapshot_file.flush()
+            os.fsync(snapshot_file.fileno())
+
+        os.replace(temp_path, self._path)
+        self._written = len(self._latest)
+
+        if _debug:
+            SnapshotWriter._debug(f"Compacted snapshot to {self._written} records")
+
+    def _append(self, snapshots: List[SensorSnapshot], removed: Sequence[int]) -> None:
+        records = []
+        for sensor_id in removed:
+            # Only sensors in the file need removing, which also
+            # leaves out the ones that didn't fit
+            if self._latest.pop(sensor_id, None) is not None:
+                records.append(encode_removal(sensor_id))
+
+        for snapshot in snapshots:
+            try:
+                record = encode_snapshot(snapshot)
+            except SnapshotError as e:
+                SnapshotWriter._error(f"Sensor {snapshot.sensor_id} not saved: {e}")
+                continue
+
+            self._latest[snapshot.sensor_id] = record
+            records.append(record)
+
+        with open(self._path, "ab") as snapshot_file:
+            snapshot_file.writelines(records)
+
+        self._written += len(records)
+
+        if self._written > SnapshotWriter.COMPACT_RATIO * len(self._latest):
+            self._compact()
+
+    def _write_loop(self) -> None:
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+
+            try:
+                self._append(*item)
+            except OSError as e:
+                SnapshotWriter._error(f"Could not write snapshot {self._path}: {e}")
+            except Exception as e:  # pylint: disable=broad-except
+                # The thread keeps going, or nothing is written again
+                SnapshotWriter._error(
+                    f"Error writing snapshot {self._path}: {e!r}", exc_info=True
+                )
@@ -0,0 +1,270 @@
+"""
+Compare running the bacpypes core on a thread of its own with running
+it on the asyncio event loop, while sensor data is being ingested.
+
+The service runs in a subprocess, fed synthetic readings through its
+stream, either at a fixed rate or as fast as it takes them. It reports
+the readings ingested per second, and the latency of handing a function
+from the event loop to the bacnet core. This process meanwhile reads
+the present value of the sensors with ReadProperty over UDP, through
+the router, one request at a time, and reports the reads per second
+and their round trip latency.
+
+    python -m benchmarks.bench_asyncio_core [--sensors N] [--duration S]
+        [--rate MSGS_PER_S ...]
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import time
+from typing import Any, Dict, List, Optional
+
+from bacpypes.apdu import APDU, ComplexAckPDU, ReadPropertyACK, ReadPropertyRequest
+from bacpypes.bvll import BVLPDU, OriginalUnicastNPDU
+from bacpypes.core import deferred
+from bacpypes.npdu import NPDU
+from bacpypes.pdu import PDU, RemoteStation
+
+from bacprop.mqtt import BaseSensorStream
+from bacprop.service import BacPropagator
+
+PORT = 47808
+KEYS = ["temp", "humidity", "co2", "pm25"]
+# Sensors are given the addresses after the router node, in order
+FIRST_ADDRESS = 2
+# Time for the sensors to be made before they are read
+WARM_UP = 1.5
+READ_TIMEOUT = 1.0
+
+
+class _SyntheticStream(BaseSensorStream):
+    def __init__(self, sensors: int, rate: float, duration: float) -> None:
+        BaseSensorStream.__init__(self)
+        self._sensors = sensors
+        self._rate = rate
+        self._duration = duration
+        self.published = 0
+
+    async def start(self) -> None:
+        self._running = True
+        asyncio.ensure_future(self._publish())
+
+    async def stop(self) -> None:
+        self._stop_reading()
+
+    async def _publish(self) -> None:
+        start = time.perf_counter()
+        end = start + self._duration
+
+        while self._running and time.perf_counter() < end:
+            sensor_id = self.published % self._sensors
+            payload = json.dumps(
+                {"sensorId": sensor_id, **{key: random.random() for key in KEYS}}
+            ).encode()
+
+            await self._queue.put((f"sensor/{sensor_id}", payload))
+            self.published += 1
+
+            if self._rate:
+                delay = start + self.published / self._rate - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+
+        self._stop_reading()
+
+
+async def _handoff_latencies(service: BacPropagator, latencies: List[float]) -> None:
+    """
+    Time handing a function to the bacnet core until it runs
+    """
+    loop = asyncio.get_event_loop()
+
+    def ran(future: "asyncio.Future[float]") -> None:
+        loop.call_soon_threadsafe(future.set_result, time.perf_counter())
+
+    while service._running:
+        future: "asyncio.Future[float]" = loop.create_future()
+        start = time.perf_counter()
+        deferred(ran, future)
+
+        latencies.append(await future - start)
+        await asyncio.sleep(0.01)
+
+
+def serve(mode: str, sensors: int, rate: float, duration: float) -> None:
+    stream = _SyntheticStream(sensors, rate, duration)
+    service = BacPropagator(
+        stream=stream, announce_rate=0, asyncio_core=mode == "asyncio"
+    )
+    latencies: List[float] = []
+
+    asyncio.ensure_future(_handoff_latencies(service, latencies))
+
+    start = time.perf_counter()
+    cpu_start = time.process_time()
+    service.start()
+    seconds = time.perf_counter() - start
+
+    latencies.sort()
+    print(
+        json.dumps(
+            {
+                "readings_per_s": stream.published / seconds,
+                "cpu_s": time.process_time() - cpu_start,
+                "handoff_p50_ms": latencies[len(latencies) // 2] * 1000,
+                "handoff_p99_ms": latencies[int(len(latencies) * 0.99)] * 1000,
+            }
+        )
+    )
+
+
+def encode_read(address: int, invoke_id: int) -> bytes:
+    request = ReadPropertyRequest(
+        objectIdentifier=("analogValue", 0), propertyIdentifier="presentValue"
+    )
+    request.apduInvokeID = invoke_id
+    # Unsegmented, up to 1476 octets
+    request.apduMaxSegs = 0
+    request.apduMaxResp = 5
+    apdu = APDU()
+    request.encode(apdu)
+    encoded = PDU()
+    apdu.encode(encoded)
+
+    npdu = NPDU(encoded.pduData)
+    npdu.npduDADR = RemoteStation(1, address.to_bytes(4, "big"))
+    npdu.npduHopCount = 255
+    npdu.pduExpectingReply = True
+    encoded = PDU()
+    npdu.encode(encoded)
+
+    bvlpdu = BVLPDU()
+    OriginalUnicastNPDU(encoded.pduData).encode(bvlpdu)
+    packet = PDU()
+    bvlpdu.encode(packet)
+
+    return bytes(packet.pduData)
+
+
+def decode_ack(data: bytes) -> Optional[int]:
+    """
+    Get the invoke id of a ReadProperty ACK
+    """
+    bvlpdu = BVLPDU()
+    bvlpdu.decode(PDU(data))
+    npdu = NPDU()
+    npdu.decode(PDU(bvlpdu.pduData))
+
+    if npdu.npduNetMessage is not None:
+        return None
+
+    apdu = APDU()
+    apdu.decode(npdu)
+
+    if (apdu.apduType, apdu.apduService) != (
+        ComplexAckPDU.pduType,
+        ReadPropertyACK.serviceChoice,
+    ):
+        return None
+
+    return int(apdu.apduInvokeID)
+
+
+def read(sensors: int, duration: float) -> Dict[str, Any]:
+    client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    client.bind(("127.0.0.1", 0))
+    client.settimeout(READ_TIMEOUT)
+
+    latencies: List[float] = []
+    timeouts = 0
+    invoke_id = 0
+    end = time.perf_counter() + duration
+
+    while time.perf_counter() < end:
+        invoke_id = (invoke_id + 1) % 256
+        address = FIRST_ADDRESS + random.randrange(sensors)
+
+        start = time.perf_counter()
+        client.sendto(encode_read(address, invoke_id), ("127.0.0.1", PORT))
+
+        try:
+            while decode_ack(client.recv(1500)) != invoke_id:
+                pass
+        except socket.timeout:
+            timeouts += 1
+            continue
+
+        latencies.append(time.perf_counter() - start)
+
+    client.close()
+    latencies.sort()
+
+    return {
+        "reads_per_s": len(latencies) / duration,
+        "read_p50_ms": statistics.median(latencies) * 1000 if latencies else None,
+        "read_p99_ms": (
+            latencies[int(len(latencies) * 0.99)] * 1000 if latencies else None
+        ),
+        "read_timeouts": timeouts,
+    }
+
+
+def run(mode: str, sensors: int, rate: float, duration: float) -> Dict[str, Any]:
+    server = subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "benchmarks.bench_asyncio_core",
+            "--serve",
+            mode,
+            "--sensors",
+            str(sensors),
+            "--duration",
+            str(duration),
+            "--rate",
+            str(rate),
+        ],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+    )
+
+    time.sleep(WARM_UP)
+    results = read(sensors, duration - WARM_UP)
+    stdout, _ = server.communicate()
+
+    return {**json.loads(stdout), **results}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--serve", choices=["thread", "asyncio"])
+    parser.add_argument("--sensors", type=int, default=200)
+    parser.add_argument("--duration", type=float, default=8.0)
+    parser.add_argument("--rate", type=float, nargs="*", default=[2000.0, 0.0])
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.serve, args.sensors, args.rate[0], args.duration)
+        return
+
+    results = {
+        f"rate_{rate:g}"
+        if rate
+        else "rate_max": {
+            mode: run(mode, args.sensors, rate, args.duration)
+            for mode in ("thread", "asyncio")
+        }
+        for rate in args.rate
+    }
+
+    print(json.dumps({"sensors": args.sensors, **results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
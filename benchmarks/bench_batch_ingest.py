@@ -0,0 +1,92 @@
+"""
+Measure the rate readings are received through the broker
+and SensorStream when sent in batches of different sizes.
+
+Publisher and stream run in this one process, so the CPU
+time includes publishing as well as receiving.
+
+    python -m benchmarks.bench_batch_ingest [readings per batch size]
+"""
+
+import asyncio
+import json
+import sys
+import time
+from typing import Dict, List
+
+from hbmqtt.client import QOS_1, MQTTClient
+
+from bacprop.mqtt import SensorStream
+
+BATCH_SIZES = [1, 10, 100, 1000]
+
+
+def make_batch(start: int, size: int) -> bytes:
+    return "\n".join(
+        json.dumps({"sensorId": i, "temp": 21.5, "humidity": 40.0, "co2": 480})
+        for i in range(start, start + size)
+    ).encode()
+
+
+async def measure(
+    stream: SensorStream, publisher: MQTTClient, readings: int, batch_size: int
+) -> Dict[str, float]:
+    batches = [
+        make_batch(start, min(batch_size, readings - start))
+        for start in range(0, readings, batch_size)
+    ]
+
+    async def receive() -> None:
+        received = 0
+        async for _ in stream.read():
+            received += 1
+            if received == readings:
+                return
+
+    start = time.perf_counter()
+    start_cpu = time.process_time()
+
+    receiver = asyncio.ensure_future(receive())
+    for batch in batches:
+        await publisher.publish(SensorStream.BATCH_TOPIC, batch, QOS_1)
+    await receiver
+
+    elapsed = time.perf_counter() - start
+    cpu = time.process_time() - start_cpu
+
+    return {
+        "batch_size": batch_size,
+        "messages_per_second": len(batches) / elapsed,
+        "readings_per_second": readings / elapsed,
+        "cpu_us_per_reading": cpu / readings * 1e6,
+    }
+
+
+async def run(readings: int) -> List[Dict[str, float]]:
+    stream = SensorStream()
+    await stream.start()
+
+    publisher = MQTTClient()
+    await publisher.connect("mqtt://localhost")
+
+    results = [
+        await measure(stream, publisher, readings, batch_size)
+        for batch_size in BATCH_SIZES
+    ]
+
+    await publisher.disconnect()
+    await stream.stop()
+
+    return results
+
+
+def main() -> None:
+    readings = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+
+    results = asyncio.get_event_loop().run_until_complete(run(readings))
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,193 @@
+"""
+Compare the BACnet packets per minute of a client polling every sensor
+value against a client subscribed to their changes of value.
+
+Sensors publish a random walk of their values every `UPDATE_INTERVAL`
+seconds of simulated time. The polling client reads every value of
+every sensor with ReadPropertyMultiple every `POLL_INTERVAL` seconds,
+and the subscribed client renews its subscriptions once per
+`LIFETIME`, which is included in its packet rate.
+
+    python -m benchmarks.bench_cov_polling [sensor count]
+"""
+
+import json
+import random
+import sys
+from typing import Any, Dict, List
+from unittest import mock
+
+from bacpypes import core
+from bacpypes.apdu import (
+    PropertyReference,
+    ReadAccessSpecification,
+    ReadPropertyMultipleRequest,
+    SubscribeCOVRequest,
+)
+from bacpypes.local.device import LocalDeviceObject
+from bacpypes.pdu import Address
+
+from bacprop.bacnet.network import VirtualSensorNetwork
+from bacprop.bacnet.sensor import BaseSensor, _VLANApplication
+
+# key -> (start, random walk step, cov increment)
+KEYS = {"temp": (21.0, 0.1, 0.5), "humidity": (40.0, 0.3, 2.0), "co2": (480.0, 5, 25)}
+
+UPDATE_INTERVAL = 10
+POLL_INTERVAL = 30
+LIFETIME = 300
+MINUTES = 10
+
+
+class _Client(_VLANApplication):
+    def confirmation(self, apdu: Any) -> None:
+        pass
+
+    def indication(self, apdu: Any) -> None:
+        pass
+
+
+def run_tasks() -> None:
+    core.run_once()
+
+    while core.deferredFns:
+        core.run_once()
+
+
+def make_network(count: int) -> Any:
+    with mock.patch("bacprop.bacnet.network._VLANRouter"):
+        network = VirtualSensorNetwork(
+            "0.0.0.0", cov_increments={key: cov for key, (_, _, cov) in KEYS.items()}
+        )
+    network.remove_node(network.nodes[0])
+
+    client = _Client(
+        LocalDeviceObject(
+            objectName="client",
+            objectIdentifier=("device", 999999),
+            vendorIdentifier=15,
+        ),
+        Address((0xFFFFFF).to_bytes(4, "big")),
+    )
+    network.add_node(client.get_node())
+
+    values: Dict[int, Dict[str, float]] = {}
+    for sensor_id in range(count):
+        values[sensor_id] = {key: start for key, (start, _, _) in KEYS.items()}
+        network.create_sensor(sensor_id).set_values(values[sensor_id])
+
+    # Count every packet sent on the network
+    packets = [0]
+    process_pdu = network.process_pdu
+
+    def counting_process_pdu(pdu: Any) -> None:
+        packets[0] += 1
+        process_pdu(pdu)
+
+    network.process_pdu = counting_process_pdu  # type: ignore
+
+    return network, client, values, packets
+
+
+def update_sensors(
+    network: VirtualSensorNetwork, values: Dict[int, Dict[str, float]]
+) -> None:
+    for sensor_id, sensor_values in values.items():
+        for key, (_, step, _) in KEYS.items():
+            sensor_values[key] += random.gauss(0, step)
+
+        sensor = network.get_sensor(sensor_id)
+        assert sensor
+        sensor.set_values(sensor_values)
+
+    run_tasks()
+
+
+def poll(client: _Client, sensors: List[BaseSensor]) -> None:
+    for sensor in sensors:
+        request = ReadPropertyMultipleRequest(
+            listOfReadAccessSpecs=[
+                ReadAccessSpecification(
+                    objectIdentifier=("analogValue", index),
+                    listOfPropertyReferences=[
+                        PropertyReference(propertyIdentifier="presentValue"),
+                        PropertyReference(propertyIdentifier="statusFlags"),
+                    ],
+                )
+                for index in range(len(KEYS))
+            ],
+            destination=sensor.get_address(),
+        )
+        client.request(request)
+
+    run_tasks()
+
+
+def subscribe(client: _Client, sensors: List[BaseSensor], confirmed: bool) -> None:
+    for sensor in sensors:
+        for index in range(len(KEYS)):
+            client.request(
+                SubscribeCOVRequest(
+                    subscriberProcessIdentifier=1,
+                    monitoredObjectIdentifier=("analogValue", index),
+                    issueConfirmedNotifications=confirmed,
+                    lifetime=LIFETIME,
+                    destination=sensor.get_address(),
+                )
+            )
+
+    run_tasks()
+
+
+def measure_polling(count: int) -> float:
+    random.seed(1)
+    network, client, values, packets = make_network(count)
+    sensors = list(network.get_sensors().values())
+
+    for second in range(0, MINUTES * 60, UPDATE_INTERVAL):
+        update_sensors(network, values)
+
+        if second % POLL_INTERVAL == 0:
+            poll(client, sensors)
+
+    return packets[0] / MINUTES
+
+
+def measure_cov(count: int, confirmed: bool) -> float:
+    random.seed(1)
+    network, client, values, packets = make_network(count)
+    sensors = list(network.get_sensors().values())
+
+    for second in range(0, MINUTES * 60, UPDATE_INTERVAL):
+        # The first subscription counts as a renewal
+        if second % LIFETIME == 0:
+            subscribe(client, sensors, confirmed)
+
+        update_sensors(network, values)
+
+    return packets[0] / MINUTES
+
+
+def main() -> None:
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+
+    polling = measure_polling(count)
+    cov = measure_cov(count, False)
+    cov_confirmed = measure_cov(count, True)
+
+    results = {
+        "sensors": count,
+        "objects": count * len(KEYS),
+        "packets_per_minute": {
+            "polling": polling,
+            "cov_unconfirmed": cov,
+            "cov_confirmed": cov_confirmed,
+        },
+        "polling_to_cov": polling / cov,
+    }
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""
+Compare per message latency and CPU of reading sensor data
+through a loopback MQTT client subscribed to the embedded
+broker, against taking publishes straight from the broker.
+
+Messages are sent one at a time, each waiting until it has been
+read. Publisher and reader run in this one process, so the CPU
+time includes publishing.
+
+    python -m benchmarks.bench_ingest_path [message count]
+"""
+
+import asyncio
+import json
+import statistics
+import sys
+import time
+from typing import Any, Dict, List, Optional
+
+from hbmqtt.broker import Broker
+from hbmqtt.client import QOS_1, QOS_2, MQTTClient
+
+from bacprop.codec import PayloadDecoder
+from bacprop.mqtt import SensorStream
+
+PAYLOAD = json.dumps({"sensorId": 1, "temp": 21.5, "humidity": 40.0}).encode()
+
+
+class LoopbackReader:
+    """
+    How SensorStream used to read, through its own client
+    """
+
+    async def start(self) -> None:
+        self._broker = Broker(SensorStream.BROKER_CONFIG, asyncio.get_event_loop())
+        await self._broker.start()
+
+        self._client = MQTTClient()
+        await self._client.connect("mqtt://localhost")
+        await self._client.subscribe([("sensor/#", QOS_2)])
+
+        self._decoder = PayloadDecoder()
+
+    async def next(self) -> Optional[Dict[str, Any]]:
+        message = await self._client.deliver_message()
+        return self._decoder.decode(message.publish_packet.payload.data)
+
+    async def stop(self) -> None:
+        await self._client.disconnect()
+        await self._broker.shutdown()
+
+
+class DirectReader:
+    async def start(self) -> None:
+        self._stream = SensorStream()
+        await self._stream.start()
+        self._reader = self._stream.read().__aiter__()
+
+    async def next(self) -> Optional[Dict[str, Any]]:
+        _, data = await self._reader.__anext__()
+        return data
+
+    async def stop(self) -> None:
+        await self._stream.stop()
+
+
+async def measure(reader: Any, count: int) -> Dict[str, float]:
+    await reader.start()
+
+    publisher = MQTTClient()
+    await publisher.connect("mqtt://localhost")
+
+    latencies: List[float] = []
+    start_cpu = time.process_time()
+
+    for _ in range(count):
+        start = time.perf_counter()
+        await publisher.publish("sensor/1", PAYLOAD, QOS_1)
+        await reader.next()
+        latencies.append(time.perf_counter() - start)
+
+    cpu = time.process_time() - start_cpu
+
+    await publisher.disconnect()
+    await reader.stop()
+
+    latencies.sort()
+    return {
+        "messages": count,
+        "latency_ms_median": statistics.median(latencies) * 1000,
+        "latency_ms_p99": latencies[int(len(latencies) * 0.99)] * 1000,
+        "cpu_us_per_message": cpu / count * 1e6,
+    }
+
+
+async def run(count: int) -> Dict[str, Dict[str, float]]:
+    return {
+        "loopback_client": await measure(LoopbackReader(), count),
+        "direct": await measure(DirectReader(), count),
+    }
+
+
+def main() -> None:
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+
+    results = asyncio.get_event_loop().run_until_complete(run(count))
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
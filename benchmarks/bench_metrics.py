@@ -0,0 +1,63 @@
+"""
+Measure the cost of updating the metrics, which are always on, and
+of scraping them.
+
+    python -m benchmarks.bench_metrics [iterations]
+"""
+
+import json
+import sys
+import time
+from typing import Any, Callable, Dict
+
+from bacprop.metrics import Counter, Histogram, Registry
+
+
+def per_call_ns(function: Callable[[], None], iterations: int) -> float:
+    start = time.perf_counter()
+    for _ in range(iterations):
+        function()
+
+    return (time.perf_counter() - start) / iterations * 1e9
+
+
+def main() -> None:
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    registry = Registry()
+
+    counter = registry.register(Counter("counter_total", "Counter"))
+    labelled = registry.register(Counter("labelled_total", "Counter", ["reason"]))
+    histogram = registry.register(Histogram("histogram_seconds", "Histogram"))
+    services = registry.register(
+        Histogram("services_seconds", "Histogram", ["service"])
+    )
+
+    def timed() -> None:
+        start = time.perf_counter()
+        histogram.observe(time.perf_counter() - start)
+
+    results: Dict[str, Any] = {
+        "empty_loop_ns": per_call_ns(lambda: None, iterations),
+        "counter_inc_ns": per_call_ns(counter.inc, iterations),
+        "labelled_counter_inc_ns": per_call_ns(
+            lambda: labelled.inc("non_number_value"), iterations
+        ),
+        "histogram_observe_ns": per_call_ns(
+            lambda: histogram.observe(0.0003), iterations
+        ),
+        "timed_observe_ns": per_call_ns(timed, iterations),
+    }
+
+    for i in range(20):
+        services.observe(0.001, f"Service{i}")
+
+    start = time.perf_counter()
+    scrape = registry.render()
+    results["render_ms"] = (time.perf_counter() - start) * 1000
+    results["render_bytes"] = len(scrape)
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,441 @@
+"""
+Drive a BacPropagator with synthetic sensors publishing to its
+embedded broker, and report the sustained ingest rate, the latency
+from publishing to the values being handed to the bacnet thread,
+and the CPU and memory used by the service.
+
+The service runs in this process, with the publishers on a thread
+of their own, or in a subprocess. The results are written as JSON.
+
+    python -m benchmarks.bench_mqtt_ingest [--mode inprocess|subprocess]
+        [--sensors N] [--keys N] [--rate MSGS_PER_S] [--duration S]
+        [--churn RATIO] [--invalid RATIO] [--output PATH]
+
+Publishing happens on one thread, so the highest rate it can offer
+is limited, and a rate of 0 publishes as fast as it can.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import signal
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from threading import Thread
+from typing import Any, Dict, List, Optional, Tuple
+
+from hbmqtt.client import QOS_0, QOS_1, MQTTClient
+
+from bacprop.buffer import Update, UpdateBuffer
+from bacprop.mqtt import SensorStream
+from bacprop.service import BacPropagator
+
+# Time the reading was published, in seconds since the epoch
+SENT_KEY = "sentAt"
+# Time to wait for the service to read everything published
+DRAIN_TIMEOUT = 30.0
+
+
+class RecordingBuffer(UpdateBuffer):
+    """
+    Records how long ago the updates were published when they are
+    taken to be applied to the sensors, on the bacnet thread
+    """
+
+    def __init__(self) -> None:
+        UpdateBuffer.__init__(self)
+        self.latencies: List[float] = []
+
+    def take(self) -> Dict[int, Update]:
+        pending = UpdateBuffer.take(self)
+        now = time.time()
+
+        for _, values in pending.values():
+            sent = values.get(SENT_KEY)
+            if sent is not None:
+                self.latencies.append(now - sent)
+
+        return pending
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return int(sock.getsockname()[1])
+
+
+def process_usage(pid: int) -> Tuple[float, int, int]:
+    """
+    CPU seconds, RSS and peak RSS in kB of a process, from /proc
+    """
+    with open(f"/proc/{pid}/stat") as stat_file:
+        # The fields after the command, which may contain spaces
+        fields = stat_file.read().rsplit(")", 1)[1].split()
+
+    cpu = (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+    memory: Dict[str, int] = {}
+    with open(f"/proc/{pid}/status") as status_file:
+        for line in status_file:
+            name, _, value = line.partition(":")
+            if name in ("VmRSS", "VmHWM"):
+                memory[name] = int(value.split()[0])
+
+    return cpu, memory["VmRSS"], memory["VmHWM"]
+
+
+def make_service(
+    mqtt_port: int, metrics_port: int
+) -> Tuple[BacPropagator, SensorStream]:
+    stream = SensorStream(mqtt_port)
+    service = BacPropagator(stream=stream, announce_rate=0, metrics_port=metrics_port)
+    service._updates = RecordingBuffer()
+
+    return service, stream
+
+
+def stop_service(stream: SensorStream) -> None:
+    # Ends the main loop of the service, which then shuts down
+    asyncio.ensure_future(stream.stop())
+
+
+class Publishers:
+    """
+    Sensors publishing readings at a fixed total rate, some of them
+    with a new set of keys, and some of them invalid
+    """
+
+    def __init__(self, args: argparse.Namespace) -> None:
+        self._args = args
+        self._random = random.Random(args.seed)
+        # The key set of each sensor, changed by churn
+        self._generations = [0] * args.sensors
+
+        self.published = 0
+        self.invalid = 0
+        self.churned = 0
+        self._clients: List[MQTTClient] = []
+
+    def _payload(self, sensor_id: int) -> bytes:
+        if self._random.random() < self._args.invalid:
+            self.invalid += 1
+
+            return self._random.choice(
+                [
+                    b"{not json",
+                    json.dumps({"temp": 21.5}).encode(),
+                    json.dumps({"sensorId": sensor_id, "temp": "warm"}).encode(),
+                ]
+            )
+
+        if self._random.random() < self._args.churn:
+            self.churned += 1
+            self._generations[sensor_id] += 1
+
+        generation = self._generations[sensor_id]
+        data: Dict[str, Any] = {
+            f"key{generation}_{i}": self._random.uniform(0, 100)
+            for i in range(self._args.keys)
+        }
+        data["sensorId"] = sensor_id
+        data[SENT_KEY] = time.time()
+
+        return json.dumps(data).encode()
+
+    async def _publish(self, client: MQTTClient, first: int, deadline: float) -> None:
+        interval = self._args.clients / self._args.rate if self._args.rate else 0.0
+        qos = QOS_1 if self._args.qos else QOS_0
+        next_time = time.perf_counter()
+        sensor_id = first
+
+        while time.perf_counter() < deadline:
+            await client.publish(f"sensor/{sensor_id}", self._payload(sensor_id), qos)
+            self.published += 1
+
+            sensor_id = (sensor_id + self._args.clients) % self._args.sensors
+            next_time += interval
+
+            # Publish late messages straight away, to keep up the rate
+            delay = next_time - time.perf_counter()
+            await asyncio.sleep(max(delay, 0))
+
+    async def connect(self, mqtt_port: int) -> None:
+        self._clients = [MQTTClient() for _ in range(self._args.clients)]
+
+        for client in self._clients:
+            await client.connect(f"mqtt://127.0.0.1:{mqtt_port}")
+
+    async def run(self) -> None:
+        deadline = time.perf_counter() + self._args.duration
+
+        await asyncio.gather(
+            *(
+                self._publish(client, i, deadline)
+                for i, client in enumerate(self._clients)
+            )
+        )
+
+    async def disconnect(self) -> None:
+        for client in self._clients:
+            await client.disconnect()
+
+
+async def scrape(metrics_port: int) -> Dict[str, float]:
+    """
+    Totals of the metrics of the service, summed over their labels
+    """
+    reader, writer = await asyncio.open_connection("127.0.0.1", metrics_port)
+    writer.write(b"GET /metrics HTTP/1.0\r\n\r\n")
+    response = await reader.read()
+    writer.close()
+
+    totals: Dict[str, float] = {}
+    for line in response.decode().partition("\r\n\r\n")[2].splitlines():
+        if line and not line.startswith("#"):
+            sample, value = line.rsplit(" ", 1)
+            name = sample.split("{")[0]
+            totals[name] = totals.get(name, 0.0) + float(value)
+
+    return totals
+
+
+async def wait_for_service(metrics_port: int) -> None:
+    deadline = time.perf_counter() + DRAIN_TIMEOUT
+
+    while True:
+        try:
+            await scrape(metrics_port)
+            return
+        except OSError:
+            if time.perf_counter() > deadline:
+                raise
+
+            await asyncio.sleep(0.1)
+
+
+async def drive(
+    args: argparse.Namespace, pid: int, mqtt_port: int, metrics_port: int
+) -> Dict[str, Any]:
+    """
+    Publish to the service and wait for it to read everything,
+    measuring the process it runs in
+    """
+    await wait_for_service(metrics_port)
+
+    publishers = Publishers(args)
+    await publishers.connect(mqtt_port)
+
+    start_metrics = await scrape(metrics_port)
+    start_cpu, _, _ = process_usage(pid)
+    start_driver_cpu = time.thread_time()
+    start = time.perf_counter()
+
+    await publishers.run()
+    publish_seconds = time.perf_counter() - start
+
+    deadline = time.perf_counter() + DRAIN_TIMEOUT
+    while True:
+        metrics = await scrape(metrics_port)
+        received = metrics["bacprop_publishes_received_total"] - start_metrics.get(
+            "bacprop_publishes_received_total", 0.0
+        )
+
+        if received >= publishers.published and not metrics.get(
+            "bacprop_stream_queue_depth"
+        ):
+            break
+
+        if time.perf_counter() > deadline:
+            raise TimeoutError(f"Only {received} of {publishers.published} read")
+
+        await asyncio.sleep(0.01)
+
+    elapsed = time.perf_counter() - start
+    await publishers.disconnect()
+    # Let the last updates be applied
+    await asyncio.sleep(BacPropagator.FLUSH_INTERVAL * 3)
+
+    cpu, rss, max_rss = process_usage(pid)
+    cpu -= start_cpu
+
+    # Publishing and scraping in the same process isn't the service's CPU
+    if pid == os.getpid():
+        cpu -= time.thread_time() - start_driver_cpu
+
+    def delta(name: str) -> float:
+        return metrics.get(name, 0.0) - start_metrics.get(name, 0.0)
+
+    return {
+        "published": publishers.published,
+        "published_invalid": publishers.invalid,
+        "published_churned": publishers.churned,
+        "publish_seconds": publish_seconds,
+        "offered_messages_per_second": publishers.published / publish_seconds,
+        "readings": delta("bacprop_readings_total"),
+        "reading_failures": delta("bacprop_reading_failures_total"),
+        "elapsed_seconds": elapsed,
+        "messages_per_second": publishers.published / elapsed,
+        "cpu_seconds": cpu,
+        "cpu_percent": cpu / elapsed * 100,
+        "rss_kb": rss,
+        "max_rss_kb": max_rss,
+    }
+
+
+def latency_summary(latencies: List[float]) -> Dict[str, Optional[float]]:
+    if not latencies:
+        return {"samples": 0, "p50": None, "p90": None, "p99": None, "max": None}
+
+    latencies = sorted(latencies)
+
+    def percentile(ratio: float) -> float:
+        return latencies[min(int(len(latencies) * ratio), len(latencies) - 1)] * 1000
+
+    return {
+        "samples": len(latencies),
+        "mean": statistics.mean(latencies) * 1000,
+        "p50": percentile(0.5),
+        "p90": percentile(0.9),
+        "p99": percentile(0.99),
+        "max": latencies[-1] * 1000,
+    }
+
+
+def run_in_process(args: argparse.Namespace) -> Dict[str, Any]:
+    mqtt_port = free_port()
+    metrics_port = free_port()
+    service, stream = make_service(mqtt_port, metrics_port)
+    service_loop = asyncio.get_event_loop()
+    results: Dict[str, Any] = {}
+
+    def driver() -> None:
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+
+        try:
+            results.update(
+                loop.run_until_complete(
+                    drive(args, os.getpid(), mqtt_port, metrics_port)
+                )
+            )
+        finally:
+            service_loop.call_soon_threadsafe(stop_service, stream)
+            loop.close()
+
+    driver_thread = Thread(target=driver, name="publishers")
+    driver_thread.start()
+    service.start()
+    driver_thread.join()
+
+    latencies = service._updates.latencies  # type: ignore
+    results["latency_ms"] = latency_summary(latencies)
+    return results
+
+
+def run_subprocess(args: argparse.Namespace) -> Dict[str, Any]:
+    mqtt_port = free_port()
+    metrics_port = free_port()
+    latency_path = os.path.join(tempfile.mkdtemp(), "latencies.json")
+
+    process = subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "benchmarks.bench_mqtt_ingest",
+            "--serve",
+            str(mqtt_port),
+            str(metrics_port),
+            latency_path,
+        ]
+    )
+
+    try:
+        results = asyncio.get_event_loop().run_until_complete(
+            drive(args, process.pid, mqtt_port, metrics_port)
+        )
+    finally:
+        process.send_signal(signal.SIGTERM)
+        process.wait()
+
+    with open(latency_path) as latency_file:
+        results["latency_ms"] = latency_summary(json.load(latency_file))
+
+    return results
+
+
+def serve(mqtt_port: int, metrics_port: int, latency_path: str) -> None:
+    """
+    Run the service for `run_subprocess`, until terminated
+    """
+    service, stream = make_service(mqtt_port, metrics_port)
+    asyncio.get_event_loop().add_signal_handler(signal.SIGTERM, stop_service, stream)
+
+    service.start()
+
+    with open(latency_path, "w") as latency_file:
+        json.dump(service._updates.latencies, latency_file)  # type: ignore
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--mode", choices=["inprocess", "subprocess"], default="inprocess"
+    )
+    parser.add_argument("--sensors", type=int, default=1000)
+    parser.add_argument("--keys", type=int, default=4, help="values per sensor")
+    parser.add_argument(
+        "--rate", type=float, default=500, help="total messages per second, 0 for max"
+    )
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument(
+        "--churn", type=float, default=0.0, help="ratio of messages with new keys"
+    )
+    parser.add_argument(
+        "--invalid", type=float, default=0.0, help="ratio of invalid messages"
+    )
+    parser.add_argument("--clients", type=int, default=4, help="MQTT connections")
+    parser.add_argument("--qos", type=int, choices=[0, 1], default=1)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--label", default="", help="recorded with the results")
+    parser.add_argument("--output", help="file to write the results to")
+
+    return parser.parse_args()
+
+
+def main() -> None:
+    if sys.argv[1:2] == ["--serve"]:
+        serve(int(sys.argv[2]), int(sys.argv[3]), sys.argv[4])
+        return
+
+    args = parse_args()
+    run = run_in_process if args.mode == "inprocess" else run_subprocess
+
+    results = {
+        "benchmark": "mqtt_ingest",
+        "label": args.label,
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": sys.version.split()[0],
+        "config": {
+            name: value
+            for name, value in vars(args).items()
+            if name not in ("label", "output")
+        },
+        "results": run(args),
+    }
+    output = json.dumps(results, indent=2)
+
+    if args.output:
+        with open(args.output, "w") as output_file:
+            output_file.write(output + "\n")
+
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
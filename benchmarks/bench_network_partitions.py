@@ -0,0 +1,108 @@
+"""
+Measure the cost of a broadcast on one of the virtual networks, with
+the same sensors partitioned across more and more networks: a Who-Is
+for every device, until every I-Am has been received, and a Who-Has,
+which is delivered to every node of the network.
+
+    python -m benchmarks.bench_network_partitions [sensor count] [networks...]
+"""
+
+import json
+import statistics
+import sys
+import time
+from typing import Any, Dict, List
+from unittest import mock
+
+from bacpypes import core
+from bacpypes.apdu import WhoHasObject, WhoHasRequest
+from bacpypes.local.device import LocalDeviceObject
+from bacpypes.pdu import Address, LocalBroadcast
+from bacpypes.task import TaskManager
+
+from bacprop.bacnet.network import VirtualSensorNetwork
+from bacprop.bacnet.sensor import _VLANApplication
+
+VALUES = {"temp": 21.5, "humidity": 40.0, "co2": 480.0}
+REPEATS = 5
+
+
+class _Client(_VLANApplication):
+    def __init__(self) -> None:
+        _VLANApplication.__init__(
+            self,
+            LocalDeviceObject(
+                objectName="client",
+                objectIdentifier=("device", 4000000),
+                vendorIdentifier=15,
+            ),
+            Address((0xFFFFFF).to_bytes(4, "big")),
+        )
+        self.received = 0
+
+    def indication(self, apdu: Any) -> None:
+        self.received += 1
+
+
+def run_tasks() -> None:
+    core.run_once()
+
+    while core.deferredFns:
+        core.run_once()
+
+
+def median_ms(client: _Client, send: Any) -> Dict[str, Any]:
+    latencies: List[float] = []
+
+    for _ in range(REPEATS):
+        client.received = 0
+
+        start = time.perf_counter()
+        send()
+        run_tasks()
+        latencies.append(time.perf_counter() - start)
+
+    return {
+        "responses": client.received,
+        "latency_ms": statistics.median(latencies) * 1000,
+    }
+
+
+def measure(count: int, networks: int) -> Dict[str, Any]:
+    TaskManager()
+
+    with mock.patch("bacprop.bacnet.network._VLANRouter"):
+        network = VirtualSensorNetwork("0.0.0.0", announce_rate=0, networks=networks)
+
+    # The router nodes aren't bound to a router
+    for segment in network.get_segments():
+        segment.remove_node(segment.nodes[0])
+
+    client = _Client()
+    network.add_node(client.get_node())
+
+    for sensor_id in range(count):
+        network.create_sensor(sensor_id).set_values(VALUES)
+
+    who_has = WhoHasRequest(object=WhoHasObject(objectName="temp"))
+    who_has.pduDestination = LocalBroadcast()
+
+    return {
+        "nodes": len(network.nodes),
+        "who_is": median_ms(
+            client, lambda: client.who_is(None, None, LocalBroadcast())
+        ),
+        "who_has": median_ms(client, lambda: client.request(who_has)),
+    }
+
+
+def main() -> None:
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    partitions = [int(arg) for arg in sys.argv[2:]] or [1, 2, 4, 8, 16]
+
+    results = {str(networks): measure(count, networks) for networks in partitions}
+    print(json.dumps({"sensors": count, "networks": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
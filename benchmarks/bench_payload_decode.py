@@ -0,0 +1,63 @@
+"""
+Compare decoding JSON sensor payloads against the
+compact binary format.
+
+    python -m benchmarks.bench_payload_decode [payload count]
+"""
+
+import json
+import random
+import sys
+import time
+from typing import Dict, List, Union
+
+from bacprop.codec import PayloadDecoder, encode_keys, encode_values
+
+KEYS = ["temp", "humidity", "co2", "pressure", "light", "noise", "voc", "pm25"]
+SENSORS = 100
+
+
+def measure(payloads: List[bytes], decoder: PayloadDecoder) -> Dict[str, float]:
+    start = time.perf_counter()
+    for payload in payloads:
+        decoder.decode(payload)
+    elapsed = time.perf_counter() - start
+
+    return {
+        "payloads_per_second": len(payloads) / elapsed,
+        "bytes_per_payload": sum(map(len, payloads)) / len(payloads),
+    }
+
+
+def main() -> None:
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    rand = random.Random(0)
+
+    readings = [
+        (i % SENSORS, [round(rand.uniform(0, 1000), 1) for _ in KEYS])
+        for i in range(count)
+    ]
+
+    json_payloads = [
+        json.dumps({"sensorId": sensor_id, **dict(zip(KEYS, values))}).encode()
+        for sensor_id, values in readings
+    ]
+    binary_payloads = [
+        encode_values(sensor_id, enumerate(values)) for sensor_id, values in readings
+    ]
+
+    binary_decoder = PayloadDecoder()
+    for sensor_id in range(SENSORS):
+        binary_decoder.decode(encode_keys(sensor_id, KEYS))
+
+    results: Dict[str, Union[int, Dict[str, float]]] = {
+        "payloads": count,
+        "json": measure(json_payloads, PayloadDecoder()),
+        "binary": measure(binary_payloads, binary_decoder),
+    }
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
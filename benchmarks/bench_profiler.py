@@ -0,0 +1,99 @@
+"""
+Measure the cost of profiling a decode, validate and apply loop
+on this thread, against not profiling it, and how the samples are
+split between the stages. The samples not in a stage are
+mostly setting the values of the sensor.
+
+    python -m benchmarks.bench_profiler [seconds]
+"""
+
+import json
+import os
+import sys
+import tempfile
+import time
+from threading import current_thread
+from typing import Any, Dict
+from unittest import mock
+
+from bacpypes.task import TaskManager
+
+from bacprop.bacnet.network import VirtualSensorNetwork
+from bacprop.bacnet.sensor import BaseSensor
+from bacprop.codec import PayloadDecoder
+from bacprop.pipeline import ReadingValidator
+from bacprop.profiler import SamplingProfiler
+
+PAYLOAD = json.dumps(
+    {"sensorId": 1, "temp": 21.5, "humidity": 40.0, "co2": 480.0}
+).encode()
+STAGES = ["[decode]", "[validate]"]
+
+
+def make_network() -> VirtualSensorNetwork:
+    TaskManager()
+
+    with mock.patch("bacprop.bacnet.network._VLANRouter"):
+        return VirtualSensorNetwork("0.0.0.0", announce_rate=0)
+
+
+def readings_per_second(sensor: BaseSensor, seconds: float) -> float:
+    decoder = PayloadDecoder()
+    validator = ReadingValidator()
+    readings = 0
+    deadline = time.perf_counter() + seconds
+
+    while time.perf_counter() < deadline:
+        for data in decoder.decode_all(PAYLOAD):
+            reading = validator.validate(data, "sensor/1", [])  # type: ignore
+
+            if reading is not None:
+                sensor.set_values(reading[1])
+                readings += 1
+
+    return readings / seconds
+
+
+def main() -> None:
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 5.0
+    sensor = make_network().create_sensor(1)
+    profiler = SamplingProfiler()
+    path = os.path.join(tempfile.mkdtemp(), "bench.folded")
+
+    # Warm up
+    readings_per_second(sensor, 1.0)
+
+    results: Dict[str, Any] = {
+        "off_readings_per_s": readings_per_second(sensor, seconds)
+    }
+
+    profiler.start(seconds * 2, path, [current_thread()])
+    results["on_readings_per_s"] = readings_per_second(sensor, seconds)
+    profiler.stop()
+
+    results["on_overhead_percent"] = (
+        1 - results["on_readings_per_s"] / results["off_readings_per_s"]
+    ) * 100
+
+    samples = {stage: 0 for stage in STAGES}
+    total = 0
+
+    with open(path) as profile_file:
+        for line in profile_file:
+            stack, count = line.rsplit(" ", 1)
+            total += int(count)
+
+            for stage in STAGES:
+                if stage in stack.split(";"):
+                    samples[stage] += int(count)
+
+    results["samples"] = total
+    results["stage_percent"] = {
+        stage: count / total * 100 for stage, count in samples.items()
+    }
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,207 @@
+"""
+Measure a BMS reading the sensors with ReadPropertyMultiple: every
+property of each device and its value objects, their static
+properties, and their present values and status flags.
+
+Each read is measured from a client on the virtual network, which
+includes encoding the request and decoding the response, and on the
+server alone, handling the request and encoding its response.
+
+    python -m benchmarks.bench_read_cache [sensor count]
+"""
+
+import json
+import sys
+import time
+from typing import Any, Dict, List, Tuple
+from unittest import mock
+
+from bacpypes import core
+from bacpypes.apdu import (
+    APDU,
+    PropertyReference,
+    ReadAccessSpecification,
+    ReadPropertyMultipleACK,
+    ReadPropertyMultipleRequest,
+)
+from bacpypes.local.device import LocalDeviceObject
+from bacpypes.pdu import Address
+from bacpypes.task import TaskManager
+
+from bacprop.bacnet.network import VirtualSensorNetwork
+from bacprop.bacnet.sensor import BaseSensor, _VLANApplication
+
+VALUES = {"temp": 21.5, "humidity": 40.0, "co2": 480.0, "pm25": 3.0}
+
+# Properties read from the devices and from the value objects
+READS: Dict[str, Tuple[List[str], List[str]]] = {
+    "all": (["all"], ["all"]),
+    "static": (
+        ["objectName", "objectIdentifier", "objectList", "vendorIdentifier"],
+        ["objectName", "objectIdentifier", "objectType", "covIncrement"],
+    ),
+    "values": ([], ["presentValue", "statusFlags"]),
+}
+
+ROUNDS = 3
+
+
+class _Client(_VLANApplication):
+    def __init__(self) -> None:
+        _VLANApplication.__init__(
+            self,
+            LocalDeviceObject(
+                objectName="client",
+                objectIdentifier=("device", 999_999),
+                vendorIdentifier=15,
+            ),
+            Address((0xFFFFFF).to_bytes(4, "big")),
+        )
+        self.received: List[Any] = []
+
+    def confirmation(self, apdu: Any) -> None:
+        self.received.append(apdu)
+
+    def indication(self, apdu: Any) -> None:
+        pass
+
+
+def run_tasks() -> None:
+    core.run_once()
+
+    while core.deferredFns:
+        core.run_once()
+
+
+def make_network(mode: str, count: int) -> Any:
+    TaskManager()
+
+    with mock.patch("bacprop.bacnet.network._VLANRouter"):
+        network = VirtualSensorNetwork(
+            "0.0.0.0", shared_stack=mode == "shared", announce_rate=0
+        )
+    network.remove_node(network.nodes[0])
+
+    client = _Client()
+    network.add_node(client.get_node())
+
+    for sensor_id in range(count):
+        network.create_sensor(sensor_id).set_values(VALUES)
+
+    return network, client
+
+
+def make_request(
+    sensor: BaseSensor, device_properties: List[str], value_properties: List[str]
+) -> ReadPropertyMultipleRequest:
+    specs = [
+        ReadAccessSpecification(
+            objectIdentifier=("analogValue", index),
+            listOfPropertyReferences=[
+                PropertyReference(propertyIdentifier=identifier)
+                for identifier in value_properties
+            ],
+        )
+        for index in range(len(VALUES))
+    ]
+
+    if device_properties:
+        specs.insert(
+            0,
+            ReadAccessSpecification(
+                objectIdentifier=("device", sensor.get_id()),
+                listOfPropertyReferences=[
+                    PropertyReference(propertyIdentifier=identifier)
+                    for identifier in device_properties
+                ],
+            ),
+        )
+
+    return ReadPropertyMultipleRequest(
+        listOfReadAccessSpecs=specs, destination=sensor.get_address()
+    )
+
+
+def round_trip_ms(client: _Client, sensors: List[BaseSensor], read: str) -> float:
+    start = time.perf_counter()
+
+    for _ in range(ROUNDS):
+        for sensor in sensors:
+            client.request(make_request(sensor, *READS[read]))
+        run_tasks()
+
+    seconds = time.perf_counter() - start
+
+    responses = client.received[-len(sensors) :]
+    assert all(isinstance(apdu, ReadPropertyMultipleACK) for apdu in responses)
+
+    return seconds / (ROUNDS * len(sensors)) * 1000
+
+
+def server_us(
+    network: VirtualSensorNetwork, sensors: List[BaseSensor], read: str
+) -> float:
+    application = network._shared_app
+    responses: List[Any] = []
+    requests = []
+
+    for sensor in sensors:
+        request = make_request(sensor, *READS[read])
+        request.pduSource = Address(1)
+        request.apduInvokeID = 1
+        requests.append(request)
+
+    # Keep the responses instead of sending them
+    apps: List[Any] = [application] if application else sensors
+    for app in apps:
+        app.response = responses.append
+
+    start = time.perf_counter()
+
+    for _ in range(ROUNDS):
+        for sensor, request in zip(sensors, requests):
+            if application:
+                application._select(sensor)  # type: ignore
+                application.do_ReadPropertyMultipleRequest(request)
+            else:
+                sensor.do_ReadPropertyMultipleRequest(request)  # type: ignore
+
+            responses.pop().encode(APDU())
+
+    seconds = time.perf_counter() - start
+
+    if application:
+        application._select(None)
+
+    return seconds / (ROUNDS * len(sensors)) * 1e6
+
+
+def run(mode: str, count: int) -> Dict[str, Any]:
+    network, client = make_network(mode, count)
+    sensors = list(network.get_sensors().values())
+
+    # The first round encodes the properties for the cache
+    first_start = time.perf_counter()
+    for sensor in sensors:
+        client.request(make_request(sensor, *READS["all"]))
+    run_tasks()
+    first_ms = (time.perf_counter() - first_start) / count * 1000
+
+    results: Dict[str, Any] = {"first_all_round_trip_ms": first_ms}
+
+    for read in READS:
+        results[f"{read}_round_trip_ms"] = round_trip_ms(client, sensors, read)
+        results[f"{read}_server_us"] = server_us(network, sensors, read)
+
+    return results
+
+
+def main() -> None:
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+
+    results = {mode: run(mode, count) for mode in ("own", "shared")}
+    print(json.dumps({"sensors": count, "keys": len(VALUES), **results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
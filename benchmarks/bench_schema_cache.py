@@ -0,0 +1,78 @@
+"""
+Measure validating sensor data and applying it to a sensor when it
+has the same shape as the sensor's last data, which takes the fast
+path, and when the order or the set of its keys keeps changing, which
+takes the general path every time.
+
+    python -m benchmarks.bench_schema_cache [iterations]
+"""
+
+import json
+import sys
+import time
+from typing import Any, Callable, Dict, List
+from unittest import mock
+
+from bacpypes.pdu import Address
+
+from bacprop.bacnet.lazy import LazySensor
+from bacprop.bacnet.sensor import Sensor
+from bacprop.pipeline import ReadingValidator, ValidationWarning
+
+KEYS = ["temp", "humidity", "co2", "pm25", "voc", "pressure"]
+
+SHAPES: Dict[str, List[List[str]]] = {
+    "same": [KEYS],
+    "reordered": [KEYS, list(reversed(KEYS))],
+    "changed": [KEYS, KEYS[:-1]],
+}
+
+
+def per_call_us(function: Callable[[int], None], iterations: int) -> float:
+    start = time.perf_counter()
+    for i in range(iterations):
+        function(i)
+
+    return (time.perf_counter() - start) / iterations * 1e6
+
+
+def run(shapes: List[List[str]], iterations: int) -> Dict[str, Any]:
+    messages = [
+        dict({"sensorId": 5}, **{key: 20.5 + i for i, key in enumerate(keys)})
+        for keys in shapes
+    ]
+    validator = ReadingValidator()
+    warnings: List[ValidationWarning] = []
+    readings = [
+        validator.validate(message, "sensor/5", warnings) for message in messages
+    ]
+    values = [reading[1] for reading in readings if reading is not None]
+
+    def validate(i: int) -> None:
+        validator.validate(messages[i % len(messages)], "sensor/5", warnings)
+
+    sensor = Sensor(5, Address(0))
+    lazy_sensor = LazySensor(5, Address(0), mock.Mock())
+
+    def apply(i: int) -> None:
+        sensor.set_values(values[i % len(values)])
+
+    def apply_lazy(i: int) -> None:
+        lazy_sensor.set_values(values[i % len(values)])
+
+    return {
+        "validate_us": per_call_us(validate, iterations),
+        "set_values_us": per_call_us(apply, iterations),
+        "set_values_lazy_us": per_call_us(apply_lazy, iterations),
+    }
+
+
+def main() -> None:
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+
+    results = {name: run(shapes, iterations) for name, shapes in SHAPES.items()}
+    print(json.dumps({"keys": len(KEYS), **results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""
+Compare the memory used for, and the rate of creating, sensors which
+have their own application stack against sensors on a shared stack.
+
+    python -m benchmarks.bench_sensor_stack [sensor count]
+"""
+
+import gc
+import json
+import sys
+import time
+import tracemalloc
+from typing import Dict
+from unittest import mock
+
+from bacprop.bacnet.network import VirtualSensorNetwork
+
+VALUES = {"temp": 21.5, "humidity": 40.0, "co2": 480.0}
+
+
+def measure(shared_stack: bool, count: int) -> Dict[str, float]:
+    # The router binds a real socket, which isn't needed to create sensors
+    with mock.patch("bacprop.bacnet.network._VLANRouter"):
+        network = VirtualSensorNetwork("0.0.0.0", shared_stack=shared_stack)
+
+    gc.collect()
+    tracemalloc.start()
+    start_memory = tracemalloc.get_traced_memory()[0]
+
+    for sensor_id in range(count):
+        network.create_sensor(sensor_id).set_values(VALUES)
+
+    gc.collect()
+    used_memory = tracemalloc.get_traced_memory()[0] - start_memory
+    tracemalloc.stop()
+
+    # Creation rate without the tracemalloc overhead
+    with mock.patch("bacprop.bacnet.network._VLANRouter"):
+        network = VirtualSensorNetwork("0.0.0.0", shared_stack=shared_stack)
+
+    start = time.perf_counter()
+    for sensor_id in range(count):
+        network.create_sensor(sensor_id).set_values(VALUES)
+    elapsed = time.perf_counter() - start
+
+    return {
+        "sensors": count,
+        "bytes_per_sensor": used_memory / count,
+        "sensors_per_second": count / elapsed,
+    }
+
+
+def main() -> None:
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+
+    results = {"own_stack": measure(False, count), "shared_stack": measure(True, count)}
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""
+Measure a warm restart from a snapshot: loading the snapshot file,
+and restoring the sensors on a network, against creating the same
+sensors from their first updates.
+
+    python -m benchmarks.bench_snapshot_restore [sensor count...]
+"""
+
+import json
+import os
+import sys
+import tempfile
+import time
+from typing import Any, Dict
+from unittest import mock
+
+from bacpypes.task import TaskManager
+
+from bacprop.bacnet.network import VirtualSensorNetwork
+from bacprop.snapshot import SensorSnapshot, SnapshotWriter
+
+VALUES = {"temp": 21.5, "humidity": 40.0, "co2": 480.0}
+
+
+def make_network(shared_stack: bool) -> VirtualSensorNetwork:
+    TaskManager()
+
+    with mock.patch("bacprop.bacnet.network._VLANRouter"):
+        return VirtualSensorNetwork("0.0.0.0", shared_stack=shared_stack)
+
+
+def write_snapshot(path: str, count: int) -> float:
+    # Addresses after the router and shared application nodes
+    snapshots = [
+        SensorSnapshot(
+            sensor_id,
+            sensor_id + 3,
+            time.time(),
+            False,
+            False,
+            {
+                key: (instance, value)
+                for instance, (key, value) in enumerate(VALUES.items())
+            },
+        )
+        for sensor_id in range(count)
+    ]
+
+    start = time.perf_counter()
+    writer = SnapshotWriter(path)
+    writer.start()
+    writer.write(snapshots)
+    writer.close()
+
+    return time.perf_counter() - start
+
+
+def load_snapshot(path: str) -> float:
+    start = time.perf_counter()
+    SnapshotWriter(path).load()
+
+    return time.perf_counter() - start
+
+
+def measure(path: str, shared_stack: bool, count: int) -> Dict[str, Any]:
+    snapshots = SnapshotWriter(path).load()
+
+    network = make_network(shared_stack)
+    start = time.perf_counter()
+    network.restore_sensors(snapshots)
+    restore = time.perf_counter() - start
+
+    network = make_network(shared_stack)
+    start = time.perf_counter()
+    for sensor_id in range(count):
+        network.create_sensor(sensor_id).set_values(VALUES)
+    create = time.perf_counter() - start
+
+    return {"restore_s": restore, "cold_create_s": create}
+
+
+def main() -> None:
+    counts = [int(arg) for arg in sys.argv[1:]] or [10000]
+    results = {}
+
+    with tempfile.TemporaryDirectory() as directory:
+        for count in counts:
+            path = os.path.join(directory, f"snapshot-{count}")
+
+            write = write_snapshot(path, count)
+
+            # Before any networks have been made, like at startup
+            results[str(count)] = {
+                "file_bytes": os.path.getsize(path),
+                "write_s": write,
+                "load_s": load_snapshot(path),
+                "own_stack": measure(path, False, count),
+                "shared_stack": measure(path, True, count),
+            }
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""
+Measure updating the values of the sensors, which are kept in the
+value store, and reading the state of every sensor at once: counting
+the faulty sensors and exporting every value from the store, against
+walking the sensors and their objects.
+
+    python -m benchmarks.bench_value_store [sensor count]
+"""
+
+import json
+import sys
+import time
+from typing import Any, Dict
+from unittest import mock
+
+from bacpypes.task import TaskManager
+
+from bacprop.bacnet.network import VirtualSensorNetwork
+
+VALUES = {"temp": 21.5, "humidity": 40.0, "co2": 480.0, "pm25": 3.0}
+ROUNDS = 20
+READS = 100
+
+
+def make_network(mode: str) -> VirtualSensorNetwork:
+    TaskManager()
+
+    with mock.patch("bacprop.bacnet.network._VLANRouter"):
+        return VirtualSensorNetwork(
+            "0.0.0.0",
+            shared_stack=mode == "shared",
+            lazy_stacks=mode == "lazy",
+            announce_rate=0,
+        )
+
+
+def per_call(function: Any, iterations: int) -> float:
+    start = time.perf_counter()
+    for _ in range(iterations):
+        function()
+
+    return (time.perf_counter() - start) / iterations
+
+
+def run(mode: str, count: int) -> Dict[str, Any]:
+    network = make_network(mode)
+    sensors = [network.create_sensor(sensor_id) for sensor_id in range(count)]
+
+    for sensor in sensors:
+        sensor.set_values(VALUES)
+
+    start = time.perf_counter()
+    for i in range(ROUNDS):
+        values = dict(VALUES, temp=i + 0.5)
+        for sensor in sensors:
+            sensor.set_values(values)
+    set_values_seconds = time.perf_counter() - start
+
+    for sensor in sensors[::3]:
+        sensor.mark_fault()
+
+    store = network.get_store()
+    all_sensors = network.get_sensors()
+
+    def walk_faults() -> int:
+        return sum(1 for sensor in all_sensors.values() if sensor.has_fault())
+
+    def walk_values() -> Dict[int, Dict[str, float]]:
+        return {
+            sensor_id: {
+                key: _object.presentValue for key, _object in sensor._objects.items()
+            }
+            for sensor_id, sensor in all_sensors.items()
+        }
+
+    assert store.count_faults() == walk_faults()
+    assert store.export_values() == walk_values()
+
+    return {
+        "set_values_per_second": ROUNDS * count / set_values_seconds,
+        "count_faults_walk_us": per_call(walk_faults, READS) * 1e6,
+        "count_faults_store_us": per_call(store.count_faults, READS) * 1e6,
+        "export_walk_ms": per_call(walk_values, READS // 5) * 1000,
+        "export_store_ms": per_call(store.export_values, READS // 5) * 1000,
+    }
+
+
+def main() -> None:
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+
+    results = {mode: run(mode, count) for mode in ("own", "shared", "lazy")}
+    print(json.dumps({"sensors": count, "keys": len(VALUES), **results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
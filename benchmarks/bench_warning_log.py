@@ -0,0 +1,90 @@
+"""
+Measure the cost of the warnings about a broken sensor, which sends
+a string value in every message, when every warning is formatted and
+logged, against the rate limited log.
+
+    python -m benchmarks.bench_warning_log [messages]
+"""
+
+import io
+import json
+import logging
+import sys
+import time
+from typing import Any, Callable, Dict, List
+
+from bacprop.pipeline import ReadingValidator, ValidationWarning
+from bacprop.ratelog import RateLimitedLog
+
+MESSAGE = {"sensorId": 42, "temp": 21.5, "status": "on", "mode": "auto"}
+
+
+def make_logger(stream: io.StringIO) -> logging.Logger:
+    logger = logging.getLogger("benchmarks.bench_warning_log")
+    logger.propagate = False
+    logger.setLevel(logging.WARNING)
+    handler = logging.StreamHandler(stream)
+    handler.setFormatter(
+        logging.Formatter("%(asctime)s %(levelname)s %(name)s %(message)s")
+    )
+    logger.handlers = [handler]
+
+    return logger
+
+
+def run(
+    handle: Callable[[logging.Logger, List[ValidationWarning]], None], messages: int
+) -> Dict[str, Any]:
+    stream = io.StringIO()
+    logger = make_logger(stream)
+    validator = ReadingValidator()
+
+    start = time.perf_counter()
+    for _ in range(messages):
+        warnings: List[ValidationWarning] = []
+        validator.validate(MESSAGE, "sensor/42", warnings)
+        handle(logger, warnings)
+    seconds = time.perf_counter() - start
+
+    return {
+        "per_message_us": seconds / messages * 1e6,
+        "log_lines": stream.getvalue().count("\n"),
+    }
+
+
+def log_all(logger: logging.Logger, warnings: List[ValidationWarning]) -> None:
+    # How every warning was logged before they were rate limited
+    for warning in warnings:
+        logger.warning(f"Sensor data invalid: {warning.message}")
+
+
+def main() -> None:
+    messages = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    data_log = RateLimitedLog()
+
+    def log_limited(logger: logging.Logger, warnings: List[ValidationWarning]) -> None:
+        for warning in warnings:
+            data_log.log(
+                logger.warning,
+                warning.source,
+                warning.reason,
+                warning.key,
+                warning.template,
+                *warning.args,
+            )
+
+    def validate_only(
+        logger: logging.Logger, warnings: List[ValidationWarning]
+    ) -> None:
+        pass
+
+    results = {
+        "validate_only": run(validate_only, messages),
+        "log_all": run(log_all, messages),
+        "rate_limited": run(log_limited, messages),
+    }
+    print(json.dumps({"messages": messages, **results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+"""
+Measure the latency of a full range and a narrow range Who-Is, from
+being sent by a client until every I-Am has been received, with the
+device instance index and with the Who-Is broadcast to every sensor.
+
+    python -m benchmarks.bench_who_is [sensor count...]
+"""
+
+import json
+import statistics
+import sys
+import time
+from contextlib import ExitStack
+from typing import Any, Dict, List, Optional
+from unittest import mock
+
+from bacpypes import core
+from bacpypes.local.device import LocalDeviceObject
+from bacpypes.pdu import Address, LocalBroadcast
+from bacpypes.task import TaskManager
+
+from bacprop.bacnet.network import VirtualSensorNetwork
+from bacprop.bacnet.sensor import SharedSensorApplication, _VLANApplication
+
+VALUES = {"temp": 21.5, "humidity": 40.0, "co2": 480.0}
+NARROW_RANGE = 10
+REPEATS = 5
+
+
+class _Client(_VLANApplication):
+    def __init__(self, *args: Any) -> None:
+        _VLANApplication.__init__(self, *args)
+        self.received = 0
+
+    def indication(self, apdu: Any) -> None:
+        self.received += 1
+
+
+def run_tasks() -> None:
+    core.run_once()
+
+    while core.deferredFns:
+        core.run_once()
+
+
+def broadcast_to_all() -> ExitStack:
+    """
+    Patch the index out, so every sensor is handed the Who-Is
+    """
+
+    def all_sensors(self: SharedSensorApplication, apdu: Any) -> List[Any]:
+        return list(self._sensors.values())
+
+    patches = ExitStack()
+    patches.enter_context(
+        mock.patch("bacprop.bacnet.network.decode_request", return_value=None)
+    )
+    patches.enter_context(
+        mock.patch.object(SharedSensorApplication, "_who_is_sensors", all_sensors)
+    )
+
+    return patches
+
+
+def who_is(client: _Client, low: Optional[int], high: Optional[int]) -> Dict[str, Any]:
+    latencies = []
+
+    for _ in range(REPEATS):
+        client.received = 0
+
+        start = time.perf_counter()
+        client.who_is(low, high, LocalBroadcast())
+        run_tasks()
+        latencies.append(time.perf_counter() - start)
+
+    return {"i_ams": client.received, "latency_ms": statistics.median(latencies) * 1000}
+
+
+def measure(shared_stack: bool, count: int) -> Dict[str, Any]:
+    TaskManager()
+
+    with mock.patch("bacprop.bacnet.network._VLANRouter"):
+        network = VirtualSensorNetwork("0.0.0.0", shared_stack=shared_stack)
+    network.remove_node(network.nodes[0])
+
+    client = _Client(
+        LocalDeviceObject(
+            objectName="client",
+            objectIdentifier=("device", 4000000),
+            vendorIdentifier=15,
+        ),
+        Address((0xFFFFFF).to_bytes(4, "big")),
+    )
+    network.add_node(client.get_node())
+
+    for sensor_id in range(count):
+        network.create_sensor(sensor_id).set_values(VALUES)
+
+    low = count // 2
+    high = low + NARROW_RANGE - 1
+
+    results: Dict[str, Any] = {
+        "indexed": {
+            "full_range": who_is(client, None, None),
+            "narrow_range": who_is(client, low, high),
+        }
+    }
+
+    with broadcast_to_all():
+        results["broadcast"] = {
+            "full_range": who_is(client, None, None),
+            "narrow_range": who_is(client, low, high),
+        }
+
+    return results
+
+
+def main() -> None:
+    counts = [int(arg) for arg in sys.argv[1:]] or [1000, 10000]
+
+    results = {
+        str(count): {
+            "own_stack": measure(False, count),
+            "shared_stack": measure(True, count),
+        }
+        for count in counts
+    }
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""
+Soak test for sensor retirement: sensors with ever new ids send one
+update, go faulty and are retired, on a simulated clock, while the
+memory of the process and the size of the network are sampled.
+Both should stay flat once the first sensors are retired.
+
+    python -m benchmarks.soak_sensor_churn [churns] [lazy|own|shared]
+"""
+
+import gc
+import json
+import resource
+import sys
+import time
+from typing import Any, Dict, List
+from unittest import mock
+
+from bacpypes.task import TaskManager
+
+from bacprop.bacnet.network import VirtualSensorNetwork
+
+VALUES = {"temp": 21.5, "humidity": 40.0, "co2": 480.0}
+
+SENSOR_TIMEOUT = 10.0
+RETIRE_AFTER = 10.0
+# A new sensor every 20ms of simulated time, so about
+# (SENSOR_TIMEOUT + RETIRE_AFTER) / STEP = 1000 are live
+STEP = 0.02
+# Faults are checked every simulated second, like the service
+CHECK_EVERY = 50
+SAMPLES = 10
+
+
+def make_network(mode: str) -> VirtualSensorNetwork:
+    TaskManager()
+
+    with mock.patch("bacprop.bacnet.network._VLANRouter"):
+        network = VirtualSensorNetwork(
+            "0.0.0.0",
+            shared_stack=mode == "shared",
+            announce_rate=0,
+            lazy_stacks=mode == "lazy",
+            retire_after=RETIRE_AFTER,
+        )
+
+    network.get_fault_scheduler().set_default_timeout(SENSOR_TIMEOUT)
+    return network
+
+
+def sample(network: VirtualSensorNetwork, churns: int, retired: int) -> Dict[str, Any]:
+    # The stacks of retired sensors hold reference cycles
+    gc.collect()
+
+    return {
+        "churns": churns,
+        "retired": retired,
+        "live_sensors": len(network.get_sensors()),
+        "nodes": len(network.nodes),
+        "addresses_used": network._address_index - 1,
+        "gc_objects": len(gc.get_objects()),
+        "max_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }
+
+
+def soak(mode: str, churns: int) -> Dict[str, Any]:
+    network = make_network(mode)
+    now = 1000.0
+    retired = 0
+    samples: List[Dict[str, Any]] = []
+    sample_every = max(churns // SAMPLES, 1)
+
+    start = time.perf_counter()
+
+    with mock.patch("bacprop.bacnet.sensor.time.time", lambda: now):
+        for churn in range(1, churns + 1):
+            now += STEP
+            network.create_sensor(churn).set_values(VALUES)
+
+            if churn % CHECK_EVERY == 0:
+                for sensor in network.pop_outdated_sensors(now):
+                    sensor.mark_fault()
+
+                retired += len(network.retire_sensors(now))
+
+            if churn % sample_every == 0:
+                samples.append(sample(network, churn, retired))
+
+    return {"mode": mode, "seconds": time.perf_counter() - start, "samples": samples}
+
+
+def main() -> None:
+    churns = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    mode = sys.argv[2] if len(sys.argv) > 2 else "lazy"
+
+    print(json.dumps(soak(mode, churns), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,230 @@
+import asyncio
+import asyncore
+import socket
+from typing import Any, Iterator, List, Tuple
+
+import pytest
+from bacpypes import core
+from bacpypes.comm import Client, bind
+from bacpypes.core import deferred
+from bacpypes.pdu import PDU
+from bacpypes.task import FunctionTask, RecurringFunctionTask, TaskManager
+from bacpypes.udp import UDPDirector
+from pytest import fixture
+from pytest_mock import MockFixture
+
+from bacprop.bacnet import aiocore
+from bacprop.bacnet.aiocore import AsyncioCore
+
+# Required for full coverage
+aiocore._debug = 1
+
+
+class _Receiver(Client):
+    def __init__(self) -> None:
+        Client.__init__(self)
+        self.received: List[PDU] = []
+
+    def confirmation(self, pdu: PDU) -> None:
+        self.received.append(pdu)
+
+
+@fixture
+def task_manager(mocker: MockFixture) -> TaskManager:
+    # Only the tasks, functions and sockets of the test
+    task_manager = TaskManager()
+    mocker.patch.object(task_manager, "tasks", [])
+    mocker.patch.object(core, "deferredFns", [])
+    mocker.patch.dict(asyncore.socket_map, clear=True)
+
+    return task_manager
+
+
+@fixture
+def director(task_manager: TaskManager) -> Iterator[Tuple[UDPDirector, _Receiver]]:
+    director = UDPDirector(("127.0.0.1", 0))
+    receiver = _Receiver()
+    bind(receiver, director)
+
+    yield director, receiver
+
+    director.close_socket()
+
+
+async def wait_for(condition: Any, timeout: float = 1.0) -> None:
+    loop = asyncio.get_event_loop()
+    end = loop.time() + timeout
+
+    while not condition():
+        assert loop.time() < end
+        await asyncio.sleep(0.001)
+
+
+class TestAsyncioCore:
+    @pytest.mark.asyncio
+    async def test_start_stop(self, task_manager: TaskManager) -> None:
+        trigger = task_manager.trigger
+        # The trigger of the task manager isn't watched
+        asyncore.socket_map[trigger._fileno] = trigger
+
+        bacnet_core = AsyncioCore(asyncio.get_event_loop())
+        bacnet_core.start()
+
+        assert task_manager.trigger is bacnet_core
+        assert core.taskManager is task_manager
+        assert core.running
+        assert not bacnet_core._dispatchers
+
+        bacnet_core.stop()
+
+        assert task_manager.trigger is trigger
+        assert not core.running
+
+        # Stopping again does nothing
+        bacnet_core.stop()
+
+    @pytest.mark.asyncio
+    async def test_deferred(self, task_manager: TaskManager) -> None:
+        bacnet_core = AsyncioCore(asyncio.get_event_loop())
+        bacnet_core.start()
+        called: List[int] = []
+
+        def defer_more(value: int) -> None:
+            called.append(value)
+            deferred(called.append, value + 1)
+
+        deferred(defer_more, 1)
+        deferred(called.append, 3)
+        pumps = bacnet_core.pumps
+
+        await wait_for(lambda: len(called) == 3)
+
+        # Run within the same pump
+        assert called == [1, 3, 2]
+        assert bacnet_core.pumps == pumps + 1
+
+        bacnet_core.stop()
+
+    @pytest.mark.asyncio
+    async def test_tasks(self, task_manager: TaskManager) -> None:
+        bacnet_core = AsyncioCore(asyncio.get_event_loop())
+        bacnet_core.start()
+        called: List[str] = []
+
+        FunctionTask(called.append, "once").install_task(delta=0.02)
+        # Every 10ms
+        recurring = RecurringFunctionTask(10, called.append, "recurring")
+        recurring.install_task()
+
+        await wait_for(lambda: "once" in called and called.count("recurring") > 2)
+
+        # Woken again for the recurring task
+        assert bacnet_core._timer is not None
+
+        recurring.suspend_task()
+        bacnet_core.stop()
+        assert bacnet_core._timer is None
+
+    @pytest.mark.asyncio
+    async def test_errors(self, task_manager: TaskManager) -> None:
+        bacnet_core = AsyncioCore(asyncio.get_event_loop())
+        bacnet_core.start()
+        called: List[int] = []
+
+        def fail() -> None:
+            raise ValueError()
+
+        deferred(fail)
+        deferred(called.append, 1)
+
+        await wait_for(lambda: called)
+
+        bacnet_core.stop()
+
+    @pytest.mark.asyncio
+    async def test_stopped_pump(self, task_manager: TaskManager) -> None:
+        bacnet_core = AsyncioCore(asyncio.get_event_loop())
+        bacnet_core.start()
+        bacnet_core.stop()
+
+        deferred(lambda: None)
+        bacnet_core._pump()
+
+        assert bacnet_core._pump_handle is None
+        assert core.deferredFns
+
+    @pytest.mark.asyncio
+    async def test_read_write(self, director: Tuple[UDPDirector, _Receiver]) -> None:
+        udp_director, receiver = director
+        address = udp_director.socket.getsockname()
+
+        bacnet_core = AsyncioCore(asyncio.get_event_loop())
+        bacnet_core.start()
+
+        peer = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        peer.bind(("127.0.0.1", 0))
+        peer.setblocking(False)
+
+        peer.sendto(b"request", address)
+        await wait_for(lambda: receiver.received)
+
+        assert receiver.received[0].pduData == b"request"
+        assert receiver.received[0].pduSource == peer.getsockname()
+
+        # Responses are written once the pump has run
+        for data in (b"one", b"two"):
+            deferred(
+                receiver.request, PDU(data, destination=receiver.received[0].pduSource)
+            )
+
+        loop = asyncio.get_event_loop()
+        responses = [await loop.sock_recv(peer, 100) for _ in range(2)]
+
+        assert responses == [b"one", b"two"]
+        await wait_for(lambda: not bacnet_core._writing)
+
+        peer.close()
+        bacnet_core.stop()
+
+    @pytest.mark.asyncio
+    async def test_read_write_errors(
+        self, mocker: MockFixture, director: Tuple[UDPDirector, _Receiver]
+    ) -> None:
+        udp_director, _ = director
+        mocker.patch.object(udp_director, "handle_read_event", side_effect=OSError)
+        mocker.patch.object(udp_director, "handle_write_event", side_effect=OSError)
+        mocker.patch.object(udp_director, "writable", side_effect=[True, False])
+        handle_error = mocker.patch.object(udp_director, "handle_error")
+
+        bacnet_core = AsyncioCore(asyncio.get_event_loop())
+        bacnet_core.start()
+
+        peer = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        peer.sendto(b"request", udp_director.socket.getsockname())
+
+        await wait_for(lambda: handle_error.call_count >= 2)
+        assert not bacnet_core._writing
+
+        peer.close()
+        bacnet_core.stop()
+
+    @pytest.mark.asyncio
+    async def test_stop_writing(
+        self, mocker: MockFixture, director: Tuple[UDPDirector, _Receiver]
+    ) -> None:
+        udp_director, _ = director
+        mocker.patch.object(AsyncioCore, "WRITES_PER_PUMP", 3)
+        mocker.patch.object(udp_director, "writable", return_value=True)
+        handle_write = mocker.patch.object(udp_director, "handle_write_event")
+
+        bacnet_core = AsyncioCore(asyncio.get_event_loop())
+        bacnet_core.start()
+
+        await wait_for(lambda: bacnet_core._writing)
+
+        # A director which stays writable is left to the event loop
+        assert handle_write.call_count >= 3
+        bacnet_core.stop()
+
+        assert not bacnet_core._writing
+        assert not bacnet_core._dispatchers
@@ -0,0 +1,166 @@
+from typing import List
+
+from bacpypes.task import TaskManager
+from pytest_mock import MockFixture
+
+from bacprop.bacnet import announce
+from bacprop.bacnet.announce import AnnounceScheduler
+from bacprop.bacnet.sensor import Sensor
+from bacprop.metrics import ANNOUNCE_WAIT
+
+# Required for full coverage
+announce._debug = 1
+
+
+def make_sensor(
+    mocker: MockFixture, sensor_id: int, update_time: float, announced: List[int]
+) -> Sensor:
+    # Not autospecced, which is slow for the number of sensors needed
+    sensor = mocker.Mock(spec=Sensor)
+    sensor.get_id.return_value = sensor_id  # type: ignore
+    sensor.get_update_time.return_value = update_time  # type: ignore
+    sensor.announce.side_effect = lambda: announced.append(sensor_id)  # type: ignore
+    return sensor
+
+
+def set_time(mocker: MockFixture, now: float) -> None:
+    mocker.patch.object(TaskManager, "get_time", return_value=now)
+
+
+class TestAnnounceScheduler:
+    def test_most_recent_first(self, mocker: MockFixture) -> None:
+        set_time(mocker, 1000)
+        scheduler = AnnounceScheduler(100)
+        announced: List[int] = []
+
+        for sensor_id, update_time in ((1, 10), (2, 30), (3, 20)):
+            scheduler.schedule(make_sensor(mocker, sensor_id, update_time, announced))
+
+        assert scheduler.queue_depth == 3
+        assert scheduler.taskTime == 1000
+
+        scheduler.process_task()
+
+        assert announced == [2, 3, 1]
+        assert scheduler.queue_depth == 0
+        assert scheduler.announced == 3
+
+    def test_rate(self, mocker: MockFixture) -> None:
+        set_time(mocker, 1000)
+        scheduler = AnnounceScheduler(2)
+        announced: List[int] = []
+
+        for sensor_id in range(5):
+            scheduler.schedule(make_sensor(mocker, sensor_id, 0, announced))
+
+        # A full bucket holds one second
+        scheduler.process_task()
+        assert len(announced) == 2
+        assert scheduler.taskTime == 1000.5
+
+        set_time(mocker, 1000.5)
+        scheduler.process_task()
+        assert len(announced) == 3
+
+        set_time(mocker, 1002)
+        scheduler.process_task()
+        assert len(announced) == 5
+        assert scheduler.queue_depth == 0
+
+    def test_batch_interval(self, mocker: MockFixture) -> None:
+        set_time(mocker, 1000)
+        scheduler = AnnounceScheduler(100)
+        announced: List[int] = []
+
+        for sensor_id in range(150):
+            scheduler.schedule(make_sensor(mocker, sensor_id, 0, announced))
+
+        scheduler.process_task()
+
+        assert len(announced) == 100
+        assert scheduler.taskTime == 1000 + AnnounceScheduler.BATCH_INTERVAL
+
+    def test_touch(self, mocker: MockFixture) -> None:
+        set_time(mocker, 1000)
+        scheduler = AnnounceScheduler(100)
+        announced: List[int] = []
+
+        sensor1 = make_sensor(mocker, 1, 10, announced)
+        sensor2 = make_sensor(mocker, 2, 20, announced)
+        scheduler.schedule(sensor1)
+        scheduler.schedule(sensor2)
+
+        set_time(mocker, 1003)
+        sensor1.get_update_time.return_value = 30  # type: ignore
+        scheduler.touch(sensor1)
+
+        scheduler.process_task()
+
+        # The outdated entry is dropped
+        assert announced == [1, 2]
+        assert scheduler.max_wait == 3
+        assert scheduler.mean_wait == 3
+
+    def test_touch_compacts(self, mocker: MockFixture) -> None:
+        set_time(mocker, 1000)
+        scheduler = AnnounceScheduler(1)
+        announced: List[int] = []
+        sensors = [make_sensor(mocker, sensor_id, 0, announced) for sensor_id in (1, 2)]
+        for sensor in sensors:
+            scheduler.schedule(sensor)
+
+        for update_time in range(100):
+            for sensor in sensors:
+                sensor.get_update_time.return_value = update_time  # type: ignore
+                scheduler.touch(sensor)
+
+        # Bounded by the sensors waiting, not by their updates
+        assert len(scheduler._heap) <= 2 * scheduler.queue_depth + 1
+
+        scheduler.process_task()
+        set_time(mocker, 1001)
+        scheduler.process_task()
+
+        assert sorted(announced) == [1, 2]
+
+    def test_touch_not_queued(self, mocker: MockFixture) -> None:
+        scheduler = AnnounceScheduler()
+        sensor = make_sensor(mocker, 1, 10, [])
+
+        scheduler.touch(sensor)
+
+        assert scheduler.queue_depth == 0
+        assert not scheduler.isScheduled
+
+    def test_discard(self, mocker: MockFixture) -> None:
+        set_time(mocker, 1000)
+        scheduler = AnnounceScheduler(100)
+        announced: List[int] = []
+
+        for sensor_id in range(3):
+            sensor = make_sensor(mocker, sensor_id, 0, announced)
+            scheduler.schedule(sensor)
+        scheduler.discard(sensor)
+
+        scheduler.process_task()
+
+        assert announced == [0, 1]
+        assert scheduler.queue_depth == 0
+
+    def test_wait_histogram(self, mocker: MockFixture) -> None:
+        set_time(mocker, 1000)
+        scheduler = AnnounceScheduler(100)
+        scheduler.schedule(make_sensor(mocker, 1, 0, []))
+        waits = ANNOUNCE_WAIT.get_count()
+
+        set_time(mocker, 1002)
+        scheduler.process_task()
+
+        assert ANNOUNCE_WAIT.get_count() == waits + 1
+
+    def test_metrics(self) -> None:
+        scheduler = AnnounceScheduler()
+
+        assert scheduler.announced == 0
+        assert scheduler.mean_wait == 0
+        assert scheduler.max_wait == 0
@@ -0,0 +1,332 @@
+from typing import Any, Iterator, Optional
+
+import pytest
+from bacpypes.apdu import SimpleAckPDU, SubscribeCOVRequest
+from bacpypes.core import run_once
+from bacpypes.errors import ExecutionError
+from bacpypes.pdu import Address
+from bacpypes.task import TaskManager
+from pytest_mock import MockFixture
+
+from bacprop.bacnet import cov
+from bacprop.bacnet.cov import (
+    ActiveSubscriptionsProperty,
+    SensorSubscription,
+    SensorValueCriteria,
+    SubscriptionExpiry,
+)
+from bacprop.bacnet.sensor import Sensor
+
+# Required for full coverage
+cov._debug = 1
+
+CLIENT = Address(100)
+
+
+def subscribe(
+    sensor: Sensor,
+    instance: int,
+    lifetime: Optional[int] = 60,
+    confirmed: Optional[bool] = False,
+    object_type: str = "analogValue",
+) -> None:
+    request = SubscribeCOVRequest(
+        subscriberProcessIdentifier=1,
+        monitoredObjectIdentifier=(object_type, instance),
+        issueConfirmedNotifications=confirmed,
+        lifetime=lifetime,
+    )
+    request.pduSource = CLIENT
+
+    sensor.do_SubscribeCOVRequest(request)
+
+
+def get_subscription(sensor: Sensor, key: str) -> Any:
+    cov_detection = sensor.cov_detections[sensor.get_object_name(key)]
+    return next(iter(cov_detection.cov_subscriptions))
+
+
+def make_sensor(mocker: MockFixture) -> Sensor:
+    TaskManager()
+    sensor = Sensor(1, Address(1), cov_increments={"temp": 0.5})
+    mocker.patch.object(sensor, "response", autospec=True)
+    mocker.patch.object(sensor, "cov_notification", autospec=True)
+    sensor.set_values({"temp": 20, "co2": 400})
+
+    return sensor
+
+
+def run_tasks() -> None:
+    for _ in range(5):
+        run_once()
+
+
+@pytest.fixture(autouse=True)
+def flush_tasks(mocker: MockFixture) -> Iterator[None]:
+    yield
+
+    # Send anything left while the notifications are still mocked
+    run_tasks()
+
+
+class TestSensorValueCriteria:
+    def test_increment(self, mocker: MockFixture) -> None:
+        sensor = make_sensor(mocker)
+        criteria = SensorValueCriteria(sensor.get_object_name("temp"))
+
+        assert not criteria.present_value_filter(20, 20.4)
+        assert criteria.present_value_filter(20, 20.5)
+        assert criteria.present_value_filter(20, 19.5)
+
+    def test_no_increment(self, mocker: MockFixture) -> None:
+        sensor = make_sensor(mocker)
+        criteria = SensorValueCriteria(sensor.get_object_name("co2"))
+
+        assert not criteria.present_value_filter(400, 400)
+        assert criteria.present_value_filter(400, 401)
+
+    def test_from_last_report(self, mocker: MockFixture) -> None:
+        sensor = make_sensor(mocker)
+        criteria = SensorValueCriteria(sensor.get_object_name("temp"))
+        criteria.previous_reported_value = 21
+
+        assert not criteria.present_value_filter(20, 20.6)
+        assert criteria.present_value_filter(20, 20.5)
+
+    def test_removed_before_sending(self, mocker: MockFixture) -> None:
+        sensor = make_sensor(mocker)
+        subscribe(sensor, 1)
+        subscribe(sensor, 0)
+        subscription = get_subscription(sensor, "co2")
+
+        # Both notifications are still waiting to be sent
+        sensor.set_values({"co2": 400})
+        subscription.cancel_subscription()
+        run_tasks()
+
+        sensor.cov_notification.assert_not_called()  # type: ignore
+
+
+class TestSubscriptionExpiry:
+    def make_subscription(
+        self, mocker: MockFixture, expiry: SubscriptionExpiry, lifetime: int
+    ) -> SensorSubscription:
+        obj = mocker.MagicMock()
+        return SensorSubscription(
+            obj, CLIENT, 1, ("analogValue", 0), False, lifetime, expiry
+        )
+
+    def test_expire(self, mocker: MockFixture) -> None:
+        mocker.patch.object(TaskManager, "get_time", return_value=1000)
+        expiry = SubscriptionExpiry()
+
+        subscription = self.make_subscription(mocker, expiry, 60)
+        other = self.make_subscription(mocker, expiry, 120)
+
+        assert len(expiry) == 2
+        assert expiry.taskTime == 1060
+
+        TaskManager.get_time.return_value = 1060  # type: ignore
+        expiry.process_task()
+
+        assert subscription.obj_ref is None
+        other.obj_ref._app.cancel_subscription.assert_not_called()
+        assert len(expiry) == 1
+
+        # Next due is the remaining subscription
+        assert expiry.taskTime == 1120
+
+    def test_renew(self, mocker: MockFixture) -> None:
+        mocker.patch.object(TaskManager, "get_time", return_value=1000)
+        expiry = SubscriptionExpiry()
+        subscription = self.make_subscription(mocker, expiry, 60)
+        obj = subscription.obj_ref
+
+        subscription.renew_subscription(300)
+        assert subscription.lifetime == 300
+        assert len(expiry) == 1
+
+        TaskManager.get_time.return_value = 1060  # type: ignore
+        expiry.process_task()
+
+        # The stale entry is dropped
+        obj._app.cancel_subscription.assert_not_called()
+        assert len(expiry._heap) == 1
+
+        TaskManager.get_time.return_value = 1300  # type: ignore
+        expiry.process_task()
+
+        obj._app.cancel_subscription.assert_called_once_with(subscription)
+        assert not expiry._heap
+
+    def test_earlier_reinstalls(self, mocker: MockFixture) -> None:
+        mocker.patch.object(TaskManager, "get_time", return_value=1000)
+        expiry = SubscriptionExpiry()
+
+        self.make_subscription(mocker, expiry, 300)
+        assert expiry.taskTime == 1300
+
+        self.make_subscription(mocker, expiry, 60)
+        assert expiry.taskTime == 1060
+
+    def test_indefinite(self, mocker: MockFixture) -> None:
+        expiry = SubscriptionExpiry()
+        self.make_subscription(mocker, expiry, 0)
+
+        assert len(expiry) == 0
+        assert not expiry.isScheduled
+
+    def test_cancel(self, mocker: MockFixture) -> None:
+        expiry = SubscriptionExpiry()
+        subscription = self.make_subscription(mocker, expiry, 60)
+
+        subscription.cancel_subscription()
+
+        assert len(expiry) == 0
+        assert not subscription.isScheduled
+
+
+class TestSensorCOVServices:
+    def test_subscribe(self, mocker: MockFixture) -> None:
+        sensor = make_sensor(mocker)
+
+        subscribe(sensor, 1, confirmed=True)
+        run_tasks()
+
+        subscription = get_subscription(sensor, "temp")
+        assert subscription.confirmed
+        assert subscription.client_addr == CLIENT
+        assert len(sensor.subscription_expiry) == 1
+        assert isinstance(sensor.response.call_args[0][0], SimpleAckPDU)  # type: ignore
+
+        # The current values are sent straight away
+        sensor.cov_notification.assert_called_once()  # type: ignore
+
+    def test_notify_increment(self, mocker: MockFixture) -> None:
+        sensor = make_sensor(mocker)
+        subscribe(sensor, 1)
+        run_tasks()
+
+        sensor.set_values({"temp": 20.2, "co2": 400})
+        run_tasks()
+        assert sensor.cov_notification.call_count == 1  # type: ignore
+
+        sensor.set_values({"temp": 20.6, "co2": 400})
+        run_tasks()
+        assert sensor.cov_notification.call_count == 2  # type: ignore
+
+    def test_notify_fault(self, mocker: MockFixture) -> None:
+        sensor = make_sensor(mocker)
+        subscribe(sensor, 0)
+        run_tasks()
+
+        sensor.mark_fault()
+        run_tasks()
+        sensor.mark_fault()
+        run_tasks()
+        assert sensor.cov_notification.call_count == 2  # type: ignore
+
+        sensor.mark_ok()
+        run_tasks()
+        assert sensor.cov_notification.call_count == 3  # type: ignore
+
+    def test_renew(self, mocker: MockFixture) -> None:
+        sensor = make_sensor(mocker)
+        subscribe(sensor, 1)
+        subscription = get_subscription(sensor, "temp")
+
+        subscribe(sensor, 1, lifetime=600)
+
+        assert get_subscription(sensor, "temp") is subscription
+        assert subscription.lifetime == 600
+
+    def test_indefinite(self, mocker: MockFixture) -> None:
+        sensor = make_sensor(mocker)
+
+        subscribe(sensor, 1, lifetime=None)
+
+        assert get_subscription(sensor, "temp").lifetime == 0
+        assert len(sensor.subscription_expiry) == 0
+
+    def test_cancel(self, mocker: MockFixture) -> None:
+        sensor = make_sensor(mocker)
+        subscribe(sensor, 1)
+
+        subscribe(sensor, 1, lifetime=None, confirmed=None)
+
+        assert not sensor.cov_detections
+        assert len(sensor.subscription_expiry) == 0
+        assert sensor.response.call_count == 2  # type: ignore
+
+    def test_cancel_unknown(self, mocker: MockFixture) -> None:
+        sensor = make_sensor(mocker)
+
+        subscribe(sensor, 1, lifetime=None, confirmed=None)
+
+        assert not sensor.cov_detections
+        sensor.response.assert_called_once()  # type: ignore
+
+    def test_unknown_object(self, mocker: MockFixture) -> None:
+        sensor = make_sensor(mocker)
+
+        with pytest.raises(ExecutionError):
+            subscribe(sensor, 5)
+
+    def test_unsupported_object(self, mocker: MockFixture) -> None:
+        sensor = make_sensor(mocker)
+
+        with pytest.raises(ExecutionError) as error:
+            subscribe(sensor, 1, object_type="device")
+
+        assert error.value.errorCode == "covSubscriptionFailed"
+
+    def test_removed_object(self, mocker: MockFixture) -> None:
+        sensor = make_sensor(mocker)
+        subscribe(sensor, 1)
+
+        sensor.set_values({"co2": 400})
+
+        assert not sensor.cov_detections
+        assert len(sensor.subscription_expiry) == 0
+
+    def test_expired(self, mocker: MockFixture) -> None:
+        sensor = make_sensor(mocker)
+        subscribe(sensor, 1)
+
+        mocker.patch.object(
+            TaskManager, "get_time", return_value=TaskManager().get_time() + 61
+        )
+        sensor.subscription_expiry.process_task()
+
+        assert not sensor.cov_detections
+
+    def test_active_subscriptions(self, mocker: MockFixture) -> None:
+        sensor = make_sensor(mocker)
+        subscribe(sensor, 1, lifetime=60)
+        subscribe(sensor, 0, lifetime=0, confirmed=True)
+
+        assert isinstance(
+            sensor.localDevice._properties["activeCovSubscriptions"],
+            ActiveSubscriptionsProperty,
+        )
+
+        subscriptions = sorted(
+            sensor.localDevice.ReadProperty("activeCovSubscriptions"),
+            key=lambda s: s.monitoredPropertyReference.objectIdentifier,
+        )
+
+        assert [
+            (
+                s.monitoredPropertyReference.objectIdentifier,
+                s.issueConfirmedNotifications,
+                s.covIncrement,
+                s.timeRemaining > 0,
+            )
+            for s in subscriptions
+        ] == [
+            (("analogValue", 0), True, 0, False),
+            (("analogValue", 1), False, 0.5, True),
+        ]
+        assert (
+            subscriptions[0].recipient.recipient.address.macAddress == CLIENT.addrAddr
+        )
@@ -0,0 +1,157 @@
+from bacpypes.pdu import Address
+from pytest_mock import MockFixture
+
+from bacprop.bacnet import fault
+from bacprop.bacnet.fault import FaultScheduler, RetireScheduler
+from bacprop.bacnet.sensor import Sensor
+
+# Required for full coverage
+fault._debug = 1
+
+
+def make_sensor(mocker: MockFixture, sensor_id: int, update_time: float) -> Sensor:
+    sensor = mocker.create_autospec(Sensor)
+    sensor.get_id.return_value = sensor_id  # type: ignore
+    sensor.get_update_time.return_value = update_time  # type: ignore
+    return sensor
+
+
+class TestFaultScheduler:
+    def test_pop_expired(self, mocker: MockFixture) -> None:
+        scheduler = FaultScheduler(10)
+
+        sensor1 = make_sensor(mocker, 1, 100)
+        sensor2 = make_sensor(mocker, 2, 105)
+
+        scheduler.touch(sensor1)
+        scheduler.touch(sensor2)
+
+        assert scheduler.pop_expired(109) == []
+        assert scheduler.pop_expired(110) == [sensor1]
+
+        # Expired sensors are no longer scheduled
+        assert scheduler.pop_expired(200) == [sensor2]
+        assert len(scheduler) == 0
+
+    def test_touch_once(self, mocker: MockFixture) -> None:
+        scheduler = FaultScheduler(10)
+        sensor = make_sensor(mocker, 1, 100)
+
+        for _ in range(5):
+            scheduler.touch(sensor)
+
+        assert len(scheduler._heap) == 1
+
+    def test_updated_sensor_pushed_back(self, mocker: MockFixture) -> None:
+        scheduler = FaultScheduler(10)
+        sensor = make_sensor(mocker, 1, 100)
+        scheduler.touch(sensor)
+
+        # New data arrived before the deadline
+        sensor.get_update_time.return_value = 108  # type: ignore
+        scheduler.touch(sensor)
+
+        assert scheduler.pop_expired(110) == []
+        assert len(scheduler._heap) == 1
+        assert scheduler.pop_expired(118) == [sensor]
+
+    def test_retouch_after_expiry(self, mocker: MockFixture) -> None:
+        scheduler = FaultScheduler(10)
+        sensor = make_sensor(mocker, 1, 100)
+        scheduler.touch(sensor)
+
+        assert scheduler.pop_expired(110) == [sensor]
+
+        sensor.get_update_time.return_value = 150  # type: ignore
+        scheduler.touch(sensor)
+
+        assert scheduler.pop_expired(159) == []
+        assert scheduler.pop_expired(160) == [sensor]
+
+    def test_sensor_timeout(self, mocker: MockFixture) -> None:
+        scheduler = FaultScheduler(10)
+        sensor = make_sensor(mocker, 1, 100)
+        scheduler.touch(sensor)
+
+        scheduler.set_timeout(1, 2)
+        assert scheduler.get_timeout(1) == 2
+        assert scheduler.pop_expired(102) == [sensor]
+
+        scheduler.set_timeout(1, None)
+        assert scheduler.get_timeout(1) == 10
+
+    def test_group_timeout(self, mocker: MockFixture) -> None:
+        scheduler = FaultScheduler(10)
+        sensor1 = make_sensor(mocker, 1, 100)
+        sensor5 = make_sensor(mocker, 5, 100)
+        scheduler.touch(sensor1)
+        scheduler.touch(sensor5)
+
+        scheduler.set_group_timeout(range(0, 3), 60)
+
+        assert scheduler.get_timeout(1) == 60
+        assert scheduler.get_timeout(5) == 10
+
+        assert scheduler.pop_expired(110) == [sensor5]
+        assert scheduler.pop_expired(160) == [sensor1]
+
+    def test_sensor_timeout_overrides_group(self) -> None:
+        scheduler = FaultScheduler(10)
+        scheduler.set_group_timeout(range(0, 3), 60)
+        scheduler.set_timeout(1, 5)
+
+        assert scheduler.get_timeout(1) == 5
+        assert scheduler.get_timeout(2) == 60
+
+    def test_default_timeout(self, mocker: MockFixture) -> None:
+        scheduler = FaultScheduler(10)
+        sensor = make_sensor(mocker, 1, 100)
+        scheduler.touch(sensor)
+
+        scheduler.set_default_timeout(1)
+        assert scheduler.pop_expired(101) == [sensor]
+
+    def test_discard(self, mocker: MockFixture) -> None:
+        scheduler = FaultScheduler(10)
+        sensor = make_sensor(mocker, 1, 100)
+        scheduler.touch(sensor)
+
+        scheduler.discard(1)
+        assert scheduler.pop_expired(200) == []
+
+    def test_sensor_touches(self) -> None:
+        scheduler = FaultScheduler(10)
+        sensor = Sensor(3, Address(3), scheduler)
+
+        sensor.set_values({"temp": 1})
+
+        assert len(scheduler) == 1
+        assert scheduler.pop_expired(sensor.get_update_time() + 10) == [sensor]
+
+
+class TestRetireScheduler:
+    def test_retire_after_fault(self, mocker: MockFixture) -> None:
+        faults = FaultScheduler(10)
+        faults.set_group_timeout(range(2, 3), 100)
+        scheduler = RetireScheduler(faults, 50)
+
+        sensor1 = make_sensor(mocker, 1, 100)
+        sensor2 = make_sensor(mocker, 2, 100)
+        scheduler.touch(sensor1)
+        scheduler.touch(sensor2)
+
+        # Retired the given time after their own fault timeouts
+        assert scheduler.get_timeout(1) == 60
+        assert scheduler.pop_expired(159) == []
+        assert scheduler.pop_expired(160) == [sensor1]
+        assert scheduler.pop_expired(250) == [sensor2]
+
+    def test_updated(self, mocker: MockFixture) -> None:
+        scheduler = RetireScheduler(FaultScheduler(10), 50)
+        sensor = make_sensor(mocker, 1, 100)
+        scheduler.touch(sensor)
+
+        sensor.get_update_time.return_value = 130  # type: ignore
+
+        assert scheduler.pop_expired(160) == []
+        assert scheduler.pop_expired(190) == [sensor]
@@ -0,0 +1,454 @@
+from typing import Any, List
+
+from bacpypes.apdu import (
+    IAmRequest,
+    ReadPropertyACK,
+    ReadPropertyRequest,
+    SubscribeCOVRequest,
+    WhoIsRequest,
+)
+from bacpypes.basetypes import StatusFlags
+from bacpypes.core import run_once
+from bacpypes.local.device import LocalDeviceObject
+from bacpypes.pdu import PDU, Address, LocalBroadcast
+from bacpypes.primitivedata import Real
+from bacpypes.task import TaskManager
+from pytest_mock import MockFixture
+
+from bacprop.bacnet import lazy
+from bacprop.bacnet.lazy import IdleEviction, LazySensor, encode_i_am
+from bacprop.bacnet.network import VirtualSensorNetwork
+from bacprop.bacnet.sensor import Sensor, SharedSensor, _VLANApplication
+from bacprop.bacnet.store import ValueStore
+from bacprop.bacnet.whois import decode_request
+from bacprop.snapshot import SensorSnapshot
+
+# Required for full coverage
+lazy._debug = 1
+
+
+def set_time(mocker: MockFixture, now: float) -> None:
+    mocker.patch.object(TaskManager, "get_time", return_value=now)
+
+
+def run_tasks() -> None:
+    # Each pass only runs the tasks which are due when it starts
+    for _ in range(5):
+        run_once()
+
+
+def make_network(mocker: MockFixture, **kwargs: Any) -> VirtualSensorNetwork:
+    mocker.patch("bacprop.bacnet.network._VLANRouter")
+    TaskManager()
+
+    network = VirtualSensorNetwork(
+        "0.0.0.0", announce_rate=0, lazy_stacks=True, **kwargs
+    )
+    # Nothing is bound to the router node
+    network.remove_node(network.nodes[0])
+
+    return network
+
+
+def make_client(network: VirtualSensorNetwork, received: List[Any]) -> _VLANApplication:
+    class Client(_VLANApplication):
+        def confirmation(self, apdu: Any) -> None:
+            received.append(apdu)
+
+        def indication(self, apdu: Any) -> None:
+            received.append(apdu)
+
+    client = Client(
+        LocalDeviceObject(
+            objectName="client", objectIdentifier=("device", 999), vendorIdentifier=15
+        ),
+        Address((100).to_bytes(4, "big")),
+    )
+    network.add_node(client.get_node())
+
+    return client
+
+
+def read_temp(client: _VLANApplication, sensor: Any) -> None:
+    client.request(
+        ReadPropertyRequest(
+            objectIdentifier=("analogValue", 0),
+            propertyIdentifier="presentValue",
+            destination=sensor.get_address(),
+        )
+    )
+    run_tasks()
+
+
+class TestLazySensor:
+    def test_values_without_stack(self, mocker: MockFixture) -> None:
+        sensor = LazySensor(3, Address(0), mocker.Mock())
+
+        sensor.set_values({"temp": 21.5, "co2": 480})
+        sensor.mark_fault()
+
+        assert sensor.get_stack() is None
+        assert sensor.get_snapshot().keys == {"co2": (0, 480), "temp": (1, 21.5)}
+
+    def test_attach_detach(self, mocker: MockFixture) -> None:
+        sensor = LazySensor(3, Address(0), mocker.Mock(), cov_increments={"temp": 2})
+        sensor.set_values({"temp": 21.5, "co2": 480})
+        sensor.mark_fault()
+
+        stack = Sensor(3, Address(0))
+        sensor.attach(stack)
+
+        temp = stack.get_object_name("temp")
+        assert sensor.get_stack() is stack
+        assert temp.ReadProperty("objectIdentifier") == ("analogValue", 1)
+        assert temp.ReadProperty("presentValue") == 21.5
+        assert temp.ReadProperty("covIncrement") == 2
+        assert temp.ReadProperty("statusFlags")[StatusFlags.bitNames["fault"]] == 1
+
+        # Updates reach the objects on the stack
+        sensor.set_values({"temp": 22.0, "humidity": 40})
+        assert temp.ReadProperty("presentValue") == 22.0
+        assert not stack.get_object_name("co2")
+        assert stack.get_object_name("humidity")
+
+        assert sensor.detach() is stack
+        assert sensor.get_stack() is None
+        assert sensor.get_snapshot().keys == {
+            "co2": (0, None),
+            "temp": (1, 22.0),
+            "humidity": (2, 40),
+        }
+
+        # Nothing more is added to the old stack
+        sensor.set_values({"temp": 23.0, "co2": 1})
+        assert not stack.get_object_name("co2")
+
+    def test_merge_without_stack(self, mocker: MockFixture) -> None:
+        sensor = LazySensor(3, Address(0), mocker.Mock())
+
+        sensor.set_values({"temp": 21.5}, merge=True)
+        sensor.set_values({"temp": 22.5}, merge=True)
+
+        assert sensor.get_snapshot().keys == {"temp": (0, 22.5)}
+
+    def test_values_never_monitored(self, mocker: MockFixture) -> None:
+        store = ValueStore()
+        sensor = LazySensor(3, Address(0), mocker.Mock(), store=store)
+
+        # Another sensor's objects are monitored
+        store.monitored = 1
+        sensor.set_values({"temp": 21.5})
+
+        assert sensor._direct
+
+    def test_attach_keeps_slots(self, mocker: MockFixture) -> None:
+        store = ValueStore()
+        sensor = LazySensor(3, Address(0), mocker.Mock(), store=store)
+        sensor.set_values({"temp": 21.5})
+        slot = sensor._objects["temp"].get_slot()
+
+        stack = Sensor(3, Address(0))
+        sensor.attach(stack)
+        temp = stack.get_object_name("temp")
+        assert temp.get_slot() == slot
+
+        store.values[slot] = 30
+        assert temp.ReadProperty("presentValue") == 30
+
+        sensor.detach()
+        assert sensor._objects["temp"].get_slot() == slot
+        assert store.export_values() == {3: {"temp": 30}}
+
+    def test_announce(self, mocker: MockFixture) -> None:
+        send_i_am = mocker.Mock()
+        sensor = LazySensor(3, Address(0), send_i_am)
+
+        sensor.announce()
+        send_i_am.assert_called_once_with(sensor)
+
+        stack = mocker.create_autospec(Sensor)
+        sensor.attach(stack)
+        sensor.announce()
+
+        stack.announce.assert_called_once()
+        send_i_am.assert_called_once()
+
+
+class TestEncodeIAm:
+    def test_encode(self) -> None:
+        address = Address((7).to_bytes(4, "big"))
+        pdu = encode_i_am(5, address)
+
+        request = decode_request(pdu)
+
+        assert isinstance(request, IAmRequest)
+        assert request.iAmDeviceIdentifier == ("device", 5)
+        assert request.segmentationSupported == "segmentedBoth"
+        assert pdu.pduSource == address
+        assert pdu.pduDestination == LocalBroadcast()
+
+
+class TestIdleEviction:
+    def test_evict(self, mocker: MockFixture) -> None:
+        evicted: List[LazySensor] = []
+
+        def evict(sensor: LazySensor) -> bool:
+            evicted.append(sensor)
+            return True
+
+        eviction = IdleEviction(10, evict)
+        sensor1 = LazySensor(1, Address(0), mocker.Mock())
+        sensor2 = LazySensor(2, Address(0), mocker.Mock())
+
+        eviction.touch(sensor1, 100)
+        eviction.touch(sensor2, 105)
+        eviction.touch(sensor1, 108)
+
+        assert eviction.taskTime == 110
+        assert len(eviction) == 2
+
+        set_time(mocker, 115)
+        eviction.process_task()
+
+        assert evicted == [sensor2]
+        assert eviction.taskTime == 118
+
+        set_time(mocker, 118)
+        eviction.process_task()
+
+        assert evicted == [sensor2, sensor1]
+        assert eviction.evicted == 2
+        assert len(eviction) == 0
+
+    def test_discard(self, mocker: MockFixture) -> None:
+        eviction = IdleEviction(10, lambda sensor: True)
+        sensor = LazySensor(1, Address(0), mocker.Mock())
+
+        eviction.touch(sensor, 100)
+        eviction.discard(sensor)
+        eviction.discard(sensor)
+
+        assert len(eviction) == 0
+
+    def test_not_evictable(self, mocker: MockFixture) -> None:
+        eviction = IdleEviction(10, lambda sensor: False)
+        sensor = LazySensor(1, Address(0), mocker.Mock())
+
+        eviction.touch(sensor, 100)
+        set_time(mocker, 110)
+        eviction.process_task()
+
+        # Checked again later
+        assert len(eviction) == 1
+        assert eviction.taskTime == 120
+        assert eviction.evicted == 0
+
+
+class TestLazyNetwork:
+    def test_create_lazy(self, mocker: MockFixture) -> None:
+        network = make_network(mocker)
+
+        sensor = network.create_sensor(5)
+        sensor.set_values({"temp": 21.5})
+
+        assert isinstance(sensor, LazySensor)
+        assert sensor.get_stack() is None
+        assert network.nodes == []
+
+    def test_read_materializes(self, mocker: MockFixture) -> None:
+        network = make_network(mocker)
+        received: List[Any] = []
+        client = make_client(network, received)
+        sensor = network.create_sensor(5)
+        sensor.set_values({"temp": 21.5})
+
+        read_temp(client, sensor)
+
+        assert isinstance(received[0], ReadPropertyACK)
+        assert received[0].propertyValue.cast_out(Real) == 21.5
+        assert received[0].pduSource == sensor.get_address()
+        assert isinstance(sensor, LazySensor)
+        assert isinstance(sensor.get_stack(), Sensor)
+
+        eviction = network.get_eviction()
+        assert eviction is not None
+        assert len(eviction) == 1
+
+    def test_stack_shares_row(self, mocker: MockFixture) -> None:
+        for shared_stack in (False, True):
+            network = make_network(mocker, shared_stack=shared_stack)
+            received: List[Any] = []
+            client = make_client(network, received)
+            sensor = network.create_sensor(5)
+            sensor.set_values({"temp": 21.5})
+
+            read_temp(client, sensor)
+
+            # No store or row of its own
+            stack = sensor.get_stack()  # type: ignore
+            assert stack._store is network._store
+            assert stack.get_row() == sensor.get_row()
+            assert network._store.count_sensors() == 1
+
+    def test_who_is_materializes(self, mocker: MockFixture) -> None:
+        network = make_network(mocker)
+        received: List[Any] = []
+        client = make_client(network, received)
+        sensors = [network.create_sensor(_id) for _id in range(5)]
+
+        client.who_is(1, 2, LocalBroadcast())
+        run_tasks()
+
+        assert [apdu.iAmDeviceIdentifier for apdu in received] == [
+            ("device", 1),
+            ("device", 2),
+        ]
+        stacks = [sensor.get_stack() for sensor in sensors]  # type: ignore
+        assert [stack is not None for stack in stacks] == [
+            False,
+            True,
+            True,
+            False,
+            False,
+        ]
+
+        # Inconsistent limits materialize nothing
+        mocker.patch(
+            "bacprop.bacnet.network.decode_request",
+            return_value=WhoIsRequest(deviceInstanceRangeLowLimit=1),
+        )
+        network._broadcast_nodes(PDU(destination=LocalBroadcast()))
+        assert sensors[0].get_stack() is None  # type: ignore
+
+    def test_eager(self, mocker: MockFixture) -> None:
+        network = make_network(mocker, eager_sensors=[range(3, 5)])
+
+        sensor = network.create_sensor(3)
+        lazy_sensor = network.create_sensor(5)
+
+        assert sensor.get_stack() is not None  # type: ignore
+        assert lazy_sensor.get_stack() is None  # type: ignore
+
+        # Eager sensors are never evicted
+        eviction = network.get_eviction()
+        assert eviction is not None
+        assert len(eviction) == 0
+
+    def test_evict(self, mocker: MockFixture) -> None:
+        network = make_network(mocker, idle_timeout=60)
+        received: List[Any] = []
+        client = make_client(network, received)
+        sensor = network.create_sensor(5)
+        sensor.set_values({"temp": 21.5})
+        read_temp(client, sensor)
+
+        assert network._evict(sensor)  # type: ignore
+        assert sensor.get_stack() is None  # type: ignore
+        assert network.nodes == [client.get_node()]
+
+        # Materialized again with the same objects
+        sensor.set_values({"temp": 22.5})
+        received.clear()
+        read_temp(client, sensor)
+        assert received[0].propertyValue.cast_out(Real) == 22.5
+
+    def test_evict_subscribed(self, mocker: MockFixture) -> None:
+        network = make_network(mocker)
+        received: List[Any] = []
+        client = make_client(network, received)
+        sensor = network.create_sensor(5)
+        sensor.set_values({"temp": 21.5})
+
+        client.request(
+            SubscribeCOVRequest(
+                subscriberProcessIdentifier=1,
+                monitoredObjectIdentifier=("analogValue", 0),
+                issueConfirmedNotifications=False,
+                lifetime=60,
+                destination=sensor.get_address(),
+            )
+        )
+        run_tasks()
+
+        assert not network._evict(sensor)  # type: ignore
+        assert sensor.get_stack() is not None  # type: ignore
+
+    def test_evict_dormant(self, mocker: MockFixture) -> None:
+        network = make_network(mocker)
+        sensor = network.create_sensor(5)
+
+        assert not network._evict(sensor)  # type: ignore
+
+    def test_shared_stack(self, mocker: MockFixture) -> None:
+        network = make_network(mocker, shared_stack=True)
+        received: List[Any] = []
+        client = make_client(network, received)
+        sensor = network.create_sensor(5)
+        sensor.set_values({"temp": 21.5})
+
+        read_temp(client, sensor)
+
+        assert received[0].propertyValue.cast_out(Real) == 21.5
+        assert isinstance(sensor.get_stack(), SharedSensor)  # type: ignore
+
+        assert network._evict(sensor)  # type: ignore
+        app = network._shared_app
+        assert app
+        assert not app._sensors
+        assert sensor.get_address() not in network._node_index
+
+    def test_dormant_announce(self, mocker: MockFixture) -> None:
+        network = make_network(mocker)
+        received: List[Any] = []
+        make_client(network, received)
+        sensor = network.create_sensor(5)
+
+        sensor.announce()
+        run_tasks()
+
+        assert received[0].iAmDeviceIdentifier == ("device", 5)
+        assert received[0].pduSource == sensor.get_address()
+        assert sensor.get_stack() is None  # type: ignore
+
+    def test_restore_dormant_address_taken(self, mocker: MockFixture) -> None:
+        network = make_network(mocker)
+        sensor = network.create_sensor(5)
+
+        (restored,) = network.restore_sensors(
+            [SensorSnapshot(6, 2, 100, False, False, {})]
+        )
+
+        assert sensor.get_address() == Address((2).to_bytes(4, "big"))
+        assert restored.get_address() == Address((3).to_bytes(4, "big"))
+
+    def test_remove(self, mocker: MockFixture) -> None:
+        network = make_network(mocker)
+        received: List[Any] = []
+        client = make_client(network, received)
+        sensor = network.create_sensor(5)
+        sensor.set_values({"temp": 21.5})
+        read_temp(client, sensor)
+        dormant = network.create_sensor(6)
+
+        network.remove_sensor(5)
+        network.remove_sensor(6)
+
+        assert network.nodes == [client.get_node()]
+        assert not network._lazy_addresses
+        assert not network._lazy_index.find((0, 10))
+        assert len(network.get_eviction()) == 0  # type: ignore
+        assert sensor.get_stack() is None  # type: ignore
+        assert network.create_sensor(7).get_address() == sensor.get_address()
+        assert network.create_sensor(8).get_address() == dormant.get_address()
+
+    def test_no_eviction(self, mocker: MockFixture) -> None:
+        network = make_network(mocker, idle_timeout=0)
+        received: List[Any] = []
+        client = make_client(network, received)
+        sensor = network.create_sensor(5)
+        sensor.set_values({"temp": 21.5})
+
+        read_temp(client, sensor)
+
+        assert network.get_eviction() is None
+        assert sensor.get_stack() is not None  # type: ignore
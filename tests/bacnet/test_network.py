@@ -1,8 +1,12 @@
+from typing import Any
+
 from bacprop.bacnet.network import VirtualSensorNetwork
 from bacprop.bacnet import network
-from bacpypes.pdu import Address
+from bacpypes.apdu import IAmRequest, WhoHasRequest, WhoIsRequest
+from bacpypes.pdu import Address, LocalBroadcast, PDU
 from bacpypes.comm import service_map
-from bacprop.bacnet.sensor import Sensor
+from bacprop.bacnet.sensor import Sensor, SharedSensor
+from bacprop.snapshot import SensorSnapshot
 
 from pytest_mock import MockFixture
 import pytest
@@ -33,21 +37,21 @@ class TestVirtualSensorNetwork:
 
     def test_create_sensor(self, mocker: MockFixture) -> None:
         mocker.patch("bacprop.bacnet.network._VLANRouter")
-        network = VirtualSensorNetwork("0.0.0.0")
+        network = VirtualSensorNetwork("0.0.0.0", announce_rate=0)
 
         sensor = network.create_sensor(7)
         sensor2 = network.create_sensor(8)
 
         assert len(network.nodes) == 3
-        assert network.nodes[-1] == sensor2.get_node()
-        assert network.nodes[-2] == sensor.get_node()
+        assert network.nodes[-1] == sensor2.get_node()  # type: ignore
+        assert network.nodes[-2] == sensor.get_node()  # type: ignore
 
         assert sensor._vlan_address == Address((2).to_bytes(4, "big"))
         assert sensor2._vlan_address == Address((3).to_bytes(4, "big"))
 
     def test_create_sensor_exists(self, mocker: MockFixture) -> None:
         mocker.patch("bacprop.bacnet.network._VLANRouter")
-        network = VirtualSensorNetwork("0.0.0.0")
+        network = VirtualSensorNetwork("0.0.0.0", announce_rate=0)
 
         network.create_sensor(7)
 
@@ -56,7 +60,7 @@ class TestVirtualSensorNetwork:
 
     def test_get_sensor(self, mocker: MockFixture) -> None:
         mocker.patch("bacprop.bacnet.network._VLANRouter")
-        network = VirtualSensorNetwork("0.0.0.0")
+        network = VirtualSensorNetwork("0.0.0.0", announce_rate=0)
 
         sensor_created = network.create_sensor(7)
         sensor_found = network.get_sensor(7)
@@ -65,7 +69,7 @@ class TestVirtualSensorNetwork:
 
     def test_get_sensors(self, mocker: MockFixture) -> None:
         mocker.patch("bacprop.bacnet.network._VLANRouter")
-        network = VirtualSensorNetwork("0.0.0.0")
+        network = VirtualSensorNetwork("0.0.0.0", announce_rate=0)
 
         for i in range(10):
             network.create_sensor(i)
@@ -75,10 +79,141 @@ class TestVirtualSensorNetwork:
         for i in range(10):
             assert type(sensors[i]) == Sensor
 
+    def test_pop_outdated_sensors(self, mocker: MockFixture) -> None:
+        mocker.patch("bacprop.bacnet.network._VLANRouter")
+        network = VirtualSensorNetwork("0.0.0.0", announce_rate=0)
+
+        sensor = network.create_sensor(7)
+        network.create_sensor(8).set_values({"temp": 1})
+        sensor.set_values({"temp": 1})
+
+        network.get_fault_scheduler().set_timeout(7, 1)
+        now = sensor.get_update_time() + 1
+
+        assert network.pop_outdated_sensors(now) == [sensor]
+
+    def test_pop_outdated_retirement(self, mocker: MockFixture) -> None:
+        mocker.patch("bacprop.bacnet.network._VLANRouter")
+        network = VirtualSensorNetwork("0.0.0.0", announce_rate=0, retire_after=100)
+        network.get_fault_scheduler().set_default_timeout(10)
+
+        sensor = network.create_sensor(7)
+        sensor.set_values({"temp": 1})
+        updated = sensor.get_update_time()
+
+        assert network.pop_outdated_sensors(updated + 10) == [sensor]
+
+        # Faulty for `retire_after` after becoming faulty
+        assert network.retire_sensors(updated + 109) == []
+        assert network.retire_sensors(updated + 110) == [sensor]
+        assert network.get_sensor(7) is None
+
+    def test_retire_sensors_disabled(self, mocker: MockFixture) -> None:
+        mocker.patch("bacprop.bacnet.network._VLANRouter")
+        network = VirtualSensorNetwork("0.0.0.0", announce_rate=0)
+        network.get_fault_scheduler().set_default_timeout(10)
+
+        sensor = network.create_sensor(7)
+        sensor.set_values({"temp": 1})
+        network.pop_outdated_sensors(sensor.get_update_time() + 10)
+
+        assert network.retire_sensors(sensor.get_update_time() + 1e9) == []
+        assert network.get_sensor(7) is sensor
+
+    def test_remove_sensor(self, mocker: MockFixture) -> None:
+        mocker.patch("bacprop.bacnet.network._VLANRouter")
+        network = VirtualSensorNetwork("0.0.0.0", announce_rate=5, retire_after=10)
+        announcer = network.get_announcer()
+        assert announcer
+
+        sensor = network.create_sensor(7)
+        sensor.set_values({"temp": 1})
+        network.create_sensor(8)
+
+        assert network.remove_sensor(7) is sensor
+        assert network.get_sensor(7) is None
+        assert sensor.get_node() not in network.nodes  # type: ignore
+        assert sensor.get_address() not in network._node_index
+        assert 7 not in network._device_index.find((7, 7))
+        assert len(network.get_fault_scheduler()) == 0
+        assert announcer.queue_depth == 1
+        assert not sensor._objects
+
+        with pytest.raises(KeyError):
+            network.remove_sensor(7)
+
+    @pytest.mark.parametrize(
+        "kwargs", [{}, {"shared_stack": True}, {"lazy_stacks": True}]
+    )
+    def test_store(self, mocker: MockFixture, kwargs: Any) -> None:
+        mocker.patch("bacprop.bacnet.network._VLANRouter")
+        network = VirtualSensorNetwork("0.0.0.0", announce_rate=0, **kwargs)
+        store = network.get_store()
+
+        network.create_sensor(7).set_values({"temp": 1})
+        network.create_sensor(8).mark_fault()
+
+        assert store.count_sensors() == 2
+        assert store.count_faults() == 1
+        assert store.export_values() == {7: {"temp": 1}, 8: {}}
+
+        network.remove_sensor(7)
+        assert store.count_sensors() == 1
+        assert store.export_values() == {8: {}}
+
+    def test_remove_shared_sensor(self, mocker: MockFixture) -> None:
+        mocker.patch("bacprop.bacnet.network._VLANRouter")
+        network = VirtualSensorNetwork("0.0.0.0", shared_stack=True, announce_rate=0)
+
+        sensor = network.create_sensor(7)
+        sensor.set_values({"temp": 1})
+        network.remove_sensor(7)
+
+        app = network._shared_app
+        assert app
+        assert not app._sensors
+        assert not app.objectName
+        assert sensor.get_address() not in network._node_index
+
+    def test_address_reuse(self, mocker: MockFixture) -> None:
+        mocker.patch("bacprop.bacnet.network._VLANRouter")
+        network = VirtualSensorNetwork("0.0.0.0", announce_rate=0)
+
+        sensors = [network.create_sensor(_id) for _id in range(3)]
+        network.remove_sensor(1)
+        network.remove_sensor(0)
+
+        # Freed addresses are used oldest first, before any new ones
+        assert network.create_sensor(10).get_address() == sensors[1].get_address()
+        assert network.create_sensor(11).get_address() == sensors[0].get_address()
+        assert network.create_sensor(12).get_address() == Address(
+            (5).to_bytes(4, "big")
+        )
+
+    def test_churn(self, mocker: MockFixture) -> None:
+        mocker.patch("bacprop.bacnet.network._VLANRouter")
+        network = VirtualSensorNetwork("0.0.0.0", announce_rate=0, retire_after=0)
+        network.get_fault_scheduler().set_default_timeout(0)
+
+        for _id in range(1000):
+            network.create_sensor(_id).set_values({"temp": _id})
+
+            now = network.get_sensor(_id).get_update_time()  # type: ignore
+            network.pop_outdated_sensors(now)
+            network.retire_sensors(now)
+
+        # Nothing is left behind by the removed sensors
+        assert network.get_sensors() == {}
+        assert len(network.nodes) == 1
+        assert len(network._node_index) == 1
+        assert len(network._device_index) == 0
+        assert len(network.get_fault_scheduler()) == 0
+        assert network._address_index == 3
+
     def test_run(self, mocker: MockFixture) -> None:
         mock_run = mocker.patch("bacprop.bacnet.network.run")
 
-        network = VirtualSensorNetwork("0.0.0.0")
+        network = VirtualSensorNetwork("0.0.0.0", announce_rate=0)
         # Teardown
         network._router.mux.close_socket()
         service_map.clear()
@@ -96,3 +231,345 @@ class TestVirtualSensorNetwork:
 
         network.stop()
         mock_stop.assert_called_once()
+
+    def test_create_shared_sensor(self, mocker: MockFixture) -> None:
+        mocker.patch("bacprop.bacnet.network._VLANRouter")
+        network = VirtualSensorNetwork("0.0.0.0", shared_stack=True, announce_rate=0)
+
+        sensor = network.create_sensor(7)
+        network.create_sensor(8)
+
+        # Router node and the shared application node
+        assert len(network.nodes) == 2
+        assert type(sensor) == SharedSensor
+        assert sensor.get_address() == Address((3).to_bytes(4, "big"))
+        assert network._node_index[sensor.get_address()] == network.nodes[1]
+
+    def test_announce_sensors(self, mocker: MockFixture) -> None:
+        mocker.patch("bacprop.bacnet.network._VLANRouter")
+        network = VirtualSensorNetwork("0.0.0.0", announce_rate=5)
+        announcer = network.get_announcer()
+        assert announcer
+        mock_schedule = mocker.patch.object(announcer, "schedule", autospec=True)
+
+        sensor = network.create_sensor(7)
+
+        mock_schedule.assert_called_once_with(sensor)
+        assert sensor._announcer is announcer
+
+    def test_no_announcements(self, mocker: MockFixture) -> None:
+        mocker.patch("bacprop.bacnet.network._VLANRouter")
+        network = VirtualSensorNetwork("0.0.0.0", shared_stack=True, announce_rate=0)
+
+        sensor = network.create_sensor(7)
+
+        assert network.get_announcer() is None
+        assert sensor._announcer is None
+
+    def test_restore_sensors(self, mocker: MockFixture) -> None:
+        mocker.patch("bacprop.bacnet.network._VLANRouter")
+        network = VirtualSensorNetwork("0.0.0.0", announce_rate=5)
+        announcer = network.get_announcer()
+        assert announcer
+        mock_schedule = mocker.patch.object(announcer, "schedule", autospec=True)
+
+        sensors = network.restore_sensors(
+            [
+                SensorSnapshot(7, 5, 100, False, False, {"temp": (2, 21.0)}),
+                SensorSnapshot(8, 3, 200, True, False, {}),
+            ]
+        )
+
+        assert sensors == [network.get_sensor(7), network.get_sensor(8)]
+        assert sensors[0].get_address() == Address((5).to_bytes(4, "big"))
+        assert sensors[1].get_address() == Address((3).to_bytes(4, "big"))
+        assert sensors[0].get_update_time() == 100
+        assert sensors[1].has_fault()
+        mock_schedule.assert_has_calls(
+            [mocker.call(sensors[0]), mocker.call(sensors[1])]
+        )
+
+        # Restored sensors time out from their last update
+        network.get_fault_scheduler().set_default_timeout(10)
+        assert network.pop_outdated_sensors(150) == [sensors[0]]
+
+        # New sensors are given addresses after the restored ones
+        sensor = network.create_sensor(9)
+        assert sensor.get_address() == Address((6).to_bytes(4, "big"))
+
+    def test_restore_sensors_address_taken(self, mocker: MockFixture) -> None:
+        mocker.patch("bacprop.bacnet.network._VLANRouter")
+        network = VirtualSensorNetwork("0.0.0.0", shared_stack=True, announce_rate=0)
+
+        # The shared application node is at address 2
+        (sensor,) = network.restore_sensors(
+            [SensorSnapshot(7, 2, 100, False, False, {})]
+        )
+
+        assert sensor.get_address() == Address((3).to_bytes(4, "big"))
+        assert network._node_index[sensor.get_address()] == network.nodes[1]
+
+    def test_restore_sensors_exists(self, mocker: MockFixture) -> None:
+        mocker.patch("bacprop.bacnet.network._VLANRouter")
+        network = VirtualSensorNetwork("0.0.0.0", announce_rate=0)
+        network.create_sensor(7)
+
+        with pytest.raises(ValueError):
+            network.restore_sensors([SensorSnapshot(7, 10, 100, False, False, {})])
+
+    def test_process_pdu_unicast(self, mocker: MockFixture) -> None:
+        mocker.patch("bacprop.bacnet.network._VLANRouter")
+        network = VirtualSensorNetwork("0.0.0.0", announce_rate=0)
+        sensor = network.create_sensor(7)
+        other = network.create_sensor(8)
+
+        mocker.patch.object(
+            sensor.get_node(), "response", autospec=True  # type: ignore
+        )
+        mocker.patch.object(other.get_node(), "response", autospec=True)  # type: ignore
+
+        network.process_pdu(PDU(destination=sensor.get_address()))
+        network.process_pdu(PDU(destination=Address((50).to_bytes(4, "big"))))
+
+        sensor.get_node().response.assert_called_once()  # type: ignore
+        other.get_node().response.assert_not_called()  # type: ignore
+
+    def test_process_pdu_traffic(self, mocker: MockFixture) -> None:
+        mocker.patch("bacprop.bacnet.network._VLANRouter")
+        network = VirtualSensorNetwork("0.0.0.0", announce_rate=0)
+        sensor = network.create_sensor(7)
+        segment = network.get_segment(7)
+
+        response = mocker.patch.object(
+            sensor.get_node(), "response", autospec=True  # type: ignore
+        )
+        segment.traffic_log = mocker.Mock()
+        pdu = PDU(destination=sensor.get_address())
+
+        segment.process_pdu(pdu)
+        segment.traffic_log.assert_called_once_with(segment.name, pdu)
+        response.assert_called_once()
+
+        # Dropped packets are still logged
+        segment.drop_percent = 100.0
+        segment.process_pdu(pdu)
+        assert segment.traffic_log.call_count == 2
+        response.assert_called_once()
+
+    def test_process_pdu_broadcast(self, mocker: MockFixture) -> None:
+        mocker.patch("bacprop.bacnet.network._VLANRouter")
+        network = VirtualSensorNetwork("0.0.0.0", announce_rate=0)
+        network.remove_node(network.nodes[0])
+        sensor = network.create_sensor(7)
+        other = network.create_sensor(8)
+
+        mocker.patch.object(
+            sensor.get_node(), "response", autospec=True  # type: ignore
+        )
+        mocker.patch.object(other.get_node(), "response", autospec=True)  # type: ignore
+
+        network.process_pdu(
+            PDU(source=sensor.get_address(), destination=LocalBroadcast())
+        )
+
+        # Not sent back to where it came from
+        sensor.get_node().response.assert_not_called()  # type: ignore
+        other.get_node().response.assert_called_once()  # type: ignore
+
+    def test_process_pdu_who_is(self, mocker: MockFixture) -> None:
+        mocker.patch("bacprop.bacnet.network._VLANRouter")
+        network = VirtualSensorNetwork("0.0.0.0", announce_rate=0)
+        router_node = network.nodes[0]
+        sensors = [network.create_sensor(sensor_id) for sensor_id in (9, 3, 5, 7)]
+
+        mocker.patch.object(router_node, "response", autospec=True)
+        for sensor in sensors:
+            mocker.patch.object(
+                sensor.get_node(), "response", autospec=True  # type: ignore
+            )
+
+        mocker.patch(
+            "bacprop.bacnet.network.decode_request",
+            return_value=WhoIsRequest(
+                deviceInstanceRangeLowLimit=4, deviceInstanceRangeHighLimit=8
+            ),
+        )
+        network.process_pdu(PDU(destination=LocalBroadcast()))
+
+        # Only the sensors in range, and nodes which aren't sensors
+        router_node.response.assert_called_once()
+        assert [
+            sensor.get_id()
+            for sensor in sensors
+            if sensor.get_node().response.called  # type: ignore
+        ] == [5, 7]
+
+    def test_process_pdu_i_am(self, mocker: MockFixture) -> None:
+        mocker.patch("bacprop.bacnet.network._VLANRouter")
+        network = VirtualSensorNetwork("0.0.0.0", announce_rate=0)
+        router_node = network.nodes[0]
+        sensor = network.create_sensor(7)
+        mocker.patch.object(router_node, "response", autospec=True)
+        mocker.patch.object(
+            sensor.get_node(), "response", autospec=True  # type: ignore
+        )
+
+        mocker.patch("bacprop.bacnet.network.decode_request", return_value=IAmRequest())
+        network.process_pdu(PDU(destination=LocalBroadcast()))
+
+        router_node.response.assert_called_once()
+        sensor.get_node().response.assert_not_called()  # type: ignore
+
+    @pytest.mark.parametrize(
+        "request_", [None, WhoIsRequest(deviceInstanceRangeLowLimit=1), WhoHasRequest()]
+    )
+    def test_process_pdu_all_nodes(self, mocker: MockFixture, request_: Any) -> None:
+        mocker.patch("bacprop.bacnet.network._VLANRouter")
+        network = VirtualSensorNetwork("0.0.0.0", announce_rate=0)
+        network.remove_node(network.nodes[0])
+        sensor = network.create_sensor(7)
+        mocker.patch.object(
+            sensor.get_node(), "response", autospec=True  # type: ignore
+        )
+
+        mocker.patch("bacprop.bacnet.network.decode_request", return_value=request_)
+        network.process_pdu(PDU(destination=LocalBroadcast()))
+
+        sensor.get_node().response.assert_called_once()  # type: ignore
+
+    def test_remove_sensor_node(self, mocker: MockFixture) -> None:
+        mocker.patch("bacprop.bacnet.network._VLANRouter")
+        network = VirtualSensorNetwork("0.0.0.0", announce_rate=0)
+        sensor = network.create_sensor(7)
+
+        network.remove_node(sensor.get_node())  # type: ignore
+
+        assert len(network._device_index) == 0
+        assert network._other_nodes == network.nodes
+
+
+class TestSensorSegments:
+    def test_init_segments(self, mocker: MockFixture) -> None:
+        mocker.patch("bacprop.bacnet.network._VLANRouter")
+        network = VirtualSensorNetwork("0.0.0.0", networks=3)
+
+        segments = network.get_segments()
+        assert segments[0] is network
+        assert [segment.number for segment in segments] == [1, 2, 3]
+
+        # A router node on each network
+        router_nodes = [segment.nodes[0] for segment in segments]
+        assert [node.address for node in router_nodes] == [
+            Address((address).to_bytes(4, "big")) for address in (1, 2, 3)
+        ]
+        assert network._router.bind.call_args_list == [  # type: ignore
+            mocker.call(node, number) for node, number in zip(router_nodes, (1, 2, 3))
+        ]
+        network._router.start.assert_called_once()  # type: ignore
+
+    def test_segment_by_id(self, mocker: MockFixture) -> None:
+        mocker.patch("bacprop.bacnet.network._VLANRouter")
+        network = VirtualSensorNetwork("0.0.0.0", announce_rate=0, networks=3)
+        segments = network.get_segments()
+
+        sensors = [network.create_sensor(_id) for _id in range(6)]
+
+        assert [network.get_segment(_id).number for _id in range(6)] == [
+            1,
+            2,
+            3,
+            1,
+            2,
+            3,
+        ]
+        for sensor in sensors:
+            segment = network.get_segment(sensor.get_id())
+            for other in segments:
+                assert (sensor.get_node() in other.nodes) is (  # type: ignore
+                    other is segment
+                )
+
+        network.remove_sensor(4)
+        assert len(segments[1].nodes) == 2
+
+    def test_segment_by_range(self, mocker: MockFixture) -> None:
+        mocker.patch("bacprop.bacnet.network._VLANRouter")
+        network = VirtualSensorNetwork(
+            "0.0.0.0", announce_rate=0, networks=3, network_size=10
+        )
+
+        # The last network takes the ids past the ranges
+        assert [network.get_segment(_id).number for _id in (0, 9, 10, 25, 99)] == [
+            1,
+            1,
+            2,
+            3,
+            3,
+        ]
+
+    def test_broadcast_bounded(self, mocker: MockFixture) -> None:
+        mocker.patch("bacprop.bacnet.network._VLANRouter")
+        network = VirtualSensorNetwork("0.0.0.0", announce_rate=0, networks=2)
+        sensors = [network.create_sensor(_id) for _id in range(4)]
+        router_nodes = [segment.nodes[0] for segment in network.get_segments()]
+
+        for node in router_nodes:
+            mocker.patch.object(node, "response", autospec=True)
+        for sensor in sensors:
+            mocker.patch.object(
+                sensor.get_node(), "response", autospec=True  # type: ignore
+            )
+
+        mocker.patch(
+            "bacprop.bacnet.network.decode_request", return_value=WhoHasRequest()
+        )
+        network.get_segments()[1].process_pdu(PDU(destination=LocalBroadcast()))
+
+        router_nodes[0].response.assert_not_called()
+        router_nodes[1].response.assert_called_once()
+        assert [
+            sensor.get_id()
+            for sensor in sensors
+            if sensor.get_node().response.called  # type: ignore
+        ] == [1, 3]
+
+    def test_shared_stack_segments(self, mocker: MockFixture) -> None:
+        mocker.patch("bacprop.bacnet.network._VLANRouter")
+        network = VirtualSensorNetwork(
+            "0.0.0.0", shared_stack=True, announce_rate=0, networks=2
+        )
+        segments = network.get_segments()
+        apps = [segment.get_shared_app() for segment in segments]
+        assert apps[0] and apps[1] and apps[0] is not apps[1]
+
+        # After the router nodes
+        assert apps[0].get_node().address == Address((3).to_bytes(4, "big"))
+        assert apps[1].get_node() in segments[1].nodes
+
+        sensor = network.create_sensor(5)
+        assert apps[1]._sensors == {sensor.get_address(): sensor}
+        assert segments[1].is_taken(sensor.get_address())
+        assert not segments[0].is_taken(sensor.get_address())
+
+        network.remove_sensor(5)
+        assert not apps[1]._sensors
+        assert not segments[1].is_taken(sensor.get_address())
+
+    def test_lazy_segments(self, mocker: MockFixture) -> None:
+        mocker.patch("bacprop.bacnet.network._VLANRouter")
+        network = VirtualSensorNetwork(
+            "0.0.0.0", lazy_stacks=True, announce_rate=0, networks=2
+        )
+        segments = network.get_segments()
+        process_pdu = mocker.patch.object(segments[1], "process_pdu", autospec=True)
+
+        sensor = network.create_sensor(3)
+        assert segments[1].is_taken(sensor.get_address())
+        assert not segments[0].is_taken(sensor.get_address())
+
+        # Announced on its own network
+        sensor.announce()
+        process_pdu.assert_called_once()
+
+        network.remove_sensor(3)
+        assert not segments[1].is_taken(sensor.get_address())
@@ -0,0 +1,316 @@
+from bacpypes.apdu import (
+    APDU,
+    PropertyReference,
+    ReadAccessSpecification,
+    ReadPropertyMultipleRequest,
+    ReadPropertyRequest,
+)
+from bacpypes.basetypes import StatusFlags
+from bacpypes.errors import ExecutionError
+from bacpypes.pdu import Address
+from bacpypes.primitivedata import CharacterString, ObjectIdentifier, Real, Unsigned
+from bacpypes.service.object import (
+    ReadWritePropertyMultipleServices,
+    ReadWritePropertyServices,
+)
+from bacpypes.task import TaskManager
+from bacprop.bacnet import readcache
+from bacprop.bacnet.readcache import clear_read_cache, read_element
+from bacprop.bacnet.sensor import Sensor, SharedSensor, SharedSensorApplication
+import pytest
+from pytest_mock import MockFixture
+from typing import Any, List, Optional, Tuple
+
+# Required for full coverage
+readcache._debug = 1
+
+
+def make_sensor(mocker: MockFixture) -> Tuple[Sensor, List[Any]]:
+    TaskManager()
+    sensor = Sensor(5, Address((5).to_bytes(4, "big")))
+    sensor.set_values({"temp": 21.5, "co2": 480})
+
+    responses: List[Any] = []
+    mocker.patch.object(sensor, "response", side_effect=responses.append)
+
+    return sensor, responses
+
+
+def read_request(
+    identifier: Any, property_identifier: str, array_index: Optional[int] = None
+) -> ReadPropertyRequest:
+    request = ReadPropertyRequest(
+        objectIdentifier=identifier,
+        propertyIdentifier=property_identifier,
+        propertyArrayIndex=array_index,
+    )
+    request.pduSource = Address(1)
+    request.apduInvokeID = 1
+
+    return request
+
+
+def read_multiple_request(
+    specs: List[Tuple[Any, List[str]]], array_index: Optional[int] = None
+) -> ReadPropertyMultipleRequest:
+    request = ReadPropertyMultipleRequest(
+        listOfReadAccessSpecs=[
+            ReadAccessSpecification(
+                objectIdentifier=identifier,
+                listOfPropertyReferences=[
+                    PropertyReference(
+                        propertyIdentifier=property_identifier,
+                        propertyArrayIndex=array_index,
+                    )
+                    for property_identifier in property_identifiers
+                ],
+            )
+            for identifier, property_identifiers in specs
+        ]
+    )
+    request.pduSource = Address(1)
+    request.apduInvokeID = 1
+
+    return request
+
+
+def encode(apdu: Any) -> bytes:
+    encoded = APDU()
+    apdu.encode(encoded)
+
+    return bytes(encoded.pduData)
+
+
+class TestReadElement:
+    def test_static_cached(self, mocker: MockFixture) -> None:
+        sensor, _ = make_sensor(mocker)
+        _object = sensor.get_object_name("temp")
+
+        element = read_element(_object, "objectName")
+
+        assert element.readResult.propertyValue.cast_out(CharacterString) == "temp"
+        assert read_element(_object, "objectName") is element
+        assert read_element(_object, "objectType") is read_element(
+            _object, "objectType"
+        )
+
+    def test_array_index_cached(self, mocker: MockFixture) -> None:
+        sensor, _ = make_sensor(mocker)
+        device = sensor.localDevice
+
+        length = read_element(device, "objectList", 0)
+        first = read_element(device, "objectList", 1)
+
+        assert length.readResult.propertyValue.cast_out(Unsigned) == 3
+        assert first.readResult.propertyValue.cast_out(ObjectIdentifier) == (
+            "device",
+            5,
+        )
+        assert read_element(device, "objectList", 0) is length
+
+    def test_values_encoded_on_read(self, mocker: MockFixture) -> None:
+        sensor, _ = make_sensor(mocker)
+        _object = sensor.get_object_name("temp")
+
+        assert read_element(_object, "presentValue") is not read_element(
+            _object, "presentValue"
+        )
+
+        sensor.set_values({"temp": 3.0, "co2": 480})
+        sensor.mark_fault()
+
+        value = read_element(_object, "presentValue").readResult.propertyValue
+        flags = read_element(_object, "statusFlags").readResult.propertyValue
+        assert value.cast_out(Real) == 3.0
+        assert flags.cast_out(StatusFlags)[StatusFlags.bitNames["fault"]] == 1
+
+    def test_computed_encoded_on_read(self, mocker: MockFixture) -> None:
+        sensor, _ = make_sensor(mocker)
+        device = sensor.localDevice
+
+        assert read_element(device, "localTime") is not read_element(
+            device, "localTime"
+        )
+        assert read_element(device, "activeCovSubscriptions") is not read_element(
+            device, "activeCovSubscriptions"
+        )
+        assert read_element(device, "propertyList") is read_element(
+            device, "propertyList"
+        )
+
+    def test_errors_cached(self, mocker: MockFixture) -> None:
+        sensor, _ = make_sensor(mocker)
+        _object = sensor.get_object_name("temp")
+
+        element = read_element(_object, "objectName", 1)
+        unknown = read_element(_object, "timeDelay")
+
+        assert element.readResult.propertyAccessError.errorCode == (
+            "propertyIsNotAnArray"
+        )
+        assert unknown.readResult.propertyAccessError.errorCode == "unknownProperty"
+        assert read_element(_object, "objectName", 1) is element
+        assert read_element(_object, "timeDelay") is unknown
+
+    def test_errors_encoded_on_read(self, mocker: MockFixture) -> None:
+        sensor, _ = make_sensor(mocker)
+        _object = sensor.get_object_name("temp")
+
+        element = read_element(_object, "presentValue", 1)
+        # Not a property of the object at all
+        missing = read_element(_object, "localTime")
+
+        assert element.readResult.propertyAccessError.errorCode == (
+            "propertyIsNotAnArray"
+        )
+        assert missing.readResult.propertyAccessError.errorCode == "unknownProperty"
+        assert read_element(_object, "presentValue", 1) is not element
+        assert read_element(_object, "localTime") is not missing
+
+    def test_clear_read_cache(self, mocker: MockFixture) -> None:
+        sensor, _ = make_sensor(mocker)
+        _object = sensor.get_object_name("temp")
+        element = read_element(_object, "objectName")
+
+        clear_read_cache(_object)
+        # Nothing to clear
+        clear_read_cache(_object)
+
+        assert read_element(_object, "objectName") is not element
+
+
+class TestCachedReadPropertyServices:
+    @pytest.mark.parametrize(
+        "identifier,property_identifier,array_index",
+        [
+            (("analogValue", 0), "objectName", None),
+            (("analogValue", 0), "presentValue", None),
+            (("device", 5), "objectList", None),
+            (("device", 5), "objectList", 2),
+            (("device", 4194303), "objectName", None),
+        ],
+    )
+    def test_read_property(
+        self,
+        mocker: MockFixture,
+        identifier: Any,
+        property_identifier: str,
+        array_index: Optional[int],
+    ) -> None:
+        sensor, responses = make_sensor(mocker)
+        request = read_request(identifier, property_identifier, array_index)
+
+        ReadWritePropertyServices.do_ReadPropertyRequest(sensor, request)
+        sensor.do_ReadPropertyRequest(request)
+        sensor.do_ReadPropertyRequest(request)
+
+        assert responses[1].objectIdentifier == responses[0].objectIdentifier
+        assert encode(responses[1]) == encode(responses[0])
+        assert encode(responses[2]) == encode(responses[0])
+
+    def test_read_property_errors(self, mocker: MockFixture) -> None:
+        sensor, _ = make_sensor(mocker)
+
+        with pytest.raises(ExecutionError) as error:
+            sensor.do_ReadPropertyRequest(
+                read_request(("analogValue", 9), "objectName")
+            )
+        assert error.value.errorCode == "unknownObject"
+
+        with pytest.raises(ExecutionError) as error:
+            sensor.do_ReadPropertyRequest(
+                read_request(("analogValue", 0), "objectName", 1)
+            )
+        assert error.value.errorCode == "propertyIsNotAnArray"
+
+        with pytest.raises(ExecutionError) as error:
+            sensor.do_ReadPropertyRequest(read_request(("analogValue", 0), "timeDelay"))
+        assert error.value.errorCode == "unknownProperty"
+
+    def test_read_property_multiple(self, mocker: MockFixture) -> None:
+        sensor, responses = make_sensor(mocker)
+        # The local time of the device changes between reads
+        device_properties = ["required", "objectName", "objectList", "description"]
+        value_properties = ["all", "required", "optional", "presentValue", "objectType"]
+        request = read_multiple_request(
+            [
+                (("device", 5), device_properties),
+                (("device", 4194303), device_properties),
+                (("analogValue", 0), value_properties),
+                (("analogValue", 1), value_properties),
+                (("analogValue", 9), ["all", "objectName"]),
+            ]
+        )
+
+        ReadWritePropertyMultipleServices.do_ReadPropertyMultipleRequest(
+            sensor, request
+        )
+        sensor.do_ReadPropertyMultipleRequest(request)
+        sensor.set_values({"temp": 21.5, "co2": 480})
+        sensor.do_ReadPropertyMultipleRequest(request)
+
+        assert encode(responses[1]) == encode(responses[0])
+        assert encode(responses[2]) == encode(responses[0])
+
+    def test_read_property_multiple_array_index(self, mocker: MockFixture) -> None:
+        sensor, responses = make_sensor(mocker)
+        request = read_multiple_request([(("device", 5), ["objectList"])], 3)
+
+        ReadWritePropertyMultipleServices.do_ReadPropertyMultipleRequest(
+            sensor, request
+        )
+        sensor.do_ReadPropertyMultipleRequest(request)
+
+        assert encode(responses[1]) == encode(responses[0])
+
+    def test_read_present_value_changes(self, mocker: MockFixture) -> None:
+        sensor, responses = make_sensor(mocker)
+        request = read_request(("analogValue", 1), "presentValue")
+
+        sensor.do_ReadPropertyRequest(request)
+        sensor.set_values({"temp": 30.0, "co2": 480})
+        sensor.do_ReadPropertyRequest(request)
+
+        assert [response.propertyValue.cast_out(Real) for response in responses] == [
+            21.5,
+            30.0,
+        ]
+
+    def test_object_list_changes(self, mocker: MockFixture) -> None:
+        sensor, responses = make_sensor(mocker)
+        request = read_request(("device", 5), "objectList")
+
+        sensor.do_ReadPropertyRequest(request)
+        sensor.set_values({"temp": 21.5, "co2": 480, "voc": 3})
+        sensor.do_ReadPropertyRequest(request)
+        sensor.set_values({"voc": 3})
+        sensor.do_ReadPropertyRequest(request)
+
+        assert [len(response.propertyValue.tagList) for response in responses] == [
+            3,
+            4,
+            2,
+        ]
+
+    def test_shared_object_list_changes(self, mocker: MockFixture) -> None:
+        application = SharedSensorApplication(Address(1))
+        sensor = SharedSensor(3, Address(2), application)
+        sensor.set_values({"temp": 21.5})
+        device = sensor.localDevice
+
+        assert (
+            len(read_element(device, "objectList").readResult.propertyValue.tagList)
+            == 2
+        )
+
+        sensor.set_values({"temp": 21.5, "co2": 480})
+        assert (
+            len(read_element(device, "objectList").readResult.propertyValue.tagList)
+            == 3
+        )
+
+        sensor.set_values({"co2": 480})
+        assert (
+            len(read_element(device, "objectList").readResult.propertyValue.tagList)
+            == 2
+        )
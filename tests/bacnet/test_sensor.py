@@ -1,12 +1,42 @@
-from bacpypes.pdu import Address
-from bacpypes.apdu import ReadPropertyRequest
+from bacpypes.pdu import Address, LocalBroadcast
+from bacpypes.apdu import (
+    ConfirmedCOVNotificationRequest,
+    Error,
+    IAmRequest,
+    ReadPropertyRequest,
+    SimpleAckPDU,
+    SubscribeCOVRequest,
+    UnconfirmedCOVNotificationRequest,
+    WhoIsRequest,
+)
+from bacpypes.core import run_once
+from bacpypes.errors import ExecutionError
+from bacpypes.local.device import LocalDeviceObject
 from bacpypes.object import get_datatype
-
-from bacprop.bacnet.sensor import Sensor, Application
+from bacpypes.primitivedata import Real
+from bacpypes.task import TaskManager
+
+from bacprop.bacnet.network import VirtualSensorNetwork
+from bacprop.bacnet.sensor import (
+    BaseSensor,
+    Sensor,
+    Application,
+    SensorCOVServices,
+    SharedSensor,
+    SharedSensorApplication,
+    _DeviceAddress,
+    _SensorValueObject,
+    _VLANApplication,
+)
 from bacprop.bacnet import sensor
+from bacprop.bacnet.store import ValueStore
+from bacprop.metrics import BACNET_REQUESTS
+from bacprop.snapshot import SensorSnapshot
 from bacpypes.basetypes import StatusFlags
+import pytest
+from pytest import fixture
 from pytest_mock import MockFixture
-from typing import Dict
+from typing import Any, Dict, List
 
 import time
 
@@ -53,6 +83,7 @@ class TestSensor:
 
         prop2 = sensor.get_object_name("anotherProp")
         assert prop2.ReadProperty("objectIdentifier") == ("analogValue", 0)
+        assert sensor.get_object_count() == 2
 
     def test_mark_fault(self) -> None:
         sensor = Sensor(0, Address(0))
@@ -116,6 +147,292 @@ class TestSensor:
         assert sensor.get_object_name("otherProp").ReadProperty("presentValue") == 50
         assert sensor.get_object_name("prop2").ReadProperty("presentValue") == -20
 
+    def test_add_prop(self, mocker: MockFixture) -> None:
+        sensor = Sensor(0, Address(0))
+        sensor.set_values({"b": 1, "c": 2})
+
+        existing = sensor.get_object_name("b")
+        mocker.spy(sensor, "delete_object")
+
+        sensor.set_values({"a": 0, "b": 3, "c": 4})
+
+        # Only the new key gets an object, numbered after the others
+        sensor.delete_object.assert_not_called()  # type: ignore
+        assert sensor.get_object_name("b") is existing
+        assert sensor.get_object_name("a").ReadProperty("objectIdentifier") == (
+            "analogValue",
+            2,
+        )
+        assert sensor.get_object_name("c").ReadProperty("objectIdentifier") == (
+            "analogValue",
+            1,
+        )
+
+    def test_remove_prop(self) -> None:
+        sensor = Sensor(0, Address(0))
+        sensor.set_values({"a": 1, "b": 2})
+
+        sensor.set_values({"b": 3})
+
+        assert not sensor.get_object_name("a")
+        assert sensor.get_object_name("b").ReadProperty("objectIdentifier") == (
+            "analogValue",
+            1,
+        )
+
+    def test_returning_prop_keeps_instance(self) -> None:
+        sensor = Sensor(0, Address(0))
+        sensor.set_values({"a": 1, "b": 2})
+        sensor.set_values({"b": 3})
+        sensor.set_values({"a": 4, "b": 5})
+
+        assert sensor.get_object_name("a").ReadProperty("objectIdentifier") == (
+            "analogValue",
+            0,
+        )
+
+    def test_removed_keys_forgotten(self, mocker: MockFixture) -> None:
+        mocker.patch.object(BaseSensor, "REMOVED_KEYS", 2)
+        sensor = Sensor(0, Address(0))
+
+        for key in ("a", "b", "c", "d"):
+            sensor.set_values({key: 1})
+
+        # Only the instances of the last removed keys are kept,
+        # and the lowest forgotten instance is given to a new key
+        assert sensor.get_snapshot().keys == {
+            "b": (1, None),
+            "c": (2, None),
+            "d": (0, 1.0),
+        }
+
+        sensor.set_values({"b": 2, "d": 2})
+        sensor.set_values({"a": 3})
+
+        assert sensor.get_object_name("a").ReadProperty("objectIdentifier") == (
+            "analogValue",
+            2,
+        )
+        assert sensor.get_snapshot().keys == {
+            "a": (2, 3.0),
+            "b": (1, None),
+            "d": (0, None),
+        }
+        assert sensor._object_index == 3
+
+    def test_instances_run_out(self, mocker: MockFixture) -> None:
+        mocker.patch.object(sensor, "MAX_INSTANCE", 1)
+        error = mocker.patch.object(BaseSensor, "_error")
+        test_sensor = Sensor(0, Address(0))
+
+        test_sensor.set_values({"a": 1})
+        test_sensor.set_values({"b": 2})
+
+        # The removed key is forgotten early to make room
+        test_sensor.set_values({"b": 3, "c": 4})
+        assert test_sensor.get_snapshot().keys == {"b": (1, 3.0), "c": (0, 4.0)}
+        error.assert_not_called()
+
+        test_sensor.set_values({"b": 5, "c": 6, "d": 7})
+        assert test_sensor.get_snapshot().keys == {"b": (1, 5.0), "c": (0, 6.0)}
+        error.assert_called_once()
+
+        test_sensor.set_values({"d": 8}, merge=True)
+        assert test_sensor.get_object_name("d") is None
+        assert error.call_count == 2
+
+    def test_restore_forgets_removed_keys(self, mocker: MockFixture) -> None:
+        mocker.patch.object(BaseSensor, "REMOVED_KEYS", 1)
+        sensor = Sensor(0, Address(0))
+
+        keys = {"a": (0, None), "b": (1, None), "c": (2, 1.0)}
+        sensor.restore(SensorSnapshot(0, 0, 100.0, False, False, keys))
+
+        assert sensor.get_snapshot().keys == {"b": (1, None), "c": (2, 1.0)}
+
+    def test_new_prop_while_faulty(self) -> None:
+        sensor = Sensor(0, Address(0))
+        sensor.set_values({"a": 1})
+        sensor.mark_fault()
+
+        sensor.set_values({"a": 1, "b": 2})
+
+        status = sensor.get_object_name("b").ReadProperty("statusFlags")
+        assert status[StatusFlags.bitNames["fault"]] == 1
+
+    def test_values_in_store(self) -> None:
+        store = ValueStore()
+        sensor = Sensor(0, Address(0), store=store)
+        sensor.set_values({"a": 1, "b": 2})
+
+        assert store.export_values() == {0: {"a": 1, "b": 2}}
+        assert store.update_times[sensor._row] == sensor.get_update_time()
+
+        prop = sensor.get_object_name("a")
+        store.values[prop.get_slot()] = 5
+        assert prop.ReadProperty("presentValue") == 5
+
+        sensor.mark_fault()
+        assert store.count_faults() == 1
+
+        sensor.close()
+        assert store.count_sensors() == 0
+        assert store.export_values() == {}
+
+    def test_values_into_slots(self, mocker: MockFixture) -> None:
+        sensor = Sensor(0, Address(0))
+        sensor.set_values({"a": 1, "b": 2})
+        prop = sensor.get_object_name("a")
+        set_value = mocker.spy(_SensorValueObject, "set_value")
+
+        # Unchanged keys are written straight into their slots
+        sensor.set_values({"a": 3, "b": 4})
+        assert prop.ReadProperty("presentValue") == 3
+        set_value.assert_not_called()
+
+        # Keys in another order are still matched to their objects
+        sensor.set_values({"b": 5, "a": 6})
+        assert prop.ReadProperty("presentValue") == 6
+        assert sensor.get_object_name("b").ReadProperty("presentValue") == 5
+
+        # Monitored values go through their objects
+        monitor = mocker.Mock()
+        prop._property_monitors["presentValue"].append(monitor)
+        prop.monitor_added()
+
+        sensor.set_values({"b": 5, "a": 7})
+        assert set_value.call_count == 2
+        set_value.assert_any_call(prop, 7)
+        monitor.assert_called_once_with(6, 7)
+
+    def test_stored_properties_read_only(self) -> None:
+        sensor = Sensor(0, Address(0))
+        sensor.set_values({"a": 1})
+        prop = sensor.get_object_name("a")
+
+        with pytest.raises(ExecutionError):
+            prop.WriteProperty("presentValue", 2)
+
+        with pytest.raises(ExecutionError):
+            prop.WriteProperty("statusFlags", [0, 1, 0, 0], direct=True)
+
+        with pytest.raises(KeyError):
+            prop._values["unknownProperty"]  # pylint: disable=pointless-statement
+
+        assert prop.ReadProperty("presentValue") == 1
+
+    def test_merge_values(self, mocker: MockFixture) -> None:
+        sensor = Sensor(0, Address(0))
+        sensor.set_values({"temp": 21.0}, merge=True)
+
+        mocker.spy(sensor, "delete_object")
+        sensor.set_values({"co2": 480}, merge=True)
+
+        # Keys not in the message are left alone
+        sensor.delete_object.assert_not_called()  # type: ignore
+        assert sensor.get_object_name("temp").ReadProperty("presentValue") == 21.0
+        assert sensor.get_object_name("co2").ReadProperty("presentValue") == 480
+
+        sensor.set_values({"temp": 22.0}, merge=True)
+        assert sensor.get_object_name("temp").ReadProperty("presentValue") == 22.0
+
+    def test_merge_remove_key(self) -> None:
+        sensor = Sensor(0, Address(0))
+        sensor.set_values({"temp": 21.0, "co2": 480}, merge=True)
+
+        sensor.set_values({"co2": None, "unknown": None}, merge=True)
+
+        assert not sensor.get_object_name("co2")
+        assert sensor.get_object_name("temp")
+
+    def test_replace_ignores_removals(self) -> None:
+        sensor = Sensor(0, Address(0))
+
+        sensor.set_values({"temp": 21.0, "co2": None})
+
+        assert sensor.get_object_name("temp")
+        assert not sensor.get_object_name("co2")
+
+    def test_expire_keys(self, mocker: MockFixture) -> None:
+        mock_time = mocker.patch("time.time")
+        sensor = Sensor(0, Address(0))
+
+        mock_time.return_value = 100
+        sensor.set_values({"temp": 21.0, "co2": 480}, merge=True)
+        mock_time.return_value = 200
+        sensor.set_values({"temp": 22.0}, merge=True)
+
+        assert sensor.expire_keys(150) == ["co2"]
+        assert not sensor.get_object_name("co2")
+        assert sensor.get_object_name("temp")
+        assert sensor.expire_keys(150) == []
+
+    def test_replace_stops_key_expiry(self) -> None:
+        sensor = Sensor(0, Address(0))
+        sensor.set_values({"temp": 21.0}, merge=True)
+        sensor.set_values({"temp": 22.0})
+
+        assert sensor.expire_keys(time.time() + 1) == []
+        assert sensor.get_object_name("temp")
+
+    def test_clear_objects(self) -> None:
+        sensor = Sensor(0, Address(0))
+        sensor.set_values({"a": 1, "b": 2})
+
+        sensor._clear_objects()
+
+        assert not sensor.get_object_name("a")
+        assert not sensor._objects
+
+    def test_get_snapshot(self, mocker: MockFixture) -> None:
+        mocker.patch("time.time", return_value=100)
+        sensor = Sensor(3, Address((7).to_bytes(4, "big")))
+        sensor.set_values({"a": 1.5, "b": 2.5})
+        sensor.set_values({"b": 3.5})
+        sensor.mark_fault()
+
+        assert sensor.get_snapshot() == SensorSnapshot(
+            3, 7, 100, True, False, {"a": (0, None), "b": (1, 3.5)}
+        )
+
+        sensor.set_values({"c": 1.0}, merge=True)
+        assert sensor.get_snapshot().merged
+
+    def test_restore(self) -> None:
+        sensor = Sensor(3, Address(0))
+
+        sensor.restore(
+            SensorSnapshot(3, 7, 100, True, False, {"a": (4, None), "b": (1, 3.5)})
+        )
+
+        prop = sensor.get_object_name("b")
+        assert prop.ReadProperty("objectIdentifier") == ("analogValue", 1)
+        assert prop.ReadProperty("presentValue") == 3.5
+        assert prop.ReadProperty("statusFlags")[StatusFlags.bitNames["fault"]] == 1
+        assert not sensor.get_object_name("a")
+        assert sensor.has_fault()
+        assert sensor.get_update_time() == 100
+
+        # Keys keep their instances, and new keys take the unused ones
+        sensor.set_values({"a": 1.0, "c": 2.0})
+        assert sensor.get_object_name("a").ReadProperty("objectIdentifier") == (
+            "analogValue",
+            4,
+        )
+        assert sensor.get_object_name("c").ReadProperty("objectIdentifier") == (
+            "analogValue",
+            0,
+        )
+        assert sensor._free_instances == [2, 3]
+
+    def test_restore_merged(self) -> None:
+        sensor = Sensor(3, Address(0))
+
+        sensor.restore(SensorSnapshot(3, 7, 100, False, True, {"a": (0, 1.0)}))
+
+        assert sensor.expire_keys(99) == []
+        assert sensor.expire_keys(101) == ["a"]
+
     def test_request_hook(self, mocker: MockFixture) -> None:
         sensor = Sensor(0, Address(0))
         mocker.patch.object(Application, "request", autospec=True)
@@ -142,11 +459,452 @@ class TestSensor:
         # pylint: disable=no-member
         Application.indication.assert_called_with(sensor, "something")
 
+    def test_announce(self, mocker: MockFixture) -> None:
+        sensor = Sensor(0, Address(0))
+        mocker.patch.object(sensor, "i_am", autospec=True)
+
+        sensor.announce()
+
+        sensor.i_am.assert_called_once_with()  # type: ignore
+
+    def test_announcer_touched(self, mocker: MockFixture) -> None:
+        announcer = mocker.MagicMock()
+        sensor = Sensor(0, Address(0), announcer=announcer)
+
+        sensor.set_values({"temp": 1})
+
+        announcer.touch.assert_called_once_with(sensor)
+
     def test_confirmation_hook(self, mocker: MockFixture) -> None:
         sensor = Sensor(0, Address(0))
 
-        mocker.patch.object(Application, "confirmation", autospec=True)
+        mocker.patch.object(SensorCOVServices, "confirmation", autospec=True)
 
         sensor.confirmation("something")
         # pylint: disable=no-member
-        Application.confirmation.assert_called_with(sensor, "something")
+        SensorCOVServices.confirmation.assert_called_with(  # type: ignore
+            sensor, "something"
+        )
+
+
+class TestSensorCOV:
+    def test_notifications(self, mocker: MockFixture) -> None:
+        mocker.patch("bacprop.bacnet.network._VLANRouter")
+        TaskManager()
+        network = VirtualSensorNetwork(
+            "0.0.0.0", cov_increments={"temp": 0.5}, announce_rate=0
+        )
+        network.remove_node(network.nodes[0])
+
+        received: List[Any] = []
+        client = make_client(network, received)
+        sensor = network.create_sensor(5)
+        sensor.set_values({"temp": 20})
+        requests = BACNET_REQUESTS.get_count("SubscribeCOVRequest")
+
+        client.request(
+            SubscribeCOVRequest(
+                subscriberProcessIdentifier=1,
+                monitoredObjectIdentifier=("analogValue", 0),
+                issueConfirmedNotifications=False,
+                lifetime=60,
+                destination=sensor.get_address(),
+            )
+        )
+        run_tasks()
+        assert isinstance(received[-1], UnconfirmedCOVNotificationRequest)
+        assert BACNET_REQUESTS.get_count("SubscribeCOVRequest") == requests + 1
+        received.clear()
+
+        for value in (20.2, 20.4, 20.6, 20.6):
+            sensor.set_values({"temp": value})
+            run_tasks()
+
+        assert len(received) == 1
+        assert received[0].pduSource == sensor.get_address()
+        assert received[0].listOfValues[0].value.cast_out(Real) == pytest.approx(20.6)
+
+        # Subscriptions of every sensor share the network's expiry
+        expiry = sensor.subscription_expiry  # type: ignore
+        assert expiry is network._subscription_expiry
+        assert len(network._subscription_expiry) == 1
+
+    def test_remove_cancels_subscriptions(self, mocker: MockFixture) -> None:
+        mocker.patch("bacprop.bacnet.network._VLANRouter")
+        TaskManager()
+        network = VirtualSensorNetwork("0.0.0.0", announce_rate=0)
+        network.remove_node(network.nodes[0])
+
+        received: List[Any] = []
+        client = make_client(network, received)
+        sensor = network.create_sensor(5)
+        sensor.set_values({"temp": 20})
+
+        client.request(
+            SubscribeCOVRequest(
+                subscriberProcessIdentifier=1,
+                monitoredObjectIdentifier=("analogValue", 0),
+                issueConfirmedNotifications=False,
+                lifetime=60,
+                destination=sensor.get_address(),
+            )
+        )
+        run_tasks()
+        assert len(network._subscription_expiry) == 1
+
+        network.remove_sensor(5)
+
+        assert len(network._subscription_expiry) == 0
+        assert not sensor.cov_detections  # type: ignore
+
+    def test_cancel_restores_direct_values(self, mocker: MockFixture) -> None:
+        mocker.patch("bacprop.bacnet.network._VLANRouter")
+        TaskManager()
+        network = VirtualSensorNetwork("0.0.0.0", announce_rate=0)
+        network.remove_node(network.nodes[0])
+
+        received: List[Any] = []
+        client = make_client(network, received)
+        sensor = network.create_sensor(5)
+        sensor.set_values({"temp": 20})
+        assert sensor._direct
+
+        def subscribe(**kwargs: Any) -> None:
+            client.request(
+                SubscribeCOVRequest(
+                    subscriberProcessIdentifier=1,
+                    monitoredObjectIdentifier=("analogValue", 0),
+                    destination=sensor.get_address(),
+                    **kwargs,
+                )
+            )
+            run_tasks()
+
+        subscribe(issueConfirmedNotifications=False, lifetime=60)
+        sensor.set_values({"temp": 21})
+        assert not sensor._direct
+
+        # A request without a lifetime or confirmation cancels
+        subscribe()
+        sensor.set_values({"temp": 22})
+
+        assert sensor._direct
+        assert not sensor._objects["temp"].is_monitored()
+        assert network._store.monitored == 0
+
+        # Subscribed again, with the same number of monitored objects
+        # as when the values were last checked
+        subscribe(issueConfirmedNotifications=False, lifetime=60)
+        received.clear()
+        sensor.set_values({"temp": 23})
+        run_tasks()
+
+        assert not sensor._direct
+        assert len(received) == 1
+
+
+def run_tasks() -> None:
+    # Each pass only runs the tasks which are due when it starts
+    for _ in range(5):
+        run_once()
+
+
+def make_client(network: VirtualSensorNetwork, received: List[Any]) -> _VLANApplication:
+    class Client(_VLANApplication):
+        def confirmation(self, apdu: Any) -> None:
+            received.append(apdu)
+
+        def indication(self, apdu: Any) -> None:
+            received.append(apdu)
+
+    client = Client(
+        LocalDeviceObject(
+            objectName="client", objectIdentifier=("device", 999), vendorIdentifier=15
+        ),
+        Address((100).to_bytes(4, "big")),
+    )
+    network.add_node(client.get_node())
+
+    return client
+
+
+@fixture
+def shared_network(mocker: MockFixture) -> VirtualSensorNetwork:
+    mocker.patch("bacprop.bacnet.network._VLANRouter")
+    TaskManager()
+
+    # Announcements would be received by the test clients
+    network = VirtualSensorNetwork("0.0.0.0", shared_stack=True, announce_rate=0)
+    # Nothing is bound to the router node
+    network.remove_node(network.nodes[0])
+
+    return network
+
+
+class TestSharedSensor:
+    def test_init(self) -> None:
+        app = SharedSensorApplication(Address(1))
+        sensor = SharedSensor(3, Address(2), app)
+
+        assert sensor.localDevice.ReadProperty("objectIdentifier") == ("device", 3)
+        assert sensor.get_address() == Address(2)
+        assert sensor.get_object_id(("device", 3)) == sensor.localDevice
+
+    def test_announce(self, mocker: MockFixture) -> None:
+        app = SharedSensorApplication(Address(1))
+        sensor = SharedSensor(3, Address(2), app)
+        mocker.patch.object(app, "announce", autospec=True)
+
+        sensor.announce()
+
+        app.announce.assert_called_once_with(sensor)  # type: ignore
+
+    def test_set_values(self) -> None:
+        app = SharedSensorApplication(Address(1))
+        sensor = SharedSensor(3, Address(2), app)
+
+        sensor.set_values({"testProp": 0.2, "anotherProp": 0.7})
+
+        prop = sensor.get_object_name("testProp")
+        assert prop.ReadProperty("presentValue") == 0.2
+        assert prop.ReadProperty("objectIdentifier") == ("analogValue", 1)
+        assert list(sensor.localDevice.objectList) == [
+            ("device", 3),
+            ("analogValue", 0),
+            ("analogValue", 1),
+        ]
+
+        sensor.set_values({"otherProp": 50})
+
+        assert not sensor.get_object_name("testProp")
+        assert list(sensor.localDevice.objectList) == [
+            ("device", 3),
+            ("analogValue", 2),
+        ]
+
+    def test_add_object_exists(self) -> None:
+        app = SharedSensorApplication(Address(1))
+        sensor = SharedSensor(3, Address(2), app)
+        sensor.set_values({"testProp": 0.2})
+
+        store = ValueStore()
+        row = store.add_row(3)
+
+        with pytest.raises(RuntimeError):
+            sensor.add_object(
+                _SensorValueObject(1, "testProp", store, row, store.add_slot(row, "a"))
+            )
+
+        with pytest.raises(RuntimeError):
+            sensor.add_object(
+                _SensorValueObject(0, "otherProp", store, row, store.add_slot(row, "b"))
+            )
+
+    def test_mark_fault(self) -> None:
+        app = SharedSensorApplication(Address(1))
+        sensor = SharedSensor(3, Address(2), app)
+        sensor.set_values({"something": 2})
+
+        sensor.mark_fault()
+
+        assert sensor.has_fault()
+        assert (
+            sensor.get_object_name("something").ReadProperty("statusFlags")[
+                StatusFlags.bitNames["fault"]
+            ]
+            == 1
+        )
+
+
+class TestSharedSensorApplication:
+    def test_read_property(self, shared_network: VirtualSensorNetwork) -> None:
+        received: List[Any] = []
+        client = make_client(shared_network, received)
+
+        sensor1 = shared_network.create_sensor(5)
+        sensor1.set_values({"temp": 21.5})
+        sensor2 = shared_network.create_sensor(6)
+        sensor2.set_values({"temp": 3})
+        requests = BACNET_REQUESTS.get_count("ReadPropertyRequest")
+
+        for sensor in (sensor1, sensor2):
+            client.request(
+                ReadPropertyRequest(
+                    objectIdentifier=("analogValue", 0),
+                    propertyIdentifier="presentValue",
+                    destination=sensor.get_address(),
+                )
+            )
+        run_tasks()
+
+        assert [
+            (apdu.pduSource, apdu.propertyValue.cast_out(Real)) for apdu in received
+        ] == [(sensor1.get_address(), 21.5), (sensor2.get_address(), 3)]
+        assert BACNET_REQUESTS.get_count("ReadPropertyRequest") == requests + 2
+
+    def test_unknown_object(self, shared_network: VirtualSensorNetwork) -> None:
+        received: List[Any] = []
+        client = make_client(shared_network, received)
+        sensor = shared_network.create_sensor(5)
+
+        client.request(
+            ReadPropertyRequest(
+                objectIdentifier=("analogValue", 0),
+                propertyIdentifier="presentValue",
+                destination=sensor.get_address(),
+            )
+        )
+        run_tasks()
+
+        assert isinstance(received[0], Error)
+        assert received[0].pduSource == sensor.get_address()
+
+    def test_who_is(self, shared_network: VirtualSensorNetwork) -> None:
+        received: List[Any] = []
+        client = make_client(shared_network, received)
+
+        for sensor_id in range(5):
+            shared_network.create_sensor(sensor_id)
+
+        client.who_is(1, 2, LocalBroadcast())
+        run_tasks()
+
+        assert [apdu.iAmDeviceIdentifier for apdu in received] == [
+            ("device", 1),
+            ("device", 2),
+        ]
+        assert (
+            received[0].pduSource
+            == shared_network.get_sensor(1).get_address()  # type: ignore
+        )
+
+    def test_who_is_inconsistent(
+        self, shared_network: VirtualSensorNetwork, mocker: MockFixture
+    ) -> None:
+        app = shared_network._shared_app
+        assert app
+        mocker.patch.object(app, "do_WhoIsRequest", autospec=True)
+        for sensor_id in range(3):
+            shared_network.create_sensor(sensor_id)
+
+        app.indication(WhoIsRequest(deviceInstanceRangeLowLimit=1))
+
+        # Left to each sensor to reject
+        assert app.do_WhoIsRequest.call_count == 3  # type: ignore
+
+    def test_ignores_other_broadcasts(
+        self, shared_network: VirtualSensorNetwork, mocker: MockFixture
+    ) -> None:
+        app = shared_network._shared_app
+        assert app
+        mocker.patch.object(app, "do_WhoIsRequest", autospec=True)
+        shared_network.create_sensor(1)
+
+        app.indication(IAmRequest())
+
+        app.do_WhoIsRequest.assert_not_called()  # type: ignore
+
+    def test_announce(self, shared_network: VirtualSensorNetwork) -> None:
+        received: List[Any] = []
+        make_client(shared_network, received)
+        sensor = shared_network.create_sensor(7)
+
+        app = shared_network._shared_app
+        assert app
+
+        app.announce(sensor)  # type: ignore
+        run_tasks()
+
+        assert received[0].iAmDeviceIdentifier == ("device", 7)
+        assert received[0].pduSource == sensor.get_address()
+        assert not app.localDevice
+
+    def test_cov_subscription(self, shared_network: VirtualSensorNetwork) -> None:
+        received: List[Any] = []
+        client = make_client(shared_network, received)
+        sensor1 = shared_network.create_sensor(5)
+        sensor1.set_values({"temp": 20})
+        sensor2 = shared_network.create_sensor(6)
+        sensor2.set_values({"temp": 20})
+
+        for sensor in (sensor1, sensor2):
+            client.request(
+                SubscribeCOVRequest(
+                    subscriberProcessIdentifier=1,
+                    monitoredObjectIdentifier=("analogValue", 0),
+                    issueConfirmedNotifications=True,
+                    lifetime=60,
+                    destination=sensor.get_address(),
+                )
+            )
+        run_tasks()
+
+        notifications = [
+            apdu
+            for apdu in received
+            if isinstance(apdu, ConfirmedCOVNotificationRequest)
+        ]
+        assert [apdu.initiatingDeviceIdentifier for apdu in notifications] == [
+            ("device", 5),
+            ("device", 6),
+        ]
+
+        for apdu in notifications:
+            client.response(SimpleAckPDU(context=apdu))
+        run_tasks()
+
+        app = shared_network._shared_app
+        assert app
+        # The acks were matched to the notifications from each sensor
+        assert not app._smap.clientTransactions
+        assert not app.cov_detections
+
+        received.clear()
+        sensor2.mark_fault()
+        run_tasks()
+
+        assert received[0].pduSource == sensor2.get_address()
+        assert received[0].initiatingDeviceIdentifier == ("device", 6)
+
+    def test_cov_removed_object(self, shared_network: VirtualSensorNetwork) -> None:
+        received: List[Any] = []
+        client = make_client(shared_network, received)
+        sensor = shared_network.create_sensor(5)
+        sensor.set_values({"temp": 20})
+
+        client.request(
+            SubscribeCOVRequest(
+                subscriberProcessIdentifier=1,
+                monitoredObjectIdentifier=("analogValue", 0),
+                issueConfirmedNotifications=False,
+                lifetime=60,
+                destination=sensor.get_address(),
+            )
+        )
+        run_tasks()
+
+        sensor.set_values({"co2": 400})
+
+        assert not sensor.cov_detections  # type: ignore
+        assert len(shared_network._subscription_expiry) == 0
+
+    def test_remove_sensor(self) -> None:
+        app = SharedSensorApplication(Address(1))
+        sensor = SharedSensor(3, Address(2), app)
+
+        app.add_sensor(sensor)
+        app.remove_sensor(sensor)
+
+        assert not app._sensors
+        assert not app._device_index
+        assert not app.get_node().addresses
+
+
+class TestDeviceAddress:
+    def test_equality(self) -> None:
+        address = _DeviceAddress(Address(100), Address(2))
+
+        assert address == _DeviceAddress(Address(100), Address(2))
+        assert address != _DeviceAddress(Address(100), Address(3))
+        assert address != Address(100)
+        assert hash(address) == hash(_DeviceAddress(Address(100), Address(2)))
@@ -0,0 +1,91 @@
+from bacprop.bacnet import store
+from bacprop.bacnet.store import FREE, ValueStore
+
+# Required for full coverage
+store._debug = 1
+
+
+class TestValueStore:
+    def test_add_row(self) -> None:
+        value_store = ValueStore()
+
+        assert value_store.add_row(7) == 0
+        assert value_store.add_row(8) == 1
+
+        assert list(value_store.sensor_ids) == [7, 8]
+        assert list(value_store.update_times) == [0.0, 0.0]
+        assert list(value_store.faults) == [0, 0]
+        assert value_store.count_sensors() == 2
+
+    def test_free_row(self) -> None:
+        value_store = ValueStore()
+
+        row = value_store.add_row(7)
+        value_store.add_row(8)
+        value_store.update_times[row] = 5.0
+        value_store.faults[row] = 1
+
+        value_store.free_row(row)
+
+        assert value_store.sensor_ids[row] == FREE
+        assert value_store.update_times[row] == 0.0
+        assert value_store.faults[row] == 0
+        assert value_store.count_sensors() == 1
+
+        # Freed rows are reused
+        assert value_store.add_row(9) == row
+        assert value_store.sensor_ids[row] == 9
+        assert value_store.count_sensors() == 2
+
+    def test_add_free_slot(self) -> None:
+        value_store = ValueStore()
+        row = value_store.add_row(7)
+
+        slot = value_store.add_slot(row, "temp")
+        assert value_store.add_slot(row, "humidity") == slot + 1
+        value_store.values[slot] = 21.5
+
+        value_store.free_slot(slot)
+        assert value_store.slot_rows[slot] == FREE
+        assert value_store.values[slot] == 0.0
+
+        # Freed slots are reused
+        assert value_store.add_slot(row, "co2") == slot
+        assert value_store.slot_rows[slot] == row
+
+    def test_count_faults(self) -> None:
+        value_store = ValueStore()
+        rows = [value_store.add_row(sensor_id) for sensor_id in range(4)]
+
+        assert value_store.count_faults() == 0
+
+        value_store.faults[rows[1]] = 1
+        value_store.faults[rows[3]] = 1
+        assert value_store.count_faults() == 2
+
+        value_store.free_row(rows[1])
+        assert value_store.count_faults() == 1
+
+    def test_export_values(self) -> None:
+        value_store = ValueStore()
+        row = value_store.add_row(7)
+        row2 = value_store.add_row(8)
+        value_store.add_row(9)
+
+        value_store.values[value_store.add_slot(row, "temp")] = 21.5
+        value_store.values[value_store.add_slot(row2, "temp")] = 19.0
+        humidity = value_store.add_slot(row2, "humidity")
+        value_store.values[humidity] = 40.0
+
+        value_store.free_slot(humidity)
+
+        removed = value_store.add_row(10)
+        value_store.free_slot(value_store.add_slot(removed, "temp"))
+        value_store.free_row(removed)
+
+        # Sensors without keys are still exported
+        assert value_store.export_values() == {
+            7: {"temp": 21.5},
+            8: {"temp": 19.0},
+            9: {},
+        }
@@ -0,0 +1,114 @@
+from typing import Any
+
+import pytest
+from bacpypes.apdu import APDU, IAmRequest, WhoIsRequest
+from bacpypes.npdu import NPDU, WhatIsNetworkNumber
+from bacpypes.pdu import PDU
+
+from bacprop.bacnet.whois import MAX_INSTANCE, DeviceIndex, decode_request, who_is_range
+
+
+def encode(request: Any) -> PDU:
+    apdu = APDU()
+    request.encode(apdu)
+
+    npdu = NPDU()
+    apdu.encode(npdu)
+
+    pdu = PDU()
+    npdu.encode(pdu)
+    return pdu
+
+
+class TestWhoIsRange:
+    def test_all(self) -> None:
+        assert who_is_range(None, None) == (0, MAX_INSTANCE)
+
+    def test_range(self) -> None:
+        assert who_is_range(3, 9) == (3, 9)
+
+    def test_inconsistent(self) -> None:
+        assert who_is_range(3, None) is None
+        assert who_is_range(None, 9) is None
+        assert who_is_range(-1, 9) is None
+        assert who_is_range(0, MAX_INSTANCE + 1) is None
+
+
+class TestDecodeRequest:
+    def test_who_is(self) -> None:
+        pdu = encode(
+            WhoIsRequest(deviceInstanceRangeLowLimit=3, deviceInstanceRangeHighLimit=9)
+        )
+
+        request = decode_request(pdu)
+
+        assert isinstance(request, WhoIsRequest)
+        assert request.deviceInstanceRangeLowLimit == 3
+        assert request.deviceInstanceRangeHighLimit == 9
+
+        # The PDU can still be delivered
+        assert isinstance(decode_request(pdu), WhoIsRequest)
+
+    def test_i_am(self) -> None:
+        i_am = IAmRequest(
+            iAmDeviceIdentifier=("device", 1),
+            maxAPDULengthAccepted=1024,
+            segmentationSupported="noSegmentation",
+            vendorID=15,
+        )
+
+        request = decode_request(encode(i_am))
+
+        assert isinstance(request, IAmRequest)
+        assert request.iAmDeviceIdentifier == ("device", 1)
+
+    def test_not_requests(self) -> None:
+        npdu = NPDU()
+        WhatIsNetworkNumber().encode(npdu)
+        pdu = PDU()
+        npdu.encode(pdu)
+        assert decode_request(pdu) is None
+
+        # Confirmed ReadProperty
+        assert decode_request(PDU(b"\x01\x00\x00\x05\x01\x0c")) is None
+
+        # Unknown unconfirmed service
+        assert decode_request(PDU(b"\x01\x00\x10\x7f")) is None
+
+    def test_invalid(self) -> None:
+        assert decode_request(PDU()) is None
+        assert decode_request(PDU(b"\x01\x00\x10\x08\x09")) is None
+
+
+class TestDeviceIndex:
+    def test_find(self) -> None:
+        index: DeviceIndex[str] = DeviceIndex()
+        for instance in (50, 7, 12, 3):
+            index.add(instance, f"device {instance}")
+
+        assert len(index) == 4
+        assert index.find((0, MAX_INSTANCE)) == [
+            "device 3",
+            "device 7",
+            "device 12",
+            "device 50",
+        ]
+        assert index.find((7, 12)) == ["device 7", "device 12"]
+        assert index.find((13, 49)) == []
+
+    def test_remove(self) -> None:
+        index: DeviceIndex[str] = DeviceIndex()
+        index.add(1, "a")
+        index.add(2, "b")
+
+        index.remove(1)
+
+        assert index.find((0, 10)) == ["b"]
+        assert len(index) == 1
+
+    def test_duplicate(self) -> None:
+        index: DeviceIndex[str] = DeviceIndex()
+        index.add(1, "a")
+
+        with pytest.raises(ValueError):
+            index.add(1, "b")
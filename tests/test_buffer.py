@@ -0,0 +1,60 @@
+from bacprop import buffer
+from bacprop.buffer import UpdateBuffer
+
+# Required for full coverage
+buffer._debug = 1
+
+
+class TestUpdateBuffer:
+    def test_take(self) -> None:
+        updates = UpdateBuffer()
+        updates.put(1, {"temp": 1})
+        updates.put(2, {"temp": 2})
+
+        assert len(updates) == 2
+        assert updates.take() == {1: (False, {"temp": 1}), 2: (False, {"temp": 2})}
+        assert updates.take() == {}
+        assert not updates
+
+    def test_last_value_wins(self) -> None:
+        updates = UpdateBuffer()
+        updates.put(1, {"temp": 1, "co2": 400})
+        updates.put(1, {"temp": 2})
+
+        assert updates.take() == {1: (False, {"temp": 2})}
+
+    def test_merge(self) -> None:
+        updates = UpdateBuffer()
+        updates.put(1, {"temp": 1, "co2": 400}, True)
+        updates.put(1, {"temp": 2, "humidity": None}, True)
+
+        assert updates.take() == {1: (True, {"temp": 2, "co2": 400, "humidity": None})}
+
+    def test_merge_into_replace(self) -> None:
+        updates = UpdateBuffer()
+        updates.put(1, {"temp": 1})
+        updates.put(1, {"co2": 400}, True)
+
+        # Still replaces the sensor's keys once applied
+        assert updates.take() == {1: (False, {"temp": 1, "co2": 400})}
+
+    def test_counters(self) -> None:
+        updates = UpdateBuffer()
+        updates.put(1, {"temp": 1})
+        updates.put(1, {"temp": 2})
+        updates.put(1, {"temp": 3})
+        updates.put(2, {"temp": 1})
+
+        assert updates.coalesced == 2
+        assert updates.applied == 0
+
+        updates.take()
+        assert updates.applied == 2
+
+    def test_values_copied(self) -> None:
+        updates = UpdateBuffer()
+        values = {"temp": 1.0}
+        updates.put(1, values, True)
+        updates.put(1, {"temp": 2.0}, True)
+
+        assert values == {"temp": 1.0}
@@ -1,3 +1,7 @@
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import pytest
+
 from bacprop import cli
 from bacprop.service import BacPropagator
 from pytest_mock import MockFixture
@@ -19,3 +23,281 @@ class TestCli:
         cli.main()
 
         mock_service.start.assert_called_once()
+
+    def test_service_timeouts(self, mocker: MockFixture) -> None:
+        mock_service = mocker.patch("bacprop.cli.BacPropagator")
+        mocker.patch.dict(
+            "os.environ",
+            {"SENSOR_TIMEOUT": "30", "SENSOR_GROUP_TIMEOUTS": "0-9:5,10-19:60"},
+        )
+
+        cli.main()
+
+        mock_service.assert_called_once_with(
+            sensor_timeout=30.0,
+            group_timeouts=[(range(0, 10), 5.0), (range(10, 20), 60.0)],
+            shared_stack=False,
+            flush_interval=mocker.ANY,
+            merge_sensors=[],
+            merge_topics=[],
+            key_timeout=None,
+            stream=mocker.ANY,
+            decode_executor=None,
+            decode_max_in_flight=64,
+            cov_increments={},
+            announce_rate=20.0,
+            snapshot_path=None,
+            snapshot_interval=mocker.ANY,
+            lazy_stacks=False,
+            eager_sensors=[],
+            idle_timeout=600,
+            retire_after=None,
+            networks=1,
+            network_size=0,
+            asyncio_core=False,
+            metrics_port=None,
+            metrics_address="127.0.0.1",
+            profile_dir=mocker.ANY,
+            profile_seconds=mocker.ANY,
+            log_period=60.0,
+            log_burst=5,
+            log_sample=0,
+        )
+
+    def test_parse_group_timeouts_empty(self) -> None:
+        assert cli.parse_group_timeouts("") == []
+
+    def test_parse_group_timeouts_single(self) -> None:
+        assert cli.parse_group_timeouts("7:60,10-11:5") == [
+            (range(7, 8), 60.0),
+            (range(10, 12), 5.0),
+        ]
+
+    def test_parse_group_timeouts_invalid(self) -> None:
+        for spec in ("7", "0-9", "a-9:60", "0-9:soon", "0-9-12:60"):
+            with pytest.raises(ValueError, match="Invalid group timeout"):
+                cli.parse_group_timeouts(spec)
+
+    def test_service_shared_stack(self, mocker: MockFixture) -> None:
+        mock_service = mocker.patch("bacprop.cli.BacPropagator")
+        mocker.patch.dict("os.environ", {"BACNET_SHARED_STACK": "1"})
+
+        cli.main()
+
+        assert mock_service.call_args[1]["shared_stack"]
+
+    def test_service_flush_interval(self, mocker: MockFixture) -> None:
+        mock_service = mocker.patch("bacprop.cli.BacPropagator")
+        mocker.patch.dict("os.environ", {"UPDATE_FLUSH_INTERVAL": "0.5"})
+
+        cli.main()
+
+        assert mock_service.call_args[1]["flush_interval"] == 0.5
+
+    def test_service_merge(self, mocker: MockFixture) -> None:
+        mock_service = mocker.patch("bacprop.cli.BacPropagator")
+        mocker.patch.dict(
+            "os.environ",
+            {
+                "MERGE_SENSORS": "7,10-19",
+                "MERGE_TOPICS": "sensor/partial/#",
+                "KEY_TIMEOUT": "3600",
+            },
+        )
+
+        cli.main()
+
+        kwargs = mock_service.call_args[1]
+        assert kwargs["merge_sensors"] == [range(7, 8), range(10, 20)]
+        assert kwargs["merge_topics"] == ["sensor/partial/#"]
+        assert kwargs["key_timeout"] == 3600.0
+
+    def test_parse_sensor_ids_empty(self) -> None:
+        assert cli.parse_sensor_ids("", "MERGE_SENSORS") == []
+
+    def test_parse_sensor_ids_invalid(self) -> None:
+        for spec in ("a", "1-b", "0-9-12", "7,x"):
+            with pytest.raises(ValueError, match="Invalid sensor ids .* EAGER_SENSORS"):
+                cli.parse_sensor_ids(spec, "EAGER_SENSORS")
+
+    def test_parse_cov_increments_invalid(self) -> None:
+        for spec in ("temp", ":0.5", "temp:", "temp:high", "temp:0.5,co2"):
+            with pytest.raises(ValueError, match="Invalid COV increment .* COV_"):
+                cli.parse_cov_increments(spec)
+
+    def test_embedded_broker(self, mocker: MockFixture) -> None:
+        mocker.patch("bacprop.cli.BacPropagator")
+        mock_stream = mocker.patch("bacprop.cli.SensorStream")
+        mocker.patch.dict("os.environ", {"MQTT_PORT": "1885"})
+
+        cli.main()
+
+        mock_stream.assert_called_once_with(1885)
+
+    def test_external_broker(self, mocker: MockFixture) -> None:
+        mock_service = mocker.patch("bacprop.cli.BacPropagator")
+        mock_stream = mocker.patch("bacprop.cli.ClientSensorStream")
+        mocker.patch.dict(
+            "os.environ",
+            {
+                "MQTT_EXTERNAL_BROKER": "1",
+                "MQTT_ADDR": "broker.local",
+                "MQTT_PORT": "1885",
+                "MQTT_QOS": "1",
+                "MQTT_SHARED_GROUP": "bacprop",
+            },
+        )
+
+        cli.main()
+
+        mock_stream.assert_called_once_with(
+            "broker.local", 1885, qos=1, shared_group="bacprop"
+        )
+        assert mock_service.call_args[1]["stream"] == mock_stream.return_value
+
+    def test_decode_pool(self, mocker: MockFixture) -> None:
+        mock_service = mocker.patch("bacprop.cli.BacPropagator")
+        mock_make = mocker.patch("bacprop.cli.make_decode_executor")
+        mocker.patch.dict(
+            "os.environ",
+            {
+                "DECODE_WORKERS": "4",
+                "DECODE_POOL": "thread",
+                "DECODE_MAX_IN_FLIGHT": "16",
+            },
+        )
+
+        cli.main()
+
+        mock_make.assert_called_once_with("thread", 4)
+        kwargs = mock_service.call_args[1]
+        assert kwargs["decode_executor"] == mock_make.return_value
+        assert kwargs["decode_max_in_flight"] == 16
+
+    def test_make_process_pool(self) -> None:
+        executor = cli.make_decode_executor("process", 2)
+        assert isinstance(executor, ProcessPoolExecutor)
+        executor.shutdown()
+
+    def test_make_thread_pool(self) -> None:
+        executor = cli.make_decode_executor("thread", 2)
+        assert isinstance(executor, ThreadPoolExecutor)
+        executor.shutdown()
+
+    def test_make_unknown_pool(self) -> None:
+        with pytest.raises(ValueError):
+            cli.make_decode_executor("fibre", 2)
+
+    def test_service_announce_rate(self, mocker: MockFixture) -> None:
+        mock_service = mocker.patch("bacprop.cli.BacPropagator")
+        mocker.patch.dict("os.environ", {"ANNOUNCE_RATE": "5"})
+
+        cli.main()
+
+        assert mock_service.call_args[1]["announce_rate"] == 5.0
+
+    def test_service_snapshot(self, mocker: MockFixture) -> None:
+        mock_service = mocker.patch("bacprop.cli.BacPropagator")
+        mocker.patch.dict(
+            "os.environ",
+            {"SNAPSHOT_PATH": "/var/lib/bacprop/sensors", "SNAPSHOT_INTERVAL": "30"},
+        )
+
+        cli.main()
+
+        assert mock_service.call_args[1]["snapshot_path"] == "/var/lib/bacprop/sensors"
+        assert mock_service.call_args[1]["snapshot_interval"] == 30.0
+
+    def test_service_lazy_stacks(self, mocker: MockFixture) -> None:
+        mock_service = mocker.patch("bacprop.cli.BacPropagator")
+        mocker.patch.dict(
+            "os.environ",
+            {
+                "BACNET_LAZY_STACKS": "1",
+                "EAGER_SENSORS": "3,10-19",
+                "STACK_IDLE_TIMEOUT": "60",
+            },
+        )
+
+        cli.main()
+
+        assert mock_service.call_args[1]["lazy_stacks"]
+        assert mock_service.call_args[1]["eager_sensors"] == [
+            range(3, 4),
+            range(10, 20),
+        ]
+        assert mock_service.call_args[1]["idle_timeout"] == 60.0
+
+    def test_service_retire_after(self, mocker: MockFixture) -> None:
+        mock_service = mocker.patch("bacprop.cli.BacPropagator")
+        mocker.patch.dict("os.environ", {"SENSOR_RETIRE_AFTER": "86400"})
+
+        cli.main()
+
+        assert mock_service.call_args[1]["retire_after"] == 86400.0
+
+    def test_service_networks(self, mocker: MockFixture) -> None:
+        mock_service = mocker.patch("bacprop.cli.BacPropagator")
+        mocker.patch.dict(
+            "os.environ", {"BACNET_NETWORKS": "4", "BACNET_NETWORK_SIZE": "1000"}
+        )
+
+        cli.main()
+
+        assert mock_service.call_args[1]["networks"] == 4
+        assert mock_service.call_args[1]["network_size"] == 1000
+
+    def test_service_asyncio_core(self, mocker: MockFixture) -> None:
+        mock_service = mocker.patch("bacprop.cli.BacPropagator")
+        mocker.patch.dict("os.environ", {"BACNET_ASYNCIO": "1"})
+
+        cli.main()
+
+        assert mock_service.call_args[1]["asyncio_core"]
+
+    def test_service_metrics(self, mocker: MockFixture) -> None:
+        mock_service = mocker.patch("bacprop.cli.BacPropagator")
+        mocker.patch.dict(
+            "os.environ", {"METRICS_PORT": "9180", "METRICS_ADDR": "0.0.0.0"}
+        )
+
+        cli.main()
+
+        assert mock_service.call_args[1]["metrics_port"] == 9180
+        assert mock_service.call_args[1]["metrics_address"] == "0.0.0.0"
+
+    def test_service_profile(self, mocker: MockFixture) -> None:
+        mock_service = mocker.patch("bacprop.cli.BacPropagator")
+        mocker.patch.dict(
+            "os.environ", {"PROFILE_DIR": "/var/tmp", "PROFILE_SECONDS": "30"}
+        )
+
+        cli.main()
+
+        assert mock_service.call_args[1]["profile_dir"] == "/var/tmp"
+        assert mock_service.call_args[1]["profile_seconds"] == 30.0
+
+    def test_service_sensor_log(self, mocker: MockFixture) -> None:
+        mock_service = mocker.patch("bacprop.cli.BacPropagator")
+        mocker.patch.dict(
+            "os.environ",
+            {
+                "SENSOR_LOG_PERIOD": "10",
+                "SENSOR_LOG_BURST": "2",
+                "SENSOR_LOG_SAMPLE": "100",
+            },
+        )
+
+        cli.main()
+
+        assert mock_service.call_args[1]["log_period"] == 10.0
+        assert mock_service.call_args[1]["log_burst"] == 2
+        assert mock_service.call_args[1]["log_sample"] == 100
+
+    def test_service_cov_increments(self, mocker: MockFixture) -> None:
+        mock_service = mocker.patch("bacprop.cli.BacPropagator")
+        mocker.patch.dict("os.environ", {"COV_INCREMENTS": "temp:0.5,co2:10"})
+
+        cli.main()
+
+        assert mock_service.call_args[1]["cov_increments"] == {"temp": 0.5, "co2": 10.0}
@@ -0,0 +1,159 @@
+import json
+
+import pytest
+
+from bacprop import codec
+from bacprop.codec import DecodeError, PayloadDecoder, encode_keys, encode_values
+
+# Required for full coverage
+codec._debug = 1
+
+
+class TestPayloadDecoder:
+    def test_decode_json(self) -> None:
+        decoder = PayloadDecoder()
+
+        assert decoder.decode(b'{"sensorId": 1, "temp": 2.5}') == {
+            "sensorId": 1,
+            "temp": 2.5,
+        }
+
+    def test_decode_bad_json(self) -> None:
+        decoder = PayloadDecoder()
+
+        with pytest.raises(json.JSONDecodeError):
+            decoder.decode(b"lol")
+
+        with pytest.raises(json.JSONDecodeError):
+            decoder.decode(b"")
+
+        with pytest.raises(DecodeError):
+            decoder.decode(b'{"temp": "\xff"}')
+
+    def test_decode_binary(self) -> None:
+        decoder = PayloadDecoder()
+
+        assert decoder.decode(encode_keys(70000, ["temp", "co2"])) is None
+        assert decoder.decode(encode_values(70000, [(1, 480), (0, 21.5)])) == {
+            "sensorId": 70000,
+            "co2": 480,
+            "temp": 21.5,
+        }
+
+    def test_decode_bytearray(self) -> None:
+        decoder = PayloadDecoder()
+        decoder.decode(bytearray(encode_keys(1, ["temp"])))
+
+        assert decoder.decode(bytearray(encode_values(1, [(0, 1)]))) == {
+            "sensorId": 1,
+            "temp": 1,
+        }
+
+    def test_keys_replaced(self) -> None:
+        decoder = PayloadDecoder()
+        decoder.decode(encode_keys(1, ["temp"]))
+        decoder.decode(encode_keys(1, ["co2"]))
+
+        assert decoder.decode(encode_values(1, [(0, 400)])) == {
+            "sensorId": 1,
+            "co2": 400,
+        }
+
+    def test_no_keys(self) -> None:
+        decoder = PayloadDecoder()
+
+        with pytest.raises(DecodeError):
+            decoder.decode(encode_values(1, [(0, 1)]))
+
+    def test_unknown_key_index(self) -> None:
+        decoder = PayloadDecoder()
+        decoder.decode(encode_keys(1, ["temp"]))
+
+        with pytest.raises(DecodeError):
+            decoder.decode(encode_values(1, [(1, 1)]))
+
+    def test_truncated(self) -> None:
+        decoder = PayloadDecoder()
+
+        with pytest.raises(DecodeError):
+            decoder.decode(encode_keys(1, ["temp"])[:4])
+
+        with pytest.raises(DecodeError):
+            decoder.decode(encode_keys(1, ["temp"])[:-1])
+
+        with pytest.raises(DecodeError):
+            decoder.decode(encode_keys(1, ["temp"])[:-5])
+
+        decoder.decode(encode_keys(1, ["temp"]))
+
+        with pytest.raises(DecodeError):
+            decoder.decode(encode_values(1, [(0, 1)])[:-1])
+
+    def test_bad_key_name(self) -> None:
+        decoder = PayloadDecoder()
+
+        with pytest.raises(DecodeError):
+            decoder.decode(encode_keys(1, ["temp"])[:-4] + b"\xff\xff\xff\xff")
+
+    def test_unknown_type(self) -> None:
+        decoder = PayloadDecoder()
+
+        with pytest.raises(DecodeError):
+            decoder.decode(bytes((codec.BINARY_MARKER, 9, 0, 0, 0, 1, 0)))
+
+    def test_decode_not_object(self) -> None:
+        decoder = PayloadDecoder()
+
+        with pytest.raises(DecodeError):
+            decoder.decode(b"[1, 2]")
+
+
+class TestDecodeBatch:
+    def test_array(self) -> None:
+        decoder = PayloadDecoder()
+        payload = b' [{"sensorId": 1, "temp": 1}, {"sensorId": 2, "temp": 2}]'
+
+        assert list(decoder.decode_batch(payload)) == [
+            {"sensorId": 1, "temp": 1},
+            {"sensorId": 2, "temp": 2},
+        ]
+
+    def test_lines(self) -> None:
+        decoder = PayloadDecoder()
+        payload = b'{"sensorId": 1, "temp": 1}\n\n{"sensorId": 2, "temp": 2}\n'
+
+        assert list(decoder.decode_batch(payload)) == [
+            {"sensorId": 1, "temp": 1},
+            {"sensorId": 2, "temp": 2},
+        ]
+
+    def test_bad_array_item(self) -> None:
+        decoder = PayloadDecoder()
+        payload = b'[{"sensorId": 1}, 5, {"sensorId": 2}]'
+
+        readings = list(decoder.decode_batch(payload))
+
+        assert readings[0] == {"sensorId": 1}
+        assert isinstance(readings[1], DecodeError)
+        assert "Reading 1" in str(readings[1])
+        assert readings[2] == {"sensorId": 2}
+
+    def test_bad_line(self) -> None:
+        decoder = PayloadDecoder()
+        payload = b'{"sensorId": 1}\nlol\n[]\n{"sensorId": 2}'
+
+        readings = list(decoder.decode_batch(payload))
+
+        assert readings[0] == {"sensorId": 1}
+        assert isinstance(readings[1], DecodeError)
+        assert "Line 2" in str(readings[1])
+        assert isinstance(readings[2], DecodeError)
+        assert readings[3] == {"sensorId": 2}
+
+    def test_bad_array(self) -> None:
+        decoder = PayloadDecoder()
+
+        readings = list(decoder.decode_batch(b'[{"sensorId": 1}'))
+
+        assert len(readings) == 1
+        assert isinstance(readings[0], DecodeError)
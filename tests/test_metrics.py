@@ -0,0 +1,178 @@
+import asyncio
+from threading import Thread
+from typing import Tuple
+
+import pytest
+from pytest_mock import MockFixture
+
+from bacprop import metrics
+from bacprop.metrics import Counter, Gauge, Histogram, MetricsServer, Registry
+
+# Required for full coverage
+metrics._debug = 1
+
+
+async def fetch(port: int, request: bytes) -> Tuple[bytes, bytes]:
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(request)
+
+    response = await reader.read()
+    writer.close()
+
+    head, _, body = response.partition(b"\r\n\r\n")
+    return head.split(b"\r\n")[0], body
+
+
+class TestCounter:
+    def test_threads(self) -> None:
+        counter = Counter("requests_total", "Requests", ["service"])
+
+        def count() -> None:
+            for _ in range(1000):
+                counter.inc("read")
+
+        threads = [Thread(target=count) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        counter.inc("write", amount=2)
+
+        # Each thread has its own copy
+        assert len(counter._shards) == 5
+        assert counter.get("read") == 4000
+        assert counter.get("write") == 2
+        assert counter.get("other") == 0
+        assert list(counter.render()) == [
+            "# HELP requests_total Requests",
+            "# TYPE requests_total counter",
+            'requests_total{service="read"} 4000.0',
+            'requests_total{service="write"} 2.0',
+        ]
+
+    def test_escape(self) -> None:
+        counter = Counter("failures_total", "Failures", ["reason"])
+        counter.inc('a "b"\\\n')
+
+        assert list(counter.collect()) == [
+            'failures_total{reason="a \\"b\\"\\\\\\n"} 1.0'
+        ]
+
+
+class TestHistogram:
+    def test_observe(self) -> None:
+        histogram = Histogram("latency_seconds", "Latency", buckets=[1.0, 0.1])
+
+        histogram.observe(0.05)
+        histogram.observe(0.1)
+        histogram.observe(0.5)
+        histogram.observe(2.0)
+
+        assert histogram.get_count() == 4
+        assert list(histogram.collect()) == [
+            'latency_seconds_bucket{le="0.1"} 2.0',
+            'latency_seconds_bucket{le="1.0"} 3.0',
+            'latency_seconds_bucket{le="+Inf"} 4.0',
+            "latency_seconds_sum 2.65",
+            "latency_seconds_count 4.0",
+        ]
+
+    def test_threads_and_labels(self) -> None:
+        histogram = Histogram("latency_seconds", "Latency", ["service"], [0.1])
+
+        thread = Thread(target=lambda: histogram.observe(0.5, "read"))
+        thread.start()
+        thread.join()
+        histogram.observe(0.01, "read")
+
+        assert histogram.get_count("read") == 2
+        assert histogram.get_count("write") == 0
+        assert list(histogram.collect()) == [
+            'latency_seconds_bucket{service="read",le="0.1"} 1.0',
+            'latency_seconds_bucket{service="read",le="+Inf"} 2.0',
+            'latency_seconds_sum{service="read"} 0.51',
+            'latency_seconds_count{service="read"} 2.0',
+        ]
+
+
+class TestGauge:
+    def test_function(self) -> None:
+        gauge = Gauge("sensors", "Sensors", ["state"])
+        assert list(gauge.collect()) == []
+
+        gauge.set_function(lambda: {("ok",): 3, ("fault",): 1})
+
+        assert list(gauge.collect()) == [
+            'sensors{state="fault"} 1.0',
+            'sensors{state="ok"} 3.0',
+        ]
+
+
+class TestRegistry:
+    def test_render(self) -> None:
+        registry = Registry()
+        counter = registry.register(Counter("a_total", "A"))
+        registry.register(Gauge("b", "B"))
+        counter.inc()
+
+        assert registry.render() == (
+            "# HELP a_total A\n"
+            "# TYPE a_total counter\n"
+            "a_total 1.0\n"
+            "# HELP b B\n"
+            "# TYPE b gauge\n"
+        )
+
+
+class TestMetricsServer:
+    @pytest.mark.asyncio
+    async def test_serve(self) -> None:
+        registry = Registry()
+        registry.register(Counter("a_total", "A")).inc()
+        server = MetricsServer(port=0, registry=registry)
+
+        await server.start()
+        assert server.port != 0
+
+        status, body = await fetch(
+            server.port, b"GET /metrics?x=1 HTTP/1.1\r\nHost: localhost\r\n\r\n"
+        )
+        assert status == b"HTTP/1.0 200 OK"
+        assert body == registry.render().encode()
+
+        status, _ = await fetch(server.port, b"GET /other HTTP/1.1\r\n\r\n")
+        assert status == b"HTTP/1.0 404 Not Found"
+
+        status, _ = await fetch(server.port, b"POST /metrics HTTP/1.1\r\n\r\n")
+        assert status == b"HTTP/1.0 405 Method Not Allowed"
+
+        await server.stop()
+        await server.stop()
+
+    @pytest.mark.asyncio
+    async def test_render_error(self, mocker: MockFixture) -> None:
+        mock_error = mocker.patch.object(MetricsServer, "_error")
+        registry = Registry()
+        gauge = registry.register(Gauge("a", "A"))
+        gauge.set_function(lambda: 1 / 0)  # type: ignore
+        server = MetricsServer(port=0, registry=registry)
+
+        await server.start()
+        status, body = await fetch(server.port, b"GET /metrics HTTP/1.1\r\n\r\n")
+        await server.stop()
+
+        assert status == b"HTTP/1.0 500 Internal Server Error"
+        assert body == b""
+        mock_error.assert_called_once()
+
+    @pytest.mark.asyncio
+    async def test_client_gone(self, mocker: MockFixture) -> None:
+        server = MetricsServer(port=0, registry=Registry())
+        reader = mocker.Mock()
+        reader.readline.side_effect = ConnectionResetError()
+        writer = mocker.Mock()
+
+        await server._handle(reader, writer)
+
+        writer.close.assert_called_once()
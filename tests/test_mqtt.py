@@ -1,31 +1,112 @@
 import asyncio
+import socket
+import subprocess
+import sys
+import time
+from typing import Any, Iterator, List
 
 import pytest
 from hbmqtt.broker import Broker
-from hbmqtt.client import MQTTClient, QOS_2
+from hbmqtt.client import MQTTClient, QOS_1, QOS_2, ClientException
 from pytest import fixture
 from pytest_mock import MockFixture
 
 from typing import AsyncIterator
 
 from bacprop import mqtt
-from bacprop.mqtt import SensorStream
+from bacprop.codec import encode_keys, encode_values
+from bacprop.metrics import PUBLISHES, READING_FAILURES
+from bacprop.mqtt import (
+    BaseSensorStream,
+    ClientSensorStream,
+    SensorStream,
+    _IngestBroker,
+    backoff_delay,
+    topic_matches,
+)
+from bacprop.ratelog import RateLimitedLog
 
 mqtt._debug = 1
 
+BROKER_PORT = 1884
+BROKER_SCRIPT = f"""
+import asyncio
+from hbmqtt.broker import Broker
+
+config = {{
+    "listeners": {{"default": {{"type": "tcp", "bind": "127.0.0.1:{BROKER_PORT}"}}}},
+    "topic-check": {{"enabled": False}},
+}}
+loop = asyncio.get_event_loop()
+loop.run_until_complete(Broker(config).start())
+loop.run_forever()
+"""
+
+
+class BrokerProcess:
+    """
+    A broker in its own process, so it can be
+    killed like a real broker going away
+    """
+
+    def __init__(self) -> None:
+        self._process: "subprocess.Popen[bytes]"
+
+    def start(self) -> None:
+        self._process = subprocess.Popen(
+            [sys.executable, "-c", BROKER_SCRIPT], stderr=subprocess.DEVNULL
+        )
+
+        for _ in range(100):
+            try:
+                socket.create_connection(("127.0.0.1", BROKER_PORT)).close()
+                return
+            except OSError:
+                time.sleep(0.05)
+
+        raise RuntimeError("Broker did not start")
+
+    def kill(self) -> None:
+        self._process.kill()
+        self._process.wait()
+
+
+@fixture
+def broker() -> Iterator[BrokerProcess]:
+    process = BrokerProcess()
+    process.start()
+    yield process
+    process.kill()
+
+
+async def publish(topic: str, payload: bytes) -> None:
+    client = MQTTClient()
+    await client.connect(f"mqtt://127.0.0.1:{BROKER_PORT}")
+    await client.publish(topic, payload, QOS_1)
+    await client.disconnect()
+
+
+async def wait_subscribed(stream: ClientSensorStream) -> None:
+    for _ in range(100):
+        if stream._attempt == 0 and stream._is_connected():
+            return
+        await asyncio.sleep(0.05)
+
+    raise RuntimeError("Stream did not connect")
+
 
 class TestSensorStream:
     def test_init(self) -> None:
         sensor_stream = SensorStream()
 
-        assert isinstance(sensor_stream, MQTTClient)
-        assert type(sensor_stream._broker) == Broker
+        assert isinstance(sensor_stream._broker, Broker)
         assert not sensor_stream._running
 
     @pytest.mark.asyncio
     async def test_receive_data(self) -> None:
         test_stream = SensorStream()
         mqtt_sensor = MQTTClient()
+        publishes = PUBLISHES.get()
 
         await test_stream.start()
         await mqtt_sensor.connect("mqtt://localhost")
@@ -44,10 +125,38 @@ class TestSensorStream:
         await mqtt_sensor.publish("sensor/1", b'{"test": 6.0, "sensorId": 1}', QOS_2)
         await asyncio.sleep(0.1)
 
-        assert received[0] == {"test": 6.0, "sensorId": 1}
+        assert received[0] == ("sensor/1", {"test": 6.0, "sensorId": 1})
+        assert PUBLISHES.get() == publishes + 1
+
+        await mqtt_sensor.disconnect()
+        await test_stream.stop()
+
+    @pytest.mark.asyncio
+    async def test_receive_without_ingest(self, mocker: MockFixture) -> None:
+        mocker.patch.object(_IngestBroker, "can_ingest", return_value=False)
+        warning = mocker.patch.object(SensorStream, "_warning")
+
+        test_stream = SensorStream()
+        warning.assert_called_once()
+        client_stream = test_stream._client_stream
+        assert isinstance(client_stream, ClientSensorStream)
+
+        await test_stream.start()
+        await wait_subscribed(client_stream)
+
+        mqtt_sensor = MQTTClient()
+        await mqtt_sensor.connect("mqtt://localhost")
+        await mqtt_sensor.publish("sensor/1", b'{"sensorId": 1}', QOS_1)
+
+        reader = test_stream.read().__aiter__()
+        assert await asyncio.wait_for(reader.__anext__(), 2) == (
+            "sensor/1",
+            {"sensorId": 1},
+        )
 
         await mqtt_sensor.disconnect()
         await test_stream.stop()
+        assert not client_stream._is_connected()
 
     @pytest.mark.asyncio
     async def test_receive_bad_data(self) -> None:
@@ -67,16 +176,337 @@ class TestSensorStream:
             except:
                 pass
 
+        failures = READING_FAILURES.get("undecodable")
+
         asyncio.ensure_future(receive())
         await mqtt_sensor.publish("sensor/1", b"lol", QOS_2)
         await asyncio.sleep(0.1)
 
         assert not received
+        assert READING_FAILURES.get("undecodable") == failures + 1
+
+        await mqtt_sensor.disconnect()
+        await test_stream.stop()
+
+    @pytest.mark.asyncio
+    async def test_receive_binary_data(self) -> None:
+        test_stream = SensorStream()
+        mqtt_sensor = MQTTClient()
+
+        await test_stream.start()
+        await mqtt_sensor.connect("mqtt://localhost")
+
+        received = []
+
+        async def receive() -> None:
+            try:
+                async for message in test_stream.read():
+                    received.append(message)
+                    break
+            except:
+                pass
+
+        asyncio.ensure_future(receive())
+        await mqtt_sensor.publish("sensor/3", encode_keys(3, ["test"]), QOS_2)
+        await mqtt_sensor.publish("sensor/3", encode_values(3, [(0, 6.0)]), QOS_2)
+        await asyncio.sleep(0.1)
+
+        # The key dictionary isn't passed on
+        assert received == [("sensor/3", {"test": 6.0, "sensorId": 3})]
+
+        await mqtt_sensor.disconnect()
+        await test_stream.stop()
+
+    @pytest.mark.asyncio
+    async def test_receive_batch(self) -> None:
+        test_stream = SensorStream()
+        mqtt_sensor = MQTTClient()
+
+        await test_stream.start()
+        await mqtt_sensor.connect("mqtt://localhost")
+
+        received = []
+
+        async def receive() -> None:
+            try:
+                async for message in test_stream.read():
+                    received.append(message)
+            except:
+                pass
+
+        asyncio.ensure_future(receive())
+        await mqtt_sensor.publish(
+            "sensors/batch", b'{"sensorId": 1, "a": 1}\nlol\n{"sensorId": 2}', QOS_2
+        )
+        await asyncio.sleep(0.1)
+
+        # The bad reading doesn't stop the rest of the batch
+        assert received == [
+            ("sensors/batch", {"sensorId": 1, "a": 1}),
+            ("sensors/batch", {"sensorId": 2}),
+        ]
+
+        await mqtt_sensor.disconnect()
+        await test_stream.stop()
+
+    @pytest.mark.asyncio
+    async def test_other_topics(self) -> None:
+        test_stream = SensorStream()
+        mqtt_sensor = MQTTClient()
+        subscriber = MQTTClient()
+
+        await test_stream.start()
+        await mqtt_sensor.connect("mqtt://localhost")
+        await subscriber.connect("mqtt://localhost")
+        await subscriber.subscribe([("other/#", QOS_2), ("sensor/#", QOS_2)])
+
+        await mqtt_sensor.publish("other/1", b'{"sensorId": 1}', QOS_2)
+        await mqtt_sensor.publish("sensor/1", b'{"sensorId": 1}', QOS_2)
 
+        # Only the sensor topics are read
+        assert test_stream._queue.qsize() == 1
+
+        # Subscribers still get everything
+        message = await subscriber.deliver_message()
+        assert message.topic == "other/1"
+        message = await subscriber.deliver_message()
+        assert message.topic == "sensor/1"
+
+        await subscriber.disconnect()
         await mqtt_sensor.disconnect()
         await test_stream.stop()
 
+    @pytest.mark.asyncio
+    async def test_stop_wakes_reader(self) -> None:
+        test_stream = SensorStream()
+        await test_stream.start()
+
+        received = []
+
+        async def receive() -> None:
+            async for message in test_stream.read():
+                received.append(message)
+
+        reader = asyncio.ensure_future(receive())
+        await asyncio.sleep(0)
+
+        await test_stream.stop()
+        await asyncio.wait_for(reader, 1)
+
+        assert not received
+
+    @pytest.mark.asyncio
+    async def test_stop_queue_full(self) -> None:
+        test_stream = SensorStream()
+        await test_stream.start()
+
+        for _ in range(SensorStream.QUEUE_SIZE):
+            test_stream._queue.put_nowait(("sensor/1", bytearray(b"{}")))
+
+        await test_stream.stop()
+
+        assert [message async for message in test_stream.read()] == []
+
+    @pytest.mark.asyncio
+    async def test_read_yields(self, mocker: MockFixture) -> None:
+        mocker.patch.object(BaseSensorStream, "PUBLISHES_PER_YIELD", 2)
+        test_stream = SensorStream()
+        test_stream._running = True
+        turns = []
+
+        async def other() -> None:
+            while True:
+                turns.append(len(received))
+                await asyncio.sleep(0)
+
+        for _ in range(5):
+            test_stream._queue.put_nowait(("sensor/1", b"{}"))
+        test_stream._queue.put_nowait(None)
+
+        received: List[Any] = []
+        task = asyncio.ensure_future(other())
+        await asyncio.sleep(0)
+
+        async for publish in test_stream.read_publishes():
+            received.append(publish)
+
+        task.cancel()
+
+        # The queue is read without waiting, but not all at once
+        assert len(received) == 5
+        assert turns[:3] == [0, 2, 4]
+
+    @pytest.mark.asyncio
+    async def test_queue_depth(self) -> None:
+        test_stream = SensorStream()
+        test_stream._queue.put_nowait(("sensor/1", b"{}"))
+
+        assert test_stream.get_queue_depth() == 1
+
     @pytest.mark.asyncio
     async def test_stop_not_running(self) -> None:
         stream = SensorStream()
         await stream.stop()
+
+
+class TestTopicMatches:
+    def test_matches(self) -> None:
+        assert topic_matches("sensor/1", "sensor/1")
+        assert topic_matches("sensor/1", "sensor/+")
+        assert topic_matches("sensor/partial/1", "sensor/#")
+        assert topic_matches("sensor", "sensor/#")
+
+    def test_no_match(self) -> None:
+        assert not topic_matches("sensor/1", "sensor/2")
+        assert not topic_matches("sensor/partial/1", "sensor/+")
+        assert not topic_matches("sensor", "sensor/+")
+
+
+class TestBaseSensorStream:
+    def test_decode_error_logged(self, mocker: MockFixture) -> None:
+        stream = SensorStream()
+        data_log = mocker.create_autospec(RateLimitedLog)
+        stream.set_data_log(data_log)
+
+        assert list(stream.decode("sensor/1", b"lol")) == []
+
+        data_log.log.assert_called_once_with(
+            BaseSensorStream._error,
+            "sensor/1",
+            "undecodable",
+            None,
+            "Could not decode sensor data: %s",
+            mocker.ANY,
+        )
+
+
+class TestBackoff:
+    def test_backoff_delay(self) -> None:
+        assert backoff_delay(0, 1, 60, lambda: 1.0) == 1
+        assert backoff_delay(3, 1, 60, lambda: 1.0) == 8
+        assert backoff_delay(10, 1, 60, lambda: 1.0) == 60
+        assert backoff_delay(3, 1, 60, lambda: 0.5) == 4
+
+    def test_backoff_jitter(self) -> None:
+        delays = {backoff_delay(5, 1, 60) for _ in range(10)}
+
+        assert len(delays) > 1
+        assert all(0 <= delay <= 32 for delay in delays)
+
+
+class TestClientSensorStream:
+    def test_init(self) -> None:
+        stream = ClientSensorStream("broker", 1234, qos=QOS_1)
+
+        assert stream._uri == "mqtt://broker:1234"
+        assert stream._qos == QOS_1
+        assert stream._topic_filters == ["sensor/#", "sensors/batch"]
+
+    def test_shared_group(self) -> None:
+        stream = ClientSensorStream("broker", shared_group="bacprop")
+
+        assert stream._topic_filters == [
+            "$share/bacprop/sensor/#",
+            "$share/bacprop/sensors/batch",
+        ]
+
+    @pytest.mark.asyncio
+    async def test_receive_data(self, broker: BrokerProcess) -> None:
+        stream = ClientSensorStream("127.0.0.1", BROKER_PORT, qos=QOS_1)
+        await stream.start()
+        await wait_subscribed(stream)
+
+        await publish("sensor/1", b'{"sensorId": 1}')
+        await publish("sensors/batch", b'[{"sensorId": 2}]')
+
+        reader = stream.read().__aiter__()
+        assert await asyncio.wait_for(reader.__anext__(), 2) == (
+            "sensor/1",
+            {"sensorId": 1},
+        )
+        assert await asyncio.wait_for(reader.__anext__(), 2) == (
+            "sensors/batch",
+            {"sensorId": 2},
+        )
+
+        await stream.stop()
+        assert not stream._is_connected()
+
+    @pytest.mark.asyncio
+    async def test_reconnect(self, broker: BrokerProcess) -> None:
+        broker.kill()
+
+        stream = ClientSensorStream(
+            "127.0.0.1", BROKER_PORT, min_backoff=0.05, max_backoff=0.1
+        )
+        await stream.start()
+        await asyncio.sleep(0.3)
+
+        # Retrying while the broker is down
+        assert stream._attempt > 1
+
+        broker.start()
+        await wait_subscribed(stream)
+
+        # The broker goes away and comes back with no subscriptions
+        broker.kill()
+        await asyncio.sleep(0.2)
+        broker.start()
+        await wait_subscribed(stream)
+
+        await publish("sensor/1", b'{"sensorId": 1}')
+
+        reader = stream.read().__aiter__()
+        assert await asyncio.wait_for(reader.__anext__(), 2) == (
+            "sensor/1",
+            {"sensorId": 1},
+        )
+
+        await stream.stop()
+
+    @pytest.mark.asyncio
+    async def test_delivery_error(
+        self, mocker: MockFixture, broker: BrokerProcess
+    ) -> None:
+        stream = ClientSensorStream("127.0.0.1", BROKER_PORT, min_backoff=10)
+
+        async def fail(client: MQTTClient) -> None:
+            raise ClientException("Broken")
+
+        mocker.patch.object(stream, "_deliver", fail)
+        spy = mocker.spy(MQTTClient, "disconnect")
+
+        await stream.start()
+        await asyncio.sleep(0.3)
+
+        # Still connected, so the client is disconnected before retrying
+        spy.assert_called_once()
+        assert not stream._is_connected()
+
+        await stream.stop()
+
+    @pytest.mark.asyncio
+    async def test_no_disconnect_task(self, mocker: MockFixture) -> None:
+        class Client:
+            async def connect(self, uri: str, cleansession: bool) -> None:
+                pass
+
+            async def subscribe(self, topics: List[Any]) -> None:
+                pass
+
+        async def fail(client: Client) -> None:
+            raise ClientException("Broken")
+
+        stream = ClientSensorStream("127.0.0.1", BROKER_PORT)
+        mocker.patch.object(stream, "_deliver", fail)
+        warning = mocker.patch.object(ClientSensorStream, "_warning")
+
+        with pytest.raises(ClientException, match="Broken"):
+            await stream._receive(Client())
+
+        warning.assert_called_once()
+
+    @pytest.mark.asyncio
+    async def test_stop_not_running(self) -> None:
+        stream = ClientSensorStream("127.0.0.1", BROKER_PORT)
+        await stream.stop()
@@ -0,0 +1,414 @@
+import asyncio
+import json
+import pickle
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing import get_context
+from typing import Any, AsyncIterable, Dict, List, Tuple
+
+import pytest
+from pytest_mock import MockFixture
+
+from bacprop import pipeline
+from bacprop.codec import Payload, encode_keys, encode_values
+from bacprop.metrics import READING_FAILURES, READINGS
+from bacprop.mqtt import BaseSensorStream
+from bacprop.ratelog import RateLimitedLog
+from bacprop.pipeline import (
+    DecodePipeline,
+    Reading,
+    ReadingValidator,
+    ValidationWarning,
+    decode_and_validate,
+)
+
+# Required for full coverage
+pipeline._debug = 1
+
+
+def make_stream(
+    mocker: MockFixture, publishes: List[Tuple[str, Payload]]
+) -> BaseSensorStream:
+    stream = mocker.create_autospec(BaseSensorStream)
+
+    async def read_publishes() -> AsyncIterable[Tuple[str, Payload]]:
+        for publish in publishes:
+            yield publish
+
+    stream.read_publishes.return_value = read_publishes()  # type: ignore
+    return stream
+
+
+async def collect(
+    decode_pipeline: DecodePipeline, stream: BaseSensorStream
+) -> List[Reading]:
+    return [reading async for reading in decode_pipeline.process(stream)]
+
+
+class TestReadingValidator:
+    def test_validate(self) -> None:
+        warnings: List[ValidationWarning] = []
+        reading = ReadingValidator().validate(
+            {"sensorId": "3", "temp": 1.5, "unit": "C"}, "sensor/3", warnings
+        )
+
+        assert reading == (3, {"temp": 1.5}, False)
+        assert [warning[:3] for warning in warnings] == [
+            ("non_number_value", 3, "unit")
+        ]
+        assert (
+            warnings[0].message
+            == "Recieved non-number value (unit: 'C') from sensor id: 3"
+        )
+
+    def test_warning_sources(self) -> None:
+        validator = ReadingValidator()
+        warnings: List[ValidationWarning] = []
+
+        validator.validate({"temp": 1}, "sensor/a", warnings)
+        validator.validate({"sensorId": "x"}, "sensor/b", warnings)
+        validator.validate({"sensorId": -1}, "sensor/c", warnings)
+
+        # Without a valid sensor id, the topic is the source
+        assert [warning.source for warning in warnings] == [
+            "sensor/a",
+            "sensor/b",
+            "sensor/c",
+        ]
+        assert [warning.message for warning in warnings] == [
+            "sensorId missing from sensor data: {'temp': 1}",
+            "sensorId x could not be decoded",
+            "sensorId -1 is an invalid id",
+        ]
+
+    def test_validate_bad_ids(self) -> None:
+        validator = ReadingValidator()
+        warnings: List[ValidationWarning] = []
+
+        assert validator.validate({"temp": 1}, "", warnings) is None
+        assert validator.validate({"sensorId": "x"}, "", warnings) is None
+        assert validator.validate({"sensorId": [1]}, "", warnings) is None
+        assert validator.validate({"sensorId": -1}, "", warnings) is None
+        assert [warning.reason for warning in warnings] == [
+            "missing_sensor_id",
+            "invalid_sensor_id",
+            "invalid_sensor_id",
+            "negative_sensor_id",
+        ]
+
+    def test_merge(self) -> None:
+        validator = ReadingValidator([range(5, 10)], ["sensor/partial/#"])
+        warnings: List[ValidationWarning] = []
+
+        assert validator.validate({"sensorId": 5, "temp": None}, "", warnings) == (
+            5,
+            {"temp": None},
+            True,
+        )
+        assert validator.validate(
+            {"sensorId": 1, "temp": None}, "sensor/partial/1", warnings
+        ) == (1, {"temp": None}, True)
+
+        # Only merge updates can remove keys
+        assert validator.validate({"sensorId": 1, "temp": None}, "", warnings) == (
+            1,
+            {},
+            False,
+        )
+        assert len(warnings) == 1
+
+    def test_schema(self, mocker: MockFixture) -> None:
+        validator = ReadingValidator([range(5, 10)])
+        is_merge = mocker.spy(validator, "is_merge")
+        warnings: List[ValidationWarning] = []
+
+        data = {"sensorId": 5, "temp": 1.5, "co2": 400}
+        assert validator.validate(data, "sensor/5", warnings) == (
+            5,
+            {"temp": 1.5, "co2": 400},
+            True,
+        )
+
+        # Data of the same shape only has its values checked
+        data = {"sensorId": 5, "temp": 2.5, "co2": 410}
+        assert validator.validate(data, "sensor/5", warnings) == (
+            5,
+            {"temp": 2.5, "co2": 410},
+            True,
+        )
+        assert is_merge.call_count == 1
+
+        # Anything else is validated in full, only finding
+        # out whether to merge again for another topic
+        assert validator.validate({"sensorId": 5, "temp": 1}, "sensor/5", warnings) == (
+            5,
+            {"temp": 1},
+            True,
+        )
+        assert is_merge.call_count == 1
+
+        validator.validate({"sensorId": 5, "temp": 1}, "sensor/other", warnings)
+        assert is_merge.call_count == 2
+        assert not warnings
+
+    def test_schema_invalid_values(self) -> None:
+        validator = ReadingValidator()
+        warnings: List[ValidationWarning] = []
+
+        validator.validate({"sensorId": 3, "temp": 1.5}, "", warnings)
+        assert validator.validate({"sensorId": 3, "temp": "1.5"}, "", warnings) == (
+            3,
+            {},
+            False,
+        )
+        assert len(warnings) == 1
+
+        # Only data which is all numbers is given a schema
+        assert 3 not in validator._schemas
+
+    def test_forget(self) -> None:
+        validator = ReadingValidator()
+
+        validator.validate({"sensorId": 3, "temp": 1.5}, "", [])
+        validator.forget(3)
+        validator.forget(4)
+
+        assert not validator._schemas
+
+    def test_shared_by_threads(self) -> None:
+        validator = ReadingValidator([range(0, 50)])
+        shapes: List[Dict[str, Any]] = [
+            {"temp": 1.5},
+            {"temp": 1.5, "co2": 400},
+            {"temp": "bad"},
+        ]
+        data = [{"sensorId": i % 100, **shapes[i % 3]} for i in range(3000)]
+
+        def validate(index: int) -> Reading:
+            if index % 7 == 0:
+                validator.forget(index % 100)
+            return validator.validate(data[index], "sensor", [])  # type: ignore
+
+        with ThreadPoolExecutor(8) as executor:
+            readings = list(executor.map(validate, range(len(data))))
+
+        # The same as validating each on its own
+        assert readings == [
+            ReadingValidator([range(0, 50)]).validate(values, "sensor", [])
+            for values in data
+        ]
+
+    def test_pickle_drops_schemas(self) -> None:
+        validator = ReadingValidator([range(5, 10)], ["sensor/partial/#"])
+        validator.validate({"sensorId": 3, "temp": 1.5}, "", [])
+
+        copy = pickle.loads(pickle.dumps(validator))
+
+        assert copy.merge_sensors == [range(5, 10)]
+        assert copy.merge_topics == ["sensor/partial/#"]
+        assert not copy._schemas
+        assert validator._schemas
+
+
+class TestDecodeAndValidate:
+    def test_single(self) -> None:
+        payload = b'{"sensorId": 1, "temp": 2, "bad": "x"}'
+
+        readings, errors, warnings = decode_and_validate(
+            ReadingValidator(), "sensor/1", payload
+        )
+
+        assert readings == [(1, {"temp": 2}, False)]
+        assert errors == []
+        assert len(warnings) == 1
+
+    def test_batch(self) -> None:
+        payload = b'[{"sensorId": 1, "temp": 2}, 5, {"temp": 3}]'
+
+        readings, errors, warnings = decode_and_validate(
+            ReadingValidator(), BaseSensorStream.BATCH_TOPIC, payload
+        )
+
+        assert readings == [(1, {"temp": 2}, False)]
+        assert errors == ["Reading 1: Sensor data must be an object, not 5"]
+        assert [warning[:3] for warning in warnings] == [
+            ("missing_sensor_id", BaseSensorStream.BATCH_TOPIC, None)
+        ]
+        assert warnings[0].message == "sensorId missing from sensor data: {'temp': 3}"
+
+    def test_invalid_json(self) -> None:
+        readings, errors, _ = decode_and_validate(
+            ReadingValidator(), "sensor/1", b"{nope"
+        )
+
+        assert readings == []
+        assert len(errors) == 1
+
+
+class TestDecodePipeline:
+    @pytest.mark.asyncio
+    async def test_process(self, mocker: MockFixture) -> None:
+        stream = make_stream(
+            mocker,
+            [
+                ("sensor/1", bytearray(b'{"sensorId": 1, "temp": 1}')),
+                (
+                    BaseSensorStream.BATCH_TOPIC,
+                    bytearray(
+                        b'{"sensorId": 2, "temp": 2}\n{"sensorId": 1, "temp": 3}'
+                    ),
+                ),
+                ("sensor/3", bytearray(b'{"sensorId": 3, "temp": 4}')),
+            ],
+        )
+
+        with ThreadPoolExecutor(2) as executor:
+            readings = await collect(
+                DecodePipeline(executor, ReadingValidator()), stream
+            )
+
+        # In the order they were published
+        assert readings == [
+            (1, {"temp": 1}, False),
+            (2, {"temp": 2}, False),
+            (1, {"temp": 3}, False),
+            (3, {"temp": 4}, False),
+        ]
+
+    @pytest.mark.asyncio
+    async def test_sensor_order(self, mocker: MockFixture) -> None:
+        publishes: List[Tuple[str, Payload]] = [
+            ("sensor/1", json.dumps({"sensorId": 1, "count": i}).encode())
+            for i in range(200)
+        ]
+        stream = make_stream(mocker, publishes)
+
+        with ThreadPoolExecutor(4) as executor:
+            readings = await collect(
+                DecodePipeline(executor, ReadingValidator(), max_in_flight=8), stream
+            )
+
+        assert [values["count"] for _, values, _ in readings] == list(range(200))
+
+    @pytest.mark.asyncio
+    async def test_binary_inline(self, mocker: MockFixture) -> None:
+        stream = make_stream(
+            mocker,
+            [
+                ("sensor/7", encode_keys(7, ["temp"])),
+                ("sensor/7", encode_values(7, [(0, 1.5)])),
+                ("sensor/8", b'{"sensorId": 8, "temp": 2}'),
+            ],
+        )
+        executor = mocker.MagicMock()
+        executor_future: asyncio.Future = asyncio.Future()
+        executor_future.set_result(([(8, {"temp": 2}, False)], [], []))
+        mocker.patch.object(
+            asyncio.get_event_loop(), "run_in_executor", return_value=executor_future
+        )
+
+        readings = await collect(DecodePipeline(executor, ReadingValidator()), stream)
+
+        assert readings == [(7, {"temp": 1.5}, False), (8, {"temp": 2}, False)]
+
+        # Only the JSON payload left the event loop
+        asyncio.get_event_loop().run_in_executor.assert_called_once()  # type: ignore
+
+    @pytest.mark.asyncio
+    async def test_logs_problems(self, mocker: MockFixture) -> None:
+        mock_error = mocker.patch.object(DecodePipeline, "_error")
+        mock_warning = mocker.patch.object(DecodePipeline, "_warning")
+        stream = make_stream(
+            mocker,
+            [
+                ("sensor/1", b"{nope"),
+                ("sensor/1", b'{"temp": 1}'),
+                ("sensor/1", b'{"sensorId": 1, "temp": 1}'),
+            ],
+        )
+        undecodable = READING_FAILURES.get("undecodable")
+        missing = READING_FAILURES.get("missing_sensor_id")
+        decoded = READINGS.get()
+
+        with ThreadPoolExecutor(1) as executor:
+            readings = await collect(
+                DecodePipeline(executor, ReadingValidator()), stream
+            )
+
+        assert readings == [(1, {"temp": 1}, False)]
+        mock_error.assert_called_once()
+        mock_warning.assert_called_once_with(
+            "sensorId missing from sensor data: %s", {"temp": 1}
+        )
+        assert READING_FAILURES.get("undecodable") == undecodable + 1
+        assert READING_FAILURES.get("missing_sensor_id") == missing + 1
+        assert READINGS.get() == decoded + 1
+
+    @pytest.mark.asyncio
+    async def test_problems_rate_limited(self, mocker: MockFixture) -> None:
+        mock_error = mocker.patch.object(DecodePipeline, "_error")
+        mock_warning = mocker.patch.object(DecodePipeline, "_warning")
+        stream = make_stream(
+            mocker,
+            [("sensor/1", b"{nope"), ("sensor/2", b"{nope")] * 3
+            + [("sensor/1", b'{"sensorId": 1, "temp": "x"}')] * 3,
+        )
+        undecodable = READING_FAILURES.get("undecodable")
+
+        with ThreadPoolExecutor(1) as executor:
+            await collect(
+                DecodePipeline(
+                    executor, ReadingValidator(), data_log=RateLimitedLog(burst=1)
+                ),
+                stream,
+            )
+
+        # Only the first problem of each topic or sensor is logged
+        assert mock_error.call_count == 2
+        assert mock_warning.call_count == 1
+        assert READING_FAILURES.get("undecodable") == undecodable + 6
+
+    @pytest.mark.asyncio
+    async def test_bounded_in_flight(self, mocker: MockFixture) -> None:
+        publishes: List[Tuple[str, Payload]] = [
+            ("sensor/1", b'{"sensorId": 1}') for _ in range(10)
+        ]
+        stream = make_stream(mocker, publishes)
+
+        never_done: asyncio.Future = asyncio.Future()
+        executor = mocker.MagicMock()
+        mock_run = mocker.patch.object(
+            asyncio.get_event_loop(), "run_in_executor", return_value=never_done
+        )
+
+        decode_pipeline = DecodePipeline(executor, ReadingValidator(), max_in_flight=3)
+        reader = asyncio.ensure_future(collect(decode_pipeline, stream))
+
+        for _ in range(10):
+            await asyncio.sleep(0)
+
+        # The first is being waited on, then the queue is full
+        assert mock_run.call_count == 5
+
+        reader.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await reader
+
+    @pytest.mark.asyncio
+    async def test_process_pool(self, mocker: MockFixture) -> None:
+        stream = make_stream(
+            mocker, [("sensor/1", bytearray(b'{"sensorId": 1, "temp": 1}'))]
+        )
+
+        with ProcessPoolExecutor(1, mp_context=get_context("spawn")) as executor:
+            readings = await collect(
+                DecodePipeline(executor, ReadingValidator()), stream
+            )
+
+        assert readings == [(1, {"temp": 1}, False)]
+
+    def test_shutdown(self, mocker: MockFixture) -> None:
+        executor = mocker.MagicMock()
+
+        DecodePipeline(executor, ReadingValidator()).shutdown()
+
+        executor.shutdown.assert_called_once()
@@ -0,0 +1,105 @@
+import sys
+import time
+from pathlib import Path
+from threading import Event, Thread, current_thread
+from typing import Dict
+
+from pytest_mock import MockFixture
+
+from bacprop import profiler
+from bacprop.profiler import STAGES, SamplingProfiler, collapse_stack, stage
+
+# Required for full coverage
+profiler._debug = 1
+
+
+@stage("work")
+def staged_work(stop: Event) -> None:
+    stop.wait()
+
+
+def read_profile(path: Path) -> Dict[str, int]:
+    stacks = {}
+
+    for line in path.read_text().splitlines():
+        stack, count = line.rsplit(" ", 1)
+        stacks[stack] = int(count)
+
+    return stacks
+
+
+class TestStage:
+    def test_registers_code(self) -> None:
+        assert STAGES[staged_work.__code__] == "work"
+
+    def test_collapse_stack(self) -> None:
+        frame = sys._getframe()
+        stack = collapse_stack(frame, "main").split(";")
+
+        assert stack[0] == "main"
+        assert stack[-1] == f"{__name__}:test_collapse_stack"
+
+    def test_collapse_stage(self) -> None:
+        stop = Event()
+        worker = Thread(target=staged_work, args=(stop,), name="worker")
+        worker.start()
+
+        try:
+            time.sleep(0.01)
+            stack = collapse_stack(
+                sys._current_frames()[worker.ident or 0], worker.name
+            )
+        finally:
+            stop.set()
+            worker.join()
+
+        assert f";[work];{__name__}:staged_work;" in stack
+        assert stack.startswith("worker;")
+
+
+class TestSamplingProfiler:
+    def test_profile(self, tmp_path: Path) -> None:
+        stop = Event()
+        worker = Thread(target=staged_work, args=(stop,), name="worker")
+        worker.start()
+        path = tmp_path / "profile.folded"
+        sampler = SamplingProfiler(interval=0.001)
+
+        try:
+            assert sampler.start(0.05, str(path), [worker])
+            assert sampler.is_running()
+            sampler._thread.join()  # type: ignore
+        finally:
+            stop.set()
+            worker.join()
+
+        stacks = read_profile(path)
+        assert stacks
+        # Only the given threads are sampled
+        assert all(stack.startswith("worker;") for stack in stacks)
+        assert all("[work]" in stack for stack in stacks)
+        assert not sampler.is_running()
+
+    def test_already_running(self, mocker: MockFixture, tmp_path: Path) -> None:
+        mock_warning = mocker.patch.object(SamplingProfiler, "_warning")
+        sampler = SamplingProfiler()
+        path = tmp_path / "profile.folded"
+
+        assert sampler.start(10, str(path), [current_thread()])
+        assert not sampler.start(10, str(path), [current_thread()])
+        mock_warning.assert_called_once()
+
+        # Stopping early still writes the profile
+        sampler.stop()
+        sampler.stop()
+
+        assert list(read_profile(path))[0].startswith("MainThread;")
+
+    def test_write_error(self, mocker: MockFixture, tmp_path: Path) -> None:
+        mock_error = mocker.patch.object(SamplingProfiler, "_error")
+        sampler = SamplingProfiler()
+
+        sampler.start(0, str(tmp_path / "missing" / "profile.folded"), [])
+        sampler.stop()
+
+        mock_error.assert_called_once()
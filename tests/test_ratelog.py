@@ -0,0 +1,123 @@
+from typing import List
+
+from pytest_mock import MockFixture
+
+from bacprop import ratelog
+from bacprop.ratelog import RateLimitedLog, describe_source
+
+# Required for full coverage
+ratelog._debug = 1
+
+
+class Clock:
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class TestRateLimitedLog:
+    def test_burst(self, mocker: MockFixture) -> None:
+        log = mocker.Mock()
+        data_log = RateLimitedLog(burst=2, clock=Clock())
+
+        for value in range(5):
+            data_log.log(log, 3, "non_number_value", "status", "value %s", value)
+
+        # Formatting is left to the log function
+        assert log.call_args_list == [
+            mocker.call("value %s", 0),
+            mocker.call("value %s", 1),
+        ]
+
+    def test_problems_limited_apart(self, mocker: MockFixture) -> None:
+        log = mocker.Mock()
+        data_log = RateLimitedLog(burst=1, clock=Clock())
+
+        data_log.log(log, 3, "non_number_value", "status", "a")
+        data_log.log(log, 3, "non_number_value", "mode", "b")
+        data_log.log(log, 4, "non_number_value", "status", "c")
+        data_log.log(log, "sensor/x", "undecodable", None, "d")
+        data_log.log(log, 3, "non_number_value", "status", "e")
+
+        assert [call[0][0] for call in log.call_args_list] == ["a", "b", "c", "d"]
+        assert len(data_log) == 4
+
+    def test_sample(self, mocker: MockFixture) -> None:
+        log = mocker.Mock()
+        data_log = RateLimitedLog(burst=1, sample=3, clock=Clock())
+
+        for value in range(8):
+            data_log.log(log, 3, "non_number_value", "status", "value %s", value)
+
+        # The first, and then every third after it
+        assert [call[0][1] for call in log.call_args_list] == [0, 3, 6]
+
+    def test_flush_summary(self, mocker: MockFixture) -> None:
+        log = mocker.Mock()
+        other_log = mocker.Mock()
+        clock = Clock()
+        data_log = RateLimitedLog(period=60, burst=1, clock=clock)
+
+        for _ in range(1204):
+            data_log.log(log, 42, "non_number_value", "status", "message")
+
+        clock.now = 30
+        data_log.log(other_log, "sensor/x", "undecodable", None, "message")
+        data_log.log(other_log, "sensor/x", "undecodable", None, "message")
+
+        clock.now = 59
+        data_log.flush()
+        assert len(data_log) == 2
+
+        log.reset_mock()
+        clock.now = 60
+        data_log.flush()
+
+        log.assert_called_once_with(
+            "%s: %s more %s%s in the last %gs",
+            "Sensor 42",
+            "1,203",
+            "non_number_value",
+            " for 'status'",
+            60,
+        )
+        assert (
+            log.call_args[0][0] % log.call_args[0][1:]
+            == "Sensor 42: 1,203 more non_number_value for 'status' in the last 60s"
+        )
+        assert len(data_log) == 1
+
+        # A new period starts with a new burst
+        data_log.log(log, 42, "non_number_value", "status", "again")
+        log.assert_called_with("again")
+
+        clock.now = 90
+        data_log.flush()
+        other_log.assert_called_with(
+            "%s: %s more %s%s in the last %gs",
+            "Topic sensor/x",
+            "1",
+            "undecodable",
+            "",
+            60,
+        )
+
+    def test_flush_nothing_suppressed(self, mocker: MockFixture) -> None:
+        log = mocker.Mock()
+        clock = Clock()
+        data_log = RateLimitedLog(period=60, clock=clock)
+
+        data_log.log(log, 3, "non_number_value", "status", "message")
+        clock.now = 60
+        data_log.flush()
+
+        log.assert_called_once_with("message")
+        assert len(data_log) == 0
+
+
+class TestDescribeSource:
+    def test_describe(self) -> None:
+        assert describe_source(42) == "Sensor 42"
+        assert describe_source("sensor/42") == "Topic sensor/42"
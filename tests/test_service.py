@@ -1,18 +1,36 @@
 import asyncio
+import os
 import time
-from threading import Thread
-from typing import Any, AsyncIterable, Dict, NoReturn
+from concurrent.futures import ThreadPoolExecutor
+from threading import Thread, current_thread
+from pathlib import Path
+from typing import Any, AsyncIterable, Dict, NoReturn, Tuple
 from unittest.mock import call
 
 import pytest
 from pytest import fixture
 from pytest_mock import MockFixture
+from bacpypes.pdu import Address
 
 from bacprop import service
+from bacprop.bacnet.announce import AnnounceScheduler
+from bacprop.bacnet.lazy import IdleEviction
 from bacprop.bacnet.network import VirtualSensorNetwork
 from bacprop.bacnet.sensor import Sensor
+from bacprop.bacnet.store import ValueStore
+from bacprop.metrics import (
+    ANNOUNCE_QUEUE_DEPTH,
+    HANDLE_SECONDS,
+    QUEUE_DEPTH,
+    READING_FAILURES,
+    READINGS,
+    MetricsServer,
+)
 from bacprop.mqtt import SensorStream
+from bacprop.pipeline import DecodePipeline, Reading
+from bacprop.ratelog import RateLimitedLog
 from bacprop.service import BacPropagator
+from bacprop.snapshot import SensorSnapshot, SnapshotWriter
 
 service._debug = 1
 
@@ -31,6 +49,8 @@ def bacprop_service(mocker: MockFixture) -> BacPropagator:
     service = BacPropagator()
 
     service._sensor_net = mocker.create_autospec(VirtualSensorNetwork)
+    service._sensor_net.get_announcer.return_value = None  # type: ignore
+    service._sensor_net.get_eviction.return_value = None  # type: ignore
     service._stream = mocker.create_autospec(SensorStream)
 
     return service
@@ -44,11 +64,47 @@ class TestBacPropagator:
         BacPropagator()
 
         mock_stream.assert_called_once()
-        mock_network.assert_called_with("0.0.0.0")
+        mock_network.assert_called_with(
+            "0.0.0.0",
+            shared_stack=False,
+            cov_increments=None,
+            announce_rate=20.0,
+            lazy_stacks=False,
+            eager_sensors=(),
+            idle_timeout=600,
+            retire_after=None,
+            networks=1,
+            network_size=0,
+        )
+
+    def test_init_metrics(self, mocker: MockFixture) -> None:
+        mocker.patch("bacprop.service.SensorStream")
+        mocker.patch("bacprop.service.VirtualSensorNetwork")
+
+        assert BacPropagator()._metrics_server is None
+
+        service = BacPropagator(metrics_port=0, metrics_address="0.0.0.0")
+        assert service._metrics_server is not None
+        assert service._metrics_server._host == "0.0.0.0"
+
+    def test_init_stream(self, mocker: MockFixture) -> None:
+        mock_stream = mocker.patch("bacprop.service.SensorStream")
+        mocker.patch("bacprop.service.VirtualSensorNetwork")
+        stream = mocker.create_autospec(SensorStream)
+
+        service = BacPropagator(stream=stream, log_burst=2)
+
+        mock_stream.assert_not_called()
+        assert service._stream is stream
+
+        # The stream logs its problems along with the service's
+        stream.set_data_log.assert_called_once_with(service._data_log)  # type: ignore
+        assert service._data_log._burst == 2
 
     def test_start(self, mocker: MockFixture, bacprop_service: BacPropagator) -> None:
         mocker.patch.object(bacprop_service, "_main_loop", autospec=True)
         mocker.patch.object(bacprop_service, "_fault_check_loop", autospec=True)
+        mocker.patch.object(bacprop_service, "_flush_loop", autospec=True)
         mocker.patch.object(bacprop_service, "_start_bacnet_thread", autospec=True)
 
         class MainLoopCheck:
@@ -61,20 +117,170 @@ class TestBacPropagator:
         bacprop_service._fault_check_loop.return_value = async_return(  # type: ignore
             None
         )
+        bacprop_service._flush_loop.return_value = async_return(None)  # type: ignore
         bacprop_service._stream.stop.return_value = async_return(None)  # type: ignore
 
+        announcer = AnnounceScheduler()
+        bacprop_service._sensor_net.get_announcer.return_value = (  # type: ignore
+            announcer
+        )
+        eviction = IdleEviction(60, lambda sensor: True)
+        bacprop_service._sensor_net.get_eviction.return_value = eviction  # type: ignore
+
         bacprop_service.start()
 
         # Make sure all the correct things are called on startup
         assert MainLoopCheck.ran
         bacprop_service._fault_check_loop.assert_called_once()  # type: ignore
+        bacprop_service._flush_loop.assert_called_once()  # type: ignore
         bacprop_service._start_bacnet_thread.assert_called_once()  # type: ignore
 
+    def test_start_stops_pipeline(
+        self, mocker: MockFixture, bacprop_service: BacPropagator
+    ) -> None:
+        mocker.patch.object(bacprop_service, "_main_loop", autospec=True)
+        mocker.patch.object(bacprop_service, "_fault_check_loop", autospec=True)
+        mocker.patch.object(bacprop_service, "_flush_loop", autospec=True)
+        mocker.patch.object(bacprop_service, "_start_bacnet_thread", autospec=True)
+
+        bacprop_service._main_loop.return_value = async_return(None)  # type: ignore
+        bacprop_service._fault_check_loop.return_value = async_return(  # type: ignore
+            None
+        )
+        bacprop_service._flush_loop.return_value = async_return(None)  # type: ignore
+        bacprop_service._stream.stop.return_value = async_return(None)  # type: ignore
+
+        pipeline = mocker.create_autospec(DecodePipeline)
+        bacprop_service._decode_pipeline = pipeline
+
+        bacprop_service.start()
+
+        pipeline.shutdown.assert_called_once()
+
+    def test_start_metrics(
+        self, mocker: MockFixture, bacprop_service: BacPropagator
+    ) -> None:
+        mocker.patch.object(bacprop_service, "_main_loop", autospec=True)
+        mocker.patch.object(bacprop_service, "_fault_check_loop", autospec=True)
+        mocker.patch.object(bacprop_service, "_flush_loop", autospec=True)
+        mocker.patch.object(bacprop_service, "_start_bacnet_thread", autospec=True)
+
+        bacprop_service._main_loop.return_value = async_return(None)  # type: ignore
+        bacprop_service._fault_check_loop.return_value = async_return(  # type: ignore
+            None
+        )
+        bacprop_service._flush_loop.return_value = async_return(None)  # type: ignore
+        bacprop_service._stream.stop.return_value = async_return(None)  # type: ignore
+
+        server = mocker.create_autospec(MetricsServer)
+        server.start.return_value = async_return(None)
+        server.stop.return_value = async_return(None)
+        bacprop_service._metrics_server = server
+
+        bacprop_service.start()
+
+        server.start.assert_called_once()
+        server.stop.assert_called_once()
+
+    def test_start_profile_signal(
+        self, mocker: MockFixture, bacprop_service: BacPropagator
+    ) -> None:
+        mocker.patch.object(bacprop_service, "_main_loop", autospec=True)
+        mocker.patch.object(bacprop_service, "_fault_check_loop", autospec=True)
+        mocker.patch.object(bacprop_service, "_flush_loop", autospec=True)
+        mocker.patch.object(bacprop_service, "_start_bacnet_thread", autospec=True)
+        mocker.patch.object(bacprop_service, "profile", autospec=True)
+        mock_stop = mocker.patch.object(bacprop_service._profiler, "stop")
+
+        async def run_main_loop() -> None:
+            os.kill(os.getpid(), BacPropagator.PROFILE_SIGNAL)
+            await asyncio.sleep(0.01)
+
+        bacprop_service._main_loop.return_value = run_main_loop()  # type: ignore
+        bacprop_service._fault_check_loop.return_value = async_return(  # type: ignore
+            None
+        )
+        bacprop_service._flush_loop.return_value = async_return(None)  # type: ignore
+        bacprop_service._stream.stop.return_value = async_return(None)  # type: ignore
+
+        bacprop_service.start()
+
+        bacprop_service.profile.assert_called_once_with()  # type: ignore
+        assert bacprop_service._profile_threads == [
+            current_thread(),
+            bacprop_service._start_bacnet_thread.return_value,  # type: ignore
+        ]
+        mock_stop.assert_called_once()
+
+    def test_start_asyncio_core(
+        self, mocker: MockFixture, bacprop_service: BacPropagator
+    ) -> None:
+        mocker.patch.object(bacprop_service, "_main_loop", autospec=True)
+        mocker.patch.object(bacprop_service, "_fault_check_loop", autospec=True)
+        mocker.patch.object(bacprop_service, "_flush_loop", autospec=True)
+        mocker.patch.object(bacprop_service, "_start_bacnet_thread", autospec=True)
+        mocker.patch.object(bacprop_service, "_start_bacnet_core", autospec=True)
+        bacprop_service._asyncio_core = True
+
+        bacprop_service._main_loop.return_value = async_return(None)  # type: ignore
+        bacprop_service._fault_check_loop.return_value = async_return(  # type: ignore
+            None
+        )
+        bacprop_service._flush_loop.return_value = async_return(None)  # type: ignore
+        bacprop_service._stream.stop.return_value = async_return(None)  # type: ignore
+
+        bacprop_service.start()
+
+        bacprop_service._start_bacnet_core.assert_called_once_with(  # type: ignore
+            asyncio.get_event_loop()
+        )
+        bacprop_service._start_bacnet_thread.assert_not_called()  # type: ignore
+        assert bacprop_service._profile_threads == [current_thread()]
+
+        # Stopped without the bacnet thread
+        bacnet_core = bacprop_service._start_bacnet_core.return_value  # type: ignore
+        bacnet_core.stop.assert_called_once()
+        bacprop_service._sensor_net.stop.assert_not_called()  # type: ignore
+
+    def test_start_bacnet_core(
+        self, mocker: MockFixture, bacprop_service: BacPropagator
+    ) -> None:
+        mock_core = mocker.patch("bacprop.service.AsyncioCore")
+        loop = asyncio.get_event_loop()
+
+        assert bacprop_service._start_bacnet_core(loop) is mock_core.return_value
+
+        mock_core.assert_called_once_with(loop)
+        mock_core.return_value.start.assert_called_once()
+
+    def test_profile(self, mocker: MockFixture, tmp_path: Path) -> None:
+        mocker.patch("bacprop.service.SensorStream")
+        mocker.patch("bacprop.service.VirtualSensorNetwork")
+        bacprop_service = BacPropagator(profile_dir=str(tmp_path), profile_seconds=5)
+        bacprop_service._profile_threads = [current_thread()]
+        mock_start = mocker.patch.object(
+            bacprop_service._profiler, "start", return_value=True
+        )
+
+        path = bacprop_service.profile()
+
+        assert path is not None
+        assert path.startswith(str(tmp_path))
+        assert path.endswith(".folded")
+        mock_start.assert_called_once_with(5, path, [current_thread()])
+
+        bacprop_service.profile(1)
+        assert mock_start.call_args[0][0] == 1
+
+        mock_start.return_value = False
+        assert bacprop_service.profile() is None
+
     def test_main_interrupt(
         self, mocker: MockFixture, bacprop_service: BacPropagator
     ) -> None:
         mocker.patch.object(bacprop_service, "_main_loop", autospec=True)
         mocker.patch.object(bacprop_service, "_fault_check_loop", autospec=True)
+        mocker.patch.object(bacprop_service, "_flush_loop", autospec=True)
         mocker.patch.object(bacprop_service, "_start_bacnet_thread", autospec=True)
 
         backnet_thread = mocker.create_autospec(Thread)
@@ -90,6 +296,7 @@ class TestBacPropagator:
         bacprop_service._fault_check_loop.return_value = async_return(  # type: ignore
             None
         )
+        bacprop_service._flush_loop.return_value = async_return(None)  # type: ignore
         bacprop_service._stream.stop.return_value = async_return(None)  # type: ignore
 
         bacprop_service.start()
@@ -101,6 +308,7 @@ class TestBacPropagator:
     ) -> None:
         mocker.patch.object(bacprop_service, "_main_loop", autospec=True)
         mocker.patch.object(bacprop_service, "_fault_check_loop", autospec=True)
+        mocker.patch.object(bacprop_service, "_flush_loop", autospec=True)
         mocker.patch.object(bacprop_service, "_start_bacnet_thread", autospec=True)
 
         backnet_thread = mocker.create_autospec(Thread)
@@ -117,17 +325,149 @@ class TestBacPropagator:
         bacprop_service._fault_check_loop.return_value = async_return(  # type: ignore
             None
         )
+        bacprop_service._flush_loop.return_value = async_return(None)  # type: ignore
         bacprop_service._stream.stop.return_value = async_return(None)  # type: ignore
 
         bacprop_service.start()
         bacprop_service._sensor_net.stop.assert_called_once()  # type: ignore
         backnet_thread.join.assert_called_once()
 
+    def test_start_snapshot(
+        self, mocker: MockFixture, bacprop_service: BacPropagator
+    ) -> None:
+        mocker.patch.object(bacprop_service, "_main_loop", autospec=True)
+        mocker.patch.object(bacprop_service, "_fault_check_loop", autospec=True)
+        mocker.patch.object(bacprop_service, "_flush_loop", autospec=True)
+        mocker.patch.object(bacprop_service, "_snapshot_loop", autospec=True)
+        mocker.patch.object(bacprop_service, "_restore_snapshot", autospec=True)
+        mocker.patch.object(bacprop_service, "_save_snapshot", autospec=True)
+        mocker.patch.object(bacprop_service, "_start_bacnet_thread", autospec=True)
+
+        bacprop_service._main_loop.return_value = async_return(None)  # type: ignore
+        bacprop_service._fault_check_loop.return_value = async_return(  # type: ignore
+            None
+        )
+        bacprop_service._flush_loop.return_value = async_return(None)  # type: ignore
+        bacprop_service._snapshot_loop.return_value = async_return(None)  # type: ignore
+        bacprop_service._stream.stop.return_value = async_return(None)  # type: ignore
+
+        writer = mocker.create_autospec(SnapshotWriter)
+        bacprop_service._snapshot = writer
+
+        manager = mocker.Mock()
+        manager.attach_mock(bacprop_service._restore_snapshot, "restore")
+        manager.attach_mock(bacprop_service._start_bacnet_thread, "start_thread")
+        manager.attach_mock(bacprop_service._save_snapshot, "save")
+        manager.attach_mock(writer.close, "close")
+
+        bacprop_service.start()
+
+        # Restored before the bacnet thread runs, and saved once it's stopped
+        assert manager.mock_calls == [
+            call.restore(writer),
+            call.start_thread(),
+            call.start_thread().join(),
+            call.save(writer),
+            call.close(),
+        ]
+        bacprop_service._snapshot_loop.assert_called_once_with(writer)  # type: ignore
+
+    def test_init_snapshot(self, mocker: MockFixture) -> None:
+        mocker.patch("bacprop.service.SensorStream")
+        mocker.patch("bacprop.service.VirtualSensorNetwork")
+
+        assert BacPropagator()._snapshot is None
+
+        service = BacPropagator(snapshot_path="/tmp/snapshot", snapshot_interval=2)
+        assert service._snapshot is not None
+        assert service._snapshot_interval == 2
+
+    def test_restore_snapshot(
+        self, mocker: MockFixture, bacprop_service: BacPropagator
+    ) -> None:
+        snapshots = [
+            SensorSnapshot(3, 10, 100, False, True, {}),
+            SensorSnapshot(4, 11, 100, False, False, {}),
+        ]
+        writer = mocker.create_autospec(SnapshotWriter)
+        writer.load.return_value = snapshots
+        bacprop_service._sensor_net.restore_sensors.return_value = []  # type: ignore
+
+        bacprop_service._restore_snapshot(writer)
+
+        bacprop_service._sensor_net.restore_sensors.assert_called_once_with(  # type: ignore
+            snapshots
+        )
+        assert bacprop_service._merged_sensor_ids == {3}
+        writer.start.assert_called_once()
+
+    def test_restore_snapshot_new_address(
+        self, mocker: MockFixture, bacprop_service: BacPropagator
+    ) -> None:
+        snapshots = [
+            SensorSnapshot(3, 10, 100, False, False, {}),
+            SensorSnapshot(4, 11, 100, False, False, {}),
+        ]
+        writer = mocker.create_autospec(SnapshotWriter)
+        writer.load.return_value = snapshots
+
+        sensors = []
+        for sensor_id, address in ((3, 10), (4, 12)):
+            sensor = mocker.create_autospec(Sensor)
+            sensor.get_id.return_value = sensor_id
+            sensor.get_address.return_value = Address(address.to_bytes(4, "big"))
+            sensors.append(sensor)
+        mocker.patch.object(
+            bacprop_service._sensor_net, "restore_sensors", return_value=sensors
+        )
+
+        bacprop_service._restore_snapshot(writer)
+
+        # Only the sensor whose address was taken is saved again
+        assert bacprop_service._snapshot_dirty == {4}
+
+    def test_save_snapshot(
+        self, mocker: MockFixture, bacprop_service: BacPropagator
+    ) -> None:
+        sensor = mocker.create_autospec(Sensor)
+        writer = mocker.create_autospec(SnapshotWriter)
+        bacprop_service._sensor_net.get_sensor.side_effect = {  # type: ignore
+            3: sensor
+        }.get
+        bacprop_service._snapshot_dirty = {3, 4}
+        bacprop_service._snapshot_removed = {5}
+
+        bacprop_service._save_snapshot(writer)
+
+        writer.write.assert_called_once_with([sensor.get_snapshot.return_value], [5])
+        assert not bacprop_service._snapshot_dirty
+        assert not bacprop_service._snapshot_removed
+
+    @pytest.mark.asyncio
+    async def test_snapshot_loop(
+        self, mocker: MockFixture, bacprop_service: BacPropagator
+    ) -> None:
+        mock_deferred = mocker.patch("bacprop.service.deferred")
+        writer = mocker.create_autospec(SnapshotWriter)
+        bacprop_service._snapshot_interval = 0
+
+        bacprop_service._running = True
+        asyncio.ensure_future(bacprop_service._snapshot_loop(writer))
+        await asyncio.sleep(0)
+        await asyncio.sleep(0)
+
+        # Saved on the bacnet thread
+        mock_deferred.assert_called_with(bacprop_service._save_snapshot, writer)
+
+        bacprop_service._running = False
+        await asyncio.sleep(0)
+
     def test_start_bacnet(
         self, mocker: MockFixture, bacprop_service: BacPropagator
     ) -> None:
         thread = bacprop_service._start_bacnet_thread()
         assert thread.daemon
+        assert thread.name == "bacnet"
         thread.join()
 
         bacprop_service._sensor_net.run.assert_called_once()  # type: ignore
@@ -138,9 +478,9 @@ class TestBacPropagator:
     ) -> None:
         mocker.patch.object(bacprop_service, "_handle_sensor_data", autospec=True)
 
-        async def mock_read() -> AsyncIterable[Dict[str, float]]:
-            yield {"something": 0.1, "sensorId": 1}
-            yield {"somethingElse": 6, "sensorId": 5}
+        async def mock_read() -> AsyncIterable[Tuple[str, Dict[str, float]]]:
+            yield "sensor/1", {"something": 0.1, "sensorId": 1}
+            yield "sensor/5", {"somethingElse": 6, "sensorId": 5}
 
         bacprop_service._stream.start.return_value = async_return(None)  # type: ignore
         bacprop_service._stream.read.return_value = mock_read()  # type: ignore
@@ -148,11 +488,50 @@ class TestBacPropagator:
         await bacprop_service._main_loop()
         bacprop_service._handle_sensor_data.assert_has_calls(  # type: ignore
             [
-                call({"something": 0.1, "sensorId": 1}),
-                call({"somethingElse": 6, "sensorId": 5}),
+                call({"something": 0.1, "sensorId": 1}, "sensor/1"),
+                call({"somethingElse": 6, "sensorId": 5}, "sensor/5"),
             ]
         )
 
+    def test_init_decode_executor(self, mocker: MockFixture) -> None:
+        mocker.patch("bacprop.service.SensorStream")
+        mocker.patch("bacprop.service.VirtualSensorNetwork")
+        executor = ThreadPoolExecutor(1)
+
+        service = BacPropagator(
+            merge_sensors=[range(5, 10)],
+            decode_executor=executor,
+            decode_max_in_flight=8,
+        )
+
+        assert service._decode_pipeline is not None
+        assert service._decode_pipeline._executor is executor
+        assert service._decode_pipeline._validator is service._validator
+        assert service._decode_pipeline._max_in_flight == 8
+        executor.shutdown()
+
+    @pytest.mark.asyncio
+    async def test_receive_data_pipeline(
+        self, mocker: MockFixture, bacprop_service: BacPropagator
+    ) -> None:
+        pipeline = mocker.create_autospec(DecodePipeline)
+        bacprop_service._decode_pipeline = pipeline
+
+        async def mock_process() -> AsyncIterable[Reading]:
+            yield 1, {"temp": 1}, False
+            yield 1, {"humidity": None}, True
+
+        bacprop_service._stream.start.return_value = async_return(None)  # type: ignore
+        pipeline.process.return_value = mock_process()
+
+        await bacprop_service._main_loop()
+
+        pipeline.process.assert_called_once_with(bacprop_service._stream)
+        bacprop_service._stream.read.assert_not_called()  # type: ignore
+        assert bacprop_service._updates.take() == {
+            1: (False, {"temp": 1, "humidity": None})
+        }
+
     def test_handle_data_new_sensor(
         self, mocker: MockFixture, bacprop_service: BacPropagator
     ) -> None:
@@ -165,10 +544,85 @@ class TestBacPropagator:
         bacprop_service._sensor_net.get_sensor.return_value = None  # type: ignore
 
         bacprop_service._handle_sensor_data(data)
+        bacprop_service._apply_updates()
 
         bacprop_service._sensor_net.create_sensor.assert_called_with(1)  # type: ignore
         sensor.has_fault.assert_called_once()
-        sensor.set_values.assert_called_with({"somethingElse": 0.2})
+        sensor.set_values.assert_called_with({"somethingElse": 0.2}, False)
+
+    def test_handle_data_metrics(
+        self, mocker: MockFixture, bacprop_service: BacPropagator
+    ) -> None:
+        readings = READINGS.get()
+        non_numbers = READING_FAILURES.get("non_number_value")
+        missing = READING_FAILURES.get("missing_sensor_id")
+        handled = HANDLE_SECONDS.get_count()
+
+        bacprop_service._handle_sensor_data({"sensorId": 1, "temp": "hot"})
+        bacprop_service._handle_sensor_data({"temp": 1})
+
+        assert READINGS.get() == readings + 1
+        assert READING_FAILURES.get("non_number_value") == non_numbers + 1
+        assert READING_FAILURES.get("missing_sensor_id") == missing + 1
+        assert HANDLE_SECONDS.get_count() == handled + 2
+
+    def test_handle_data_warnings_limited(
+        self, mocker: MockFixture, bacprop_service: BacPropagator
+    ) -> None:
+        mock_warning = mocker.patch.object(BacPropagator, "_warning")
+        non_numbers = READING_FAILURES.get("non_number_value")
+
+        for _ in range(10):
+            bacprop_service._handle_sensor_data({"sensorId": 1, "status": "on"})
+
+        # Every warning is counted, but only the first few are logged
+        assert READING_FAILURES.get("non_number_value") == non_numbers + 10
+        assert mock_warning.call_count == RateLimitedLog.BURST
+        mock_warning.assert_called_with(
+            "Recieved non-number value (%s: '%s') from sensor id: %s", "status", "on", 1
+        )
+
+    def test_sensor_metrics(
+        self, mocker: MockFixture, bacprop_service: BacPropagator
+    ) -> None:
+        sensors = [mocker.create_autospec(Sensor) for _ in range(3)]
+        for sensor, objects in zip(sensors, (2, 2, 3)):
+            sensor.get_object_count.return_value = objects
+
+        bacprop_service._sensor_net.get_sensors.return_value = dict(  # type: ignore
+            enumerate(sensors)
+        )
+        store = ValueStore()
+        for sensor_id, fault in enumerate((False, True, False)):
+            store.faults[store.add_row(sensor_id)] = fault
+        bacprop_service._sensor_net.get_store.return_value = store  # type: ignore
+        bacprop_service._stream.get_queue_depth.return_value = 12  # type: ignore
+
+        assert bacprop_service._sensor_states() == {("ok",): 2, ("fault",): 1}
+        assert bacprop_service._sensor_objects() == {("2",): 2, ("3",): 1}
+        assert list(QUEUE_DEPTH.collect()) == ["bacprop_stream_queue_depth 12.0"]
+
+    def test_announce_metrics(
+        self, mocker: MockFixture, bacprop_service: BacPropagator
+    ) -> None:
+        announcer = AnnounceScheduler()
+        mocker.patch.object(
+            bacprop_service._sensor_net, "get_announcer", return_value=announcer
+        )
+        mocker.patch.object(announcer, "install_task")
+        sensor = mocker.create_autospec(Sensor)
+        sensor.get_id.return_value = 1
+        sensor.get_update_time.return_value = 0.0
+        announcer.schedule(sensor)
+
+        assert list(ANNOUNCE_QUEUE_DEPTH.collect()) == [
+            "bacprop_announce_queue_depth 1.0"
+        ]
+
+        mocker.patch.object(
+            bacprop_service._sensor_net, "get_announcer", return_value=None
+        )
+        assert list(ANNOUNCE_QUEUE_DEPTH.collect()) == []
 
     def test_handle_bad_data(
         self, mocker: MockFixture, bacprop_service: BacPropagator
@@ -176,7 +630,7 @@ class TestBacPropagator:
         data = {"noId": 2}
         bacprop_service._handle_sensor_data(data)
 
-        bacprop_service._sensor_net.get_sensor.assert_not_called()  # type: ignore
+        assert not bacprop_service._updates
 
     def test_handle_bad_sensor_id(
         self, mocker: MockFixture, bacprop_service: BacPropagator
@@ -184,7 +638,7 @@ class TestBacPropagator:
         data = {"sensorId": "Hello"}
         bacprop_service._handle_sensor_data(data)
 
-        bacprop_service._sensor_net.get_sensor.assert_not_called()  # type: ignore
+        assert not bacprop_service._updates
 
     def test_handle_negative_sensor_id(
         self, mocker: MockFixture, bacprop_service: BacPropagator
@@ -192,7 +646,7 @@ class TestBacPropagator:
         data = {"sensorId": "-2"}
         bacprop_service._handle_sensor_data(data)
 
-        bacprop_service._sensor_net.get_sensor.assert_not_called()  # type: ignore
+        assert not bacprop_service._updates
 
     def test_handle_new_data(
         self, mocker: MockFixture, bacprop_service: BacPropagator
@@ -205,8 +659,9 @@ class TestBacPropagator:
         bacprop_service._sensor_net.get_sensor.return_value = sensor  # type: ignore
 
         bacprop_service._handle_sensor_data(data)
+        bacprop_service._apply_updates()
 
-        sensor.set_values.assert_called_with({"somethingNew": 2})
+        sensor.set_values.assert_called_with({"somethingNew": 2}, False)
         sensor.mark_ok.assert_not_called()
 
     def test_handle_new_data_faulty_sensor(
@@ -220,8 +675,9 @@ class TestBacPropagator:
         bacprop_service._sensor_net.get_sensor.return_value = sensor  # type: ignore
 
         bacprop_service._handle_sensor_data(data)
+        bacprop_service._apply_updates()
 
-        sensor.set_values.assert_called_with({"somethingNew": 2})
+        sensor.set_values.assert_called_with({"somethingNew": 2}, False)
         sensor.mark_ok.assert_called_once()
 
     def test_handle_weird_data(
@@ -235,51 +691,199 @@ class TestBacPropagator:
         bacprop_service._sensor_net.get_sensor.return_value = sensor  # type: ignore
 
         bacprop_service._handle_sensor_data(data)
+        bacprop_service._apply_updates()
+
+        sensor.set_values.assert_called_with({"something": 2}, False)
+
+    def test_init_timeouts(self, mocker: MockFixture) -> None:
+        mocker.patch("bacprop.service.SensorStream")
+        mock_network = mocker.patch("bacprop.service.VirtualSensorNetwork")
+
+        BacPropagator(30, [(range(0, 10), 5)])
 
-        sensor.set_values.assert_called_with({"something": 2})
+        scheduler = mock_network.return_value.get_fault_scheduler.return_value
+        scheduler.set_default_timeout.assert_called_once_with(30)
+        scheduler.set_group_timeout.assert_called_once_with(range(0, 10), 5)
 
     @pytest.mark.asyncio
     async def test_fault_checking(
         self, mocker: MockFixture, bacprop_service: BacPropagator
     ) -> None:
-        sensors = {1: mocker.create_autospec(Sensor), 2: mocker.create_autospec(Sensor)}
-        bacprop_service._sensor_net.get_sensors.return_value = sensors  # type: ignore
+        mock_deferred = mocker.patch("bacprop.service.deferred")
+        mock_flush = mocker.patch.object(bacprop_service._data_log, "flush")
 
         bacprop_service._running = True
         asyncio.ensure_future(bacprop_service._fault_check_loop())
         await asyncio.sleep(0)
 
-        bacprop_service._sensor_net.get_sensors.assert_called_once()  # type: ignore
-
-        sensors[1].has_fault.assert_called_once()
-        sensors[2].has_fault.assert_called_once()
+        # The check itself runs on the bacnet thread
+        mock_deferred.assert_called_once_with(bacprop_service._check_faults, mocker.ANY)
+        # Summaries of the problems with sensor data are logged
+        mock_flush.assert_called_once()
+        bacprop_service._sensor_net.pop_outdated_sensors.assert_not_called()  # type: ignore
 
         # Finish the loop
         bacprop_service._running = False
         await asyncio.sleep(0)
 
-    @pytest.mark.asyncio
-    async def test_faulty_sensor(
+    def test_faulty_sensor(
         self, mocker: MockFixture, bacprop_service: BacPropagator
     ) -> None:
         sensors = {1: mocker.create_autospec(Sensor), 2: mocker.create_autospec(Sensor)}
         sensors[1].has_fault.return_value = False
-        sensors[2].has_fault.return_value = False
+        sensors[2].has_fault.return_value = True
+
+        # Only outdated sensors are given back by the network
+        bacprop_service._sensor_net.pop_outdated_sensors.return_value = [  # type: ignore
+            sensors[1],
+            sensors[2],
+        ]
 
-        sensors[1].get_update_time.return_value = (
-            time.time() - BacPropagator.SENSOR_OUTDATED_TIME - 1
+        bacprop_service._check_faults(100)
+
+        # Sensor 2 should not be marked as faulty again
+        bacprop_service._sensor_net.pop_outdated_sensors.assert_called_once_with(  # type: ignore
+            100
         )
-        sensors[2].get_update_time.return_value = time.time()
+        sensors[1].mark_fault.assert_called_once()
+        sensors[2].mark_fault.assert_not_called()
+        assert bacprop_service._snapshot_dirty == {sensors[1].get_id.return_value}
 
-        bacprop_service._sensor_net.get_sensors.return_value = sensors  # type: ignore
+    def test_retire_sensors(
+        self, mocker: MockFixture, bacprop_service: BacPropagator
+    ) -> None:
+        sensor = mocker.create_autospec(Sensor)
+        sensor.get_id.return_value = 3
+        mocker.patch.object(
+            bacprop_service._sensor_net, "pop_outdated_sensors", return_value=[]
+        )
+        mocker.patch.object(
+            bacprop_service._sensor_net, "retire_sensors", return_value=[sensor]
+        )
+        bacprop_service._merged_sensor_ids = {3, 4}
+        bacprop_service._snapshot_dirty = {3, 4}
+        bacprop_service._handle_sensor_data({"sensorId": 3, "temp": 1})
+
+        bacprop_service._check_faults(100)
+
+        bacprop_service._sensor_net.retire_sensors.assert_called_once_with(  # type: ignore
+            100
+        )
+        assert bacprop_service._merged_sensor_ids == {4}
+        assert bacprop_service._snapshot_dirty == {4}
+        assert bacprop_service._snapshot_removed == {3}
+        assert 3 not in bacprop_service._validator._schemas
+
+    def test_handle_data_buffered(
+        self, mocker: MockFixture, bacprop_service: BacPropagator
+    ) -> None:
+        bacprop_service._handle_sensor_data({"sensorId": 5, "temp": 1, "co2": 400})
+        bacprop_service._handle_sensor_data({"sensorId": 5, "temp": 2})
+
+        # Nothing touches the network until the updates are applied
+        bacprop_service._sensor_net.get_sensor.assert_not_called()  # type: ignore
+
+        sensor = mocker.create_autospec(Sensor)
+        sensor.has_fault.return_value = False  # type: ignore
+        bacprop_service._sensor_net.get_sensor.return_value = sensor  # type: ignore
+
+        bacprop_service._apply_updates()
+
+        sensor.set_values.assert_called_once_with({"temp": 2}, False)
+        assert bacprop_service._updates.coalesced == 1
+        assert bacprop_service._updates.applied == 1
+
+    @pytest.mark.asyncio
+    async def test_flush_loop(
+        self, mocker: MockFixture, bacprop_service: BacPropagator
+    ) -> None:
+        mock_deferred = mocker.patch("bacprop.service.deferred")
+        bacprop_service._flush_interval = 0
 
         bacprop_service._running = True
-        asyncio.ensure_future(bacprop_service._fault_check_loop())
+        asyncio.ensure_future(bacprop_service._flush_loop())
         await asyncio.sleep(0)
 
-        # Sensor 2 should not be marked as faulty, as it's update time is in range
-        sensors[1].mark_fault.assert_called_once()
-        sensors[2].mark_fault.assert_not_called()
+        # Nothing to flush yet
+        mock_deferred.assert_not_called()
+
+        bacprop_service._handle_sensor_data({"sensorId": 5, "temp": 1})
+        await asyncio.sleep(0)
+
+        mock_deferred.assert_called_once_with(bacprop_service._apply_updates)
 
         bacprop_service._running = False
         await asyncio.sleep(0)
+
+    def test_merge_sensors(
+        self, mocker: MockFixture, bacprop_service: BacPropagator
+    ) -> None:
+        bacprop_service._validator.merge_sensors = [range(5, 10)]
+
+        bacprop_service._handle_sensor_data({"sensorId": 7, "temp": 1})
+        bacprop_service._handle_sensor_data({"sensorId": 7, "co2": None})
+        bacprop_service._handle_sensor_data({"sensorId": 2, "co2": None})
+
+        assert bacprop_service._updates.take() == {
+            7: (True, {"temp": 1, "co2": None}),
+            2: (False, {}),
+        }
+
+    def test_merge_topics(
+        self, mocker: MockFixture, bacprop_service: BacPropagator
+    ) -> None:
+        bacprop_service._validator.merge_topics = ["sensor/partial/#"]
+
+        bacprop_service._handle_sensor_data({"sensorId": 1, "a": 1}, "sensor/partial/1")
+        bacprop_service._handle_sensor_data({"sensorId": 2, "a": 1}, "sensor/2")
+
+        assert bacprop_service._updates.take() == {
+            1: (True, {"a": 1}),
+            2: (False, {"a": 1}),
+        }
+
+    def test_apply_merge_update(
+        self, mocker: MockFixture, bacprop_service: BacPropagator
+    ) -> None:
+        sensor = mocker.create_autospec(Sensor)
+        sensor.has_fault.return_value = False  # type: ignore
+        bacprop_service._sensor_net.get_sensor.return_value = sensor  # type: ignore
+
+        bacprop_service._updates.put(3, {"temp": 1}, True)
+        bacprop_service._apply_updates()
+
+        sensor.set_values.assert_called_once_with({"temp": 1}, True)
+        assert bacprop_service._merged_sensor_ids == {3}
+        assert bacprop_service._snapshot_dirty == {3}
+
+    def test_key_expiry(
+        self, mocker: MockFixture, bacprop_service: BacPropagator
+    ) -> None:
+        sensor = mocker.create_autospec(Sensor)
+        sensor.expire_keys.return_value = ["temp"]  # type: ignore
+
+        mocker.patch.object(
+            bacprop_service._sensor_net, "pop_outdated_sensors", return_value=[]
+        )
+        bacprop_service._sensor_net.get_sensor.side_effect = {  # type: ignore
+            3: sensor
+        }.get
+        bacprop_service._merged_sensor_ids = {3, 4}
+        bacprop_service._key_timeout = 30
+
+        bacprop_service._check_faults(100)
+
+        sensor.expire_keys.assert_called_once_with(70)
+        assert bacprop_service._snapshot_dirty == {3}
+
+    def test_no_key_expiry(
+        self, mocker: MockFixture, bacprop_service: BacPropagator
+    ) -> None:
+        mocker.patch.object(bacprop_service, "_expire_keys", autospec=True)
+        mocker.patch.object(
+            bacprop_service._sensor_net, "pop_outdated_sensors", return_value=[]
+        )
+
+        bacprop_service._check_faults(100)
+
+        bacprop_service._expire_keys.assert_not_called()  # type: ignore
@@ -0,0 +1,203 @@
+import math
+import os
+import struct
+from pathlib import Path
+
+import pytest
+
+from pytest_mock import MockFixture
+
+from bacprop import snapshot
+from bacprop.snapshot import (
+    MAGIC,
+    VERSION,
+    SensorSnapshot,
+    SnapshotError,
+    SnapshotWriter,
+    encode_removal,
+    encode_snapshot,
+)
+
+# Required for full coverage
+snapshot._debug = 1
+
+
+SENSOR_1 = SensorSnapshot(
+    1, 2, 100.5, False, False, {"temp": (0, 21.5), "co2": (1, None)}
+)
+SENSOR_NAN = SensorSnapshot(4, 5, 100.5, False, False, {"temp": (0, math.nan)})
+SENSOR_2 = SensorSnapshot(2, 3, 200.0, True, True, {"températur": (3, -1.0)})
+
+
+def write_file(path: Path, *snapshots: SensorSnapshot) -> None:
+    path.write_bytes(
+        MAGIC + bytes([VERSION]) + b"".join(encode_snapshot(s) for s in snapshots)
+    )
+
+
+class TestSnapshotWriter:
+    def test_load(self, tmp_path: Path) -> None:
+        path = tmp_path / "snapshot"
+        updated = SENSOR_1._replace(update_time=300.0, keys={"temp": (0, 22.0)})
+        write_file(path, SENSOR_1, SENSOR_2, updated)
+
+        # The latest record of each sensor
+        assert SnapshotWriter(str(path)).load() == [updated, SENSOR_2]
+
+    def test_load_removed(self, tmp_path: Path) -> None:
+        path = tmp_path / "snapshot"
+        write_file(path, SENSOR_1, SENSOR_2)
+        with open(path, "ab") as snapshot_file:
+            snapshot_file.write(encode_removal(1) + encode_removal(5))
+            snapshot_file.write(encode_snapshot(SENSOR_2._replace(update_time=300.0)))
+
+        writer = SnapshotWriter(str(path))
+        assert writer.load() == [SENSOR_2._replace(update_time=300.0)]
+        assert writer._written == 5
+
+    def test_load_missing(self, tmp_path: Path) -> None:
+        assert SnapshotWriter(str(tmp_path / "snapshot")).load() == []
+
+    def test_load_truncated(self, tmp_path: Path) -> None:
+        path = tmp_path / "snapshot"
+        write_file(path, SENSOR_1, SENSOR_2)
+
+        data = path.read_bytes()
+        for length in (len(data) - 1, len(data) - 20):
+            path.write_bytes(data[:length])
+            assert SnapshotWriter(str(path)).load() == [SENSOR_1]
+
+    def test_load_invalid(self, mocker: MockFixture, tmp_path: Path) -> None:
+        mock_error = mocker.patch.object(SnapshotWriter, "_error")
+        path = tmp_path / "snapshot"
+
+        for data in (b"BP", b"JUNK\x02", MAGIC + b"\x01"):
+            path.write_bytes(data)
+            writer = SnapshotWriter(str(path))
+
+            assert writer.load() == []
+            assert not writer._latest
+
+        assert mock_error.call_count == 3
+
+    def test_write(self, tmp_path: Path) -> None:
+        path = tmp_path / "snapshot"
+        write_file(path, SENSOR_1)
+        path.write_bytes(path.read_bytes()[:-1])
+
+        writer = SnapshotWriter(str(path))
+        writer.load()
+        writer.start()
+
+        # The truncated record is gone from the file
+        assert len(path.read_bytes()) == 5
+
+        writer.write([SENSOR_1])
+        writer.write([])
+        writer.write([SENSOR_2])
+        writer.close()
+
+        assert SnapshotWriter(str(path)).load() == [SENSOR_1, SENSOR_2]
+        assert not os.path.exists(str(path) + ".tmp")
+
+    def test_write_removed(self, tmp_path: Path) -> None:
+        path = tmp_path / "snapshot"
+        writer = SnapshotWriter(str(path))
+        writer.start()
+
+        writer.write([SENSOR_1, SENSOR_2])
+        writer.write([], [1])
+        writer.close()
+
+        assert SnapshotWriter(str(path)).load() == [SENSOR_2]
+
+        # Removed and written again in the same batch
+        writer.start()
+        writer.write([SENSOR_2], [2])
+        writer.close()
+
+        assert SnapshotWriter(str(path)).load() == [SENSOR_2]
+
+    def test_compact(self, tmp_path: Path) -> None:
+        path = tmp_path / "snapshot"
+        writer = SnapshotWriter(str(path))
+        writer.start()
+
+        for update_time in range(SnapshotWriter.COMPACT_RATIO + 1):
+            writer.write([SENSOR_1._replace(update_time=update_time)])
+        writer.close()
+
+        # Compacted down to the latest record
+        assert writer._written == 1
+        assert len(path.read_bytes()) == 5 + len(encode_snapshot(SENSOR_1))
+
+        (restored,) = SnapshotWriter(str(path)).load()
+        assert restored.update_time == SnapshotWriter.COMPACT_RATIO
+
+    def test_write_error(self, mocker: MockFixture, tmp_path: Path) -> None:
+        mock_error = mocker.patch.object(SnapshotWriter, "_error")
+        writer = SnapshotWriter(str(tmp_path / "snapshot"))
+        writer.start()
+        mocker.patch.object(writer, "_append", side_effect=OSError("disk full"))
+
+        writer.write([SENSOR_1])
+        writer.close()
+
+        mock_error.assert_called_once()
+
+    def test_load_nan(self, tmp_path: Path) -> None:
+        path = tmp_path / "snapshot"
+        write_file(path, SENSOR_NAN, SENSOR_1)
+
+        restored, sensor1 = SnapshotWriter(str(path)).load()
+
+        # A NaN value still has its object
+        assert sensor1 == SENSOR_1
+        assert math.isnan(restored.keys["temp"][1])  # type: ignore
+
+    def test_encode_too_large(self) -> None:
+        for sensor in (
+            SENSOR_1._replace(sensor_id=2 ** 32),
+            SENSOR_1._replace(address=-1),
+            SENSOR_1._replace(keys={"t" * 256: (0, 1.0)}),
+            SENSOR_1._replace(keys={"temp": (2 ** 32, 1.0)}),
+            SENSOR_1._replace(keys={str(i): (i, 1.0) for i in range(2 ** 16)}),
+        ):
+            with pytest.raises(SnapshotError):
+                encode_snapshot(sensor)
+
+    def test_write_too_large(self, mocker: MockFixture, tmp_path: Path) -> None:
+        mock_error = mocker.patch.object(SnapshotWriter, "_error")
+        path = tmp_path / "snapshot"
+        writer = SnapshotWriter(str(path))
+        writer.start()
+
+        large = SENSOR_1._replace(sensor_id=2 ** 32)
+        writer.write([large, SENSOR_2])
+        writer.write([], [2 ** 32])
+        writer.close()
+
+        # Only the sensor which doesn't fit is left out
+        assert SnapshotWriter(str(path)).load() == [SENSOR_2]
+        mock_error.assert_called_once()
+
+    def test_write_unexpected_error(self, mocker: MockFixture, tmp_path: Path) -> None:
+        mock_error = mocker.patch.object(SnapshotWriter, "_error")
+        path = tmp_path / "snapshot"
+        writer = SnapshotWriter(str(path))
+        writer.start()
+        mocker.patch.object(writer, "_append", side_effect=[struct.error("bad"), None])
+
+        writer.write([SENSOR_1])
+        writer.write([SENSOR_2])
+        writer.close()
+
+        # The writer thread kept going
+        assert writer._append.call_count == 2  # type: ignore
+        mock_error.assert_called_once()
+
+    def test_close_not_started(self, tmp_path: Path) -> None:
+        writer = SnapshotWriter(str(tmp_path / "snapshot"))
+        writer.close()
+
+        assert not (tmp_path / "snapshot").exists()